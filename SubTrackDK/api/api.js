@@ -1,7 +1,25 @@
 import axios from "axios";
 import * as SecureStore from "expo-secure-store";
 
-const API_URL = "http://192.168.0.5:8080"; // Updated port to match backend server
+export const API_URL = "http://192.168.0.5:8080"; // Updated port to match backend server
+
+// Time of our last write, as reported by the backend. Sent back so reads that follow it see it,
+// whichever backend worker serves them
+let lastWrite = null;
+
+export function trackLastWrite(instance) {
+  instance.interceptors.request.use((config) => {
+    if (lastWrite) config.headers["X-Last-Write"] = lastWrite;
+    return config;
+  });
+  instance.interceptors.response.use((res) => {
+    if (res.headers["x-last-write"]) lastWrite = res.headers["x-last-write"];
+    return res;
+  });
+  return instance;
+}
+
+trackLastWrite(axios);
 
 export async function login(email, password) {
   const res = await axios.post(`${API_URL}/api/auth/login`, new URLSearchParams({
@@ -24,17 +42,28 @@ export async function signup(email, password) {
   return res.data;
 }
 
+function newIdempotencyKey() {
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+}
+
 export async function createSubscription(subscription) {
   const token = await SecureStore.getItemAsync("token");
   console.log("Sending subscription to API:", subscription);
   console.log("Using token:", token);
 
+  // Same key on the retry, so the backend returns the first result instead of creating a duplicate
+  const headers = {
+    Authorization: `Bearer ${token}`,
+    "Content-Type": "application/json",
+    "Idempotency-Key": newIdempotencyKey(),
+  };
+  const post = () => axios.post(`${API_URL}/api/subscriptions`, subscription, { headers });
+
   try {
-    const res = await axios.post(`${API_URL}/api/subscriptions`, subscription, {
-      headers: {
-        Authorization: `Bearer ${token}`,
-        "Content-Type": "application/json",
-      },
+    const res = await post().catch((err) => {
+      // No response means a network failure; the first request may still have been processed
+      if (err.response) throw err;
+      return post();
     });
     return res.data;
   } catch (err) {
@@ -49,4 +78,24 @@ export async function getSubscriptions() {
     headers: { Authorization: `Bearer ${token}` },
   });
   return res.data;
-} 
\ No newline at end of file
+} 
+
+export async function suggestCompanies(query, signal) {
+  const token = await SecureStore.getItemAsync("token");
+  const res = await axios.get(`${API_URL}/api/companies/suggest`, {
+    params: { q: query },
+    headers: { Authorization: `Bearer ${token}` },
+    signal,
+  });
+  // Logos come back as backend paths
+  return res.data.map((company) => ({ ...company, logo: `${API_URL}${company.logo}` }));
+}
+
+// Logo served and cached by the backend, for a domain or a stored Clearbit logo URL
+export function proxiedLogoUrl(urlOrDomain, size = 128) {
+  if (!urlOrDomain) return null;
+  const match = urlOrDomain.match(/^https?:\/\/logo\.clearbit\.com\/([^/?#]+)/);
+  if (match) return `${API_URL}/api/logos/${match[1]}?size=${size}`;
+  if (/^https?:\/\//.test(urlOrDomain)) return urlOrDomain;
+  return `${API_URL}/api/logos/${urlOrDomain}?size=${size}`;
+}
@@ -5,27 +5,30 @@ import {
 } from 'react-native';
 import { Ionicons } from '@expo/vector-icons'; // For fallback icon
 import Colors from '../constants/Colors';
+import { suggestCompanies } from '../api/api';
 
 const CompanyAutocomplete = ({ onSelect }) => {
   const [query, setQuery] = useState('');
   const [results, setResults] = useState([]);
   const debounceRef = useRef(null);
+  const requestRef = useRef(null);
 
   useEffect(() => {
-    if (!query) { setResults([]); return; }
     clearTimeout(debounceRef.current);
+    requestRef.current?.abort(); // Drop the response for an older query
+    if (query.trim().length < 2) { setResults([]); return; }
     debounceRef.current = setTimeout(async () => {
+      const controller = new AbortController();
+      requestRef.current = controller;
       try {
-        const res = await fetch(
-          `https://autocomplete.clearbit.com/v1/companies/suggest?query=${query}`
-        );
-        const data = await res.json();
-        setResults(data);
+        setResults(await suggestCompanies(query, controller.signal));
       } catch (e) {
+        if (controller.signal.aborted) return;
         console.warn('Autocomplete fejl', e);
         setResults([]); // Clear results on error
       }
     }, 300); // 300ms debounce
+    return () => clearTimeout(debounceRef.current);
   }, [query]);
 
   return (
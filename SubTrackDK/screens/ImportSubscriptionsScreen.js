@@ -404,8 +404,10 @@ const ImportSubscriptionsScreen = ({ route, navigation }) => {
       await cleanupLowConfidenceSubscriptions();
       
       // Fetch transactions
+      // Without a fresh Tink token the backend uses the stored bank connection
       const response = await axios.get(`${BACKEND_URL}/api/tink/transactions`, {
-        params: { token }
+        params: token ? { token } : {},
+        headers: { 'Authorization': `Bearer ${token_value}` }
       });
 
       console.log('📡 Backend response:', response.status, response.data);
@@ -3,6 +3,7 @@ import { View, Text, StyleSheet, TouchableOpacity, Image, Alert, SafeAreaView, L
 import Colors from '../constants/Colors';
 import { Ionicons } from '@expo/vector-icons';
 import { useSubscriptions } from '../context/SubscriptionContext';
+import { proxiedLogoUrl } from '../api/api';
 
 const getBackgroundColor = (type) => {
   // Always return the green Spotify color for consistency
@@ -53,13 +54,13 @@ const SubscriptionDetailScreen = ({ route, navigation }) => {
     return null;
   };
   
-  // Helper to build Clearbit URL with high resolution
-  const buildClearbitUrl = (domain) => `https://logo.clearbit.com/${domain}?size=512`;
+  // High-resolution logo through the backend's cache
+  const buildLogoUrl = (domain) => proxiedLogoUrl(domain, 512);
 
   // Use logo_url from DB, otherwise try Clearbit based on known domains / title
-  const clearbitLogoUrl = subscription.logo_url ? subscription.logo_url :
-    subscription.domain ? buildClearbitUrl(subscription.domain) :
-    (getDomainFromTitle(subscription.title) ? buildClearbitUrl(getDomainFromTitle(subscription.title)) : null);
+  const clearbitLogoUrl = subscription.logo_url ? proxiedLogoUrl(subscription.logo_url, 512) :
+    subscription.domain ? buildLogoUrl(subscription.domain) :
+    (getDomainFromTitle(subscription.title) ? buildLogoUrl(getDomainFromTitle(subscription.title)) : null);
 
   const handleDeleteSubscription = () => {
     Alert.alert(
@@ -15,7 +15,7 @@ import {
 } from 'react-native';
 import { Ionicons } from '@expo/vector-icons';
 import Colors from '../constants/Colors';
-import { getSubscriptions } from '../api/api';
+import { getSubscriptions, proxiedLogoUrl } from '../api/api';
 import { useFocusEffect } from '@react-navigation/native';
 
 const { width: screenWidth } = Dimensions.get('window');
@@ -62,13 +62,13 @@ const SubscriptionItem = ({ item, onPress }) => {
     return null;
   };
   
-  // Helper to build Clearbit URL with size param
-  const buildClearbitUrl = (domain) => `https://logo.clearbit.com/${domain}?size=64`;
+  // Logo through the backend's cache
+  const buildLogoUrl = (domain) => proxiedLogoUrl(domain, 64);
 
   // Use logo_url from DB, otherwise try Clearbit based on known domains / title
-  const logoSource = item.logo_url ? item.logo_url :
-    item.domain ? buildClearbitUrl(item.domain) :
-    (getDomainFromTitle(item.title) ? buildClearbitUrl(getDomainFromTitle(item.title)) : null);
+  const logoSource = item.logo_url ? proxiedLogoUrl(item.logo_url, 64) :
+    item.domain ? buildLogoUrl(item.domain) :
+    (getDomainFromTitle(item.title) ? buildLogoUrl(getDomainFromTitle(item.title)) : null);
 
   const getBackgroundColor = (type) => {
     switch (type) {
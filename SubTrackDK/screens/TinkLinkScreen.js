@@ -4,6 +4,7 @@ import { WebView } from 'react-native-webview';
 import { Ionicons } from '@expo/vector-icons';
 import Colors from '../constants/Colors';
 import axios from 'axios';
+import * as SecureStore from 'expo-secure-store';
 
 const TINK_CLIENT_ID = 'c5bee9bff49b45aaa32743b49d36901a';
 const REDIRECT_URI = 'https://auth.expo.io/@mads_olsen/SubTrackDK';
@@ -26,9 +27,12 @@ const TinkLinkScreen = ({ navigation }) => {
       
       try {
         setIsLoading(true);
-        // Exchange code for token via backend
+        // Exchange code for token via backend (signed in, so the backend keeps the connection)
+        const userToken = await SecureStore.getItemAsync('token');
         const response = await axios.post(`${BACKEND_URL}/api/tink/token`, {
           code,
+        }, {
+          headers: userToken ? { 'Authorization': `Bearer ${userToken}` } : {}
         });
 
         console.log('✅ Token exchange successful');
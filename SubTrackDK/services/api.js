@@ -1,5 +1,6 @@
 import axios from 'axios';
 import * as SecureStore from 'expo-secure-store';
+import { trackLastWrite } from '../api/api';
 
 // TODO: Remember to change this to your actual backend IP address or domain in production
 // If running on Expo Go on a physical device, 'localhost' will not work.
@@ -28,6 +29,8 @@ api.interceptors.request.use(
   }
 );
 
+trackLastWrite(api);
+
 export default api;
 
 export async function loginWithSocialToken(provider, token) {
@@ -0,0 +1,182 @@
+"""Background account deletion (GDPR).
+
+DELETE /api/account deactivates the user and queues a row in
+account_deletions. A worker in every API process claims queued jobs with
+a lease and works through these phases:
+
+- revoke:    reject the user's access tokens, drop cached tokens and Tink
+             credentials, delete push tokens and stored Tink tokens
+- anonymize: detach analytics_events from the user, in batches
+- delete:    delete dependent rows table by table, in batches, children
+             before subscriptions so no delete cascades into a large set
+- finalize:  delete the users row, which nothing references any more
+
+Each batch is one short transaction of at most DELETION_BATCH_SIZE rows,
+followed by a pause of DELETION_BATCH_PAUSE_SECONDS, so other traffic
+never waits long on locks held by the job. Progress counters and the
+lease are written after every batch. A job whose worker died is picked up
+again once its lease runs out. Every phase is safe to repeat.
+
+    python account_deletion.py   # drain the queue once, e.g. from cron
+"""
+import os
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+
+from dotenv import load_dotenv
+
+from auth import revoke_user
+from logging_config import get_logger, setup_logging, shutdown_logging
+from periodic import PeriodicJob
+from resources import resources
+from supabase_client import (
+    anonymize_analytics_events_batch, claim_account_deletion, delete_user, delete_user_rows_batch,
+    update_account_deletion
+)
+from tink_vault import vault
+
+load_dotenv()
+
+logger = get_logger("account_deletion")
+
+DELETION_BATCH_SIZE = int(os.getenv("DELETION_BATCH_SIZE", 500))
+DELETION_BATCH_PAUSE_SECONDS = float(os.getenv("DELETION_BATCH_PAUSE_SECONDS", 0.05))
+DELETION_POLL_SECONDS = float(os.getenv("DELETION_POLL_SECONDS", 30))
+DELETION_LEASE_SECONDS = int(os.getenv("DELETION_LEASE_SECONDS", 300))
+DELETION_MAX_ATTEMPTS = 5
+
+# Credentials go first so nothing can be sent or synced for the user while the rest runs
+REVOKE_TABLES = ("push_tokens", "tink_tokens")
+# Rows referencing subscriptions before subscriptions themselves
+DELETE_TABLES = ("notification_events", "transactions", "transaction_series", "notification_preferences",
+                 "tink_webhook_events", "subscriptions_archive", "subscriptions")
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+class AccountDeletionWorker:
+    def __init__(self, batch_size: int = DELETION_BATCH_SIZE, pause: float = DELETION_BATCH_PAUSE_SECONDS):
+        self.batch_size = batch_size
+        self.pause = pause
+        self._job = PeriodicJob(self.run_once, logger, "Account deletion pass failed", max_jitter=5)
+
+    # ---------- Phases ----------
+
+    async def _checkpoint(self, job: Dict[str, Any], **changes: Any) -> None:
+        job.update(changes)
+        await update_account_deletion(job["id"], {
+            **changes,
+            "lease_until": (datetime.now(timezone.utc) + timedelta(seconds=DELETION_LEASE_SECONDS)).isoformat(),
+        })
+
+    async def _drain(self, job: Dict[str, Any], table: str) -> None:
+        """Delete the user's rows from one table a batch at a time"""
+        while True:
+            deleted = await delete_user_rows_batch(table, job["user_id"], self.batch_size)
+            if deleted:
+                await self._checkpoint(job, rows_deleted=job["rows_deleted"] + deleted)
+            if deleted < self.batch_size:
+                return
+            await asyncio.sleep(self.pause)
+
+    async def _revoke(self, job: Dict[str, Any]) -> None:
+        user_id = job["user_id"]
+        revoke_user(user_id)
+        vault.invalidate_user(user_id)
+        for table in REVOKE_TABLES:
+            await self._drain(job, table)
+
+    async def _anonymize(self, job: Dict[str, Any]) -> None:
+        while True:
+            changed = await anonymize_analytics_events_batch(job["user_id"], self.batch_size)
+            if changed:
+                await self._checkpoint(job, rows_anonymized=job["rows_anonymized"] + changed)
+            if changed < self.batch_size:
+                return
+            await asyncio.sleep(self.pause)
+
+    async def _delete(self, job: Dict[str, Any]) -> None:
+        for table in DELETE_TABLES:
+            await self._drain(job, table)
+
+    async def _finalize(self, job: Dict[str, Any]) -> None:
+        await delete_user(job["user_id"])
+
+    PHASES = (("revoke", _revoke), ("anonymize", _anonymize), ("delete", _delete), ("finalize", _finalize))
+
+    async def process(self, job: Dict[str, Any]) -> None:
+        """Run a claimed job from its recorded phase to the end"""
+        names = [name for name, _ in self.PHASES]
+        start = names.index(job.get("phase") or "revoke")
+        logger.info("Account deletion started", extra={"deletion_id": job["id"], "user_id": job["user_id"],
+                                                       "phase": names[start], "attempt": job.get("attempts")})
+        try:
+            for name, run in self.PHASES[start:]:
+                if job.get("phase") != name:
+                    await self._checkpoint(job, phase=name)
+                await run(self, job)
+        except asyncio.CancelledError:
+            # Shutting down; the lease runs out and the job is resumed from this phase
+            raise
+        except Exception as e:
+            failed = (job.get("attempts") or 0) >= DELETION_MAX_ATTEMPTS
+            logger.error("Account deletion failed", extra={"deletion_id": job["id"], "user_id": job["user_id"],
+                                                           "phase": job.get("phase"), "error": str(e)})
+            # Keep the job running with its lease; another claim retries it after the lease expires
+            await update_account_deletion(job["id"], {"error": str(e)[:500], **(
+                {"status": "failed", "finished_at": _now(), "lease_until": None} if failed else {})})
+            return
+        await update_account_deletion(job["id"], {"status": "completed", "finished_at": _now(), "lease_until": None,
+                                                  "error": None})
+        logger.info("Account deletion completed", extra={"deletion_id": job["id"], "user_id": job["user_id"],
+                                                         "rows_anonymized": job["rows_anonymized"],
+                                                         "rows_deleted": job["rows_deleted"]})
+
+    async def run_once(self) -> int:
+        """Process queued jobs until none is left; returns how many were claimed"""
+        claimed = 0
+        while True:
+            job = await claim_account_deletion(DELETION_LEASE_SECONDS)
+            if job is None:
+                return claimed
+            claimed += 1
+            await self.process(job)
+
+    # ---------- Background loop ----------
+
+    def wake(self) -> None:
+        """Start on a newly queued job now instead of at the next poll"""
+        self._job.wake()
+
+    def start(self, interval: float = DELETION_POLL_SECONDS) -> None:
+        self._job.start(interval)
+
+    async def stop(self) -> None:
+        await self._job.stop()
+
+deletions = AccountDeletionWorker()
+
+def progress(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Public view of a deletion job (no personal data)"""
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "phase": job["phase"],
+        "rows_anonymized": job["rows_anonymized"],
+        "rows_deleted": job["rows_deleted"],
+        "requested_at": job["requested_at"],
+        "finished_at": job.get("finished_at"),
+    }
+
+async def main() -> None:
+    setup_logging()
+    try:
+        claimed = await deletions.run_once()
+        logger.info("Account deletion queue drained", extra={"jobs": claimed})
+    finally:
+        await resources.close()
+        shutdown_logging()
+
+if __name__ == "__main__":
+    asyncio.run(main())
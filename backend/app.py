@@ -1,29 +1,84 @@
-from fastapi import FastAPI, Form, HTTPException, Depends, status, Response, File, UploadFile
+from fastapi import FastAPI, Form, HTTPException, Depends, status, Request, Response, File, UploadFile, BackgroundTasks, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional
-from datetime import datetime, timedelta
-import httpx
-import openai
+from uuid import UUID
+from contextlib import asynccontextmanager
 import os
 import io
-import PyPDF2
+import asyncio
 import json
 from dotenv import load_dotenv
-from jose import JWTError, jwt
+from jose import JWTError
 import re
 import datetime as dt
 
-from models import UserCreate, UserInDB, Token, TokenData, SubscriptionCreate, SubscriptionInDB, get_password_hash, verify_password
+from models import (
+    UserCreate, UserInDB, CurrentUser, Token, RefreshTokenRequest, SubscriptionCreate, SubscriptionInDB,
+    get_password_hash, verify_password
+)
+from auth import (
+    ACCESS_TOKEN_EXPIRE_MINUTES, DELETION_STATUS_TOKEN_TYPE, REFRESH_TOKEN_TYPE, create_access_token,
+    create_deletion_status_token, create_refresh_token, current_user_from_claims, decode_token, public_jwks,
+    revoke_user, revoked_users, user_claims
+)
+from logging_config import RequestContextMiddleware, get_logger, log_payload, setup_logging, shutdown_logging
+from metrics import PROMETHEUS_CONTENT_TYPE, MetricsMiddleware, registry, span
+from responses import CompressionMiddleware, FastJSONResponse, project_rows
+from rate_limit import admission, limited
+from idempotency import idempotency
+from companies import LOGO_MAX_AGE_SECONDS, directory, normalize_domain
+from export import EXPORT_MEDIA_TYPES, stream_export
+from account_deletion import deletions, progress as deletion_progress
+from replicas import LAST_WRITE_HEADER, ReadYourWritesMiddleware, router as replicas
+from subscription_archive import archiver
+from cancel_links import link_checker
+from pdf_cache import (
+    line_items, pdf_cache_lookups, read_upload, result_merchant, statement_lines, statement_prompt, statements
+)
+from resources import TINK_API_URL, resources
+from tink_vault import vault
+from tink_webhooks import WebhookError, WebhookSignatureError, receive as receive_tink_webhook, webhooks
+from detection import DetectionError, clean_description, detect_subscriptions
+from charge_detector import ingest_transactions
+from cost_model import add_months, charges_between, next_renewal, normalize_costs, parse_date
 from supabase_client import (
-    get_user_by_email, create_user, create_subscription, get_subscriptions_by_owner,
-    delete_subscription, update_user_last_login, log_analytics_event, get_merchant_cancel_link
+    get_user_by_email, create_user, create_subscription, get_subscriptions_by_owner, get_subscriptions_renewing_before,
+    delete_subscription, update_user_last_login, log_analytics_event, get_merchant_cancel_link,
+    deactivate_user, request_account_deletion, get_account_deletion, get_subscription_by_id, update_subscription,
+    restore_archived_subscription
 )
 
 load_dotenv()
 
-app = FastAPI()
+setup_logging()
+logger = get_logger("api")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Clients are created lazily; warm them in the background so startup stays fast
+    resources.start_warm_up()
+    vault.start_refresh_job()
+    replicas.start()
+    deletions.start()
+    webhooks.start()
+    archiver.start()
+    link_checker.start()
+    yield
+    await link_checker.stop()
+    await archiver.stop()
+    await webhooks.stop()
+    await deletions.stop()
+    await replicas.stop()
+    await vault.stop()
+    await admission.close()
+    await idempotency.close()
+    await resources.close()
+    shutdown_logging()
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -31,82 +86,119 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[LAST_WRITE_HEADER],
 )
-
-SECRET_KEY = os.getenv("SECRET_JWT_KEY")
-ALGORITHM = os.getenv("ALGORITHM", "HS256")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
-
-if not SECRET_KEY:
-    raise ValueError("SECRET_JWT_KEY not found in environment variables. Please set it in .env")
+app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestContextMiddleware)
+app.add_middleware(CompressionMiddleware)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
 
 TINK_CLIENT_ID = os.getenv("TINK_CLIENT_ID")
 TINK_CLIENT_SECRET = os.getenv("TINK_CLIENT_SECRET")
 TINK_REDIRECT_URI = os.getenv("TINK_REDIRECT_URI")
 
-# OpenAI configuration
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta if expires_delta else timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-
 async def get_user(email: str):
     user_data = await get_user_by_email(email)
     if user_data:
         return UserInDB(**user_data)
     return None
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
+def credentials_exception(detail: str = "Could not validate credentials") -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
+        detail=detail,
         headers={"WWW-Authenticate": "Bearer"}
     )
+
+def issue_tokens(user) -> dict:
+    claims = user_claims(user)
+    return {
+        "access_token": create_access_token(data=claims, expires_delta=dt.timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)),
+        "refresh_token": create_refresh_token(data=claims),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> CurrentUser:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        token_data = TokenData(email=email)
+        with span("auth", "jwt_decode"):
+            claims = decode_token(token)
     except JWTError:
-        raise credentials_exception
-    user = await get_user(email=token_data.email)
+        raise credentials_exception()
+    email = claims.get("sub")
+    if email is None:
+        raise credentials_exception()
+
+    # Fast path: tokens carry the user id and active flag, so no lookup is needed
+    user = current_user_from_claims(claims)
     if user is None:
-        raise credentials_exception
+        # Tokens issued before the claims existed only carry the email
+        user_in_db = await get_user(email=email)
+        if user_in_db is None:
+            raise credentials_exception()
+        user = CurrentUser(id=user_in_db.id, email=user_in_db.email, is_active=user_in_db.is_active)
+    if not user.is_active or user.id in revoked_users:
+        raise credentials_exception("Inactive user")
     return user
 
-@app.post("/api/auth/signup", response_model=UserInDB)
+async def get_optional_user(token: Optional[str] = Depends(optional_oauth2_scheme)) -> Optional[CurrentUser]:
+    """Current user when a bearer token is sent, None for anonymous calls"""
+    if token is None:
+        return None
+    return await get_current_user(token)
+
+@app.post("/api/auth/signup", response_model=UserInDB, dependencies=[Depends(limited("auth"))])
 async def signup_user(user: UserCreate):
     if await get_user(user.email):
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_password = get_password_hash(user.password)
+    # bcrypt is slow on purpose; keep it off the event loop
+    hashed_password = await asyncio.to_thread(get_password_hash, user.password)
     new_user_data = await create_user(user.email, hashed_password)
     return UserInDB(**new_user_data)
 
-@app.post("/api/auth/login", response_model=Token)
+@app.post("/api/auth/login", response_model=Token, dependencies=[Depends(limited("auth"))])
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     user = await get_user(form_data.username)
-    if not user or not verify_password(form_data.password, user.hashed_password):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect email or password",
-            headers={"WWW-Authenticate": "Bearer"}
-        )
+    if not user or not await asyncio.to_thread(verify_password, form_data.password, user.hashed_password):
+        raise credentials_exception("Incorrect email or password")
+    if not user.is_active:
+        raise credentials_exception("Inactive user")
 
     # Update last login timestamp
     await update_user_last_login(user.id)
 
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(data={"sub": user.email}, expires_delta=access_token_expires)
-    return {"access_token": access_token, "token_type": "bearer"}
+    return issue_tokens(user)
+
+@app.post("/api/auth/refresh", response_model=Token)
+async def refresh_access_token(request: RefreshTokenRequest):
+    """Exchange a refresh token for a new token pair without re-entering the password"""
+    try:
+        claims = decode_token(request.refresh_token, expected_type=REFRESH_TOKEN_TYPE)
+    except JWTError:
+        raise credentials_exception("Invalid refresh token")
+
+    # One lookup (no bcrypt) so deactivated accounts cannot keep refreshing
+    user = await get_user(claims.get("sub", ""))
+    if not user or not user.is_active:
+        raise credentials_exception("Invalid refresh token")
+    return issue_tokens(user)
+
+@app.get("/api/auth/jwks")
+async def get_jwks():
+    """Public verification keys for services that validate our access tokens"""
+    return public_jwks()
 
 @app.post("/api/subscriptions", response_model=SubscriptionInDB)
-async def create_subscription_endpoint(subscription: SubscriptionCreate, current_user: UserInDB = Depends(get_current_user)):
+async def create_subscription_endpoint(subscription: SubscriptionCreate, current_user: CurrentUser = Depends(get_current_user),
+                                       idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    # A retried request with the same Idempotency-Key gets the first response instead of a duplicate row
+    return await idempotency.run(idempotency_key, current_user.id, "create_subscription", subscription,
+                                 lambda: create_subscription_for_user(subscription, current_user))
+
+async def create_subscription_for_user(subscription: SubscriptionCreate, current_user: CurrentUser) -> SubscriptionInDB:
     # Create subscription data with all fields from new schema
     subscription_data = {
         "title": subscription.title,
@@ -142,12 +234,39 @@ async def create_subscription_endpoint(subscription: SubscriptionCreate, current
     return SubscriptionInDB(**new_sub)
 
 @app.get("/api/subscriptions", response_model=List[SubscriptionInDB])
-async def read_subscriptions(current_user: UserInDB = Depends(get_current_user)):
+async def read_subscriptions(current_user: CurrentUser = Depends(get_current_user)):
     subs = await get_subscriptions_by_owner(current_user.id)
-    return [SubscriptionInDB(**sub) for sub in subs]
+    # Rows come straight from the subscriptions table; skip validating them into models and back
+    return FastJSONResponse(project_rows(subs, SubscriptionInDB.model_fields))
+
+@app.get("/api/subscriptions/upcoming")
+async def read_upcoming_renewals(days: int = Query(30, ge=1, le=366), current_user: CurrentUser = Depends(get_current_user)):
+    """Renewals in the next `days` days grouped by date, recurring subscriptions expanded"""
+    today = dt.date.today()
+    end = today + dt.timedelta(days=days - 1)
+    # Anything renewing before the window end may still charge inside it; later ones cannot
+    subs = await get_subscriptions_renewing_before(current_user.id, end.isoformat())
+    calendar_days = {}
+    for sub, cost in zip(subs, normalize_costs(subs)):
+        renewal = parse_date(sub["renewal_date"])
+        if renewal is None:
+            continue
+        item = {"id": sub["id"], "title": sub["title"], "amount": sub["amount"], "currency": sub["currency"],
+                "amount_dkk": cost["amount_dkk"], "logo_url": sub.get("logo_url")}
+        for charge in charges_between(renewal, sub.get("frequency"), max(today, renewal), end):
+            calendar_days.setdefault(charge, []).append(item)
+    return {
+        "from": today.isoformat(),
+        "to": end.isoformat(),
+        "total_dkk": round(sum(i["amount_dkk"] for items in calendar_days.values() for i in items), 2),
+        "days": [
+            {"date": day.isoformat(), "total_dkk": round(sum(i["amount_dkk"] for i in items), 2), "items": items}
+            for day, items in sorted(calendar_days.items())
+        ],
+    }
 
 @app.delete("/api/subscriptions/{subscription_id}")
-async def delete_subscription_endpoint(subscription_id: int, current_user: UserInDB = Depends(get_current_user)):
+async def delete_subscription_endpoint(subscription_id: int, current_user: CurrentUser = Depends(get_current_user)):
     # First check if subscription belongs to current user
     subs = await get_subscriptions_by_owner(current_user.id)
     subscription = next((sub for sub in subs if sub["id"] == subscription_id), None)
@@ -164,74 +283,129 @@ async def delete_subscription_endpoint(subscription_id: int, current_user: UserI
     )
 
     # Delete the subscription (soft delete)
-    await delete_subscription(subscription_id)
+    await delete_subscription(subscription_id, current_user.id)
     return {"message": "Subscription deleted successfully"}
 
+@app.post("/api/subscriptions/{subscription_id}/restore", response_model=SubscriptionInDB)
+async def restore_subscription_endpoint(subscription_id: int, current_user: CurrentUser = Depends(get_current_user)):
+    """Undo a delete, also after the subscription has been moved to the archive"""
+    subscription = await get_subscription_by_id(subscription_id, current_user.id)
+    if subscription is None:
+        subscription = await restore_archived_subscription(subscription_id, current_user.id)
+    elif not subscription["is_active"]:
+        subscription = await update_subscription(subscription_id, current_user.id, {"is_active": True})
+    if subscription is None:
+        raise HTTPException(status_code=404, detail="Subscription not found or not owned by user")
+    return subscription
+
 @app.get("/api/merchant-links/{merchant_name}")
-async def get_merchant_link(merchant_name: str, current_user: UserInDB = Depends(get_current_user)):
+async def get_merchant_link(merchant_name: str, current_user: CurrentUser = Depends(get_current_user)):
     """Get cancellation link for a specific merchant"""
     link = await get_merchant_cancel_link(merchant_name)
     if not link:
         raise HTTPException(status_code=404, detail="Merchant not found")
     return link
 
+@app.get("/api/companies/suggest")
+async def suggest_companies(q: str = Query(..., max_length=100), current_user: CurrentUser = Depends(get_current_user)):
+    """Company name autocomplete, with logos served through /api/logos"""
+    return [
+        {"name": c["name"], "domain": c["domain"], "logo": f"/api/logos/{c['domain']}"}
+        for c in await directory.suggest(q)
+    ]
+
+@app.get("/api/logos/{domain}")
+async def get_logo(domain: str, size: int = Query(128, ge=16, le=512), if_none_match: Optional[str] = Header(None)):
+    """Company logo from the disk cache; public so image components can load it directly"""
+    normalized = normalize_domain(domain)
+    if normalized is None:
+        raise HTTPException(status_code=404, detail="Logo not found")
+    logo = await directory.logo(normalized, size)
+    if logo is None:
+        raise HTTPException(status_code=404, detail="Logo not found")
+    headers = {"ETag": logo["etag"], "Cache-Control": f"public, max-age={LOGO_MAX_AGE_SECONDS}"}
+    if if_none_match and logo["etag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(logo["body"], media_type=logo["content_type"], headers=headers)
+
+@app.get("/api/export")
+async def export_user_data(format: str = Query("json", pattern="^(csv|json|ndjson)$"),
+                           current_user: CurrentUser = Depends(get_current_user)):
+    """Download all of the user's subscriptions, transactions and preferences, streamed page by page"""
+    await log_analytics_event(user_id=current_user.id, event_type="export_requested", event_data={"format": format})
+    filename = f"subtrack-export-{dt.date.today().isoformat()}.{format}"
+    return StreamingResponse(
+        stream_export(current_user.id, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"},
+    )
+
+@app.delete("/api/account", status_code=status.HTTP_202_ACCEPTED)
+async def delete_account(current_user: CurrentUser = Depends(get_current_user)):
+    """Deactivate the account now and delete its data in a background job"""
+    await deactivate_user(current_user.id)
+    job = await request_account_deletion(current_user.id)
+    revoke_user(current_user.id)
+    vault.invalidate_user(current_user.id)
+    deletions.wake()
+    logger.info("Account deletion requested", extra={"user_id": current_user.id, "deletion_id": job["id"]})
+    return {**deletion_progress(job), "status_url": f"/api/account/deletions/{job['id']}",
+            "status_token": create_deletion_status_token(str(job["id"]))}
+
+@app.get("/api/account/deletions/{deletion_id}", dependencies=[Depends(limited("status"))])
+async def get_account_deletion_progress(deletion_id: UUID, token: str = Depends(oauth2_scheme)):
+    """Progress of a deletion job, for the bearer of the status_token returned by DELETE /api/account.
+
+    The user can no longer sign in, so their access token doesn't work here.
+    """
+    try:
+        claims = decode_token(token, expected_type=DELETION_STATUS_TOKEN_TYPE)
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid status token", headers={"WWW-Authenticate": "Bearer"})
+    if claims.get("did") != str(deletion_id):
+        raise HTTPException(status_code=404, detail="Deletion not found")
+    job = await get_account_deletion(str(deletion_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Deletion not found")
+    return deletion_progress(job)
+
 @app.get("/api/user/summary")
-async def get_user_summary(current_user: UserInDB = Depends(get_current_user)):
+async def get_user_summary(current_user: CurrentUser = Depends(get_current_user)):
     subs = await get_subscriptions_by_owner(current_user.id)
-    monthly_total = sum(sub["amount"] for sub in subs)
-    top3_expensive = sorted(subs, key=lambda x: x["amount"], reverse=True)[:3]
+    return build_user_summary(subs)
+
+def build_user_summary(subs: List[dict]) -> dict:
+    """Totals, top 3, category split and 6-month history for a user's active subscriptions"""
+    costs = normalize_costs(subs)
+    monthly_total = round(sum(c["monthly"] for c in costs), 2)
+    ranked = sorted(zip(subs, costs), key=lambda pair: pair[1]["monthly"], reverse=True)
+    top3_expensive = [sub for sub, _ in ranked[:3]]
     category_spending = {}
-    for sub in subs:
+    for sub, cost in zip(subs, costs):
         cat = sub.get("category", "Ukategoriseret")
-        category_spending[cat] = category_spending.get(cat, 0) + sub["amount"]
-    
-    # Calculate monthly history based on transaction dates and frequency
-    monthly_history = {}
-    current_date = datetime.now()
-    
-    # Generate data for last 6 months
-    for i in range(6):
-        month_date = current_date - timedelta(days=30 * i)
-        month_key = f"{month_date.month} {month_date.year}"
-        monthly_spending = 0
-        
-        for sub in subs:
-            # Use transaction_date if available, otherwise use renewal_date
-            date_to_use = sub.get("transaction_date") or sub.get("renewal_date")
-            if not date_to_use:
-                # If no date available, include in current month only
-                if i == 0:
-                    monthly_spending += sub["amount"]
-                continue
-            
-            try:
-                # Parse the date (handle both ISO format with time and simple date)
-                if 'T' in date_to_use:
-                    base_date = datetime.fromisoformat(date_to_use.replace('Z', '+00:00'))
-                else:
-                    base_date = datetime.strptime(date_to_use, "%Y-%m-%d")
-                
-                # Check if this subscription was active in this month
-                # For monthly subscriptions, check if the transaction was within the last year
-                # and would have had a payment in this specific month
-                months_diff = (month_date.year - base_date.year) * 12 + (month_date.month - base_date.month)
-                
-                # Simple logic: if transaction was in the past and this month would have a payment
-                if base_date <= month_date:
-                    # For monthly subscriptions, include if months_diff is non-negative and reasonable
-                    if months_diff >= 0 and months_diff <= 12:  # Within last year
-                        monthly_spending += sub["amount"]
-                        
-            except Exception as e:
-                print(f"Error parsing date {date_to_use} for subscription {sub.get('title', 'unknown')}: {e}")
-                # If date parsing fails, include in current month only
-                if i == 0:
-                    monthly_spending += sub["amount"]
-        
-        monthly_history[month_key] = monthly_spending
-    
+        category_spending[cat] = round(category_spending.get(cat, 0) + cost["monthly"], 2)
+
+    # Charges that fell in each of the last 6 calendar months, following each subscription's schedule
+    today = dt.date.today()
+    months = [add_months(today.replace(day=1), -i) for i in range(6)]
+    monthly_history = {f"{m.month} {m.year}": 0.0 for m in months}
+    window_start = months[-1]
+    for sub, cost in zip(subs, costs):
+        # Use renewal_date as the schedule anchor if available, otherwise transaction_date
+        anchor = parse_date(sub.get("renewal_date")) or parse_date(sub.get("transaction_date"))
+        if anchor is None:
+            # If no date available, include in current month only
+            if sub.get("renewal_date") or sub.get("transaction_date"):
+                logger.warning("Could not parse subscription date", extra={"subscription_id": sub.get("id")})
+            monthly_history[f"{today.month} {today.year}"] += cost["amount_dkk"]
+            continue
+        for charge in charges_between(anchor, sub.get("frequency"), window_start, today):
+            key = f"{charge.month} {charge.year}"
+            monthly_history[key] = round(monthly_history[key] + cost["amount_dkk"], 2)
+
     return {
         "monthly_total": monthly_total,
+        "yearly_total": round(sum(c["yearly"] for c in costs), 2),
         "top3_expensive": top3_expensive,
         "category_spending": [{"category": k, "total": v} for k, v in category_spending.items()],
         "monthly_history": monthly_history
@@ -239,13 +413,11 @@ async def get_user_summary(current_user: UserInDB = Depends(get_current_user)):
 
 class TinkTokenRequest(BaseModel):
     code: str
+    bank_name: Optional[str] = None
 
 @app.post("/api/tink/token", response_model=Token)
-async def exchange_code_for_token(request: TinkTokenRequest):
-    import time
-    timestamp = time.strftime("%H:%M:%S")
-    print(f"🔄 [{timestamp}] NEW TOKEN EXCHANGE REQUEST")
-    print(f"🔄 Starting token exchange for code: {request.code[:20]}...")
+async def exchange_code_for_token(request: TinkTokenRequest, current_user: Optional[CurrentUser] = Depends(get_optional_user)):
+    logger.info("Tink token exchange started")
     data = {
         "client_id": TINK_CLIENT_ID,
         "client_secret": TINK_CLIENT_SECRET,
@@ -253,90 +425,136 @@ async def exchange_code_for_token(request: TinkTokenRequest):
         "code": request.code,
         "redirect_uri": TINK_REDIRECT_URI,
     }
-    print(f"📤 Sending request to Tink with data:")
-    print(f"   client_id: {TINK_CLIENT_ID}")
-    print(f"   redirect_uri: {TINK_REDIRECT_URI}")
-    print(f"   code: {request.code[:20]}...")
+    logger.debug("Tink token request", extra={"client_id": TINK_CLIENT_ID, "redirect_uri": TINK_REDIRECT_URI})
+    import httpx
     try:
-        async with httpx.AsyncClient() as client:
-            print("📡 Making request to Tink token endpoint...")
-            response = await client.post("https://api.tink.com/api/v1/oauth/token", data=data)
-            print(f"📊 Tink response status: {response.status_code}")
-            print(f"📊 Tink response headers: {dict(response.headers)}")
-            print(f"📊 Tink response body: {response.text}")
-            response.raise_for_status()
-            token_data = response.json()
-            print(f"✅ Token exchange successful! Token: {token_data.get('access_token', '')[:20]}...")
-            return Token(access_token=token_data["access_token"], token_type="bearer")
+        client = resources.tink_http
+        with span("tink", "oauth_token"):
+            response = await client.post("/api/v1/oauth/token", data=data)
+        logger.debug("Tink token response", extra={"status": response.status_code})
+        log_payload(logger, "Tink token response body", response.text)
+        response.raise_for_status()
+        token_data = response.json()
+        logger.info("Tink token exchange succeeded")
+        if current_user and vault.enabled:
+            # Keep the connection so later imports and syncs can skip Tink Link
+            await vault.store(current_user.id, token_data, request.bank_name)
+        return Token(access_token=token_data["access_token"], token_type="bearer")
     except httpx.HTTPError as e:
         detail = e.response.text if e.response else str(e)
-        print(f"❌ Tink token exchange failed!")
-        print(f"❌ Status code: {e.response.status_code if e.response else 'Unknown'}")
-        print(f"❌ Response: {detail}")
+        logger.error("Tink token exchange failed", extra={"status": e.response.status_code if e.response else None})
+        log_payload(logger, "Tink token error body", detail, sample_rate=1.0)
         raise HTTPException(status_code=e.response.status_code if e.response else 400, detail=f"Tink token exchange error: {detail}")
 
+async def resolve_tink_tokens(token: Optional[str], current_user: Optional[CurrentUser]) -> dict:
+    """Explicit token from the query string, otherwise the user's stored connections"""
+    if token:
+        return {None: token}
+    if current_user is None:
+        raise credentials_exception()
+    if not vault.enabled:
+        raise HTTPException(status_code=400, detail="Tink token required")
+    tokens = await vault.access_tokens(current_user.id)
+    if not tokens:
+        raise HTTPException(status_code=404, detail="No bank connection found. Please connect your bank again.")
+    return tokens
+
+async def fetch_tink_transactions(access_token: str) -> tuple:
+    """Accounts and up to 100 transactions per account for one Tink token"""
+    headers = {"Authorization": f"Bearer {access_token}"}
+    client = resources.tink_http
+    with span("tink", "accounts"):
+        accounts_resp = await client.get("/data/v2/accounts", headers=headers)
+    logger.debug("Tink accounts response", extra={"status": accounts_resp.status_code})
+    log_payload(logger, "Tink accounts body", accounts_resp.text)
+    accounts_resp.raise_for_status()
+    accounts = accounts_resp.json().get("accounts", [])
+    logger.debug("Tink accounts fetched", extra={"accounts": len(accounts)})
+
+    all_transactions = []
+    for acc in accounts:
+        acc_id = acc.get("id")
+        if acc_id:
+            with span("tink", "transactions"):
+                tx_resp = await client.get("/data/v2/transactions", headers=headers, params={"accountId": acc_id, "limit": 100})
+            logger.debug("Tink transactions response", extra={"account_id": acc_id, "status": tx_resp.status_code})
+            log_payload(logger, "Tink transactions body", tx_resp.text)
+            tx_resp.raise_for_status()
+            transactions = tx_resp.json().get("transactions", [])
+            all_transactions.extend(transactions)
+    return accounts, all_transactions
+
 @app.get("/api/tink/transactions")
-async def get_tink_transactions(token: str):
-    headers = {"Authorization": f"Bearer {token}"}
-    print(f"🔍 Fetching Tink data with token: {token[:20]}...")
+async def get_tink_transactions(token: Optional[str] = None, current_user: Optional[CurrentUser] = Depends(get_optional_user)):
+    """Transactions for a raw Tink token, or for the signed-in user's stored bank connections"""
+    logger.info("Fetching Tink transactions", extra={"stored_token": token is None})
+    import httpx
+    tokens = await resolve_tink_tokens(token, current_user)
     try:
-        async with httpx.AsyncClient() as client:
-            print("📡 Fetching accounts from Tink...")
-            accounts_resp = await client.get("https://api.tink.com/data/v2/accounts", headers=headers)
-            print(f"📊 Accounts response status: {accounts_resp.status_code}")
-            print(f"📊 Accounts response: {accounts_resp.text[:500]}...")
-            accounts_resp.raise_for_status()
-            accounts = accounts_resp.json().get("accounts", [])
-            print(f"🏦 Found {len(accounts)} accounts")
-            
-            all_transactions = []
-            for acc in accounts:
-                acc_id = acc.get("id")
-                acc_name = acc.get("name", "Unknown")
-                print(f"💳 Processing account: {acc_name} (ID: {acc_id})")
-                if acc_id:
-                    tx_resp = await client.get("https://api.tink.com/data/v2/transactions", headers=headers, params={"accountId": acc_id, "limit": 100})
-                    print(f"💰 Transactions response status for {acc_name}: {tx_resp.status_code}")
-                    print(f"💰 Transactions response: {tx_resp.text[:500]}...")
-                    tx_resp.raise_for_status()
-                    transactions = tx_resp.json().get("transactions", [])
-                    print(f"💰 Found {len(transactions)} transactions for {acc_name}")
-                    all_transactions.extend(transactions)
-            
-            print(f"✅ Total transactions found: {len(all_transactions)}")
-            return {"transactions": all_transactions}
+        account_count = 0
+        all_transactions = []
+        for bank_name, access_token in tokens.items():
+            accounts, transactions = await fetch_tink_transactions(access_token)
+            account_count += len(accounts)
+            all_transactions.extend(transactions)
+            if bank_name is not None:
+                await vault.mark_synced(current_user.id, bank_name)
+
+        logger.info("Tink transactions fetched", extra={"accounts": account_count, "transactions": len(all_transactions)})
+        return FastJSONResponse({"transactions": all_transactions})
     except httpx.HTTPError as e:
         detail = e.response.text if e.response else str(e)
-        print(f"❌ Tink API error: {e.response.status_code if e.response else 'Unknown'}")
-        print(f"❌ Error detail: {detail}")
+        logger.error("Tink transactions fetch failed", extra={"status": e.response.status_code if e.response else None})
+        log_payload(logger, "Tink error body", detail, sample_rate=1.0)
         raise HTTPException(status_code=e.response.status_code if e.response else 400, detail=f"Tink fetch error: {detail}")
 
 @app.get("/api/tink/accounts")
-async def get_tink_accounts(token: str):
+async def get_tink_accounts(token: Optional[str] = None, current_user: Optional[CurrentUser] = Depends(get_optional_user)):
     """Test endpoint to fetch only accounts from Tink"""
-    headers = {"Authorization": f"Bearer {token}"}
-    print(f"🔍 Testing accounts fetch with token: {token[:20]}...")
-    print(f"🔍 Full token length: {len(token)}")
-    print(f"🔍 Headers being sent: {headers}")
+    logger.info("Fetching Tink accounts")
+    import httpx
+    tokens = await resolve_tink_tokens(token, current_user)
     try:
-        async with httpx.AsyncClient() as client:
-            print("📡 Fetching accounts from Tink...")
-            accounts_resp = await client.get("https://api.tink.com/data/v2/accounts", headers=headers)
-            print(f"📊 Accounts response status: {accounts_resp.status_code}")
-            print(f"📊 Accounts response headers: {dict(accounts_resp.headers)}")
-            print(f"📊 Accounts response: {accounts_resp.text}")
+        client = resources.tink_http
+        accounts = []
+        for access_token in tokens.values():
+            with span("tink", "accounts"):
+                accounts_resp = await client.get("/data/v2/accounts", headers={"Authorization": f"Bearer {access_token}"})
+            logger.debug("Tink accounts response", extra={"status": accounts_resp.status_code})
+            log_payload(logger, "Tink accounts body", accounts_resp.text)
             accounts_resp.raise_for_status()
-            accounts_data = accounts_resp.json()
-            print(f"🏦 Accounts data: {accounts_data}")
-            return accounts_data
+            accounts.extend(accounts_resp.json().get("accounts", []))
+        return FastJSONResponse({"accounts": accounts})
     except httpx.HTTPError as e:
         detail = e.response.text if e.response else str(e)
-        print(f"❌ Tink accounts error: {e.response.status_code if e.response else 'Unknown'}")
-        print(f"❌ Error detail: {detail}")
-        print(f"❌ Request URL: https://api.tink.com/data/v2/accounts")
-        print(f"❌ Request headers: {headers}")
+        logger.error("Tink accounts fetch failed", extra={"status": e.response.status_code if e.response else None, "url": f"{TINK_API_URL}/data/v2/accounts"})
+        log_payload(logger, "Tink error body", detail, sample_rate=1.0)
         raise HTTPException(status_code=e.response.status_code if e.response else 400, detail=f"Tink accounts error: {detail}")
 
+@app.get("/api/tink/connections")
+async def get_tink_connections(current_user: CurrentUser = Depends(get_current_user)):
+    """Stored bank connections, so the app can skip Tink Link when one exists"""
+    if not vault.enabled:
+        return {"connections": []}
+    return {"connections": await vault.connections(current_user.id)}
+
+@app.post("/api/tink/webhooks", status_code=status.HTTP_204_NO_CONTENT)
+async def tink_webhook(request: Request):
+    """Verify and store a Tink event; the affected accounts are fetched in the background"""
+    if not webhooks.enabled:
+        raise HTTPException(status_code=404, detail="Not found")
+    body = await request.body()
+    try:
+        outcome = await receive_tink_webhook(body, request.headers.get("X-Tink-Signature"))
+    except WebhookSignatureError as e:
+        logger.warning("Tink webhook rejected", extra={"error": str(e)})
+        raise HTTPException(status_code=401, detail=str(e))
+    except WebhookError as e:
+        logger.warning("Tink webhook rejected", extra={"error": str(e)})
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.debug("Tink webhook received", extra={"outcome": outcome})
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
 @app.get("/api/debug/env")
 async def debug_env():
     """Debug endpoint to check environment variables"""
@@ -344,285 +562,148 @@ async def debug_env():
         "TINK_CLIENT_ID": TINK_CLIENT_ID,
         "TINK_CLIENT_SECRET": TINK_CLIENT_SECRET[:10] + "..." if TINK_CLIENT_SECRET else None,
         "TINK_REDIRECT_URI": TINK_REDIRECT_URI,
-        "SECRET_KEY_SET": bool(SECRET_KEY),
+        "SECRET_KEY_SET": bool(os.getenv("SECRET_JWT_KEY")),
     }
 
 @app.get("/api/debug/test-token")
 async def test_token(token: str):
     """Test endpoint to manually test a Tink token"""
     headers = {"Authorization": f"Bearer {token}"}
-    print(f"🧪 Manual token test with: {token[:30]}...")
+    logger.info("Manual Tink token test")
     
     try:
-        async with httpx.AsyncClient() as client:
-            # Test accounts endpoint
-            print("🧪 Testing accounts endpoint...")
-            accounts_resp = await client.get("https://api.tink.com/data/v2/accounts", headers=headers)
-            print(f"🧪 Accounts status: {accounts_resp.status_code}")
-            print(f"🧪 Accounts response: {accounts_resp.text[:200]}...")
-            
-            if accounts_resp.status_code == 200:
-                accounts_data = accounts_resp.json()
-                return {
-                    "success": True,
-                    "accounts_count": len(accounts_data.get("accounts", [])),
-                    "accounts": accounts_data.get("accounts", [])[:2]  # First 2 accounts
-                }
-            else:
-                return {
-                    "success": False,
-                    "status": accounts_resp.status_code,
-                    "error": accounts_resp.text
-                }
+        client = resources.tink_http
+        # Test accounts endpoint
+        with span("tink", "accounts"):
+            accounts_resp = await client.get("/data/v2/accounts", headers=headers)
+        logger.debug("Tink accounts response", extra={"status": accounts_resp.status_code})
+        log_payload(logger, "Tink accounts body", accounts_resp.text)
+        
+        if accounts_resp.status_code == 200:
+            accounts_data = accounts_resp.json()
+            return {
+                "success": True,
+                "accounts_count": len(accounts_data.get("accounts", [])),
+                "accounts": accounts_data.get("accounts", [])[:2]  # First 2 accounts
+            }
+        else:
+            return {
+                "success": False,
+                "status": accounts_resp.status_code,
+                "error": accounts_resp.text
+            }
     except Exception as e:
-        print(f"🧪 Test failed: {e}")
+        logger.warning("Manual Tink token test failed", extra={"error": str(e)})
         return {"success": False, "error": str(e)}
 
 class TransactionAnalysisRequest(BaseModel):
     transactions: List[dict]
 
-@app.post("/api/ai/analyze-subscriptions")
-async def analyze_subscriptions_with_ai(request: TransactionAnalysisRequest, current_user: UserInDB = Depends(get_current_user)):
+@app.post("/api/ai/analyze-subscriptions", dependencies=[Depends(limited("ai", get_current_user))])
+async def analyze_subscriptions_with_ai(request: TransactionAnalysisRequest, background_tasks: BackgroundTasks,
+                                        current_user: CurrentUser = Depends(get_current_user),
+                                        idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
     """Use OpenAI to intelligently detect subscriptions from transactions"""
-    print(f"🤖 Starting AI analysis of {len(request.transactions)} transactions...")
-    
-    try:
-        # Group transactions by description
-        groups = {}
-        for tx in request.transactions:
-            desc = tx.get("descriptions", {}).get("display", "") or tx.get("descriptions", {}).get("original", "")
-            if not desc or desc == "Ukendt":
-                continue
-            if desc not in groups:
-                groups[desc] = []
-            groups[desc].append(tx)
-        
-        print(f"🔍 Grouped into {len(groups)} unique transaction descriptions")
-        
-        # Only analyze groups with 2+ transactions
-        recurring_groups = {desc: txs for desc, txs in groups.items() if len(txs) >= 2}
-        print(f"📊 Found {len(recurring_groups)} recurring transaction groups")
-        
-        if not recurring_groups:
-            return {"subscriptions": []}
-        
-        # Prepare data for OpenAI analysis
-        transaction_summaries = []
-        for desc, txs in recurring_groups.items():
-            amounts = []
-            dates = []
-            for tx in txs:
-                try:
-                    unscaled = float(tx.get("amount", {}).get("value", {}).get("unscaledValue", 0))
-                    scale = int(tx.get("amount", {}).get("value", {}).get("scale", 0))
-                    amount = abs(unscaled / (10 ** scale))
-                    amounts.append(amount)
-                    dates.append(tx.get("dates", {}).get("booked", ""))
-                except:
-                    continue
-            
-            if amounts:
-                avg_amount = sum(amounts) / len(amounts)
-                transaction_summaries.append({
-                    "description": desc,
-                    "frequency": len(txs),
-                    "average_amount": round(avg_amount, 2),
-                    "amount_range": f"{min(amounts):.2f}-{max(amounts):.2f} DKK",
-                    "dates": sorted(dates)[-3:]  # Last 3 dates
-                })
-        
-        # Create prompt for OpenAI
-        prompt = f"""
-Analyser følgende danske banktransaktioner og identificer hvilke der er abonnementer/subscriptions.
-
-For hver transaktion skal du bestemme:
-1. Er det et abonnement? (ja/nej)
-2. Confidence score (0-100%)
-3. Præcist virksomhedsnavn (forkort og rens - f.eks. "SPLICE.COM* CREATOR" → "Splice", "DISNEYPLUS.COM DK" → "Disney+")
-4. Kategori (Streaming & Underholdning, Forsikring & Pension, Telekom & Internet, osv.)
-5. Betalingsfrekvens (måned/kvartal/halvår/år)
-6. Næste fornyelsesdato (baseret på frekvens og seneste betaling)
+    logger.info("AI analysis started", extra={"transactions": len(request.transactions)})
 
-Transaktioner:
-{chr(10).join([f"- {t['description']}: {t['frequency']} gange, gennemsnit {t['average_amount']} DKK, seneste datoer: {', '.join(t['dates'])}" for t in transaction_summaries[:20]])}
-
-Returner JSON format:
-[
-  {{
-    "original_description": "SPLICE.COM* CREATOR",
-    "clean_name": "Splice",
-    "is_subscription": true,
-    "confidence": 95,
-    "category": "Software & Værktøjer",
-    "frequency": "måned",
-    "next_renewal_date": "2024-02-15",
-    "reasoning": "Kendt musik-software abonnement med regelmæssige månedlige betalinger"
-  }}
-]
-
-Vigtige regler:
-- Rens virksomhedsnavne: fjern .COM, *, CREATOR osv. og gør dem læselige
-- Beregn næste fornyelsesdato baseret på frekvens og seneste betaling
-- Fokuser på danske tjenester og vær konservativ
-- Kun klassificer som abonnement hvis du er sikker
-"""
-
-        # Call OpenAI API
+    async def analyze():
         try:
-            client = openai.OpenAI(api_key=OPENAI_API_KEY)
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "Du er en ekspert i danske banktransaktioner og abonnementer. Analyser transaktioner og identificer abonnementer præcist."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=2000
-            )
-            
-            ai_response = response.choices[0].message.content
-            print(f"🤖 OpenAI response: {ai_response[:500]}...")
-        except Exception as openai_error:
-            print(f"❌ OpenAI API call failed: {openai_error}")
-            raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(openai_error)}")
-        
-        # Parse AI response
-        try:
-            ai_results = json.loads(ai_response)
-        except json.JSONDecodeError as e:
-            print(f"❌ JSON decode error: {e}")
-            # Try to extract JSON from response
-            json_match = re.search(r'\[.*\]', ai_response, re.DOTALL)
-            if json_match:
-                try:
-                    ai_results = json.loads(json_match.group())
-                except json.JSONDecodeError:
-                    print("❌ Failed to parse extracted JSON")
-                    return {"subscriptions": []}
-            else:
-                print("❌ No JSON array found in AI response")
-                print(f"❌ AI response was: {ai_response}")
-                return {"subscriptions": []}
-        
-        # Convert AI results to subscription format
-        detected_subscriptions = []
-        for result in ai_results:
-            if result.get("is_subscription", False) and result.get("confidence", 0) >= 70:
-                # Use original_description to find the transaction group, but clean_name for display
-                original_desc = result.get("original_description", result.get("description", ""))
-                clean_name = result.get("clean_name", clean_description(original_desc))
-                
-                if original_desc in recurring_groups:
-                    txs = recurring_groups[original_desc]
-                    amounts = []
-                    dates = []
-                    
-                    for tx in txs:
-                        try:
-                            unscaled = float(tx.get("amount", {}).get("value", {}).get("unscaledValue", 0))
-                            scale = int(tx.get("amount", {}).get("value", {}).get("scale", 0))
-                            amount = abs(unscaled / (10 ** scale))
-                            amounts.append(amount)
-                            dates.append(tx.get("dates", {}).get("booked", ""))
-                        except:
-                            continue
-                    
-                    if amounts and dates:
-                        avg_amount = sum(amounts) / len(amounts)
-                        
-                        # Use AI-provided next_renewal_date if available, otherwise calculate
-                        if result.get("next_renewal_date"):
-                            renewal_date = result["next_renewal_date"]
-                        else:
-                            sorted_dates = sorted([d for d in dates if d])
-                            from datetime import datetime, timedelta
-                            last_date = datetime.fromisoformat(sorted_dates[-1].replace('Z', '+00:00'))
-                            
-                            freq_days = {"måned": 30, "kvartal": 90, "halvår": 180, "år": 365}
-                            days_to_add = freq_days.get(result.get("frequency", "måned"), 30)
-                            next_renewal = last_date + timedelta(days=days_to_add)
-                            renewal_date = next_renewal.strftime("%Y-%m-%d")
-                        
-                        detected_subscriptions.append({
-                            "name": clean_name,
-                            "amount": round(avg_amount, 2),
-                            "category": result.get("category", "Øvrige"),
-                            "frequency": result.get("frequency", "måned"),
-                            "confidence": result.get("confidence", 70),
-                            "renewal_date": renewal_date,
-                            "transaction_date": sorted_dates[-1] if sorted_dates else None,  # Most recent transaction date
-                            "reasoning": result.get("reasoning", "AI detected subscription"),
-                            "source": "tink"  # Mark as coming from Tink integration
-                        })
-        
-        print(f"🎯 AI detected {len(detected_subscriptions)} subscriptions")
+            detected_subscriptions = await detect_subscriptions(request.transactions)
+        except DetectionError as e:
+            raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
+        except Exception as e:
+            logger.exception("AI analysis failed")
+            raise HTTPException(status_code=500, detail=f"AI analysis error: {str(e)}")
+        logger.info("AI analysis finished", extra={"subscriptions": len(detected_subscriptions)})
         return {"subscriptions": detected_subscriptions}
-        
-    except Exception as e:
-        print(f"❌ AI analysis failed: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"AI analysis error: {str(e)}")
 
-@app.post("/api/ai/analyze-pdf")
-async def analyze_pdf_with_ai(file: UploadFile = File(...), current_user: UserInDB = Depends(get_current_user)):
+    # Retries replay the stored result; identical concurrent requests share one OpenAI call
+    result = await idempotency.run(
+        idempotency_key, current_user.id, "analyze_subscriptions", request.transactions,
+        lambda: idempotency.coalesce(current_user.id, "analyze_subscriptions", request.transactions, analyze))
+    # Keep the transactions for price-change detection once the response is sent (re-ingesting is a no-op)
+    background_tasks.add_task(ingest_transactions, current_user.id, request.transactions)
+    return result
+
+@app.post("/api/ai/analyze-pdf", dependencies=[Depends(limited("ai", get_current_user))])
+async def analyze_pdf_with_ai(file: UploadFile = File(...), current_user: CurrentUser = Depends(get_current_user),
+                              idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
     """Use OpenAI to analyze PDF bank statements and detect subscriptions"""
-    print(f"🤖 Starting PDF analysis for file: {file.filename}")
-    
+    logger.info("PDF analysis started", extra={"upload_filename": file.filename})
+
+    # Validate file type
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+
+    # Hashed while it is read; the digest identifies the document for the caches and idempotency
+    pdf_content, digest = await read_upload(file)
+    return await idempotency.run(
+        idempotency_key, current_user.id, "analyze_pdf", digest,
+        lambda: idempotency.coalesce(current_user.id, "analyze_pdf", digest,
+                                     lambda: analyze_pdf_content(pdf_content, digest, current_user.id)))
+
+async def analyze_pdf_content(pdf_content: bytes, digest: str, user_id: int) -> dict:
+    """Extract, classify and convert the subscriptions in one PDF statement"""
+    cached = await asyncio.to_thread(statements.get, digest)
+    if cached and cached["result"] is not None:
+        pdf_cache_lookups.inc(("document",))
+        logger.info("PDF analysis served from cache", extra={"subscriptions": len(cached["result"]["subscriptions"])})
+        return cached["result"]
     try:
-        # Validate file type
-        if not file.filename.lower().endswith('.pdf'):
-            raise HTTPException(status_code=400, detail="Only PDF files are supported")
-        
-        # Read PDF content
-        pdf_content = await file.read()
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_content))
-        
-        # Extract text from all pages
-        text_content = ""
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            text_content += page.extract_text() + "\n"
-        
-        print(f"📄 Extracted {len(text_content)} characters from PDF")
-        print(f"📄 Sample content: {text_content[:500]}...")
+        if cached:
+            text_content = cached["text"]
+        else:
+            text_content = await asyncio.to_thread(extract_pdf_text, pdf_content)
+            await asyncio.to_thread(statements.put, digest, text_content)
+        logger.debug("PDF text extracted", extra={"chars": len(text_content)})
         
         if len(text_content.strip()) < 100:
             raise HTTPException(status_code=400, detail="PDF contains insufficient text content")
         
         # Build map of cleaned description -> latest transaction date found in PDF
-        date_pattern = re.compile(r"(\d{1,2}[./-]\d{1,2}[./-]\d{2,4})")
+        lines = statement_lines(text_content)
         desc_last_date = {}
-        for line in text_content.splitlines():
-            if not line.strip():
-                continue
-            m_date = date_pattern.search(line)
-            if not m_date:
-                continue
-            date_str = m_date.group(1)
-            # normalize separators
-            date_str_norm = date_str.replace('.', '/').replace('-', '/')
-            try:
-                dt_obj = dt.datetime.strptime(date_str_norm, "%d/%m/%Y")
-            except ValueError:
-                try:
-                    dt_obj = dt.datetime.strptime(date_str_norm, "%d/%m/%y")
-                except ValueError:
-                    continue
-            # remove date part from line then clean
-            desc_part = line.replace(date_str, "").strip()
-            clean_desc = clean_description(desc_part)
-            key = clean_desc.lower()
-            if key in desc_last_date:
-                if dt_obj > desc_last_date[key]:
-                    desc_last_date[key] = dt_obj
-            else:
-                desc_last_date[key] = dt_obj
-        
-        # Create prompt for OpenAI to analyze bank statement
-        prompt = f"""
+        for line in lines:
+            key = clean_description(line["description"]).lower()
+            if key not in desc_last_date or line["date"] > desc_last_date[key]:
+                desc_last_date[key] = line["date"]
+
+        # Merchants classified from an overlapping statement are reused instead of sent again
+        to_classify, reused = line_items.plan(user_id, lines)
+        if lines and not to_classify:
+            pdf_cache_lookups.inc(("lines",))
+            ai_results = []
+        else:
+            partial = len(to_classify) < len(lines)
+            pdf_cache_lookups.inc(("partial" if partial else "miss",))
+            statement_text, sent = statement_prompt(text_content, lines, to_classify, 8000)
+            ai_results = await classify_pdf_statement(statement_text)
+            if ai_results is None:
+                return {"subscriptions": []}
+            # Lines cut off by the prompt limit weren't seen, so they stay unknown
+            line_items.remember(user_id, sent, ai_results)
+        fresh = {result_merchant(result) for result in ai_results if isinstance(result, dict)}
+        ai_results = ai_results + [result for result in reused if result_merchant(result) not in fresh]
+        subscriptions = pdf_results_to_subscriptions(ai_results, desc_last_date)
+        logger.info("PDF analysis finished", extra={
+            "subscriptions": len(subscriptions), "lines": len(lines), "lines_classified": len(to_classify) if lines else None,
+            "reused": len(reused)})
+        result = {"subscriptions": subscriptions}
+        await asyncio.to_thread(statements.put, digest, text_content, result)
+        return result
+
+    except Exception as e:
+        logger.exception("PDF analysis failed")
+        raise HTTPException(status_code=500, detail=f"PDF analysis error: {str(e)}")
+
+async def classify_pdf_statement(statement_text: str) -> Optional[list]:
+    """The model's verdicts on a statement's text; None if its reply can't be parsed"""
+    # Create prompt for OpenAI to analyze bank statement
+    prompt = f"""
 Analyser følgende danske kontoudtog og identificer alle abonnementer/subscriptions.
 
 Kontoudtog indhold:
-{text_content[:8000]}  # Limit to avoid token limits
+{statement_text}  # Limit to avoid token limits
 
 For hver potentiel abonnement skal du bestemme:
 1. Er det et abonnement? (ja/nej)
@@ -659,10 +740,10 @@ Vigtige regler:
 - Hvis du finder en virksomhed som ikke typisk er et abonnement, men har muligheden for et abonnement og det er et fast beløb, så søg på nettet og revurdér om det kunne være et abonnement. Et eksempel på dette kunne være "Wolt" som typisk er engangskøb, men også har muligheden for abonnement "Wolt+".
 """
 
-        # Call OpenAI API
-        try:
-            client = openai.OpenAI(api_key=OPENAI_API_KEY)
-            response = client.chat.completions.create(
+    # Call OpenAI API
+    try:
+        with span("openai", "analyze_pdf"):
+            response = await resources.openai.chat.completions.create(
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": "Du er en ekspert i banktransaktioner og abonnementer. Analyser kontoudtog og identificer abonnementer præcist."},
@@ -671,117 +752,100 @@ Vigtige regler:
                 temperature=0.1,
                 max_tokens=3000
             )
-            
-            ai_response = response.choices[0].message.content
-            print(f"🤖 OpenAI PDF response: {ai_response[:500]}...")
-        except Exception as openai_error:
-            print(f"❌ OpenAI PDF API call failed: {openai_error}")
-            raise HTTPException(status_code=500, detail=f"OpenAI PDF API error: {str(openai_error)}")
         
-        # Parse AI response
-        try:
-            ai_results = json.loads(ai_response)
-        except json.JSONDecodeError as e:
-            print(f"❌ PDF JSON decode error: {e}")
-            # Try to extract JSON from response
-            json_match = re.search(r'\[.*\]', ai_response, re.DOTALL)
-            if json_match:
-                try:
-                    ai_results = json.loads(json_match.group())
-                except json.JSONDecodeError:
-                    print("❌ Failed to parse extracted PDF JSON")
-                    return {"subscriptions": []}
+        ai_response = response.choices[0].message.content
+        log_payload(logger, "OpenAI PDF response", ai_response)
+    except Exception as openai_error:
+        logger.error("OpenAI PDF call failed", extra={"error": str(openai_error)})
+        raise HTTPException(status_code=500, detail=f"OpenAI PDF API error: {str(openai_error)}")
+    
+    # Parse AI response
+    try:
+        ai_results = json.loads(ai_response)
+    except json.JSONDecodeError as e:
+        logger.warning("OpenAI PDF response is not valid JSON", extra={"error": str(e)})
+        # Try to extract JSON from response
+        json_match = re.search(r'\[.*\]', ai_response, re.DOTALL)
+        if json_match:
+            try:
+                ai_results = json.loads(json_match.group())
+            except json.JSONDecodeError:
+                logger.warning("Failed to parse extracted JSON from OpenAI PDF response")
+                return None
+        else:
+            logger.warning("No JSON array found in OpenAI PDF response")
+            log_payload(logger, "Unparseable OpenAI PDF response", ai_response, sample_rate=1.0)
+            return None
+    return ai_results
+
+def pdf_results_to_subscriptions(ai_results: list, desc_last_date: dict) -> list:
+    """Detected subscriptions in the shape the app imports"""
+    detected_subscriptions = []
+    for result in ai_results:
+        if result.get("is_subscription", False) and result.get("confidence", 0) >= 70:
+            # Use clean_name from AI if available, otherwise clean the original description
+            clean_name = result.get("clean_name")
+            if not clean_name:
+                original_desc = result.get("original_description", result.get("description", ""))
+                clean_name = clean_description(original_desc)
+            
+            # Use AI-provided next_renewal_date if available, otherwise calculate
+            if result.get("next_renewal_date"):
+                renewal_date = result["next_renewal_date"]
             else:
-                print("❌ No JSON array found in PDF AI response")
-                print(f"❌ PDF AI response was: {ai_response}")
-                return {"subscriptions": []}
-        
-        # Convert AI results to subscription format
-        detected_subscriptions = []
-        for result in ai_results:
-            if result.get("is_subscription", False) and result.get("confidence", 0) >= 70:
-                # Use clean_name from AI if available, otherwise clean the original description
-                clean_name = result.get("clean_name")
-                if not clean_name:
-                    original_desc = result.get("original_description", result.get("description", ""))
-                    clean_name = clean_description(original_desc)
-                
-                # Use AI-provided next_renewal_date if available, otherwise calculate
-                if result.get("next_renewal_date"):
-                    renewal_date = result["next_renewal_date"]
-                else:
-                    from datetime import timedelta
-                    freq_days = {"måned": 30, "kvartal": 90, "halvår": 180, "år": 365}
-                    days_to_add = freq_days.get(result.get("frequency", "måned"), 30)
-
-                    key = clean_name.lower()
-                    last_dt = desc_last_date.get(key)
-                    if last_dt:
-                        next_renewal_dt = last_dt + timedelta(days=days_to_add)
-                    else:
-                        # fallback to today
-                        next_renewal_dt = dt.datetime.now() + timedelta(days=days_to_add)
-                    renewal_date = next_renewal_dt.strftime("%Y-%m-%d")
-                
-                # Get transaction date from PDF data
                 key = clean_name.lower()
-                transaction_date = None
-                if key in desc_last_date:
-                    transaction_date = desc_last_date[key].strftime("%Y-%m-%d")
-                
-                detected_subscriptions.append({
-                    "name": clean_name,
-                    "amount": float(result.get("amount", 0)),
-                    "category": result.get("category", "Øvrige"),
-                    "frequency": result.get("frequency", "måned"),
-                    "confidence": result.get("confidence", 70),
-                    "renewal_date": renewal_date,
-                    "transaction_date": transaction_date,  # Include actual transaction date from PDF
-                    "reasoning": result.get("reasoning", "PDF AI detected subscription"),
-                    "source": "pdf"  # Mark as coming from PDF upload
-                })
-        
-        print(f"🎯 PDF AI detected {len(detected_subscriptions)} subscriptions")
-        return {"subscriptions": detected_subscriptions}
-        
-    except Exception as e:
-        print(f"❌ PDF analysis failed: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"PDF analysis error: {str(e)}")
-
-@app.on_event("startup")
-async def create_db_tables():
-    print("Ensure 'users' and 'subscriptions' tables exist in Supabase.")
+                last_dt = desc_last_date.get(key)
+                # fallback to today
+                last_charge = last_dt.date() if last_dt else dt.date.today()
+                renewal_date = next_renewal(last_charge, result.get("frequency", "måned"), dt.date.today()).isoformat()
+            
+            # Get transaction date from PDF data
+            key = clean_name.lower()
+            transaction_date = None
+            if key in desc_last_date:
+                transaction_date = desc_last_date[key].strftime("%Y-%m-%d")
+            
+            detected_subscriptions.append({
+                "name": clean_name,
+                "amount": float(result.get("amount", 0)),
+                "category": result.get("category", "Øvrige"),
+                "frequency": result.get("frequency", "måned"),
+                "confidence": result.get("confidence", 70),
+                "renewal_date": renewal_date,
+                "transaction_date": transaction_date,  # Include actual transaction date from PDF
+                "reasoning": result.get("reasoning", "PDF AI detected subscription"),
+                "source": "pdf"  # Mark as coming from PDF upload
+            })
+    return detected_subscriptions
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus scrape endpoint (per worker process)"""
+    return PlainTextResponse(registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/api/health/live")
+async def liveness():
+    """Process is up and serving requests"""
+    return {"status": "ok"}
+
+@app.get("/api/health/ready")
+async def readiness(response: Response):
+    """Ready once the shared clients have been created"""
+    status_info = resources.status()
+    # Replicas are optional: reads fall back to the primary, so they don't affect readiness
+    status_info["read_replicas"] = replicas.status()
+    if not status_info["ready"]:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return status_info
 
 # ---------- Helper utilities ----------
 
-def clean_description(desc: str) -> str:
-    """Normalize merchant/description strings to nice subscription titles.
-
-    Examples:
-    "OPENAI *CHATGPT"      -> "Openai Chatgpt"
-    "SPLICE.COM* CREATOR"  -> "Splice Creator"
-    "DISNEYPLUS.COM  DK"   -> "Disneyplus"
-    "www.netflix.com"      -> "Netflix"
-    "TRYG FORSIKRING A/S"  -> "Tryg Forsikring A S"
-    """
-    if not desc:
-        return "Ukendt"
-    text = desc.lower()
-
-    # Remove protocol
-    text = re.sub(r"https?://", "", text)
-
-    # Replace delimiters * / - with space
-    text = re.sub(r"[*/_-]", " ", text)
-
-    # Remove domain suffixes (.com, .dk etc.)
-    text = re.sub(r"\b[a-z0-9]+\.(com|dk|io|net|org|se|co)\b", "", text)
-
-    # Remove multiple spaces and non-alphanumeric (keep danish chars)
-    text = re.sub(r"[^a-z0-9æøå \s]", "", text)
-    text = re.sub(r"\s{2,}", " ", text).strip()
-
-    return text.title()
+def extract_pdf_text(pdf_content: bytes) -> str:
+    """Extract the text of every page of a PDF, one page per block"""
+    import PyPDF2
+    with span("pdf", "extract_text"):
+        pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_content))
+        return "".join(page.extract_text() + "\n" for page in pdf_reader.pages)
 
 if __name__ == "__main__":
     import uvicorn
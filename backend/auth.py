@@ -0,0 +1,212 @@
+import os
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from jose import JWTError, jwk, jwt
+
+from models import CurrentUser
+
+load_dotenv()
+
+# ========== CONFIGURATION ==========
+
+SECRET_KEY = os.getenv("SECRET_JWT_KEY")
+ALGORITHM = os.getenv("ALGORITHM", "HS256")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 30))
+DELETION_STATUS_TOKEN_EXPIRE_DAYS = int(os.getenv("DELETION_STATUS_TOKEN_EXPIRE_DAYS", 7))
+TOKEN_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", 10000))
+
+# Asymmetric algorithms (RS256, ES256, ...) sign with a private key and let other
+# services verify with the public key only. Keys are PEM strings or file paths.
+JWT_PRIVATE_KEY = os.getenv("JWT_PRIVATE_KEY")
+JWT_PUBLIC_KEY = os.getenv("JWT_PUBLIC_KEY")
+JWT_PRIVATE_KEY_FILE = os.getenv("JWT_PRIVATE_KEY_FILE")
+JWT_PUBLIC_KEY_FILE = os.getenv("JWT_PUBLIC_KEY_FILE")
+JWT_KEY_ID = os.getenv("JWT_KEY_ID")
+
+# Bump when the claim layout changes; tokens with another version take the slow path
+TOKEN_CLAIMS_VERSION = 1
+
+ACCESS_TOKEN_TYPE = "access"
+REFRESH_TOKEN_TYPE = "refresh"
+# Lets the client of a deleted account poll that deletion's progress, and nothing else
+DELETION_STATUS_TOKEN_TYPE = "deletion_status"
+
+def _read_key(value: Optional[str], path: Optional[str]) -> Optional[str]:
+    if value:
+        return value.replace("\\n", "\n")
+    if path:
+        with open(path, "r") as f:
+            return f.read()
+    return None
+
+def is_asymmetric(algorithm: str = ALGORITHM) -> bool:
+    return algorithm.startswith(("RS", "ES", "PS"))
+
+def _load_keys() -> Tuple[Any, Any]:
+    """Construct signing and verification keys once instead of on every request"""
+    if is_asymmetric():
+        private_pem = _read_key(JWT_PRIVATE_KEY, JWT_PRIVATE_KEY_FILE)
+        public_pem = _read_key(JWT_PUBLIC_KEY, JWT_PUBLIC_KEY_FILE)
+        if not public_pem:
+            raise ValueError(f"JWT_PUBLIC_KEY or JWT_PUBLIC_KEY_FILE is required for {ALGORITHM}")
+        verify_key = jwk.construct(public_pem, ALGORITHM)
+        # Verify-only services run without the private key
+        signing_key = jwk.construct(private_pem, ALGORITHM) if private_pem else None
+        return signing_key, verify_key
+
+    if not SECRET_KEY:
+        raise ValueError("SECRET_JWT_KEY not found in environment variables. Please set it in .env")
+    key = jwk.construct(SECRET_KEY, ALGORITHM)
+    return key, key
+
+SIGNING_KEY, VERIFY_KEY = _load_keys()
+
+# ========== VERIFIED TOKEN CACHE ==========
+
+class TokenCache:
+    """LRU of verified tokens keyed by SHA-256 of the token, valid until the token's exp"""
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    @staticmethod
+    def key_for(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        key = self.key_for(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, claims = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return claims
+
+    def put(self, token: str, claims: Dict[str, Any]) -> None:
+        if self.max_size <= 0:
+            return
+        key = self.key_for(token)
+        self._entries[key] = (float(claims["exp"]), claims)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int) -> int:
+        """Drop every cached token belonging to a user, e.g. after deactivation"""
+        stale = [k for k, (_, claims) in self._entries.items() if claims.get("uid") == user_id]
+        for k in stale:
+            del self._entries[k]
+        return len(stale)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+token_cache = TokenCache()
+
+# ========== REVOKED USERS ==========
+
+class RevokedUsers:
+    """Users whose unexpired access tokens must stop working, e.g. after account deletion.
+
+    Kept in process memory for one access token lifetime, by which time every token issued
+    before the revocation has expired on its own. Other workers still accept those tokens until
+    then; the user row is deactivated, so nothing can be refreshed or logged into.
+    """
+
+    def __init__(self):
+        self._until: Dict[int, float] = {}
+
+    def revoke(self, user_id: int) -> None:
+        now = time.time()
+        for expired in [uid for uid, until in self._until.items() if until <= now]:
+            del self._until[expired]
+        self._until[user_id] = now + ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+    def __contains__(self, user_id: int) -> bool:
+        until = self._until.get(user_id)
+        return until is not None and until > time.time()
+
+revoked_users = RevokedUsers()
+
+def revoke_user(user_id: int) -> None:
+    """Reject the user's outstanding tokens in this process and drop their cached verifications"""
+    revoked_users.revoke(user_id)
+    token_cache.invalidate_user(user_id)
+
+# ========== ISSUING ==========
+
+def _encode(claims: Dict[str, Any]) -> str:
+    if SIGNING_KEY is None:
+        raise RuntimeError("No JWT signing key configured (set JWT_PRIVATE_KEY for asymmetric algorithms)")
+    headers = {"kid": JWT_KEY_ID} if JWT_KEY_ID else None
+    return jwt.encode(claims, SIGNING_KEY, algorithm=ALGORITHM, headers=headers)
+
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+    to_encode = data.copy()
+    now = datetime.utcnow()
+    expire = now + (expires_delta if expires_delta else timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    to_encode.update({"exp": expire, "iat": now, "typ": ACCESS_TOKEN_TYPE, "ver": TOKEN_CLAIMS_VERSION})
+    return _encode(to_encode)
+
+def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+    to_encode = data.copy()
+    now = datetime.utcnow()
+    expire = now + (expires_delta if expires_delta else timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+    to_encode.update({"exp": expire, "iat": now, "typ": REFRESH_TOKEN_TYPE, "ver": TOKEN_CLAIMS_VERSION})
+    return _encode(to_encode)
+
+def create_deletion_status_token(deletion_id: str, expires_delta: Optional[timedelta] = None) -> str:
+    now = datetime.utcnow()
+    expire = now + (expires_delta if expires_delta else timedelta(days=DELETION_STATUS_TOKEN_EXPIRE_DAYS))
+    return _encode({"did": deletion_id, "exp": expire, "iat": now, "typ": DELETION_STATUS_TOKEN_TYPE})
+
+def user_claims(user) -> Dict[str, Any]:
+    """Claims embedded in both token types so verification needs no user lookup"""
+    return {"sub": user.email, "uid": user.id, "act": user.is_active}
+
+# ========== VERIFICATION ==========
+
+def decode_token(token: str, expected_type: str = ACCESS_TOKEN_TYPE) -> Dict[str, Any]:
+    """Verify a token, serving repeat verifications from the LRU cache.
+
+    Raises JWTError if the token is invalid, expired or of the wrong type.
+    Tokens issued before typed claims existed carry no "typ" and count as access tokens.
+    """
+    claims = token_cache.get(token)
+    if claims is None:
+        claims = jwt.decode(token, VERIFY_KEY, algorithms=[ALGORITHM])
+        if "exp" in claims:
+            token_cache.put(token, claims)
+    if claims.get("typ", ACCESS_TOKEN_TYPE) != expected_type:
+        raise JWTError("Unexpected token type")
+    return claims
+
+def current_user_from_claims(claims: Dict[str, Any]) -> Optional[CurrentUser]:
+    """Build the request user straight from the claims, or None if the token predates them"""
+    if claims.get("ver") != TOKEN_CLAIMS_VERSION or claims.get("uid") is None:
+        return None
+    return CurrentUser(id=claims["uid"], email=claims["sub"], is_active=claims.get("act", True))
+
+def public_jwks() -> Dict[str, Any]:
+    """JWK set other services can use to verify tokens without the signing secret"""
+    if not is_asymmetric():
+        return {"keys": []}
+    key = VERIFY_KEY.public_key() if hasattr(VERIFY_KEY, "public_key") else VERIFY_KEY
+    key_dict = key.to_dict()
+    key_dict.update({"use": "sig", "alg": ALGORITHM})
+    if JWT_KEY_ID:
+        key_dict["kid"] = JWT_KEY_ID
+    return {"keys": [key_dict]}
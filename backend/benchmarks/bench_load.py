@@ -0,0 +1,238 @@
+"""Load test for the backend against local stand-ins.
+
+Starts the stand-in services (benchmarks/standins.py) and a uvicorn worker
+running app.py, signs up a pool of users, then drives a weighted mix of
+login, list, summary, create, delete and import traffic at increasing
+concurrency. Reports p50/p95/p99 latency per operation and throughput.
+
+    python -m benchmarks.bench_load --concurrency 1,8,32 --duration 10 --output load.json
+
+Use --backend-url/--standins-url to benchmark processes you started yourself.
+With --storage sqlite the backend uses a fresh embedded SQLite database
+instead of the fake PostgREST, so the database layer is measured too.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.harness import bench_env, free_port, percentile, spawn, spawn_backend, stop, wait_for
+
+DEFAULT_MIX = {"login": 5, "list": 35, "summary": 25, "create": 15, "delete": 10, "import": 10}
+PASSWORD = "benchmark-password"
+
+class UserState:
+    def __init__(self, email: str):
+        self.email = email
+        self.token: Optional[str] = None
+        self.created_ids: List[int] = []
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"}
+
+# ========== OPERATIONS ==========
+
+async def op_login(client: httpx.AsyncClient, user: UserState, rng: random.Random) -> int:
+    resp = await client.post("/api/auth/login", data={"username": user.email, "password": PASSWORD})
+    if resp.status_code == 200:
+        user.token = resp.json()["access_token"]
+    return resp.status_code
+
+async def op_list(client, user, rng) -> int:
+    return (await client.get("/api/subscriptions", headers=user.headers)).status_code
+
+async def op_summary(client, user, rng) -> int:
+    return (await client.get("/api/user/summary", headers=user.headers)).status_code
+
+async def op_create(client, user, rng) -> int:
+    payload = {
+        "title": rng.choice(["Netflix", "Spotify", "Disney+", "Viaplay", "SATS", "Tryg", "YouSee"]),
+        "amount": round(rng.uniform(29, 499), 2),
+        "renewal_date": (date.today() + timedelta(days=rng.randint(1, 60))).isoformat(),
+        "frequency": rng.choice(["måned", "måned", "måned", "kvartal", "år"]),
+        "category": "Streaming & Underholdning",
+    }
+    resp = await client.post("/api/subscriptions", json=payload, headers=user.headers)
+    if resp.status_code == 200:
+        user.created_ids.append(resp.json()["id"])
+    return resp.status_code
+
+async def op_delete(client, user, rng) -> int:
+    if not user.created_ids:
+        return await op_create(client, user, rng)
+    sub_id = user.created_ids.pop(rng.randrange(len(user.created_ids)))
+    return (await client.delete(f"/api/subscriptions/{sub_id}", headers=user.headers)).status_code
+
+async def op_import(client, user, rng) -> int:
+    resp = await client.get("/api/tink/transactions", params={"token": f"tink-bench-{user.email}"}, headers=user.headers)
+    if resp.status_code != 200:
+        return resp.status_code
+    transactions = resp.json()["transactions"]
+    resp = await client.post("/api/ai/analyze-subscriptions", json={"transactions": transactions}, headers=user.headers)
+    return resp.status_code
+
+OPERATIONS = {
+    "login": op_login, "list": op_list, "summary": op_summary,
+    "create": op_create, "delete": op_delete, "import": op_import,
+}
+
+# ========== DRIVER ==========
+
+async def setup_users(client: httpx.AsyncClient, count: int, run_id: str) -> List[UserState]:
+    users = [UserState(f"bench-{run_id}-{i}@example.com") for i in range(count)]
+    for user in users:
+        resp = await client.post("/api/auth/signup", json={"email": user.email, "password": PASSWORD})
+        if resp.status_code not in (200, 400):
+            raise RuntimeError(f"Signup failed: {resp.status_code} {resp.text}")
+        if await op_login(client, user, random.Random()) != 200:
+            raise RuntimeError(f"Login failed for {user.email}")
+    return users
+
+async def run_level(base_url: str, users: List[UserState], concurrency: int, duration: float,
+                    mix: Dict[str, int], seed: int) -> dict:
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60.0, limits=limits) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker(index: int):
+            rng = random.Random(seed * 1000 + index)
+            user = users[index % len(users)]
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                started = time.perf_counter()
+                try:
+                    status = await OPERATIONS[name](client, user, rng)
+                except httpx.HTTPError:
+                    status = 599
+                latencies[name].append(time.perf_counter() - started)
+                if status >= 400:
+                    errors[name] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    def stats(samples: List[float]) -> dict:
+        ordered = sorted(samples)
+        return {
+            "count": len(ordered),
+            "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+            "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+            "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+        }
+
+    all_samples = [s for samples in latencies.values() for s in samples]
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "requests": len(all_samples),
+        "throughput_rps": round(len(all_samples) / elapsed, 1) if elapsed else 0.0,
+        "errors": dict(errors),
+        "overall": stats(all_samples),
+        "operations": {name: {**stats(samples), "errors": errors.get(name, 0)} for name, samples in sorted(latencies.items())},
+    }
+
+async def run(args) -> dict:
+    procs = []
+    try:
+        standins_url = args.standins_url
+        if not standins_url:
+            port = free_port()
+            standins_url = f"http://127.0.0.1:{port}"
+            procs.append(spawn([
+                "-m", "benchmarks.standins", "--port", str(port),
+                "--db-latency-ms", str(args.db_latency_ms), "--tink-latency-ms", str(args.tink_latency_ms),
+                "--openai-latency-ms", str(args.openai_latency_ms),
+            ]))
+            wait_for(f"{standins_url}/_standins/stats", time.perf_counter() + 30)
+
+        backend_url = args.backend_url
+        if not backend_url:
+            port = free_port()
+            backend_url = f"http://127.0.0.1:{port}"
+            storage = {"SUPABASE_URL": standins_url}
+            if args.storage == "sqlite":
+                storage = {"STORAGE_BACKEND": "sqlite", "SQLITE_PATH": os.path.join(tempfile.mkdtemp(), "bench.db")}
+            procs.append(spawn_backend(port, bench_env({
+                **storage,
+                "TINK_API_URL": standins_url,
+                "EXPO_PUSH_URL": standins_url,
+                "COMPANY_API_URL": standins_url,
+                "LOGO_API_URL": f"{standins_url}/logos",
+                "OPENAI_BASE_URL": f"{standins_url}/v1",
+            }), workers=args.workers))
+            wait_for(f"{backend_url}/api/health/ready", time.perf_counter() + 60)
+
+        async with httpx.AsyncClient(base_url=backend_url, timeout=60.0) as client:
+            users = await setup_users(client, args.users, str(int(time.time())))
+
+        mix = dict(DEFAULT_MIX)
+        for item in args.mix.split(",") if args.mix else []:
+            name, _, weight = item.partition("=")
+            mix[name.strip()] = int(weight)
+        mix = {k: v for k, v in mix.items() if v > 0}
+
+        levels = []
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            result = await run_level(backend_url, users, concurrency, args.duration, mix, args.seed)
+            levels.append(result)
+            print(f"concurrency={concurrency:>4} rps={result['throughput_rps']:>8} "
+                  f"p50={result['overall']['p50_ms']}ms p95={result['overall']['p95_ms']}ms "
+                  f"p99={result['overall']['p99_ms']}ms errors={sum(result['errors'].values())}", file=sys.stderr)
+
+        return {
+            "benchmark": "load",
+            "python": sys.version.split()[0],
+            "config": {
+                "users": args.users, "duration_s": args.duration, "workers": args.workers, "mix": mix, "seed": args.seed,
+                "storage": args.storage, "db_latency_ms": args.db_latency_ms, "tink_latency_ms": args.tink_latency_ms,
+                "openai_latency_ms": args.openai_latency_ms,
+            },
+            "levels": levels,
+        }
+    finally:
+        for proc in reversed(procs):
+            stop(proc)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,4,16,64", help="Comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per concurrency level")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the spawned backend")
+    parser.add_argument("--mix", help="Override weights, e.g. 'import=0,list=50'")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--storage", choices=("supabase", "sqlite"), default="supabase",
+                        help="Database for the spawned backend: the fake PostgREST or an embedded SQLite file")
+    parser.add_argument("--db-latency-ms", type=float, default=1.0)
+    parser.add_argument("--tink-latency-ms", type=float, default=20.0)
+    parser.add_argument("--openai-latency-ms", type=float, default=200.0)
+    parser.add_argument("--backend-url", help="Benchmark an already running backend")
+    parser.add_argument("--standins-url", help="Use already running stand-ins")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""Micro-benchmarks for CPU-bound backend helpers.
+
+    python -m benchmarks.bench_micro --output micro.json
+
+Covers clean_description, descriptor clustering, the summary computation, PDF text extraction,
+JWT verification (cold and cached), metrics span overhead, and response
+serialization and compression (CPU plus bytes on the wire). Each case
+reports per-call timings over several repeats so runs can be compared
+between commits with benchmarks/compare.py.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from typing import Callable, List
+
+from benchmarks.harness import DEFAULT_ENV
+
+for _key, _value in DEFAULT_ENV.items():
+    os.environ.setdefault(_key, _value)
+
+import app  # noqa: E402
+import auth  # noqa: E402
+import detection  # noqa: E402
+import metrics  # noqa: E402
+import responses  # noqa: E402
+from benchmarks.standins import ONE_OFF_MERCHANTS, RECURRING_MERCHANTS, generate_transactions  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from models import SubscriptionInDB  # noqa: E402
+
+def time_case(func: Callable[[], object], number: int, repeat: int) -> dict:
+    """Best and median per-call time in microseconds"""
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        runs.append((time.perf_counter() - started) / number)
+    runs.sort()
+    return {
+        "calls_per_repeat": number,
+        "repeats": repeat,
+        "best_us": round(runs[0] * 1e6, 3),
+        "median_us": round(runs[len(runs) // 2] * 1e6, 3),
+    }
+
+# ========== FIXTURES ==========
+
+def make_descriptions(n: int, rng: random.Random) -> List[str]:
+    pool = [d for d, _ in RECURRING_MERCHANTS] + ONE_OFF_MERCHANTS + [
+        "https://www.netflix.com", "MobilePay SATS 48213", "PAYPAL *STEAM GAMES", "Dankort-køb FØTEX 12.03",
+    ]
+    return [f"{rng.choice(pool)} {rng.randint(1000, 99999) if rng.random() < 0.3 else ''}".strip() for _ in range(n)]
+
+def make_subscriptions(n: int, rng: random.Random) -> List[dict]:
+    today = date.today()
+    subs = []
+    for i in range(n):
+        has_tx = rng.random() < 0.7
+        subs.append({
+            "id": i + 1,
+            "owner_id": 1,
+            "title": rng.choice(RECURRING_MERCHANTS)[0],
+            "amount": round(rng.uniform(29, 499), 2),
+            "currency": "DKK",
+            "category": rng.choice(["Streaming & Underholdning", "Forsikring & Pension", "Telekom & Internet", "Øvrige"]),
+            "frequency": rng.choice(["måned", "kvartal", "halvår", "år"]),
+            "renewal_date": (today + timedelta(days=rng.randint(1, 365))).isoformat(),
+            "transaction_date": (today - timedelta(days=rng.randint(0, 400))).isoformat() if has_tx else None,
+            "is_active": True,
+        })
+    return subs
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def make_statement_pdf(pages: int, lines_per_page: int, rng: random.Random) -> bytes:
+    """Minimal multi-page PDF with one Helvetica text line per transaction"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    today = date.today()
+    for p in range(pages):
+        rows = []
+        for i in range(lines_per_page):
+            merchant, amount = rng.choice(RECURRING_MERCHANTS) if rng.random() < 0.3 else (rng.choice(ONE_OFF_MERCHANTS), rng.uniform(20, 600))
+            booked = today - timedelta(days=rng.randint(0, 90))
+            rows.append(f"BT /F1 9 Tf 40 {800 - i * 12} Td ({_pdf_escape(f'{booked:%d.%m.%Y} {merchant} -{amount:.2f}')}) Tj ET")
+        stream = "\n".join(rows).encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % i for i in page_ids), len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+# ========== CASES ==========
+
+def run(scale: float, repeat: int) -> dict:
+    rng = random.Random(42)
+    results = {}
+
+    descriptions = make_descriptions(1000, rng)
+    results["clean_description_x1000"] = time_case(
+        lambda: [app.clean_description(d) for d in descriptions], max(1, int(20 * scale)), repeat)
+
+    # A heavy user's history, with reference numbers appended to some descriptors
+    transactions = generate_transactions("bench", 20000)
+    for tx in transactions:
+        if rng.random() < 0.3:
+            tx["descriptions"]["display"] += f" {rng.randint(1000, 99999)}"
+    results["cluster_transactions_20000"] = time_case(
+        lambda: detection.cluster_transactions(transactions), max(1, int(2 * scale)), repeat)
+
+    for n in (10, 100, 1000):
+        subs = make_subscriptions(n, rng)
+        results[f"build_user_summary_{n}"] = time_case(lambda: app.build_user_summary(subs), max(1, int(2000 * scale / n)), repeat)
+
+    for pages in (1, 10):
+        pdf = make_statement_pdf(pages, 60, rng)
+        results[f"extract_pdf_text_{pages}_pages"] = {
+            **time_case(lambda: app.extract_pdf_text(pdf), max(1, int(20 * scale / pages)), repeat),
+            "pdf_bytes": len(pdf),
+        }
+
+    token = auth.create_access_token({"sub": "bench@example.com", "uid": 1, "act": True})
+
+    def decode_uncached():
+        auth.token_cache.clear()
+        auth.decode_token(token)
+
+    results["jwt_decode_uncached"] = time_case(decode_uncached, max(1, int(2000 * scale)), repeat)
+    auth.decode_token(token)
+    results["jwt_decode_cached"] = time_case(lambda: auth.decode_token(token), max(1, int(20000 * scale)), repeat)
+
+    def span_block():
+        with metrics.span("bench", "noop"):
+            pass
+
+    results["metrics_span"] = time_case(span_block, max(1, int(100000 * scale)), repeat)
+
+    results.update(serialization_cases(rng, scale, repeat))
+    return results
+
+def wire_sizes(body: bytes) -> dict:
+    """Bytes on the wire for a response body, uncompressed and per encoding"""
+    sizes = {"raw_bytes": len(body), "gzip_bytes": len(responses._Compressor("gzip").finish(body))}
+    if responses.brotli is not None:
+        sizes["br_bytes"] = len(responses._Compressor("br").finish(body))
+    return sizes
+
+def serialization_cases(rng: random.Random, scale: float, repeat: int) -> dict:
+    """List endpoint paths (model validation + encoder vs. direct) and Tink payload encoding"""
+    results = {}
+    for n in (100, 1000):
+        rows = make_subscriptions(n, rng)
+        for row in rows:
+            row.update(created_at="2025-11-01T10:00:00+00:00", updated_at="2025-11-01T10:00:00+00:00",
+                       logo_url=None, notes=None, confidence_score=None, source="manual")
+        number = max(1, int(2000 * scale / n))
+
+        def via_models():
+            # What FastAPI does for `return [SubscriptionInDB(**row)]` with response_model set
+            models = [SubscriptionInDB(**row) for row in rows]
+            json.dumps(jsonable_encoder(models)).encode()
+
+        results[f"serialize_subscriptions_models_{n}"] = time_case(via_models, number, repeat)
+        results[f"serialize_subscriptions_direct_{n}"] = {
+            **time_case(lambda: responses.dumps(responses.project_rows(rows, SubscriptionInDB.model_fields)), number, repeat),
+            **wire_sizes(responses.dumps(responses.project_rows(rows, SubscriptionInDB.model_fields))),
+        }
+
+    transactions = {"transactions": generate_transactions("acc-bench", 500, seed=1)}
+    number = max(1, int(200 * scale))
+    results["serialize_tink_500_stdlib_json"] = time_case(lambda: json.dumps(jsonable_encoder(transactions)).encode(), number, repeat)
+    results["serialize_tink_500_direct"] = {
+        **time_case(lambda: responses.dumps(transactions), number, repeat),
+        **wire_sizes(responses.dumps(transactions)),
+        "encoder": "orjson" if responses.orjson is not None else "json",
+    }
+    body = responses.dumps(transactions)
+    results["compress_tink_500_gzip"] = time_case(lambda: responses._Compressor("gzip").finish(body), number, repeat)
+    if responses.brotli is not None:
+        results["compress_tink_500_br"] = time_case(lambda: responses._Compressor("br").finish(body), number, repeat)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply the number of calls per repeat")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = {"benchmark": "micro", "python": sys.version.split()[0], "results": run(args.scale, args.repeat)}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Import-time and cold-start benchmark for the backend process.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_startup --runs 10 --output startup.json
+
+Reports the wall time of `import app` in fresh interpreters, the slowest
+modules according to `python -X importtime`, and the time until a fresh
+uvicorn worker answers the liveness and readiness probes.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from benchmarks.harness import BACKEND_DIR, bench_env, free_port, spawn_backend, stop, summarize, wait_for
+
+def measure_import(runs: int) -> dict:
+    code = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", code], cwd=BACKEND_DIR, env=bench_env(),
+            capture_output=True, text=True, check=True,
+        )
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return summarize(samples)
+
+def measure_importtime(top: int) -> list:
+    """Slowest modules by cumulative import time (microseconds)"""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"], cwd=BACKEND_DIR, env=bench_env(),
+        capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        rows.append({"module": name.strip(), "self_us": int(self_us), "cumulative_us": int(cumulative_us)})
+    rows.sort(key=lambda r: r["cumulative_us"], reverse=True)
+    return rows[:top]
+
+def measure_cold_start(runs: int, timeout: float) -> dict:
+    live_samples, ready_samples = [], []
+    for _ in range(runs):
+        port = free_port()
+        base = f"http://127.0.0.1:{port}"
+        started = time.perf_counter()
+        proc = spawn_backend(port)
+        try:
+            deadline = started + timeout
+            live_samples.append(wait_for(f"{base}/api/health/live", deadline) - started)
+            ready_samples.append(wait_for(f"{base}/api/health/ready", deadline) - started)
+        finally:
+            stop(proc)
+    return {"time_to_live": summarize(live_samples), "time_to_ready": summarize(ready_samples)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest modules to report")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for a worker to become ready")
+    parser.add_argument("--skip-server", action="store_true", help="Only measure imports")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = {
+        "python": sys.version.split()[0],
+        "import_app": measure_import(args.runs),
+        "slowest_imports": measure_importtime(args.top),
+    }
+    if not args.skip_server:
+        report["cold_start"] = measure_cold_start(args.runs, args.timeout)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Compare two benchmark JSON reports (micro or load) and flag regressions.
+
+    python -m benchmarks.compare baseline.json candidate.json --threshold 10
+
+Exits with status 1 if any metric got slower by more than the threshold (%).
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Iterator, Tuple
+
+# Metric names where a higher value is better
+HIGHER_IS_BETTER = ("throughput_rps",)
+
+def flatten(report: dict) -> Dict[str, float]:
+    """Map comparable metrics to dotted keys, e.g. 'c16.operations.list.p95_ms'"""
+    metrics: Dict[str, float] = {}
+    if report.get("benchmark") == "micro":
+        for case, values in report["results"].items():
+            metrics[f"{case}.median_us"] = values["median_us"]
+    elif report.get("benchmark") == "load":
+        for level in report["levels"]:
+            prefix = f"c{level['concurrency']}"
+            metrics[f"{prefix}.throughput_rps"] = level["throughput_rps"]
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                metrics[f"{prefix}.overall.{key}"] = level["overall"][key]
+            for name, values in level["operations"].items():
+                for key in ("p50_ms", "p95_ms", "p99_ms"):
+                    metrics[f"{prefix}.operations.{name}.{key}"] = values[key]
+    else:
+        raise ValueError("Unknown report type; expected a bench_micro or bench_load report")
+    return metrics
+
+def compare(baseline: dict, candidate: dict) -> Iterator[Tuple[str, float, float, float]]:
+    base, cand = flatten(baseline), flatten(candidate)
+    for key in sorted(base.keys() & cand.keys()):
+        before, after = base[key], cand[key]
+        if before == 0:
+            continue
+        change = (after - before) / before * 100
+        if key.endswith(HIGHER_IS_BETTER):
+            change = -change
+        yield key, before, after, change
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Allowed slowdown in percent")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    regressions = 0
+    for key, before, after, change in compare(baseline, candidate):
+        flag = ""
+        if change > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{key:<55} {before:>12.3f} -> {after:>12.3f}  {change:+7.1f}%{flag}")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
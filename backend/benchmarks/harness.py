@@ -0,0 +1,85 @@
+"""Helpers shared by the benchmarks: process spawning, health polling, statistics."""
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Import must not need live services; placeholders satisfy the config checks
+DEFAULT_ENV = {
+    "SECRET_JWT_KEY": "benchmark-secret",
+    "SUPABASE_URL": "http://127.0.0.1:1",
+    "SUPABASE_SERVICE_ROLE_KEY": "benchmark-key",
+    "OPENAI_API_KEY": "benchmark-key",
+    "LOG_LEVEL": "WARNING",
+    # All load comes from one client IP; limits would turn the test into a rate limiter benchmark
+    "RATE_LIMIT_AUTH_IP_PER_MINUTE": "0",
+    "RATE_LIMIT_AI_IP_PER_MINUTE": "0",
+    "RATE_LIMIT_AI_USER_PER_MINUTE": "0",
+}
+
+def bench_env(overrides: Optional[Dict[str, str]] = None) -> dict:
+    env = dict(os.environ)
+    for key, value in DEFAULT_ENV.items():
+        env.setdefault(key, value)
+    env.update(overrides or {})
+    return env
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for(url: str, deadline: float) -> float:
+    """Poll until the URL answers 200; returns the perf_counter timestamp of success"""
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=0.5) as resp:
+                if resp.status == 200:
+                    return time.perf_counter()
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.005)
+    raise TimeoutError(f"{url} did not become healthy in time")
+
+def spawn(args: List[str], env: Optional[dict] = None, quiet: bool = True) -> subprocess.Popen:
+    output = subprocess.DEVNULL if quiet else None
+    return subprocess.Popen([sys.executable] + args, cwd=BACKEND_DIR, env=env or bench_env(), stdout=output, stderr=output)
+
+def spawn_backend(port: int, env: Optional[dict] = None, workers: int = 1) -> subprocess.Popen:
+    return spawn(["-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+                  "--workers", str(workers), "--log-level", "warning"], env)
+
+def stop(proc: subprocess.Popen) -> None:
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+def percentile(ordered: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+def summarize(samples: List[float]) -> dict:
+    """Latency summary in milliseconds for samples given in seconds"""
+    ordered = sorted(samples)
+    if not ordered:
+        return {"runs": 0}
+    return {
+        "runs": len(ordered),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "median_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
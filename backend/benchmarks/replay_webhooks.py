@@ -0,0 +1,122 @@
+"""Replay Tink webhook events against a running backend.
+
+Signs each event with TINK_WEBHOOK_SECRET, the way Tink does, and posts
+it to /api/tink/webhooks. Events come from an NDJSON file of recorded
+webhook bodies, or are generated as bursts of transaction events per
+user, with some deliveries repeated to exercise deduplication:
+
+    python -m benchmarks.replay_webhooks --file events.ndjson
+    python -m benchmarks.replay_webhooks --users 50 --events-per-user 20 --duplicates 0.2
+
+Generated events come from Tink user "tink-user-<id>" for each user id,
+which the stand-ins' Tink links when user <id> exchanges code "<id>" at
+/api/tink/token. Events of users without such a connection are dropped
+on receipt. Against the stand-ins any account id works.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import Counter
+from datetime import date, timedelta
+from typing import List
+
+import httpx
+
+from benchmarks.harness import summarize
+from tink_webhooks import sign
+
+def load_events(path: str) -> List[bytes]:
+    with open(path, "rb") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def generate_events(users: int, per_user: int, accounts: int, first_user_id: int, seed: int = 0) -> List[bytes]:
+    """Bursts of account-transactions:modified events, one refresh:finished per user, interleaved across users"""
+    rng = random.Random(seed)
+    today = date.today()
+    bursts = []
+    for user_id in range(first_user_id, first_user_id + users):
+        context = {"userId": f"tink-user-{user_id}"}
+        events = []
+        for i in range(per_user):
+            events.append({
+                "context": context,
+                "content": {
+                    "account": {"id": f"acc-{user_id}-{rng.randrange(accounts)}"},
+                    "transactions": {
+                        "earliestModifiedBookedDate": (today - timedelta(days=rng.randint(0, 10))).isoformat(),
+                        "latestModifiedBookedDate": today.isoformat(),
+                        "inserted": rng.randint(1, 5), "updated": 0, "deleted": 0,
+                    },
+                    "sequence": i,
+                },
+                "event": "account-transactions:modified",
+            })
+        events.append({"context": context, "content": {"credentialsId": f"cred-{user_id}", "finished": int(time.time())},
+                       "event": "refresh:finished"})
+        bursts.append([json.dumps(e).encode() for e in events])
+    ordered = []
+    while any(bursts):
+        for burst in bursts:
+            if burst:
+                ordered.append(burst.pop(0))
+    return ordered
+
+async def replay(url: str, secret: str, bodies: List[bytes], concurrency: int) -> dict:
+    statuses: Counter = Counter()
+    latencies: List[float] = []
+    queue = list(reversed(bodies))
+
+    async def sender(client: httpx.AsyncClient) -> None:
+        while queue:
+            body = queue.pop()
+            started = time.perf_counter()
+            response = await client.post(url, content=body, headers={
+                "Content-Type": "application/json", "X-Tink-Signature": sign(body, secret)})
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] += 1
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(timeout=10) as client:
+        await asyncio.gather(*(sender(client) for _ in range(concurrency)))
+    duration = time.perf_counter() - started
+    return {
+        "sent": len(bodies),
+        "statuses": dict(statuses),
+        "duration_s": round(duration, 3),
+        "rps": round(len(bodies) / duration, 1) if duration else None,
+        "latency_s": summarize(latencies),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8080/api/tink/webhooks")
+    parser.add_argument("--secret", default=os.getenv("TINK_WEBHOOK_SECRET"))
+    parser.add_argument("--file", help="NDJSON file with one recorded webhook body per line")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--events-per-user", type=int, default=10)
+    parser.add_argument("--accounts", type=int, default=2, help="Accounts per generated user")
+    parser.add_argument("--first-user-id", type=int, default=1)
+    parser.add_argument("--duplicates", type=float, default=0.1, help="Share of deliveries sent twice")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+    if not args.secret:
+        parser.error("--secret or TINK_WEBHOOK_SECRET is required")
+
+    bodies = load_events(args.file) if args.file else generate_events(
+        args.users, args.events_per_user, args.accounts, args.first_user_id)
+    rng = random.Random(1)
+    bodies += [body for body in bodies if rng.random() < args.duplicates]
+
+    report = {"url": args.url, "events": len(bodies), **asyncio.run(replay(args.url, args.secret, bodies, args.concurrency))}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,791 @@
+"""Local stand-ins for the services the backend talks to.
+
+One Starlette app serves all of them on a single port so benchmarks and
+manual testing can run without network access:
+
+- Fake Supabase/PostgREST  /rest/v1/{table}, /rest/v1/rpc/{function}
+- Mock Tink                /api/v1/oauth/token, /api/v1/user, /data/v2/accounts, /data/v2/transactions
+- Mock OpenAI              /v1/chat/completions
+- Mock Expo push           /--/api/v2/push/send
+- Mock Clearbit            /v1/companies/suggest, /logos/{domain}
+- Mock cancel pages        /cancel/{behavior}, targets for the cancel link checker
+
+Point the backend at it with SUPABASE_URL, TINK_API_URL, EXPO_PUSH_URL and
+COMPANY_API_URL set to the base URL, OPENAI_BASE_URL set to <base URL>/v1
+and LOGO_API_URL set to <base URL>/logos.
+
+    python -m benchmarks.standins --port 9000
+
+A second instance can stand in for a read replica (SUPABASE_READ_REPLICA_URLS);
+--replication-lag-seconds sets the lag its health check reports. It keeps its
+own tables, so rows written to the primary are not replicated to it.
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import random
+import re
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+# ========== FAKE POSTGREST ==========
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+# Column defaults mirroring supabase/migrations
+TABLE_DEFAULTS: Dict[str, Dict[str, Callable[[], Any]]] = {
+    "users": {"is_active": lambda: True, "last_login": lambda: None},
+    "subscriptions": {
+        "currency": lambda: "DKK", "category": lambda: "Øvrige", "frequency": lambda: "måned",
+        "source": lambda: "manual", "is_active": lambda: True, "transaction_date": lambda: None,
+        "logo_url": lambda: None, "confidence_score": lambda: None, "notes": lambda: None,
+    },
+    "tink_tokens": {"token_type": lambda: "Bearer", "account_ids": lambda: [], "last_sync_at": lambda: None, "is_active": lambda: True,
+                    "tink_user_id": lambda: None},
+    "notification_preferences": {"is_enabled": lambda: True, "days_before_renewal": lambda: 1, "subscription_id": lambda: None},
+    "analytics_events": {"event_data": lambda: {}},
+    "merchant_cancel_links": {
+        "broken_reports": lambda: 0, "is_active": lambda: True, "country_code": lambda: "DK", "verified_at": lambda: None,
+        "checked_at": lambda: None, "check_error": lambda: None,
+    },
+    "push_tokens": {"is_active": lambda: True, "last_used_at": lambda: None},
+    "transactions": {"currency": lambda: "DKK", "subscription_id": lambda: None},
+    "transaction_series": {"version": lambda: 0},
+    "notification_events": {"status": lambda: "pending", "attempts": lambda: 0, "subscription_id": lambda: None, "processed_at": lambda: None},
+    "digest_runs": {
+        "last_user_id": lambda: 0, "users_processed": lambda: 0, "notifications_sent": lambda: 0,
+        "status": lambda: "running", "started_at": _now, "finished_at": lambda: None,
+    },
+    "account_deletions": {
+        "id": lambda: str(uuid.uuid4()), "status": lambda: "pending", "phase": lambda: "revoke",
+        "rows_anonymized": lambda: 0, "rows_deleted": lambda: 0, "attempts": lambda: 0, "lease_until": lambda: None,
+        "error": lambda: None, "requested_at": _now, "started_at": lambda: None, "finished_at": lambda: None,
+    },
+    "tink_webhook_events": {
+        "account_id": lambda: None, "booked_from": lambda: None, "status": lambda: "pending", "attempts": lambda: 0,
+        "lease_until": lambda: None, "error": lambda: None, "received_at": _now, "processed_at": lambda: None,
+    },
+}
+
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+def _coerce(arg: str, sample: Any) -> Any:
+    if arg == "null":
+        return None
+    if isinstance(sample, bool):
+        return arg.lower() == "true"
+    if isinstance(sample, int):
+        try:
+            return int(arg)
+        except ValueError:
+            return arg
+    if isinstance(sample, float):
+        try:
+            return float(arg)
+        except ValueError:
+            return arg
+    return arg
+
+def _like(pattern: str, value: Any, flags: int = 0) -> bool:
+    regex = "^" + re.escape(pattern).replace("%", ".*").replace("\\*", ".*").replace("_", ".") + "$"
+    return value is not None and re.match(regex, str(value), flags) is not None
+
+def _matches(row: Dict[str, Any], column: str, expression: str) -> bool:
+    negate = expression.startswith("not.")
+    if negate:
+        expression = expression[4:]
+    op, _, arg = expression.partition(".")
+    value = row.get(column)
+    if op == "is":
+        result = value is None if arg == "null" else value is (arg == "true")
+    elif op == "in":
+        options = [a.strip().strip('"') for a in arg.strip("()").split(",") if a.strip()]
+        result = any(value == _coerce(o, value) for o in options)
+    elif op == "like":
+        result = _like(arg, value)
+    elif op == "ilike":
+        result = _like(arg, value, re.IGNORECASE)
+    else:
+        target = _coerce(arg, value)
+        if value is None or target is None:
+            result = False
+        elif op == "eq":
+            result = value == target
+        elif op == "neq":
+            result = value != target
+        elif op == "gt":
+            result = value > target
+        elif op == "gte":
+            result = value >= target
+        elif op == "lt":
+            result = value < target
+        elif op == "lte":
+            result = value <= target
+        else:
+            raise ValueError(f"Unsupported filter operator: {op}")
+    return not result if negate else result
+
+class FakePostgrest:
+    """In-memory tables speaking enough of the PostgREST protocol for supabase-py"""
+
+    def __init__(self, latency_ms: float = 0.0, replication_lag: float = 0.0):
+        self.latency = latency_ms / 1000.0
+        # Reported by replication_lag_seconds() when this instance stands in for a read replica
+        self.replication_lag = replication_lag
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self.ids = {}
+        self.rpcs: Dict[str, Callable[["FakePostgrest", Dict[str, Any]], Any]] = {}
+
+    def rows(self, table: str) -> List[Dict[str, Any]]:
+        return self.tables.setdefault(table, [])
+
+    def _next_id(self, table: str) -> int:
+        counter = self.ids.setdefault(table, itertools.count(1))
+        return next(counter)
+
+    def _new_row(self, table: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        row = {name: factory() for name, factory in TABLE_DEFAULTS.get(table, {}).items()}
+        row.update(data)
+        row.setdefault("id", self._next_id(table))
+        row.setdefault("created_at", _now())
+        row.setdefault("updated_at", row["created_at"])
+        return row
+
+    def _filtered(self, table: str, params) -> List[Dict[str, Any]]:
+        filters = [(k, v) for k, v in params.multi_items() if k not in RESERVED_PARAMS]
+        return [r for r in self.rows(table) if all(_matches(r, k, v) for k, v in filters)]
+
+    @staticmethod
+    def _project(rows: List[Dict[str, Any]], select: Optional[str]) -> List[Dict[str, Any]]:
+        if not select or select == "*":
+            return [dict(r) for r in rows]
+        columns = [c.strip() for c in select.split(",")]
+        return [{c: r.get(c) for c in columns} for r in rows]
+
+    @staticmethod
+    def _order(rows: List[Dict[str, Any]], order: Optional[str]) -> List[Dict[str, Any]]:
+        if not order:
+            return rows
+        for part in reversed(order.split(",")):
+            pieces = part.split(".")
+            column, desc = pieces[0], "desc" in pieces[1:]
+            nulls_first = "nullsfirst" in pieces[1:] or ("nullslast" not in pieces[1:] and desc)
+            present = sorted((r for r in rows if r.get(column) is not None), key=lambda r: r[column], reverse=desc)
+            missing = [r for r in rows if r.get(column) is None]
+            rows = missing + present if nulls_first else present + missing
+        return rows
+
+    def _respond(self, request: Request, rows: List[Dict[str, Any]], status: int = 200, total: Optional[int] = None) -> Response:
+        headers = {}
+        if total is not None or "count=" in request.headers.get("prefer", ""):
+            total = len(rows) if total is None else total
+            headers["content-range"] = f"0-{max(len(rows) - 1, 0)}/{total}"
+        if "application/vnd.pgrst.object+json" in request.headers.get("accept", ""):
+            if len(rows) != 1:
+                return JSONResponse({
+                    "code": "PGRST116",
+                    "details": f"The result contains {len(rows)} rows",
+                    "hint": None,
+                    "message": "JSON object requested, multiple (or no) rows returned",
+                }, status_code=406)
+            return JSONResponse(rows[0], status_code=status, headers=headers)
+        if "return=minimal" in request.headers.get("prefer", "") and request.method != "GET":
+            return Response(status_code=204 if status == 200 else status, headers=headers)
+        return JSONResponse(rows, status_code=status, headers=headers)
+
+    async def handle_table(self, request: Request) -> Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        table = request.path_params["table"]
+        params = request.query_params
+
+        if request.method == "GET":
+            rows = self._order(self._filtered(table, params), params.get("order"))
+            total = len(rows)
+            offset = int(params.get("offset", 0))
+            if "limit" in params:
+                rows = rows[offset:offset + int(params["limit"])]
+            elif offset:
+                rows = rows[offset:]
+            return self._respond(request, self._project(rows, params.get("select")), total=total if "count=" in request.headers.get("prefer", "") else None)
+
+        if request.method == "POST":
+            body = await request.json()
+            items = body if isinstance(body, list) else [body]
+            on_conflict = params.get("on_conflict")
+            prefer = request.headers.get("prefer", "")
+            merge = "merge-duplicates" in prefer
+            ignore = "ignore-duplicates" in prefer
+            created = []
+            for item in items:
+                existing = None
+                if (merge or ignore) and on_conflict:
+                    keys = [k.strip() for k in on_conflict.split(",")]
+                    existing = next((r for r in self.rows(table) if all(r.get(k) == item.get(k) for k in keys)), None)
+                if existing is not None and ignore:
+                    # ON CONFLICT DO NOTHING: the row is left alone and not returned
+                    continue
+                if existing is not None:
+                    existing.update(item)
+                    existing["updated_at"] = _now()
+                    created.append(existing)
+                else:
+                    row = self._new_row(table, item)
+                    self.rows(table).append(row)
+                    created.append(row)
+            return self._respond(request, self._project(created, params.get("select")), status=201)
+
+        if request.method == "PATCH":
+            body = await request.json()
+            rows = self._filtered(table, params)
+            for row in rows:
+                row.update(body)
+                row["updated_at"] = _now()
+            return self._respond(request, self._project(rows, params.get("select")))
+
+        if request.method == "DELETE":
+            rows = self._filtered(table, params)
+            doomed = {id(r) for r in rows}
+            self.tables[table] = [r for r in self.rows(table) if id(r) not in doomed]
+            return self._respond(request, self._project(rows, params.get("select")))
+
+        return JSONResponse({"message": "Method not allowed"}, status_code=405)
+
+    async def handle_rpc(self, request: Request) -> Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        name = request.path_params["function"]
+        handler = self.rpcs.get(name)
+        if handler is None:
+            return JSONResponse({"code": "PGRST202", "message": f"Could not find the function {name}"}, status_code=404)
+        body = await request.json() if await request.body() else {}
+        result = handler(self, body)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return JSONResponse(result)
+
+# ---------- RPCs mirroring supabase/migrations ----------
+
+def rpc_get_tokens_expiring_soon(db: FakePostgrest, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    now = datetime.now(timezone.utc)
+    horizon = now + timedelta(days=int(args.get("days_threshold", 15)))
+    rows = []
+    for t in db.rows("tink_tokens"):
+        expires = datetime.fromisoformat(t["expires_at"])
+        if t.get("is_active") and now < expires <= horizon:
+            rows.append({"user_id": t["user_id"], "bank_name": t.get("bank_name"), "expires_at": t["expires_at"],
+                         "days_until_expiry": (expires - now).days})
+    return sorted(rows, key=lambda r: r["expires_at"])
+
+MONTHS_PER_FREQUENCY = {"måned": 1, "kvartal": 3, "halvår": 6, "år": 12}
+
+def rpc_get_weekly_digest_batch(db: FakePostgrest, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    as_of = date.fromisoformat(args.get("p_as_of") or date.today().isoformat())
+    week_end, week_ago = as_of + timedelta(days=7), (as_of - timedelta(days=7)).isoformat()
+    # Latest global row per user wins, like the ORDER BY updated_at DESC LIMIT 1 in the function
+    latest: Dict[int, Dict[str, Any]] = {}
+    for p in sorted(db.rows("notification_preferences"), key=lambda p: (p.get("updated_at", ""), p["id"])):
+        if p.get("subscription_id") is None and p.get("notification_type") == "weekly_summary":
+            latest[p["user_id"]] = p
+    opted_out = {user_id for user_id, p in latest.items() if not p.get("is_enabled")}
+    page = sorted(u["id"] for u in db.rows("users")
+                  if u["id"] > int(args.get("p_after_user_id", 0)) and u.get("is_active") and u["id"] not in opted_out)
+    rows = []
+    for user_id in page[:int(args.get("p_limit", 1000))]:
+        subs = [s for s in db.rows("subscriptions") if s["owner_id"] == user_id and s.get("is_active")]
+        renewals = sorted((s for s in subs if date.fromisoformat(s["renewal_date"][:10]) < week_end),
+                          key=lambda s: s["renewal_date"])
+        monthly_totals: Dict[str, float] = {}
+        for s in subs:
+            monthly = float(s["amount"]) / MONTHS_PER_FREQUENCY.get(s.get("frequency"), 1)
+            monthly_totals[s["currency"]] = monthly_totals.get(s["currency"], 0.0) + monthly
+        rows.append({
+            "user_id": user_id,
+            "active_count": len(subs),
+            "monthly_totals": {code: round(total, 2) for code, total in monthly_totals.items()},
+            "renewals": [{"title": s["title"], "amount": s["amount"], "currency": s["currency"],
+                          "renewal_date": s["renewal_date"], "frequency": s.get("frequency")} for s in renewals],
+            "new_count": sum(1 for s in subs if s.get("created_at", "") >= week_ago),
+            "price_increases": sum(1 for e in db.rows("notification_events") if e["user_id"] == user_id
+                                   and e["event_type"] == "price_increase" and e.get("created_at", "") >= week_ago),
+        })
+    return rows
+
+def _effective_preference(db: FakePostgrest, sub: Dict[str, Any], notification_type: str) -> Dict[str, Any]:
+    prefs = sorted((p for p in db.rows("notification_preferences")
+                    if p.get("notification_type") == notification_type and p["user_id"] == sub["owner_id"]),
+                   key=lambda p: (p.get("updated_at", ""), p["id"]), reverse=True)
+    override = next((p for p in prefs if p.get("subscription_id") == sub["id"]), None)
+    default = next((p for p in prefs if p.get("subscription_id") is None), None)
+    chosen = override or default
+    return {
+        "subscription_id": sub["id"], "user_id": sub["owner_id"],
+        "is_enabled": chosen["is_enabled"] if chosen else True,
+        "days_before_renewal": (chosen or {}).get("days_before_renewal") or 1,
+        "source": "subscription" if override else "global" if default else "default",
+    }
+
+def rpc_resolve_notification_preferences(db: FakePostgrest, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    ids = set(args.get("p_subscription_ids") or [])
+    subs = sorted((s for s in db.rows("subscriptions") if s["id"] in ids), key=lambda s: s["id"])
+    return [_effective_preference(db, s, args["p_notification_type"]) for s in subs]
+
+def rpc_get_due_renewal_reminders(db: FakePostgrest, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    as_of = date.fromisoformat(args.get("p_as_of") or date.today().isoformat())
+    active_users = {u["id"] for u in db.rows("users") if u.get("is_active")}
+    rows = []
+    for sub in sorted(db.rows("subscriptions"), key=lambda s: s["id"]):
+        if not sub.get("is_active") or sub["owner_id"] not in active_users or sub["id"] <= int(args.get("p_after_subscription_id", 0)):
+            continue
+        pref = _effective_preference(db, sub, "renewal_reminder")
+        if pref["is_enabled"] and date.fromisoformat(sub["renewal_date"][:10]) == as_of + timedelta(days=pref["days_before_renewal"]):
+            rows.append({
+                "subscription_id": sub["id"], "user_id": sub["owner_id"], "title": sub["title"], "amount": sub["amount"],
+                "currency": sub["currency"], "renewal_date": sub["renewal_date"], "days_before_renewal": pref["days_before_renewal"],
+            })
+    return rows[:int(args.get("p_limit", 1000))]
+
+def rpc_claim_account_deletion(db: FakePostgrest, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    now = datetime.now(timezone.utc)
+    queued = sorted((d for d in db.rows("account_deletions")
+                     if d["status"] == "pending" or (d["status"] == "running" and d["lease_until"]
+                                                     and datetime.fromisoformat(d["lease_until"]) < now)),
+                    key=lambda d: d["requested_at"])
+    if not queued:
+        return []
+    job = queued[0]
+    job.update(status="running", attempts=job["attempts"] + 1, started_at=job["started_at"] or _now(),
+               lease_until=(now + timedelta(seconds=int(args.get("p_lease_seconds", 300)))).isoformat())
+    return [dict(job)]
+
+def rpc_claim_tink_webhook_events(db: FakePostgrest, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    now = datetime.now(timezone.utc)
+    quiet_before = (now - timedelta(seconds=int(args.get("p_quiet_seconds", 5)))).isoformat()
+    delay_before = (now - timedelta(seconds=int(args.get("p_max_delay_seconds", 60)))).isoformat()
+    by_user: Dict[int, List[Dict[str, Any]]] = {}
+    for event in db.rows("tink_webhook_events"):
+        if event["status"] in ("pending", "processing"):
+            by_user.setdefault(event["user_id"], []).append(event)
+    ready = [
+        events for events in by_user.values()
+        if not any(e["status"] == "processing" and e["lease_until"] >= now.isoformat() for e in events)
+        and (max(e["received_at"] for e in events) < quiet_before or min(e["received_at"] for e in events) < delay_before)
+    ]
+    if not ready:
+        return []
+    events = min(ready, key=lambda events: min(e["received_at"] for e in events))
+    lease_until = (now + timedelta(seconds=int(args.get("p_lease_seconds", 300)))).isoformat()
+    claimed = [e for e in events if e["status"] == "pending" or e["lease_until"] < now.isoformat()]
+    for event in claimed:
+        event.update(status="processing", attempts=event["attempts"] + 1, lease_until=lease_until)
+    return [dict(e) for e in claimed]
+
+def rpc_archive_inactive_subscriptions(db: FakePostgrest, args: Dict[str, Any]) -> int:
+    rows = db.rows("subscriptions")
+    batch = sorted((r for r in rows if not r["is_active"] and r["updated_at"] < args["p_inactive_before"]),
+                   key=lambda r: r["updated_at"])[:int(args.get("p_limit", 500))]
+    moved = {id(r) for r in batch}
+    rows[:] = [r for r in rows if id(r) not in moved]
+    db.rows("subscriptions_archive").extend({**r, "archived_at": _now()} for r in batch)
+    return len(batch)
+
+def rpc_restore_archived_subscription(db: FakePostgrest, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    archive = db.rows("subscriptions_archive")
+    row = next((r for r in archive if r["id"] == args["p_subscription_id"] and r["owner_id"] == args["p_owner_id"]), None)
+    if row is None:
+        return []
+    archive.remove(row)
+    restored = {k: v for k, v in row.items() if k != "archived_at"}
+    restored.update(is_active=row["is_active"] or args.get("p_activate", True), updated_at=_now())
+    db.rows("subscriptions").append(restored)
+    return [dict(restored)]
+
+def rpc_claim_cancel_links_to_check(db: FakePostgrest, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    due = [link for link in db.rows("merchant_cancel_links")
+           if link["is_active"] and link["cancel_type"] == "url"
+           and (link["checked_at"] is None or link["checked_at"] < args["p_checked_before"])]
+    due.sort(key=lambda link: (-link["broken_reports"], link["verified_at"] is not None, link["verified_at"] or "", link["id"]))
+    claimed = due[:int(args.get("p_limit", 100))]
+    now = _now()
+    for link in claimed:
+        link["checked_at"] = now
+    return [{k: link[k] for k in ("id", "merchant_name", "cancel_target", "broken_reports", "verified_at")} for link in claimed]
+
+def rpc_record_cancel_link_checks(db: FakePostgrest, args: Dict[str, Any]) -> int:
+    links = {link["id"]: link for link in db.rows("merchant_cancel_links")}
+    updated, now = 0, _now()
+    for result in args.get("p_results") or []:
+        link = links.get(result["id"])
+        if link is None:
+            continue
+        if result.get("ok") is True:
+            link.update(broken_reports=0, is_active=True, verified_at=now)
+        elif result.get("ok") is False:
+            link["broken_reports"] += 1
+            if link["broken_reports"] >= 3:
+                link["is_active"] = False
+        link.update(check_error=result.get("error"), updated_at=now)
+        updated += 1
+    return updated
+
+def rpc_save_transaction_series(db: FakePostgrest, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    table = db.rows("transaction_series")
+    existing = {(s["user_id"], s["merchant_key"]): s for s in table}
+    saved = []
+    for row in args.get("p_rows") or []:
+        version = int(row.get("version") or 0)
+        data = {**{k: v for k, v in row.items() if k != "updated_at"}, "version": version + 1, "updated_at": _now()}
+        current = existing.get((row["user_id"], row["merchant_key"]))
+        if current is None:
+            table.append(db._new_row("transaction_series", data))
+        elif current.get("version", 0) == version:
+            current.update(data)
+        else:
+            continue
+        saved.append({"merchant_key": row["merchant_key"]})
+    return saved
+
+def rpc_anonymize_analytics_events_batch(db: FakePostgrest, args: Dict[str, Any]) -> int:
+    batch = [e for e in db.rows("analytics_events") if e.get("user_id") == args["p_user_id"]][:int(args.get("p_limit", 500))]
+    for event in batch:
+        event.update(user_id=None, subscription_id=None, session_id=None, event_data=None)
+    return len(batch)
+
+USER_COLUMNS = {"notification_events": "user_id", "transactions": "user_id", "transaction_series": "user_id",
+                "notification_preferences": "user_id", "push_tokens": "user_id", "tink_tokens": "user_id",
+                "tink_webhook_events": "user_id", "subscriptions_archive": "owner_id", "subscriptions": "owner_id"}
+
+def rpc_delete_user_rows_batch(db: FakePostgrest, args: Dict[str, Any]) -> int:
+    table, column = args["p_table"], USER_COLUMNS[args["p_table"]]
+    rows = db.rows(table)
+    batch = [id(r) for r in rows if r.get(column) == args["p_user_id"]][:int(args.get("p_limit", 500))]
+    doomed = set(batch)
+    rows[:] = [r for r in rows if id(r) not in doomed]
+    return len(batch)
+
+def rpc_replication_lag_seconds(db: FakePostgrest, args: Dict[str, Any]) -> float:
+    return db.replication_lag
+
+DEFAULT_RPCS = {
+    "get_tokens_expiring_soon": rpc_get_tokens_expiring_soon,
+    "get_weekly_digest_batch": rpc_get_weekly_digest_batch,
+    "resolve_notification_preferences": rpc_resolve_notification_preferences,
+    "get_due_renewal_reminders": rpc_get_due_renewal_reminders,
+    "claim_account_deletion": rpc_claim_account_deletion,
+    "claim_tink_webhook_events": rpc_claim_tink_webhook_events,
+    "archive_inactive_subscriptions": rpc_archive_inactive_subscriptions,
+    "restore_archived_subscription": rpc_restore_archived_subscription,
+    "claim_cancel_links_to_check": rpc_claim_cancel_links_to_check,
+    "record_cancel_link_checks": rpc_record_cancel_link_checks,
+    "save_transaction_series": rpc_save_transaction_series,
+    "anonymize_analytics_events_batch": rpc_anonymize_analytics_events_batch,
+    "delete_user_rows_batch": rpc_delete_user_rows_batch,
+    "replication_lag_seconds": rpc_replication_lag_seconds,
+}
+
+# ========== MOCK TINK ==========
+
+RECURRING_MERCHANTS = [
+    ("NETFLIX.COM", 129.0), ("SPOTIFY P1A2B3", 109.0), ("DISNEYPLUS.COM DK", 89.0),
+    ("TRYG FORSIKRING A/S", 412.5), ("FITNESS WORLD", 249.0), ("YOUSEE", 299.0),
+    ("OPENAI *CHATGPT", 160.0), ("SPLICE.COM* CREATOR", 99.0),
+]
+ONE_OFF_MERCHANTS = ["NETTO", "REMA 1000", "SHELL", "WOLT", "7-ELEVEN", "IRMA", "DSB", "MATAS"]
+
+def _tink_amount(value: float, currency: str = "DKK") -> Dict[str, Any]:
+    unscaled = int(round(-value * 100))
+    return {"value": {"unscaledValue": str(unscaled), "scale": "2"}, "currencyCode": currency}
+
+def generate_transactions(account_id: str, count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Deterministic mix of monthly recurring charges and one-off purchases"""
+    rng = random.Random(f"{account_id}:{seed}")
+    today = date.today()
+    transactions = []
+    months = max(1, min(12, count // 10))
+    for desc, amount in rng.sample(RECURRING_MERCHANTS, k=min(len(RECURRING_MERCHANTS), 5)):
+        for m in range(months):
+            booked = today - timedelta(days=30 * m + rng.randint(0, 2))
+            transactions.append((desc, amount, booked))
+    while len(transactions) < count:
+        booked = today - timedelta(days=rng.randint(0, 30 * months))
+        transactions.append((rng.choice(ONE_OFF_MERCHANTS), round(rng.uniform(20, 600), 2), booked))
+    result = []
+    for i, (desc, amount, booked) in enumerate(transactions[:count]):
+        result.append({
+            "id": hashlib.sha1(f"{account_id}:{i}:{desc}:{booked}".encode()).hexdigest()[:24],
+            "accountId": account_id,
+            "amount": _tink_amount(amount),
+            "descriptions": {"display": desc, "original": desc},
+            "dates": {"booked": booked.isoformat()},
+            "status": "BOOKED",
+        })
+    return result
+
+class MockTink:
+    def __init__(self, latency_ms: float = 20.0, accounts: int = 2, transactions_per_account: int = 100):
+        self.latency = latency_ms / 1000.0
+        self.accounts = accounts
+        self.transactions_per_account = transactions_per_account
+        self.issued_tokens: Dict[str, Dict[str, Any]] = {}
+        self.transaction_calls = 0
+
+    async def token(self, request: Request) -> Response:
+        await asyncio.sleep(self.latency)
+        form = await request.form()
+        grant_type = form.get("grant_type")
+        if grant_type not in ("authorization_code", "refresh_token"):
+            return JSONResponse({"errorMessage": "unsupported grant_type"}, status_code=400)
+        if grant_type == "refresh_token":
+            previous = next((t for t in self.issued_tokens.values() if t["refresh_token"] == form.get("refresh_token")), None)
+            if previous is None:
+                return JSONResponse({"errorMessage": "invalid refresh token"}, status_code=400)
+            tink_user_id = previous["id_hint"]
+        else:
+            # Each code stands for one Tink user: code "7" links Tink user "tink-user-7"
+            tink_user_id = f"tink-user-{form.get('code')}"
+        access = "tink-at-" + hashlib.sha1(f"{time.time()}:{random.random()}".encode()).hexdigest()
+        token = {
+            "access_token": access,
+            "refresh_token": "tink-rt-" + access[8:],
+            "token_type": "bearer",
+            "expires_in": 7200,
+            "scope": "accounts:read,transactions:read,user:read",
+            "id_hint": tink_user_id,
+        }
+        self.issued_tokens[access] = token
+        return JSONResponse(token)
+
+    async def user_endpoint(self, request: Request) -> Response:
+        await asyncio.sleep(self.latency)
+        token = self.issued_tokens.get(request.headers.get("authorization", "").split(" ")[-1])
+        if token is None:
+            return JSONResponse({"errorMessage": "invalid access token"}, status_code=401)
+        return JSONResponse({"id": token["id_hint"], "profile": {"market": "DK", "locale": "da_DK"}})
+
+    async def accounts_endpoint(self, request: Request) -> Response:
+        await asyncio.sleep(self.latency)
+        seed = request.headers.get("authorization", "")[-8:]
+        return JSONResponse({"accounts": [{"id": f"acc-{seed}-{i}", "name": f"Konto {i + 1}", "type": "CHECKING"} for i in range(self.accounts)], "nextPageToken": ""})
+
+    async def transactions_endpoint(self, request: Request) -> Response:
+        await asyncio.sleep(self.latency)
+        self.transaction_calls += 1
+        account_id = request.query_params.get("accountId", "acc-0")
+        limit = int(request.query_params.get("pageSize") or request.query_params.get("limit") or self.transactions_per_account)
+        transactions = generate_transactions(account_id, min(limit, self.transactions_per_account))
+        booked_from = request.query_params.get("bookedDateGte")
+        if booked_from:
+            transactions = [t for t in transactions if t["dates"]["booked"] >= booked_from]
+        return JSONResponse({"transactions": transactions, "nextPageToken": ""})
+
+# ========== MOCK OPENAI ==========
+
+_PROMPT_LINE = re.compile(r"^- (.+?): (\d+) gange, gennemsnit ([\d.]+) DKK", re.M)
+
+class MockOpenAI:
+    """Answers chat completions with every prompted description classified as a monthly subscription"""
+
+    def __init__(self, latency_ms: float = 200.0):
+        self.latency = latency_ms / 1000.0
+        self.calls = 0
+
+    async def chat_completions(self, request: Request) -> Response:
+        await asyncio.sleep(self.latency)
+        self.calls += 1
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        results = []
+        for desc, _, avg in _PROMPT_LINE.findall(prompt):
+            results.append({
+                "original_description": desc,
+                "clean_name": desc.split(".")[0].split("*")[0].strip().title(),
+                "amount": float(avg),
+                "is_subscription": True,
+                "confidence": 90,
+                "category": "Streaming & Underholdning",
+                "frequency": "måned",
+                "reasoning": "Mock classification",
+            })
+        if not results:
+            # PDF prompts carry raw statement text; pick out a few known merchants
+            for desc, amount in RECURRING_MERCHANTS:
+                if desc.split(".")[0].split("*")[0].strip().lower() in prompt.lower():
+                    results.append({
+                        "original_description": desc, "clean_name": desc.split(".")[0].title(), "amount": amount,
+                        "is_subscription": True, "confidence": 90, "category": "Øvrige", "frequency": "måned",
+                    })
+        content = json.dumps(results, ensure_ascii=False)
+        return JSONResponse({
+            "id": f"chatcmpl-mock-{self.calls}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4, "total_tokens": (len(prompt) + len(content)) // 4},
+        })
+
+# ========== MOCK EXPO PUSH ==========
+
+class MockExpoPush:
+    def __init__(self, latency_ms: float = 10.0):
+        self.latency = latency_ms / 1000.0
+        self.sent: List[Dict[str, Any]] = []
+
+    async def send(self, request: Request) -> Response:
+        await asyncio.sleep(self.latency)
+        body = await request.json()
+        messages = body if isinstance(body, list) else [body]
+        self.sent.extend(messages)
+        return JSONResponse({"data": [{"status": "ok", "id": f"ticket-{len(self.sent) - len(messages) + i}"} for i in range(len(messages))]})
+
+# ========== MOCK CLEARBIT ==========
+
+# 1x1 transparent PNG
+_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489"
+    "0000000d4944415478da63f8ffff3f0005fe02fea7d6a4c50000000049454e44ae426082"
+)
+
+CLEARBIT_COMPANIES = [
+    ("Netflix", "netflix.com"), ("Spotify", "spotify.com"), ("Disney+", "disneyplus.com"),
+    ("Tryg", "tryg.dk"), ("Fitness World", "fitnessworld.com"), ("YouSee", "yousee.dk"),
+    ("OpenAI", "openai.com"), ("Splice", "splice.com"), ("Nordisk Film", "nordiskfilm.dk"),
+]
+
+class MockClearbit:
+    def __init__(self):
+        self.suggest_calls = 0
+        self.logo_calls = 0
+
+    async def suggest(self, request: Request) -> Response:
+        self.suggest_calls += 1
+        query = request.query_params.get("query", "").strip().lower()
+        return JSONResponse([
+            {"name": name, "domain": domain, "logo": f"https://logo.clearbit.com/{domain}"}
+            for name, domain in CLEARBIT_COMPANIES if query and name.lower().startswith(query)
+        ])
+
+    async def logo(self, request: Request) -> Response:
+        self.logo_calls += 1
+        if request.path_params["domain"].startswith("missing"):
+            return Response(status_code=404)
+        return Response(_PNG, media_type="image/png")
+
+# ========== MOCK CANCEL PAGES ==========
+
+class MockCancelPages:
+    """Merchant cancel pages; the path picks how the page answers:
+
+    ok       200
+    no-head  405 to HEAD, 200 to GET
+    moved    302 to /cancel/ok
+    login    403, like a page behind a login or bot wall
+    gone     404, as does anything else
+    flaky    503 to every other request
+    slow     200 after ?seconds= (default 5)
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._flaky = itertools.count()
+
+    async def page(self, request: Request) -> Response:
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            behavior = request.path_params["behavior"]
+            if behavior == "slow":
+                await asyncio.sleep(float(request.query_params.get("seconds", 5)))
+            elif behavior == "no-head" and request.method == "HEAD":
+                return Response(status_code=405)
+            elif behavior == "moved":
+                return Response(status_code=302, headers={"Location": "/cancel/ok"})
+            elif behavior == "login":
+                return Response(status_code=403)
+            elif behavior == "flaky" and next(self._flaky) % 2 == 0:
+                return Response(status_code=503)
+            elif behavior not in ("ok", "no-head", "flaky"):
+                return Response(status_code=404)
+            return Response("<html>Opsig abonnement</html>", media_type="text/html")
+        finally:
+            self.in_flight -= 1
+
+# ========== APP ==========
+
+def create_app(db_latency_ms: float = 0.0, tink_latency_ms: float = 20.0, openai_latency_ms: float = 200.0,
+               push_latency_ms: float = 10.0, tink_accounts: int = 2, tink_transactions: int = 100,
+               replication_lag: float = 0.0) -> Starlette:
+    db = FakePostgrest(db_latency_ms, replication_lag)
+    db.rpcs.update(DEFAULT_RPCS)
+    tink = MockTink(tink_latency_ms, tink_accounts, tink_transactions)
+    ai = MockOpenAI(openai_latency_ms)
+    push = MockExpoPush(push_latency_ms)
+    clearbit = MockClearbit()
+    cancel_pages = MockCancelPages()
+
+    async def stats(request: Request) -> Response:
+        return JSONResponse({
+            "tables": {name: len(rows) for name, rows in db.tables.items()},
+            "openai_calls": ai.calls,
+            "tink_transaction_calls": tink.transaction_calls,
+            "push_messages": len(push.sent),
+            "company_suggest_calls": clearbit.suggest_calls,
+            "logo_calls": clearbit.logo_calls,
+            "cancel_page_requests": cancel_pages.requests,
+            "cancel_page_max_in_flight": cancel_pages.max_in_flight,
+        })
+
+    app = Starlette(routes=[
+        Route("/rest/v1/rpc/{function}", db.handle_rpc, methods=["POST", "GET"]),
+        Route("/rest/v1/{table}", db.handle_table, methods=["GET", "POST", "PATCH", "DELETE"]),
+        Route("/api/v1/oauth/token", tink.token, methods=["POST"]),
+        Route("/api/v1/user", tink.user_endpoint),
+        Route("/data/v2/accounts", tink.accounts_endpoint),
+        Route("/data/v2/transactions", tink.transactions_endpoint),
+        Route("/v1/chat/completions", ai.chat_completions, methods=["POST"]),
+        Route("/--/api/v2/push/send", push.send, methods=["POST"]),
+        Route("/v1/companies/suggest", clearbit.suggest),
+        Route("/logos/{domain}", clearbit.logo),
+        Route("/cancel/{behavior}", cancel_pages.page, methods=["GET", "HEAD"]),
+        Route("/_standins/stats", stats),
+    ])
+    app.state.db, app.state.tink, app.state.openai, app.state.push = db, tink, ai, push
+    app.state.clearbit, app.state.cancel_pages = clearbit, cancel_pages
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--db-latency-ms", type=float, default=0.0)
+    parser.add_argument("--tink-latency-ms", type=float, default=20.0)
+    parser.add_argument("--openai-latency-ms", type=float, default=200.0)
+    parser.add_argument("--push-latency-ms", type=float, default=10.0)
+    parser.add_argument("--tink-accounts", type=int, default=2)
+    parser.add_argument("--tink-transactions", type=int, default=100)
+    parser.add_argument("--replication-lag-seconds", type=float, default=0.0,
+                        help="lag reported to the read replica health check")
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(
+        create_app(args.db_latency_ms, args.tink_latency_ms, args.openai_latency_ms, args.push_latency_ms,
+                   args.tink_accounts, args.tink_transactions, args.replication_lag_seconds),
+        host=args.host, port=args.port, log_level="warning",
+    )
+
+if __name__ == "__main__":
+    main()
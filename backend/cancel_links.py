@@ -0,0 +1,212 @@
+"""Health checks for merchant cancel links.
+
+A job in every API process re-checks active `url` cancel links that
+haven't been checked for CANCEL_LINK_RECHECK_HOURS. Each pass claims
+batches of CANCEL_LINK_BATCH_SIZE links, most broken_reports first, then
+the ones verified longest ago, so workers never check the same link
+twice. Links are fetched with the shared pooled HTTP client: HEAD first,
+GET (body not read) when HEAD gets an error, following redirects. At
+most CANCEL_LINK_CONCURRENCY requests run at once and at most
+CANCEL_LINK_HOST_CONCURRENCY against one host, so no merchant sees a
+burst. Timeouts, connection errors, 429 and 5xx are retried
+CANCEL_LINK_RETRIES times with backoff; slots are freed while waiting.
+
+Each batch is written back in one call (record_cancel_link_checks), with
+the rules of verify_cancel_link and report_broken_cancel_link:
+- the page answered (also 401/403, pages behind a login): verified
+- 404, 410 and other client errors, or the host can't be reached: one
+  broken report; three in a row deactivate the link
+- still timing out, rate limited or failing with 5xx after retries:
+  inconclusive, only the error is stored
+If nothing in a batch got an answer, our own network is the likelier
+culprit and every result counts as inconclusive.
+
+    python cancel_links.py                         # check every due link once, e.g. from cron
+    python cancel_links.py http://127.0.0.1:9000/cancel/ok ...   # check URLs only, no database
+"""
+import os
+import asyncio
+import contextlib
+import json
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncContextManager, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+from logging_config import get_logger, setup_logging, shutdown_logging
+from metrics import Counter, registry, span
+from periodic import PeriodicJob
+from resources import resources
+from supabase_client import claim_cancel_links_to_check, record_cancel_link_checks
+
+load_dotenv()
+
+logger = get_logger("cancel_links")
+
+CANCEL_LINK_CHECK_INTERVAL_SECONDS = float(os.getenv("CANCEL_LINK_CHECK_INTERVAL_SECONDS", 3600))
+CANCEL_LINK_RECHECK_HOURS = float(os.getenv("CANCEL_LINK_RECHECK_HOURS", 24))
+CANCEL_LINK_BATCH_SIZE = int(os.getenv("CANCEL_LINK_BATCH_SIZE", 100))
+CANCEL_LINK_CONCURRENCY = int(os.getenv("CANCEL_LINK_CONCURRENCY", 16))
+CANCEL_LINK_HOST_CONCURRENCY = int(os.getenv("CANCEL_LINK_HOST_CONCURRENCY", 2))
+CANCEL_LINK_TIMEOUT_SECONDS = float(os.getenv("CANCEL_LINK_TIMEOUT_SECONDS", 10))
+CANCEL_LINK_RETRIES = int(os.getenv("CANCEL_LINK_RETRIES", 2))
+CANCEL_LINK_RETRY_DELAY_SECONDS = float(os.getenv("CANCEL_LINK_RETRY_DELAY_SECONDS", 1))
+# Longest Retry-After we wait for; beyond that the link is left for the next pass
+MAX_RETRY_AFTER_SECONDS = 30
+USER_AGENT = "SubTrack-LinkChecker/1.0"
+
+# The page exists but wants a login (or thinks we're a bot)
+REACHABLE_STATUSES = (401, 403)
+RETRY_STATUSES = (408, 425, 429)
+
+cancel_link_checks = registry.register(Counter(
+    "cancel_link_checks_total", "Cancel link health checks by outcome", ("outcome",)))
+
+def _outcome(result: Dict[str, Any]) -> str:
+    return {True: "ok", False: "broken", None: "inconclusive"}[result["ok"]]
+
+def _retry_after(response: Any) -> Optional[float]:
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+class CancelLinkChecker:
+    def __init__(self, concurrency: int = CANCEL_LINK_CONCURRENCY, per_host: int = CANCEL_LINK_HOST_CONCURRENCY,
+                 timeout: float = CANCEL_LINK_TIMEOUT_SECONDS, retries: int = CANCEL_LINK_RETRIES,
+                 batch_size: int = CANCEL_LINK_BATCH_SIZE, recheck_hours: float = CANCEL_LINK_RECHECK_HOURS):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.batch_size = batch_size
+        self.recheck_hours = recheck_hours
+        self._job = PeriodicJob(self.run_once, logger, "Cancel link check pass failed")
+
+    # ---------- Checking URLs ----------
+
+    async def _attempt(self, url: str) -> Dict[str, Any]:
+        """One HEAD (and GET if needed); `retry` says whether another attempt could change the outcome"""
+        import httpx
+
+        client = resources.link_http
+        options = {"timeout": self.timeout, "follow_redirects": True, "headers": {"User-Agent": USER_AGENT}}
+        try:
+            with span("cancel_link", "check"):
+                response = await client.head(url, **options)
+                if response.status_code >= 400:
+                    # Plenty of sites refuse or mishandle HEAD; the page is what counts
+                    async with client.stream("GET", url, **options) as response:
+                        pass
+        except httpx.TimeoutException:
+            return {"ok": None, "status": None, "error": "Timed out", "retry": True}
+        except (httpx.InvalidURL, httpx.UnsupportedProtocol, httpx.TooManyRedirects) as e:
+            return {"ok": False, "status": None, "error": str(e)[:500], "retry": False}
+        except httpx.TransportError as e:
+            return {"ok": False, "status": None, "error": f"Unreachable: {e}"[:500], "retry": True}
+        except httpx.HTTPError as e:
+            return {"ok": None, "status": None, "error": str(e)[:500], "retry": False}
+
+        status = response.status_code
+        if status < 400 or status in REACHABLE_STATUSES:
+            return {"ok": True, "status": status, "error": None, "retry": False}
+        error = f"HTTP {status}"
+        if status in RETRY_STATUSES or status >= 500:
+            return {"ok": None, "status": status, "error": error, "retry": True, "retry_after": _retry_after(response)}
+        return {"ok": False, "status": status, "error": error, "retry": False}
+
+    async def check(self, url: str, limit: Optional[Callable[[], AsyncContextManager]] = None) -> Dict[str, Any]:
+        """{ok, status, error} for one URL, retried as needed; ok is None when it can't be told.
+
+        `limit` gives the context to hold during each attempt, so nothing is held while backing off.
+        """
+        for attempt in range(self.retries + 1):
+            async with limit() if limit else contextlib.nullcontext():
+                result = await self._attempt(url)
+            if not result.pop("retry") or attempt == self.retries:
+                break
+            delay = result.pop("retry_after", None)
+            if delay is None:
+                delay = CANCEL_LINK_RETRY_DELAY_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5)
+            elif delay > MAX_RETRY_AFTER_SECONDS:
+                break
+            await asyncio.sleep(delay)
+        result.pop("retry_after", None)
+        return result
+
+    async def check_all(self, urls: List[str]) -> List[Dict[str, Any]]:
+        """Check URLs concurrently within the global and per-host limits; results in the same order"""
+        slots = asyncio.Semaphore(self.concurrency)
+        hosts: Dict[str, asyncio.Semaphore] = {}
+
+        def limit(url: str) -> Callable[[], AsyncContextManager]:
+            host = hosts.setdefault((urlsplit(url).hostname or "").lower(), asyncio.Semaphore(self.per_host))
+
+            @contextlib.asynccontextmanager
+            async def held():
+                # Host first, so a request waiting on a busy host doesn't hold a global slot
+                async with host, slots:
+                    yield
+            return held
+
+        return await asyncio.gather(*(self.check(url, limit(url)) for url in urls))
+
+    # ---------- Stored links ----------
+
+    async def run_once(self) -> Dict[str, int]:
+        """Check every due link; returns counts by outcome"""
+        cutoff = (datetime.now(timezone.utc) - timedelta(hours=self.recheck_hours)).isoformat()
+        counts = {"ok": 0, "broken": 0, "inconclusive": 0}
+        while True:
+            # Claiming sets checked_at, so each loop gets links no other worker has
+            links = await claim_cancel_links_to_check(cutoff, self.batch_size)
+            if not links:
+                break
+            results = await self.check_all([link["cancel_target"] for link in links])
+            if len(results) > 1 and all(r["status"] is None for r in results):
+                logger.warning("No cancel link answered; treating the batch as inconclusive", extra={"links": len(links)})
+                for result in results:
+                    result["ok"] = None
+            await record_cancel_link_checks([
+                {"id": link["id"], "ok": result["ok"], "error": result["error"]} for link, result in zip(links, results)])
+            for link, result in zip(links, results):
+                outcome = _outcome(result)
+                counts[outcome] += 1
+                cancel_link_checks.inc((outcome,))
+                if result["ok"] is False:
+                    logger.warning("Cancel link broken", extra={
+                        "merchant": link["merchant_name"], "url": link["cancel_target"], "status": result["status"],
+                        "error": result["error"], "broken_reports": link["broken_reports"] + 1})
+            if len(links) < self.batch_size:
+                break
+        if any(counts.values()):
+            logger.info("Cancel links checked", extra=counts)
+        return counts
+
+    # ---------- Background loop ----------
+
+    def start(self, interval: float = CANCEL_LINK_CHECK_INTERVAL_SECONDS) -> None:
+        self._job.start(interval)
+
+    async def stop(self) -> None:
+        await self._job.stop()
+
+link_checker = CancelLinkChecker()
+
+async def main(urls: List[str]) -> None:
+    setup_logging()
+    try:
+        if urls:
+            for url, result in zip(urls, await link_checker.check_all(urls)):
+                print(json.dumps({"url": url, **result}))
+        else:
+            await link_checker.run_once()
+    finally:
+        await resources.close()
+        shutdown_logging()
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
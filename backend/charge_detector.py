@@ -0,0 +1,209 @@
+import os
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from detection import descriptor_key, transaction_description
+from logging_config import get_logger
+from supabase_client import (
+    create_notification_events, get_subscriptions_by_owner, get_transaction_series, insert_new_transactions,
+    save_transaction_series
+)
+
+load_dotenv()
+
+logger = get_logger("charge_detector")
+
+# A charge this much above the previous one (relative and absolute) is a price increase
+PRICE_INCREASE_MIN_PCT = float(os.getenv("PRICE_INCREASE_MIN_PCT", 0.03))
+PRICE_INCREASE_MIN_ABS = float(os.getenv("PRICE_INCREASE_MIN_ABS", 1.0))
+# Series whose recent amounts vary more than this are not fixed-price (groceries, fuel, ...)
+STABLE_AMOUNT_TOLERANCE = float(os.getenv("STABLE_AMOUNT_TOLERANCE", 0.05))
+# Only charges booked this recently produce events; older history just builds up the series
+EVENT_MAX_AGE_DAYS = int(os.getenv("EVENT_MAX_AGE_DAYS", 35))
+RECENT_AMOUNTS = 6
+# Times a series changed by a concurrent ingest for the same user is re-read and the charges re-applied
+SERIES_SAVE_ATTEMPTS = 3
+
+# (min, max) days between charges for the app's frequencies
+RECURRING_INTERVALS = {"måned": (25, 35), "kvartal": (85, 97), "halvår": (175, 190), "år": (355, 375)}
+
+# ========== NORMALIZATION ==========
+
+def merchant_key(description: str) -> str:
+    """Grouping key for charges from the same merchant, ignoring reference numbers"""
+    return descriptor_key(description)
+
+def compact_transaction(user_id: int, tx: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The stored subset of a Tink v2 transaction, None if it lacks an id, amount or date"""
+    value = tx.get("amount", {}).get("value", {})
+    booked = tx.get("dates", {}).get("booked")
+    description = transaction_description(tx)
+    if not tx.get("id") or not booked or not description:
+        return None
+    try:
+        amount = int(value.get("unscaledValue")) / (10 ** int(value.get("scale", 0)))
+    except (TypeError, ValueError):
+        return None
+    return {
+        "user_id": user_id,
+        "external_id": tx["id"],
+        "account_id": tx.get("accountId"),
+        "merchant_key": merchant_key(description),
+        "description": description[:200],
+        "amount": round(amount, 2),
+        "currency": tx.get("amount", {}).get("currencyCode", "DKK"),
+        "booked_date": booked[:10],
+        "subscription_id": None,
+    }
+
+def match_subscription(key: str, subscriptions: List[Tuple[str, Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """Subscription whose normalized title is a prefix of the merchant key"""
+    for sub_key, sub in subscriptions:
+        if sub_key and (key == sub_key or key.startswith(sub_key)):
+            return sub
+    return None
+
+# ========== SERIES ==========
+
+def _new_series(user_id: int, key: str) -> Dict[str, Any]:
+    return {
+        "user_id": user_id, "merchant_key": key, "charge_count": 0, "last_amount": None, "mean_amount": None,
+        "recent_amounts": [], "first_booked_date": None, "last_booked_date": None, "subscription_id": None,
+        "version": 0,
+    }
+
+def _is_stable(amounts: List[float]) -> bool:
+    return len(amounts) >= 2 and max(amounts) <= min(amounts) * (1 + STABLE_AMOUNT_TOLERANCE)
+
+def _recurring_frequency(days: int) -> Optional[str]:
+    for frequency, (low, high) in RECURRING_INTERVALS.items():
+        if low <= days <= high:
+            return frequency
+    return None
+
+def apply_charge(series: Dict[str, Any], row: Dict[str, Any], subscription: Optional[Dict[str, Any]],
+                 today: date) -> Optional[Dict[str, Any]]:
+    """Fold one new charge into its series; returns a notification event or None"""
+    amount = abs(float(row["amount"]))
+    booked = date.fromisoformat(row["booked_date"])
+    last_booked = date.fromisoformat(series["last_booked_date"]) if series["last_booked_date"] else None
+    previous_amounts = [float(a) for a in series["recent_amounts"]]
+    count = series["charge_count"]
+
+    series["charge_count"] = count + 1
+    series["mean_amount"] = round(((float(series["mean_amount"] or 0) * count) + amount) / (count + 1), 2)
+    if subscription is not None:
+        series["subscription_id"] = subscription["id"]
+    if last_booked is not None and booked < last_booked:
+        # Late-arriving older charge: counts toward the mean but says nothing about the current price
+        return None
+
+    series["recent_amounts"] = (previous_amounts + [amount])[-RECENT_AMOUNTS:]
+    series["last_amount"] = amount
+    series["last_booked_date"] = row["booked_date"]
+    series["first_booked_date"] = series["first_booked_date"] or row["booked_date"]
+
+    if (today - booked).days > EVENT_MAX_AGE_DAYS or not previous_amounts:
+        return None
+
+    previous = previous_amounts[-1]
+    name = subscription["title"] if subscription else row["description"]
+    if (_is_stable(previous_amounts)
+            and amount > previous * (1 + PRICE_INCREASE_MIN_PCT) and amount - previous >= PRICE_INCREASE_MIN_ABS):
+        return {
+            "user_id": row["user_id"],
+            "subscription_id": series["subscription_id"],
+            "event_type": "price_increase",
+            "dedupe_key": f"price_increase:{row['user_id']}:{row['external_id']}",
+            "payload": {
+                "merchant": name, "old_amount": previous, "new_amount": amount,
+                "increase_pct": round((amount - previous) / previous * 100, 1),
+                "currency": row.get("currency", "DKK"), "booked_date": row["booked_date"],
+            },
+        }
+
+    if subscription is None and series["subscription_id"] is None and count == 1 and last_booked is not None:
+        # Second charge from an unknown merchant at a subscription-like interval and price
+        frequency = _recurring_frequency((booked - last_booked).days)
+        if frequency and _is_stable(series["recent_amounts"]):
+            return {
+                "user_id": row["user_id"],
+                "subscription_id": None,
+                "event_type": "transaction_detected",
+                "dedupe_key": f"transaction_detected:{row['user_id']}:{row['merchant_key']}",
+                "payload": {
+                    "merchant": name, "amount": amount, "frequency": frequency,
+                    "currency": row.get("currency", "DKK"), "booked_date": row["booked_date"],
+                },
+            }
+    return None
+
+# ========== INGEST ==========
+
+async def ingest_transactions(user_id: int, transactions: List[Dict[str, Any]],
+                              subscriptions: Optional[List[Dict[str, Any]]] = None) -> Dict[str, int]:
+    """Store new transactions and run the detector over them only.
+
+    Work is proportional to the number of transactions not seen before:
+    already stored ones are skipped by the insert, and only the series of
+    merchants that had a new charge are read and written.
+    """
+    if subscriptions is None:
+        subscriptions = await get_subscriptions_by_owner(user_id)
+    sub_index = [(merchant_key(sub["title"]), sub) for sub in subscriptions]
+
+    rows = []
+    seen = set()
+    for tx in transactions:
+        row = compact_transaction(user_id, tx)
+        if row is None or row["external_id"] in seen:
+            continue
+        seen.add(row["external_id"])
+        sub = match_subscription(row["merchant_key"], sub_index)
+        if sub is not None:
+            row["subscription_id"] = sub["id"]
+        rows.append(row)
+
+    new_rows = await insert_new_transactions(rows)
+    charges = sorted((r for r in new_rows if float(r["amount"]) < 0), key=lambda r: (r["booked_date"], r["external_id"]))
+    stats = {"transactions": len(rows), "new_transactions": len(new_rows), "events": 0}
+    if not charges:
+        return stats
+
+    # The analyze endpoint, the sync worker and the webhook processor may ingest for this user at
+    # the same time. A series is only saved if nobody wrote it since it was read; the ones that
+    # lost that race are re-read and this caller's charges applied to them again.
+    pending = {r["merchant_key"] for r in charges}
+    today = date.today()
+    events = []
+    for _ in range(SERIES_SAVE_ATTEMPTS):
+        series = {s["merchant_key"]: s for s in await get_transaction_series(user_id, sorted(pending))}
+        series_events: Dict[str, List[Dict[str, Any]]] = {}
+        for row in charges:
+            key = row["merchant_key"]
+            if key not in pending:
+                continue
+            state = series.get(key)
+            if state is None:
+                state = series[key] = _new_series(user_id, key)
+            event = apply_charge(state, row, match_subscription(key, sub_index), today)
+            if event is not None:
+                series_events.setdefault(key, []).append(event)
+        saved = set(await save_transaction_series(
+            [{k: v for k, v in s.items() if k != "updated_at"} for s in series.values()]))
+        for key in saved:
+            events += series_events.get(key, [])
+        pending -= saved
+        if not pending:
+            break
+    else:
+        logger.warning("Charge series kept changing; new charges not applied",
+                       extra={"user_id": user_id, "merchants": len(pending)})
+
+    created = await create_notification_events(events)
+    stats["events"] = len(created)
+    if created:
+        logger.info("Charge events queued", extra={"user_id": user_id, "events": len(created)})
+    return stats
@@ -0,0 +1,200 @@
+"""Company suggestions and logos, proxied and cached for the app.
+
+Suggestions are kept in an in-memory LRU keyed by the normalized query.
+Logo bytes go to a size-bounded directory on disk, with least recently
+used files evicted first. Concurrent misses for the same key share a
+single upstream request. Lookups that upstream has no answer for are
+remembered briefly as well, so a typo or a missing logo is not
+re-fetched on every keystroke or app start.
+
+The upstream is any object with `suggest(query)` and `logo(domain, size)`
+coroutines. `ClearbitUpstream` is the default, and its base URLs come
+from COMPANY_API_URL and LOGO_API_URL. Tests point those URLs at a stub,
+or call `directory.set_upstream()`.
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import tempfile
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from disk_cache import DiskLRU
+from idempotency import SingleFlight
+from logging_config import get_logger
+from metrics import span
+from resources import resources
+
+load_dotenv()
+
+logger = get_logger("companies")
+
+SUGGEST_CACHE_SIZE = int(os.getenv("SUGGEST_CACHE_SIZE", 5000))
+SUGGEST_CACHE_TTL_SECONDS = int(os.getenv("SUGGEST_CACHE_TTL_SECONDS", 24 * 3600))
+SUGGEST_MIN_QUERY_LENGTH = 2
+SUGGEST_MAX_RESULTS = 8
+LOGO_CACHE_DIR = os.getenv("LOGO_CACHE_DIR", os.path.join(tempfile.gettempdir(), "subtrack-logos"))
+LOGO_CACHE_MAX_BYTES = int(os.getenv("LOGO_CACHE_MAX_BYTES", 100 * 1024 * 1024))
+LOGO_MAX_BYTES = 512 * 1024
+# How long browsers and the app may reuse a logo without revalidating
+LOGO_MAX_AGE_SECONDS = int(os.getenv("LOGO_MAX_AGE_SECONDS", 7 * 24 * 3600))
+MISSING_TTL_SECONDS = int(os.getenv("COMPANY_MISSING_TTL_SECONDS", 3600))
+
+DOMAIN_PATTERN = re.compile(r"^(?=.{3,253}$)[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?(?:\.[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?)+$")
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())[:64]
+
+def normalize_domain(domain: str) -> Optional[str]:
+    """Lower-cased bare domain, None if it isn't one"""
+    domain = domain.strip().lower().removeprefix("www.")
+    return domain if DOMAIN_PATTERN.match(domain) else None
+
+# ========== UPSTREAM ==========
+
+class ClearbitUpstream:
+    async def suggest(self, query: str) -> List[Dict[str, Any]]:
+        with span("clearbit", "suggest"):
+            response = await resources.company_http.get("/v1/companies/suggest", params={"query": query})
+        response.raise_for_status()
+        return [{"name": c.get("name"), "domain": c.get("domain")} for c in response.json() if c.get("domain")]
+
+    async def logo(self, domain: str, size: int) -> Optional[Tuple[bytes, str]]:
+        """Image bytes and content type, None if upstream has no logo"""
+        with span("clearbit", "logo"):
+            response = await resources.logo_http.get(f"/{domain}", params={"size": size})
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        content_type = response.headers.get("content-type", "image/png").split(";")[0]
+        if not content_type.startswith("image/") or len(response.content) > LOGO_MAX_BYTES:
+            return None
+        return response.content, content_type
+
+# ========== CACHES ==========
+
+class TTLCache:
+    """LRU with per-entry expiry"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        entry = self._entries.pop(key, None)
+        return default if entry is None or entry[0] < time.monotonic() else entry[1]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class LogoDiskCache:
+    """Logo files named by a hash of (domain, size), LRU-evicted to stay under max_bytes"""
+
+    def __init__(self, directory: str = LOGO_CACHE_DIR, max_bytes: int = LOGO_CACHE_MAX_BYTES):
+        self.files = DiskLRU(directory, max_bytes, suffixes=("bin", "json"))
+
+    @staticmethod
+    def key(domain: str, size: int) -> str:
+        return hashlib.sha256(f"{domain}:{size}".encode()).hexdigest()[:40]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Stored logo as {body, content_type, etag}, refreshing its LRU position"""
+        files = self.files.get(key)
+        if files is None:
+            return None
+        try:
+            meta = json.loads(files["json"])
+        except ValueError:
+            self.files.discard(key)
+            return None
+        return {"body": files["bin"], **meta}
+
+    def put(self, key: str, body: bytes, content_type: str) -> Dict[str, Any]:
+        meta = {"content_type": content_type, "etag": f'"{hashlib.sha256(body).hexdigest()[:32]}"'}
+        self.files.put(key, {"bin": body, "json": json.dumps(meta).encode()})
+        return {"body": body, **meta}
+
+# ========== SERVICE ==========
+
+class CompanyDirectory:
+    def __init__(self, upstream: Any = None, logo_cache: Optional[LogoDiskCache] = None):
+        self.upstream = upstream or ClearbitUpstream()
+        self.suggestions = TTLCache(SUGGEST_CACHE_SIZE, SUGGEST_CACHE_TTL_SECONDS)
+        self.missing_logos = TTLCache(SUGGEST_CACHE_SIZE, MISSING_TTL_SECONDS)
+        self.logos = logo_cache or LogoDiskCache()
+        self.flights = SingleFlight()
+
+    def set_upstream(self, upstream: Any) -> None:
+        self.upstream = upstream
+        self.suggestions.clear()
+        self.missing_logos.clear()
+
+    async def suggest(self, query: str) -> List[Dict[str, Any]]:
+        query = normalize_query(query)
+        if len(query) < SUGGEST_MIN_QUERY_LENGTH:
+            return []
+        cached = self.suggestions.get(query)
+        if cached is not None:
+            return cached
+        results, _ = await self.flights.do(f"suggest:{query}", lambda: self._fetch_suggestions(query))
+        return results
+
+    async def _fetch_suggestions(self, query: str) -> List[Dict[str, Any]]:
+        try:
+            results = (await self.upstream.suggest(query))[:SUGGEST_MAX_RESULTS]
+        except Exception as e:
+            logger.warning("Company suggest failed", extra={"error": str(e)})
+            # Don't cache failures; the next keystroke tries again
+            return []
+        self.suggestions.put(query, results)
+        return results
+
+    async def logo(self, domain: str, size: int) -> Optional[Dict[str, Any]]:
+        """Cached or freshly fetched logo for a normalized domain, None if there is none"""
+        key = LogoDiskCache.key(domain, size)
+        if self.missing_logos.get(key):
+            return None
+        cached = await asyncio.to_thread(self.logos.get, key)
+        if cached is not None:
+            return cached
+        logo, _ = await self.flights.do(f"logo:{key}", lambda: self._fetch_logo(key, domain, size))
+        return logo
+
+    async def _fetch_logo(self, key: str, domain: str, size: int) -> Optional[Dict[str, Any]]:
+        try:
+            fetched = await self.upstream.logo(domain, size)
+        except Exception as e:
+            logger.warning("Logo fetch failed", extra={"domain": domain, "error": str(e)})
+            return None
+        if fetched is None:
+            self.missing_logos.put(key, True)
+            return None
+        body, content_type = fetched
+        return await asyncio.to_thread(self.logos.put, key, body, content_type)
+
+directory = CompanyDirectory()
@@ -0,0 +1,144 @@
+import os
+import json
+import calendar
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+from logging_config import get_logger
+
+load_dotenv()
+
+logger = get_logger("cost_model")
+
+BASE_CURRENCY = "DKK"
+# JSON file of {"rates": {"EUR": 7.46, ...}} in DKK per unit; reloaded when it changes on disk
+FX_RATES_PATH = os.getenv("FX_RATES_PATH", os.path.join(os.path.dirname(__file__), "fx_rates.json"))
+
+MONTHS_PER_PERIOD = {"måned": 1, "kvartal": 3, "halvår": 6, "år": 12}
+DEFAULT_FREQUENCY = "måned"
+
+# Used until an FX file is provided; DKK per unit
+DEFAULT_FX_RATES = {"DKK": 1.0, "EUR": 7.46, "USD": 6.85, "GBP": 8.70, "SEK": 0.65, "NOK": 0.64}
+
+# ========== CALENDAR ==========
+
+def months_per_period(frequency: Optional[str]) -> int:
+    return MONTHS_PER_PERIOD.get(frequency or DEFAULT_FREQUENCY, 1)
+
+def add_months(day: date, months: int) -> date:
+    """Same day of month `months` later, clamped to the month's last day (Jan 31 + 1 = Feb 28)"""
+    index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(index, 12)
+    return date(year, month + 1, min(day.day, calendar.monthrange(year, month + 1)[1]))
+
+def parse_date(value: Any) -> Optional[date]:
+    """date from a date, datetime or ISO string (with or without time), None if unparseable"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+def next_renewal(last_charge: date, frequency: Optional[str], on_or_after: Optional[date] = None) -> date:
+    """First scheduled charge after last_charge that is not before on_or_after"""
+    step = months_per_period(frequency)
+    k = 1
+    renewal = add_months(last_charge, step)
+    if on_or_after is not None and renewal < on_or_after:
+        # Jump close to the target instead of stepping one period at a time
+        months_behind = (on_or_after.year - last_charge.year) * 12 + on_or_after.month - last_charge.month
+        k = max(1, months_behind // step)
+        renewal = add_months(last_charge, step * k)
+        while renewal < on_or_after:
+            k += 1
+            renewal = add_months(last_charge, step * k)
+    return renewal
+
+def charges_between(anchor: date, frequency: Optional[str], start: date, end: date) -> List[date]:
+    """Charge dates on the anchor's schedule within [start, end], in either direction from the anchor"""
+    step = months_per_period(frequency)
+    offset = (start.year - anchor.year) * 12 + start.month - anchor.month
+    k = offset // step - 1
+    dates = []
+    while True:
+        charge = add_months(anchor, step * k)
+        if charge > end:
+            return dates
+        if charge >= start:
+            dates.append(charge)
+        k += 1
+
+# ========== CURRENCY ==========
+
+class FxTable:
+    """Conversion rates to DKK from a local JSON file, cached in memory until the file changes"""
+
+    def __init__(self, path: Optional[str] = FX_RATES_PATH):
+        self.path = path
+        self._rates = dict(DEFAULT_FX_RATES)
+        self._mtime: Optional[float] = None
+        self._warned = set()
+
+    def _maybe_reload(self) -> None:
+        if not self.path:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                rates = {code.upper(): float(rate) for code, rate in json.load(f)["rates"].items()}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning("Could not load FX rates", extra={"path": self.path, "error": str(e)})
+            return
+        self._rates = {**DEFAULT_FX_RATES, **rates, BASE_CURRENCY: 1.0}
+        logger.info("FX rates loaded", extra={"path": self.path, "currencies": len(self._rates)})
+
+    def rates(self) -> Dict[str, float]:
+        self._maybe_reload()
+        return self._rates
+
+    def to_base(self, amount: float, currency: Optional[str]) -> float:
+        code = (currency or BASE_CURRENCY).upper()
+        rate = self.rates().get(code)
+        if rate is None:
+            if code not in self._warned:
+                self._warned.add(code)
+                logger.warning("No FX rate, treating amount as DKK", extra={"currency": code})
+            rate = 1.0
+        return amount * rate
+
+fx_rates = FxTable()
+
+# ========== NORMALIZATION ==========
+
+def normalize_costs(subs: Iterable[Dict[str, Any]], fx: Optional[FxTable] = None) -> List[Dict[str, Any]]:
+    """Monthly and yearly DKK equivalents for a batch of subscriptions, in input order"""
+    fx = fx or fx_rates
+    rates = fx.rates()
+    normalized = []
+    for sub in subs:
+        code = (sub.get("currency") or BASE_CURRENCY).upper()
+        amount = float(sub.get("amount") or 0)
+        amount_dkk = amount * rates[code] if code in rates else fx.to_base(amount, code)
+        monthly = amount_dkk / months_per_period(sub.get("frequency"))
+        normalized.append({
+            "id": sub.get("id"),
+            "owner_id": sub.get("owner_id"),
+            "category": sub.get("category"),
+            "amount_dkk": round(amount_dkk, 2),
+            "monthly": round(monthly, 2),
+            "yearly": round(monthly * 12, 2),
+        })
+    return normalized
@@ -0,0 +1,393 @@
+import re
+import json
+import asyncio
+import random
+import hashlib
+from collections import Counter
+from functools import lru_cache
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from cost_model import next_renewal, parse_date
+from logging_config import get_logger, log_payload
+from metrics import span
+from resources import resources
+
+logger = get_logger("detection")
+
+# Minimum AI confidence for a group to count as a subscription
+MIN_CONFIDENCE = 70
+# Groups sent to the model per call
+MAX_PROMPT_GROUPS = 20
+
+# Descriptor clustering: MinHash signature length, LSH bands (3 rows each)
+# and the character-trigram Jaccard similarity two descriptors need to share a cluster
+CLUSTER_NUM_PERM = 24
+CLUSTER_BANDS = 8
+CLUSTER_MIN_SIMILARITY = 0.7
+# Buckets this large (a very common prefix) are only checked against their first member
+CLUSTER_MAX_BUCKET = 200
+
+SYSTEM_PROMPT = "Du er en ekspert i danske banktransaktioner og abonnementer. Analyser transaktioner og identificer abonnementer præcist."
+
+class DetectionError(Exception):
+    """The language model call failed; callers decide whether to retry or surface it"""
+
+# ========== TRANSACTION FIELDS ==========
+
+def transaction_description(tx: Dict[str, Any]) -> str:
+    descriptions = tx.get("descriptions", {})
+    return descriptions.get("display", "") or descriptions.get("original", "")
+
+def transaction_amount(tx: Dict[str, Any]) -> Optional[float]:
+    """Absolute amount of a Tink v2 transaction, None if it can't be parsed"""
+    try:
+        value = tx.get("amount", {}).get("value", {})
+        unscaled = float(value.get("unscaledValue", 0))
+        scale = int(value.get("scale", 0))
+        return abs(unscaled / (10 ** scale))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+def transaction_booked_date(tx: Dict[str, Any]) -> str:
+    return tx.get("dates", {}).get("booked", "")
+
+def clean_description(desc: str) -> str:
+    """Normalize merchant/description strings to nice subscription titles.
+
+    Examples:
+    "OPENAI *CHATGPT"      -> "Openai Chatgpt"
+    "SPLICE.COM* CREATOR"  -> "Splice Creator"
+    "DISNEYPLUS.COM  DK"   -> "Disneyplus"
+    "www.netflix.com"      -> "Netflix"
+    "TRYG FORSIKRING A/S"  -> "Tryg Forsikring A S"
+    """
+    if not desc:
+        return "Ukendt"
+    text = desc.lower()
+
+    # Remove protocol
+    text = re.sub(r"https?://", "", text)
+
+    # Replace delimiters * / - with space
+    text = re.sub(r"[*/_-]", " ", text)
+
+    # Remove domain suffixes (.com, .dk etc.)
+    text = re.sub(r"\b[a-z0-9]+\.(com|dk|io|net|org|se|co)\b", "", text)
+
+    # Remove multiple spaces and non-alphanumeric (keep danish chars)
+    text = re.sub(r"[^a-z0-9æøå \s]", "", text)
+    text = re.sub(r"\s{2,}", " ", text).strip()
+
+    return text.title()
+
+# ========== GROUPING ==========
+
+def descriptor_key(description: str) -> str:
+    """Merchant part of a bank descriptor, for clustering.
+
+    Uses the clean_description() rules, but keeps the name from domains
+    ("NETFLIX.COM" -> "netflix") and drops words containing digits
+    (reference numbers, dates, card suffixes). Also the merchant key of
+    stored transactions (charge_detector), so both agree on what a
+    merchant is. Check with `python -m doctest detection.py`:
+
+    >>> descriptor_key("NETFLIX.COM DK"), descriptor_key("HBOMAX.COM DK")
+    ('netflix dk', 'hbomax dk')
+    >>> descriptor_key("APPLE.COM/BILL"), descriptor_key("www.netflix.com")
+    ('apple bill', 'netflix')
+    >>> descriptor_key("SPOTIFY P1A2B3 4571")
+    'spotify'
+    """
+    text = re.sub(r"\b(?:www\.)?([a-z0-9æøå]+)\.(?:com|dk|io|net|org|se|co)\b", r"\1", (description or "").lower())
+    words = clean_description(text).lower().split()
+    letters_only = [w for w in words if w != "ukendt" and not any(c.isdigit() for c in w)]
+    return " ".join(letters_only or words)[:80]
+
+_DIGITS = re.compile(r"\d")
+_PERMUTATION_PRIME = (1 << 61) - 1
+# Fixed seed so signatures, and therefore clusters, are the same in every process
+_rng = random.Random(20251107)
+_PERMUTATIONS = [(_rng.randrange(1, _PERMUTATION_PRIME), _rng.randrange(_PERMUTATION_PRIME)) for _ in range(CLUSTER_NUM_PERM)]
+
+def _shingles(key: str) -> Set[str]:
+    padded = f" {key} "
+    return {padded[i:i + 3] for i in range(max(1, len(padded) - 2))}
+
+@lru_cache(maxsize=65536)
+def _permuted(shingle: str) -> Tuple[int, ...]:
+    """The shingle's hash under each MinHash permutation"""
+    h = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big")
+    return tuple((a * h + b) % _PERMUTATION_PRIME for a, b in _PERMUTATIONS)
+
+def _signature(shingles: Set[str]) -> Tuple[int, ...]:
+    return tuple(map(min, zip(*map(_permuted, shingles))))
+
+def same_merchant(a: str, b: str) -> bool:
+    """Whether two descriptor keys can name the same merchant.
+
+    They must agree word by word, except that the shorter key may end
+    early or with a truncated word (banks cut descriptors to a fixed
+    width). The first word, the merchant, always has to match in full.
+    """
+    words_a, words_b = sorted((a.split(), b.split()), key=len)
+    if not words_a or words_a[0] != words_b[0]:
+        return False
+    last = len(words_a) - 1
+    return all(x == y or (0 < i == last and y.startswith(x)) for i, (x, y) in enumerate(zip(words_a, words_b)))
+
+def cluster_keys(keys: Iterable[str]) -> Dict[str, str]:
+    """Map each descriptor key to its cluster's key (the smallest key in the cluster).
+
+    Candidate pairs come from MinHash/LSH over character trigrams: two keys
+    are compared only if all rows of at least one band of their signatures
+    match. Candidates are then checked by exact Jaccard similarity and
+    same_merchant(). Two clusters merge only if every key of one is
+    compatible with every key of the other, so a short key ("google
+    youtube") can't chain two different products or payees together. The
+    cost grows with the number of distinct keys rather than with the
+    square of it.
+
+    >>> clusters = cluster_keys(["mobilepay john hansen", "mobilepay jane hansen", "mobilepay jens hansen"])
+    >>> sorted(set(clusters.values()))
+    ['mobilepay jane hansen', 'mobilepay jens hansen', 'mobilepay john hansen']
+    >>> clusters = cluster_keys(["google youtube premium", "google youtube music", "google youtube"])
+    >>> clusters["google youtube premium"] != clusters["google youtube music"]
+    True
+    >>> cluster_keys(["netflix", "netflix dk", "disney plus subscri", "disney plus subscription"])
+    {'disney plus subscri': 'disney plus subscri', 'disney plus subscription': 'disney plus subscri', \
+'netflix': 'netflix', 'netflix dk': 'netflix'}
+    """
+    keys = sorted(set(keys))
+    shingles = [_shingles(k) for k in keys]
+    parent = list(range(len(keys)))
+    # Keys of each cluster, held by its root
+    clustered = [[i] for i in range(len(keys))]
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    rows = CLUSTER_NUM_PERM // CLUSTER_BANDS
+    buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = {}
+    for i, sh in enumerate(shingles):
+        signature = _signature(sh)
+        for band in range(CLUSTER_BANDS):
+            buckets.setdefault((band, signature[band * rows:(band + 1) * rows]), []).append(i)
+
+    for members in buckets.values():
+        if len(members) < 2:
+            continue
+        pairs = ((members[0], j) for j in members[1:]) if len(members) > CLUSTER_MAX_BUCKET else \
+            ((members[x], members[y]) for x in range(len(members)) for y in range(x + 1, len(members)))
+        for i, j in pairs:
+            root_i, root_j = find(i), find(j)
+            if root_i == root_j:
+                continue
+            a, b = shingles[i], shingles[j]
+            if len(a & b) < CLUSTER_MIN_SIMILARITY * len(a | b):
+                continue
+            if not all(same_merchant(keys[x], keys[y]) for x in clustered[root_i] for y in clustered[root_j]):
+                continue
+            # Keys are sorted, so the lower index is the smaller key and stays the root
+            root, other = min(root_i, root_j), max(root_i, root_j)
+            parent[other] = root
+            clustered[root].extend(clustered[other])
+            clustered[other] = []
+    return {key: keys[find(i)] for i, key in enumerate(keys)}
+
+class Cluster:
+    """Transactions whose descriptors are near-duplicates"""
+    __slots__ = ("key", "label", "transactions")
+
+    def __init__(self, key: str, label: str, transactions: List[Dict[str, Any]]):
+        self.key = key                     # stable id: smallest descriptor key in the cluster
+        self.label = label                 # most common original description, shown to the model
+        self.transactions = transactions
+
+def cluster_transactions(transactions: List[Dict[str, Any]]) -> List[Cluster]:
+    """Group transactions by descriptor, merging near-duplicate descriptors.
+
+    Exact descriptor keys collapse "NETFLIX 48213" and "NETFLIX 50991" first,
+    so the similarity stage only sees one entry per distinct merchant string.
+    """
+    by_key: Dict[str, List[Dict[str, Any]]] = {}
+    keys: Dict[str, str] = {}
+    for tx in transactions:
+        desc = transaction_description(tx)
+        if not desc or desc == "Ukendt":
+            continue
+        # Digits never survive into the key, so descriptors differing only in digits share one lookup
+        masked = _DIGITS.sub("0", desc)
+        key = keys.get(masked)
+        if key is None:
+            key = keys[masked] = descriptor_key(masked)
+        by_key.setdefault(key, []).append(tx)
+
+    merged: Dict[str, List[Dict[str, Any]]] = {}
+    for key, root in cluster_keys(by_key).items():
+        merged.setdefault(root, []).extend(by_key[key])
+
+    clusters = []
+    for key, txs in sorted(merged.items()):
+        counts = Counter(transaction_description(tx) for tx in txs)
+        label = min(counts, key=lambda d: (-counts[d], d))
+        clusters.append(Cluster(key, label, txs))
+    return clusters
+
+def group_recurring(transactions: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Transactions grouped by descriptor cluster, keeping only clusters seen at least twice"""
+    clusters = cluster_transactions(transactions)
+    recurring = {c.label: c.transactions for c in clusters if len(c.transactions) >= 2}
+    logger.debug("Transactions grouped", extra={"groups": len(clusters), "recurring_groups": len(recurring)})
+    return recurring
+
+def summarize_groups(recurring_groups: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    summaries = []
+    for desc, txs in recurring_groups.items():
+        amounts, dates = [], []
+        for tx in txs:
+            amount = transaction_amount(tx)
+            if amount is None:
+                continue
+            amounts.append(amount)
+            dates.append(transaction_booked_date(tx))
+
+        if amounts:
+            summaries.append({
+                "description": desc,
+                "frequency": len(txs),
+                "average_amount": round(sum(amounts) / len(amounts), 2),
+                "amount_range": f"{min(amounts):.2f}-{max(amounts):.2f} DKK",
+                "dates": sorted(dates)[-3:]  # Last 3 dates
+            })
+    return summaries
+
+# ========== MODEL CALL ==========
+
+def build_prompt(summaries: List[Dict[str, Any]]) -> str:
+    return f"""
+Analyser følgende danske banktransaktioner og identificer hvilke der er abonnementer/subscriptions.
+
+For hver transaktion skal du bestemme:
+1. Er det et abonnement? (ja/nej)
+2. Confidence score (0-100%)
+3. Præcist virksomhedsnavn (forkort og rens - f.eks. "SPLICE.COM* CREATOR" → "Splice", "DISNEYPLUS.COM DK" → "Disney+")
+4. Kategori (Streaming & Underholdning, Forsikring & Pension, Telekom & Internet, osv.)
+5. Betalingsfrekvens (måned/kvartal/halvår/år)
+6. Næste fornyelsesdato (baseret på frekvens og seneste betaling)
+
+Transaktioner:
+{chr(10).join([f"- {t['description']}: {t['frequency']} gange, gennemsnit {t['average_amount']} DKK, seneste datoer: {', '.join(t['dates'])}" for t in summaries[:MAX_PROMPT_GROUPS]])}
+
+Returner JSON format:
+[
+  {{
+    "original_description": "SPLICE.COM* CREATOR",
+    "clean_name": "Splice",
+    "is_subscription": true,
+    "confidence": 95,
+    "category": "Software & Værktøjer",
+    "frequency": "måned",
+    "next_renewal_date": "2024-02-15",
+    "reasoning": "Kendt musik-software abonnement med regelmæssige månedlige betalinger"
+  }}
+]
+
+Vigtige regler:
+- Rens virksomhedsnavne: fjern .COM, *, CREATOR osv. og gør dem læselige
+- Beregn næste fornyelsesdato baseret på frekvens og seneste betaling
+- Fokuser på danske tjenester og vær konservativ
+- Kun klassificer som abonnement hvis du er sikker
+"""
+
+def parse_ai_json(ai_response: str) -> List[Dict[str, Any]]:
+    """JSON array from a model reply, tolerating prose around it; [] if none is found"""
+    try:
+        return json.loads(ai_response)
+    except json.JSONDecodeError as e:
+        logger.warning("OpenAI analysis response is not valid JSON", extra={"error": str(e)})
+    # Try to extract JSON from response
+    json_match = re.search(r'\[.*\]', ai_response, re.DOTALL)
+    if json_match:
+        try:
+            return json.loads(json_match.group())
+        except json.JSONDecodeError:
+            logger.warning("Failed to parse extracted JSON from OpenAI analysis response")
+            return []
+    logger.warning("No JSON array found in OpenAI analysis response")
+    log_payload(logger, "Unparseable OpenAI analysis response", ai_response, sample_rate=1.0)
+    return []
+
+async def classify_groups(summaries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Ask the model which summarized groups are subscriptions"""
+    try:
+        with span("openai", "analyze_transactions"):
+            response = await resources.openai.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": build_prompt(summaries)}
+                ],
+                temperature=0.1,
+                max_tokens=2000
+            )
+        ai_response = response.choices[0].message.content
+        log_payload(logger, "OpenAI analysis response", ai_response)
+    except Exception as e:
+        logger.error("OpenAI analysis call failed", extra={"error": str(e)})
+        raise DetectionError(str(e)) from e
+    return parse_ai_json(ai_response)
+
+# ========== RESULTS ==========
+
+def to_subscriptions(ai_results: List[Dict[str, Any]], recurring_groups: Dict[str, List[Dict[str, Any]]],
+                     source: str = "tink") -> List[Dict[str, Any]]:
+    """Detected subscriptions in the shape the app imports"""
+    detected = []
+    for result in ai_results:
+        if not result.get("is_subscription", False) or result.get("confidence", 0) < MIN_CONFIDENCE:
+            continue
+        # Use original_description to find the transaction group, but clean_name for display
+        original_desc = result.get("original_description", result.get("description", ""))
+        txs = recurring_groups.get(original_desc)
+        if not txs:
+            continue
+        clean_name = result.get("clean_name", clean_description(original_desc))
+
+        amounts = [a for a in (transaction_amount(tx) for tx in txs) if a is not None]
+        sorted_dates = sorted(d for d in (transaction_booked_date(tx) for tx in txs) if d)
+        if not amounts or not sorted_dates:
+            continue
+
+        # Use AI-provided next_renewal_date if available, otherwise calculate
+        if result.get("next_renewal_date"):
+            renewal_date = result["next_renewal_date"]
+        else:
+            last_date = parse_date(sorted_dates[-1])
+            renewal_date = next_renewal(last_date, result.get("frequency", "måned"), date.today()).isoformat()
+
+        detected.append({
+            "name": clean_name,
+            "amount": round(sum(amounts) / len(amounts), 2),
+            "category": result.get("category", "Øvrige"),
+            "frequency": result.get("frequency", "måned"),
+            "confidence": result.get("confidence", MIN_CONFIDENCE),
+            "renewal_date": renewal_date,
+            "transaction_date": sorted_dates[-1],  # Most recent transaction date
+            "reasoning": result.get("reasoning", "AI detected subscription"),
+            "source": source
+        })
+    return detected
+
+async def detect_subscriptions(transactions: List[Dict[str, Any]], source: str = "tink") -> List[Dict[str, Any]]:
+    """Group, classify and convert Tink transactions; shared by the API and the sync worker"""
+    # Clustering is pure Python and takes seconds for large histories; keep it off the event loop
+    recurring_groups = await asyncio.to_thread(group_recurring, transactions)
+    if not recurring_groups:
+        return []
+    summaries = summarize_groups(recurring_groups)
+    ai_results = await classify_groups(summaries)
+    return to_subscriptions(ai_results, recurring_groups, source)
@@ -0,0 +1,108 @@
+"""Size-bounded file caches on disk, shared by the logo and PDF statement caches.
+
+A DiskLRU keeps one file per suffix for each key ("<key>.<suffix>") in
+one directory. An in-memory index of the directory is built on first
+use, so a miss costs no disk access. A key written by another worker
+after that is picked up with a stat. Files are written under a
+temporary name and renamed, so readers never see a partial file. The
+least recently used keys are evicted to stay under max_bytes, counting
+the first suffix's file. With a ttl, keys written more than ttl seconds
+ago are dropped when read. The last use is kept in the first file's
+access time and the write time in its modification time, so both
+survive a restart.
+
+Callers use it from worker threads (asyncio.to_thread), so a lock
+serializes the index and the files behind it.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+class DiskLRU:
+    def __init__(self, directory: str, max_bytes: int, ttl: float = 0, suffixes: Sequence[str] = ("bin",),
+                 private: bool = False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.suffixes = tuple(suffixes)
+        # Private: directory 0o700 and files 0o600, so only the server user can read them
+        self.private = private
+        # key -> (written at, size), least recently used first
+        self._index: Optional["OrderedDict[str, Tuple[float, int]]"] = None
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{key}.{suffix}")
+
+    def _load_index(self) -> "OrderedDict[str, Tuple[float, int]]":
+        if self._index is None:
+            os.makedirs(self.directory, mode=0o700 if self.private else 0o777, exist_ok=True)
+            ending = f".{self.suffixes[0]}"
+            files = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(ending):
+                    stat = entry.stat()
+                    files.append((stat.st_atime, entry.name[:-len(ending)], stat.st_mtime, stat.st_size))
+            self._index = OrderedDict((key, (written, size)) for _, key, written, size in sorted(files))
+            self._total = sum(size for _, size in self._index.values())
+        return self._index
+
+    def get(self, key: str) -> Optional[Dict[str, bytes]]:
+        """Contents of the key's files by suffix, refreshing its LRU position; None if missing or expired"""
+        with self._lock:
+            index = self._load_index()
+            if key not in index:
+                try:
+                    stat = os.stat(self._path(key, self.suffixes[0]))
+                except OSError:
+                    return None
+                self._total += stat.st_size
+                index[key] = (stat.st_mtime, stat.st_size)
+            written = index[key][0]
+            if self.ttl and written + self.ttl < time.time():
+                self._discard(key)
+                return None
+            try:
+                files = {}
+                for suffix in self.suffixes:
+                    with open(self._path(key, suffix), "rb") as f:
+                        files[suffix] = f.read()
+                os.utime(self._path(key, self.suffixes[0]), (time.time(), written))
+            except OSError:
+                self._discard(key)
+                return None
+            index.move_to_end(key)
+            return files
+
+    def put(self, key: str, files: Dict[str, bytes]) -> None:
+        """Write one file per suffix, evicting the least recently used keys; raises OSError"""
+        with self._lock:
+            index = self._load_index()
+            # The first suffix goes last: once it exists, a worker that stats it finds the others too
+            for suffix in reversed(self.suffixes):
+                tmp = self._path(key, f"{suffix}.tmp")
+                fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600 if self.private else 0o666)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(files[suffix])
+                os.replace(tmp, self._path(key, suffix))
+            size = len(files[self.suffixes[0]])
+            self._total += size - index.pop(key, (0, 0))[1]
+            index[key] = (time.time(), size)
+            while self._total > self.max_bytes and len(index) > 1:
+                self._discard(next(iter(index)))
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key: str) -> None:
+        index = self._load_index()
+        self._total -= index.pop(key, (0, 0))[1]
+        for suffix in self.suffixes:
+            try:
+                os.remove(self._path(key, suffix))
+            except OSError:
+                pass
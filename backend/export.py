@@ -0,0 +1,140 @@
+"""Streaming export of a user's data as CSV, JSON or NDJSON.
+
+The export includes subscriptions (deleted and archived ones too),
+stored bank transactions and notification preferences. Subscriptions and
+transactions are read in keyset pages, `id > last id ORDER BY id`, of
+EXPORT_PAGE_SIZE rows. Each page is serialized and handed to the
+response before the next one is read. Memory use therefore depends on
+the page size and not on how much history the user has.
+"""
+import io
+import os
+import csv
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+from logging_config import get_logger
+from responses import dumps
+from supabase_client import (
+    get_archived_subscriptions_page, get_subscriptions_page, get_transactions_page, get_user_notification_preferences
+)
+
+load_dotenv()
+
+logger = get_logger("export")
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", 500))
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+}
+
+SUBSCRIPTION_COLUMNS = (
+    "id", "title", "amount", "currency", "category", "frequency", "renewal_date", "transaction_date",
+    "logo_url", "source", "confidence_score", "is_active", "notes", "created_at", "updated_at",
+)
+ARCHIVED_SUBSCRIPTION_COLUMNS = SUBSCRIPTION_COLUMNS + ("archived_at",)
+TRANSACTION_COLUMNS = (
+    "id", "external_id", "account_id", "merchant_key", "description", "amount", "currency",
+    "booked_date", "subscription_id", "created_at",
+)
+PREFERENCE_COLUMNS = (
+    "id", "subscription_id", "notification_type", "is_enabled", "days_before_renewal", "created_at", "updated_at",
+)
+
+# CSV puts every record type in one table, so its header is the union of the columns
+CSV_COLUMNS = ("record_type",) + tuple(dict.fromkeys(
+    ARCHIVED_SUBSCRIPTION_COLUMNS + TRANSACTION_COLUMNS + PREFERENCE_COLUMNS))
+
+Page = List[Dict[str, Any]]
+
+async def keyset_pages(fetch_page: Callable[[int, int, int], Awaitable[Page]], owner_id: int,
+                       page_size: int = EXPORT_PAGE_SIZE) -> AsyncIterator[Page]:
+    """Pages from fetch_page(owner_id, after_id, limit) until a short page"""
+    after_id = 0
+    while True:
+        page = await fetch_page(owner_id, after_id, page_size)
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        after_id = page[-1]["id"]
+
+async def _preference_pages(user_id: int, page_size: int) -> AsyncIterator[Page]:
+    # At most one row per notification type and subscription; read in one go
+    yield await get_user_notification_preferences(user_id)
+
+# (section name, record type, columns, page source)
+SECTIONS = (
+    ("subscriptions", "subscription", SUBSCRIPTION_COLUMNS,
+     lambda user_id, page_size: keyset_pages(get_subscriptions_page, user_id, page_size)),
+    ("archived_subscriptions", "archived_subscription", ARCHIVED_SUBSCRIPTION_COLUMNS,
+     lambda user_id, page_size: keyset_pages(get_archived_subscriptions_page, user_id, page_size)),
+    ("transactions", "transaction", TRANSACTION_COLUMNS,
+     lambda user_id, page_size: keyset_pages(get_transactions_page, user_id, page_size)),
+    ("notification_preferences", "notification_preference", PREFERENCE_COLUMNS, _preference_pages),
+)
+
+def _project(row: Dict[str, Any], columns: Tuple[str, ...]) -> Dict[str, Any]:
+    return {column: row.get(column) for column in columns}
+
+async def _records(user_id: int, page_size: int) -> AsyncIterator[Tuple[str, Page]]:
+    """(record type, rows trimmed to the section's columns) for every page of every section"""
+    for _, record_type, columns, pages in SECTIONS:
+        async for page in pages(user_id, page_size):
+            yield record_type, [_project(row, columns) for row in page]
+
+# ========== FORMATS ==========
+
+async def _ndjson(user_id: int, page_size: int) -> AsyncIterator[bytes]:
+    async for record_type, rows in _records(user_id, page_size):
+        yield b"".join(dumps({"record_type": record_type, **row}) + b"\n" for row in rows)
+
+async def _json(user_id: int, page_size: int) -> AsyncIterator[bytes]:
+    yield b'{"exported_at":' + dumps(datetime.now(timezone.utc).isoformat())
+    for section, _, columns, pages in SECTIONS:
+        opening = b',"' + section.encode() + b'":['
+        separator = opening
+        async for page in pages(user_id, page_size):
+            yield separator + b",".join(dumps(_project(row, columns)) for row in page)
+            separator = b","
+        # An empty section still gets its (empty) array
+        yield (opening if separator is opening else b"") + b"]"
+    yield b"}"
+
+def _csv_chunk(record_type: str, rows: Page, header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS, extrasaction="ignore")
+    if header:
+        writer.writeheader()
+    for row in rows:
+        writer.writerow({"record_type": record_type, **row})
+    return buffer.getvalue().encode("utf-8")
+
+async def _csv(user_id: int, page_size: int) -> AsyncIterator[bytes]:
+    # Byte order mark so spreadsheet apps read æøå as UTF-8
+    yield "\ufeff".encode("utf-8") + _csv_chunk("", [], header=True)
+    async for record_type, rows in _records(user_id, page_size):
+        yield _csv_chunk(record_type, rows)
+
+WRITERS = {"csv": _csv, "json": _json, "ndjson": _ndjson}
+
+async def stream_export(user_id: int, export_format: str, page_size: int = EXPORT_PAGE_SIZE) -> AsyncIterator[bytes]:
+    """Export body in chunks of one page each"""
+    chunks = bytes_sent = 0
+    try:
+        async for chunk in WRITERS[export_format](user_id, page_size):
+            chunks += 1
+            bytes_sent += len(chunk)
+            yield chunk
+    except Exception as e:
+        # Headers are already sent; aborting the response is the only way to tell the client
+        logger.error("Export failed", extra={"user_id": user_id, "format": export_format, "chunks": chunks,
+                                             "error": str(e)})
+        raise
+    logger.info("Export finished", extra={"user_id": user_id, "format": export_format, "chunks": chunks,
+                                          "bytes": bytes_sent})
@@ -0,0 +1,187 @@
+"""Idempotency keys and single-flight request coalescing.
+
+A client retrying a POST sends the same Idempotency-Key header. The first
+successful response is stored for IDEMPOTENCY_TTL_SECONDS under
+(user, endpoint, key), and later requests with that key get the stored
+response back instead of running again. A stored key reused with a
+different body is rejected with 422, as is a key longer than
+IDEMPOTENCY_KEY_MAX_LENGTH.
+
+Identical requests that are in flight at the same time share a single
+computation. `coalesce` applies this by request fingerprint, even when
+no key is sent, so duplicate analysis requests make one OpenAI call.
+
+Responses are kept in process memory unless IDEMPOTENCY_REDIS_URL is set
+and redis is installed. With Redis, a key that another worker is still
+processing gets a 409.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+
+from logging_config import get_logger
+from responses import FastJSONResponse, dumps
+
+load_dotenv()
+
+logger = get_logger("idempotency")
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", 24 * 3600))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", 10000))
+IDEMPOTENCY_REDIS_URL = os.getenv("IDEMPOTENCY_REDIS_URL")
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# A claim older than this belongs to a worker that died mid-request
+IDEMPOTENCY_LOCK_SECONDS = 300
+
+def fingerprint(payload: Any) -> str:
+    """Stable hash of a request body (JSON-able data or raw bytes)"""
+    data = payload if isinstance(payload, bytes) else dumps(jsonable_encoder(payload))
+    return hashlib.sha256(data).hexdigest()
+
+# ========== SINGLE FLIGHT ==========
+
+class SingleFlight:
+    """Concurrent calls with the same key share one execution of the coroutine"""
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Result of fn() and whether it was shared with an earlier caller"""
+        task = self._calls.get(key)
+        shared = task is not None
+        if task is None:
+            # A task, so a disconnecting first caller does not cancel the others
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task), shared
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+# ========== STORES ==========
+
+class MemoryStore:
+    """Stored responses in this worker's memory, oldest evicted first"""
+
+    def __init__(self, max_entries: int = IDEMPOTENCY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, record = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        return record
+
+    async def claim(self, key: str) -> bool:
+        # Same-worker duplicates are coalesced by SingleFlight instead
+        return True
+
+    async def put(self, key: str, record: Dict[str, Any], ttl: int) -> None:
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + ttl, record)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def release(self, key: str) -> None:
+        pass
+
+    async def close(self) -> None:
+        self._entries.clear()
+
+class RedisStore:
+    """Stored responses shared by all workers, with a claim marker while a request runs"""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis_asyncio
+        self._client = redis_asyncio.from_url(url)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = await self._client.get(f"idem:{key}")
+        return json.loads(raw) if raw else None
+
+    async def claim(self, key: str) -> bool:
+        return bool(await self._client.set(f"idem:lock:{key}", "1", nx=True, ex=IDEMPOTENCY_LOCK_SECONDS))
+
+    async def put(self, key: str, record: Dict[str, Any], ttl: int) -> None:
+        await self._client.set(f"idem:{key}", dumps(record), ex=ttl)
+
+    async def release(self, key: str) -> None:
+        await self._client.delete(f"idem:lock:{key}")
+
+    async def close(self) -> None:
+        await self._client.close()
+
+def create_store() -> Any:
+    if IDEMPOTENCY_REDIS_URL:
+        try:
+            return RedisStore(IDEMPOTENCY_REDIS_URL)
+        except ImportError:
+            logger.warning("IDEMPOTENCY_REDIS_URL set but redis is not installed; using in-memory idempotency store")
+    return MemoryStore()
+
+# ========== API ==========
+
+class Idempotency:
+    def __init__(self, store: Any):
+        self.store = store
+        self.flights = SingleFlight()
+
+    async def run(self, idempotency_key: Optional[str], user_id: int, endpoint: str, payload: Any,
+                  compute: Callable[[], Awaitable[Any]]) -> Any:
+        """compute() once per (user, endpoint, key); without a key it just runs"""
+        if not idempotency_key:
+            return await compute()
+        if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(status_code=422, detail="Idempotency-Key is too long")
+
+        key = f"{user_id}:{endpoint}:{idempotency_key}"
+        body_hash = fingerprint(payload)
+        stored = await self.store.get(key)
+        if stored is None:
+            stored, shared = await self.flights.do(key, lambda: self._compute_and_store(key, body_hash, compute))
+            if not shared:
+                return stored["response"]
+        if stored["fingerprint"] != body_hash:
+            raise HTTPException(status_code=422,
+                                detail="Idempotency-Key was already used with a different request body")
+        logger.info("Idempotent replay", extra={"endpoint": endpoint, "user_id": user_id})
+        return FastJSONResponse(stored["response"], headers={"Idempotent-Replayed": "true"})
+
+    async def _compute_and_store(self, key: str, body_hash: str, compute: Callable[[], Awaitable[Any]]) -> Dict[str, Any]:
+        if not await self.store.claim(key):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail="A request with this Idempotency-Key is still being processed")
+        try:
+            response = jsonable_encoder(await compute())
+            record = {"fingerprint": body_hash, "response": response}
+            await self.store.put(key, record, IDEMPOTENCY_TTL_SECONDS)
+        finally:
+            await self.store.release(key)
+        return record
+
+    async def coalesce(self, user_id: int, endpoint: str, payload: Any, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Share one in-flight compute() between concurrent identical requests from a user"""
+        result, shared = await self.flights.do(f"flight:{user_id}:{endpoint}:{fingerprint(payload)}", compute)
+        if shared:
+            logger.info("Coalesced duplicate request", extra={"endpoint": endpoint, "user_id": user_id})
+        return result
+
+    async def close(self) -> None:
+        await self.store.close()
+
+idempotency = Idempotency(create_store())
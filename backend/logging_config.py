@@ -0,0 +1,200 @@
+import os
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import time
+import uuid
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json or text
+# Fraction of verbose payload logs (raw Tink/OpenAI bodies) that are actually emitted
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", 0.01))
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", 500))
+
+REQUEST_ID_HEADER = "x-request-id"
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# ========== REDACTION ==========
+
+SECRET_KEYS = {
+    "access_token", "refresh_token", "id_token", "client_secret", "code", "token",
+    "authorization", "password", "hashed_password", "api_key", "secret", "expo_push_token",
+}
+REDACTED = "[REDACTED]"
+
+_SECRET_PATTERNS = [
+    (re.compile(r"(?i)(bearer\s+)[A-Za-z0-9._~+/=-]+"), r"\1" + REDACTED),
+    # JWTs and similar three-part tokens
+    (re.compile(r"\beyJ[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]*"), REDACTED),
+    (re.compile(r"(?i)\b(access_token|refresh_token|client_secret|password|api_key)(['\"]?\s*[:=]\s*['\"]?)[^'\"&\s,}]+"), r"\1\2" + REDACTED),
+    (re.compile(r"\bsk-[A-Za-z0-9_-]{8,}"), REDACTED),
+]
+
+def redact_text(text: str) -> str:
+    for pattern, replacement in _SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+def redact(value: Any) -> Any:
+    """Recursively mask secret-looking keys and token-shaped strings"""
+    if isinstance(value, dict):
+        return {k: REDACTED if str(k).lower() in SECRET_KEYS else redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        return redact_text(value)
+    return value
+
+class RedactionFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if isinstance(record.msg, str):
+            record.msg = redact_text(record.msg)
+        for key in _extra_keys(record):
+            setattr(record, key, redact({key: getattr(record, key)})[key])
+        return True
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+# ========== FORMATTING ==========
+
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+def _extra_keys(record: logging.LogRecord):
+    return [k for k in vars(record) if k not in _STANDARD_ATTRS]
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key in _extra_keys(record):
+            entry[key] = getattr(record, key)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        extras = {k: getattr(record, k) for k in _extra_keys(record)}
+        return f"{text} {json.dumps(extras, ensure_ascii=False, default=str)}" if extras else text
+
+# ========== SETUP ==========
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """Route the "subtrack" loggers through a queue so request handlers never block on stdout"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # Filters run on the calling thread so the request id is captured before the hand-off
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(RedactionFilter())
+
+    root = logging.getLogger("subtrack")
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+def shutdown_logging() -> None:
+    """Flush queued records; safe to call more than once"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"subtrack.{name}")
+
+def log_payload(logger: logging.Logger, message: str, payload: Any, sample_rate: float = LOG_PAYLOAD_SAMPLE_RATE) -> None:
+    """Emit a sampled, truncated DEBUG record for a verbose payload.
+
+    Returns before touching the payload unless DEBUG is enabled and the sample hits.
+    """
+    if not logger.isEnabledFor(logging.DEBUG) or random.random() >= sample_rate:
+        return
+    text = payload if isinstance(payload, str) else json.dumps(redact(payload), ensure_ascii=False, default=str)
+    logger.debug(message, extra={"payload": text[:LOG_PAYLOAD_MAX_CHARS], "payload_chars": len(text)})
+
+# ========== REQUEST CONTEXT ==========
+
+class RequestContextMiddleware:
+    """Assigns a correlation id per request and writes one access log line"""
+
+    def __init__(self, app, logger: Optional[logging.Logger] = None):
+        self.app = app
+        self.logger = logger or get_logger("access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == REQUEST_ID_HEADER.encode():
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(REQUEST_ID_HEADER.encode(), request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info(
+                    "request",
+                    extra={
+                        "method": scope.get("method"),
+                        "path": scope.get("path"),
+                        "status": status_code,
+                        "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                    },
+                )
+            request_id_var.reset(token)
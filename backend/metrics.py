@@ -0,0 +1,239 @@
+import time
+import functools
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Seconds; spans from sub-millisecond cache hits up to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    """Updates hold the metric's lock: spans also finish in worker threads (asyncio.to_thread)"""
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, labels: LabelValues = (), amount: float = 1.0) -> None:
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self.values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.label_names, k)} {v}" for k, v in values]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: LabelValues = (), amount: float = 1.0) -> None:
+        self.inc(labels, -amount)
+
+    def set(self, labels: LabelValues, value: float) -> None:
+        with self._lock:
+            self.values[labels] = value
+
+class _HistogramSeries:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, n_buckets: int):
+        self.counts = [0] * (n_buckets + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+        self.series: Dict[LabelValues, _HistogramSeries] = {}
+
+    def labels(self, labels: LabelValues) -> _HistogramSeries:
+        series = self.series.get(labels)
+        if series is None:
+            with self._lock:
+                series = self.series.setdefault(labels, _HistogramSeries(len(self.buckets)))
+        return series
+
+    def observe(self, labels: LabelValues, value: float) -> None:
+        self.observe_series(self.labels(labels), value)
+
+    def observe_series(self, series: _HistogramSeries, value: float) -> None:
+        # Non-cumulative bucket counts; cumulated at render time
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            series.counts[bucket] += 1
+            series.sum += value
+            series.count += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = [(labels, list(series.counts), series.sum, series.count) for labels, series in self.series.items()]
+        lines = self.header()
+        for labels, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, count_in_bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count_in_bucket
+                le = 'le="%s"' % ("+Inf" if bound == float("inf") else repr(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# ========== BUILT-IN METRICS ==========
+
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by handler", ("method", "handler", "status")))
+http_requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served"))
+dependency_duration = registry.register(Histogram(
+    "dependency_call_duration_seconds", "Latency of calls to JWT, Supabase, Tink, OpenAI and PDF parsing",
+    ("dependency", "operation")))
+dependency_errors = registry.register(Counter(
+    "dependency_call_errors_total", "Dependency calls that raised", ("dependency", "operation")))
+dependency_in_flight = registry.register(Gauge(
+    "dependency_calls_in_flight", "Dependency calls currently running", ("dependency",)))
+
+# ========== SPANS ==========
+
+class Span:
+    """Times one dependency call; label lookups are resolved once at construction.
+
+    Spans hold no per-call state (start() returns the start time), so one
+    instance can be shared by concurrent coroutines.
+    """
+
+    __slots__ = ("series", "labels", "dependency_key")
+
+    def __init__(self, dependency: str, operation: str):
+        self.labels = (dependency, operation)
+        self.dependency_key = (dependency,)
+        self.series = dependency_duration.labels(self.labels)
+
+    def start(self) -> float:
+        dependency_in_flight.inc(self.dependency_key)
+        return time.perf_counter()
+
+    def finish(self, started: float, failed: bool = False) -> None:
+        dependency_duration.observe_series(self.series, time.perf_counter() - started)
+        dependency_in_flight.dec(self.dependency_key)
+        if failed:
+            dependency_errors.inc(self.labels)
+
+class _ActiveSpan:
+    __slots__ = ("span", "started")
+
+    def __init__(self, span: Span):
+        self.span = span
+
+    def __enter__(self):
+        self.started = self.span.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.finish(self.started, exc_type is not None)
+        return False
+
+_spans: Dict[Tuple[str, str], Span] = {}
+
+def span(dependency: str, operation: str) -> _ActiveSpan:
+    """`with span("tink", "accounts"):` times the block and counts exceptions"""
+    key = (dependency, operation)
+    s = _spans.get(key)
+    if s is None:
+        s = _spans[key] = Span(dependency, operation)
+    return _ActiveSpan(s)
+
+def instrument(dependency: str, operation: Optional[str] = None):
+    """Decorator timing an async function as a dependency call"""
+    def decorator(func):
+        s = Span(dependency, operation or func.__name__)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = s.start()
+            try:
+                result = await func(*args, **kwargs)
+            except BaseException:
+                s.finish(started, True)
+                raise
+            s.finish(started)
+            return result
+        return wrapper
+    return decorator
+
+# ========== HTTP MIDDLEWARE ==========
+
+class MetricsMiddleware:
+    """Records per-handler latency and in-flight requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_requests_in_flight.dec()
+            # Label by endpoint function rather than raw path to keep cardinality bounded
+            endpoint = scope.get("endpoint")
+            handler = getattr(endpoint, "__name__", "unmatched")
+            http_request_duration.observe((scope.get("method", ""), handler, str(status_code)), elapsed)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -24,12 +24,20 @@ class UserInDB(UserBase):
     class Config:
         from_attributes = True
 
+class CurrentUser(BaseModel):
+    """Authenticated user as carried in the access token claims"""
+    id: int
+    email: str
+    is_active: bool = True
+
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None  # Access token lifetime in seconds
 
-class TokenData(BaseModel):
-    email: Optional[str] = None
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
 
 # ----------- SUBSCRIPTIONS -----------
 
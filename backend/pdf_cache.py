@@ -0,0 +1,201 @@
+"""Caches for uploaded PDF statements.
+
+Uploads are hashed (SHA-256) chunk by chunk while they are read. The
+extracted text and, once done, the analysis of each document are kept on
+disk under that hash, so a re-uploaded statement is answered without
+PyPDF2 or OpenAI. An in-memory index of the directory finds entries
+without touching the disk on a miss. Entries expire
+PDF_CACHE_TTL_SECONDS after they were written, and the least recently
+used are evicted to stay under PDF_CACHE_MAX_BYTES. Files are only
+readable by the server user. They aren't tied to an account, so the TTL
+is what bounds how long statement text stays on disk.
+
+Overlapping statements (consecutive months, a re-export of the same
+period) share transaction lines but not bytes. What the model concluded
+about each dated line is remembered per user for PDF_LINE_CACHE_TTL_SECONDS.
+Merchants that only appear on known lines reuse those results. Only the
+lines of merchants with a new line go to the model, together with that
+merchant's known lines so recurring charges are still seen as recurring.
+"""
+import os
+import re
+import json
+import hashlib
+import tempfile
+import datetime as dt
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from companies import TTLCache
+from cost_model import next_renewal
+from detection import descriptor_key
+from disk_cache import DiskLRU
+from logging_config import get_logger
+from metrics import Counter, registry
+
+load_dotenv()
+
+logger = get_logger("pdf_cache")
+
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(tempfile.gettempdir(), "subtrack-statements"))
+PDF_CACHE_TTL_SECONDS = int(os.getenv("PDF_CACHE_TTL_SECONDS", 24 * 3600))
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+PDF_LINE_CACHE_SIZE = int(os.getenv("PDF_LINE_CACHE_SIZE", 100000))
+PDF_LINE_CACHE_TTL_SECONDS = int(os.getenv("PDF_LINE_CACHE_TTL_SECONDS", 35 * 24 * 3600))
+PDF_READ_CHUNK_BYTES = 64 * 1024
+
+DATE_PATTERN = re.compile(r"(\d{1,2}[./-]\d{1,2}[./-]\d{2,4})")
+
+pdf_cache_lookups = registry.register(Counter(
+    "pdf_analysis_cache_total", "PDF analyses by what the caches could answer", ("result",)))
+
+async def read_upload(file: Any) -> Tuple[bytes, str]:
+    """Body of an UploadFile and its SHA-256 hex digest, hashed as it is read"""
+    digest, chunks = hashlib.sha256(), []
+    while chunk := await file.read(PDF_READ_CHUNK_BYTES):
+        digest.update(chunk)
+        chunks.append(chunk)
+    return b"".join(chunks), digest.hexdigest()
+
+# ========== DOCUMENTS ==========
+
+class StatementCache:
+    """Text and analysis per document hash, one JSON file each, expired by age and LRU-evicted by size"""
+
+    def __init__(self, directory: str = PDF_CACHE_DIR, ttl: int = PDF_CACHE_TTL_SECONDS,
+                 max_bytes: int = PDF_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.files = DiskLRU(directory, max_bytes, ttl=ttl, suffixes=("json",), private=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """{text, result} stored for a digest (result None until the analysis finished)"""
+        if not self.enabled:
+            return None
+        try:
+            files = self.files.get(key)
+        except OSError as e:
+            logger.warning("PDF cache unavailable", extra={"error": str(e)})
+            return None
+        if files is None:
+            return None
+        try:
+            return json.loads(files["json"])
+        except ValueError:
+            self.files.discard(key)
+            return None
+
+    def put(self, key: str, text: str, result: Optional[Dict[str, Any]] = None) -> None:
+        """Store an entry; failures are logged, never raised, since the cache is only a shortcut"""
+        if not self.enabled:
+            return
+        data = json.dumps({"text": text, "result": result}, ensure_ascii=False).encode()
+        try:
+            self.files.put(key, {"json": data})
+        except OSError as e:
+            logger.warning("PDF cache write failed", extra={"error": str(e)})
+
+# ========== LINE ITEMS ==========
+
+def _parse_date(value: str) -> Optional[dt.datetime]:
+    normalized = value.replace(".", "/").replace("-", "/")
+    for fmt in ("%d/%m/%Y", "%d/%m/%y"):
+        try:
+            return dt.datetime.strptime(normalized, fmt)
+        except ValueError:
+            pass
+    return None
+
+def statement_lines(text: str) -> List[Dict[str, Any]]:
+    """Dated lines of a statement: {text, description (line without the date), date, merchant, end}.
+
+    `end` is the offset in `text` just past the line, to tell which lines a cut-off prompt still holds.
+    """
+    lines, end = [], 0
+    for raw in text.splitlines(keepends=True):
+        line, end = raw.rstrip("\r\n"), end + len(raw)
+        match = DATE_PATTERN.search(line)
+        if not match:
+            continue
+        date = _parse_date(match.group(1))
+        if date is None:
+            continue
+        description = line.replace(match.group(1), "").strip()
+        lines.append({"text": " ".join(line.split()), "description": description, "date": date,
+                      "merchant": descriptor_key(description), "end": end - len(raw) + len(line)})
+    return lines
+
+def statement_prompt(text: str, lines: List[Dict[str, Any]], to_classify: List[Dict[str, Any]],
+                     limit: int) -> Tuple[str, List[Dict[str, Any]]]:
+    """Statement text for the model, cut at `limit`, and the lines of `to_classify` it holds in full.
+
+    That is the whole statement when every line is new, else only the new lines.
+    """
+    if len(to_classify) == len(lines):
+        return text[:limit], [line for line in lines if line["end"] <= limit]
+    sent, length = [], -1
+    for line in to_classify:
+        length += len(line["text"]) + 1
+        if length > limit:
+            break
+        sent.append(line)
+    return "\n".join(line["text"] for line in to_classify)[:limit], sent
+
+def result_merchant(result: Dict[str, Any]) -> str:
+    return descriptor_key(result.get("original_description") or result.get("description") or "")
+
+def matches(result_key: str, line: Dict[str, Any]) -> bool:
+    """Whether a model result (by its merchant key) is about this line"""
+    return bool(result_key) and (line["merchant"] == result_key or f" {result_key} " in f" {line['merchant']} ")
+
+class LineItemCache:
+    """Model results per (user, statement line); lines the model saw but didn't list are stored as {}"""
+
+    def __init__(self, max_entries: int = PDF_LINE_CACHE_SIZE, ttl: float = PDF_LINE_CACHE_TTL_SECONDS):
+        self._lines = TTLCache(max_entries, ttl)
+
+    @staticmethod
+    def key(user_id: int, line: Dict[str, Any]) -> str:
+        return hashlib.sha256(f"{user_id}:{line['text']}".encode()).hexdigest()[:32]
+
+    def lookup(self, user_id: int, lines: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+        """Known lines by position in `lines`"""
+        known = {}
+        for i, line in enumerate(lines):
+            result = self._lines.get(self.key(user_id, line))
+            if result is not None:
+                known[i] = result
+        return known
+
+    def remember(self, user_id: int, lines: Iterable[Dict[str, Any]], results: List[Dict[str, Any]]) -> None:
+        keyed = [(result_merchant(r), r) for r in results if isinstance(r, dict)]
+        for line in lines:
+            result = next((r for key, r in keyed if matches(key, line)), {})
+            self._lines.put(self.key(user_id, line), result)
+
+    def plan(self, user_id: int, lines: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Lines the model still has to see, and results reused for every other merchant.
+
+        Reused results get a next_renewal_date from the merchant's latest line in this statement.
+        """
+        known = self.lookup(user_id, lines)
+        new_merchants = {line["merchant"] for i, line in enumerate(lines) if i not in known}
+        to_classify = [line for line in lines if line["merchant"] in new_merchants]
+        reused: Dict[str, Dict[str, Any]] = {}
+        for i, result in known.items():
+            if not result or lines[i]["merchant"] in new_merchants:
+                continue
+            key = result_merchant(result)
+            if key in reused:
+                continue
+            last = max(line["date"] for line in lines if matches(key, line) or line is lines[i])
+            reused[key] = {**result, "next_renewal_date": next_renewal(
+                last.date(), result.get("frequency", "måned"), dt.date.today()).isoformat()}
+        return to_classify, list(reused.values())
+
+statements = StatementCache()
+line_items = LineItemCache()
@@ -0,0 +1,64 @@
+"""Periodic background jobs.
+
+Every API process runs a few jobs on a fixed interval (token refresh,
+replica health, account deletion, webhook processing, archival, cancel
+link checks). PeriodicJob is their shared loop: the first pass starts
+after a random delay of up to `max_jitter` seconds, so several workers
+started together don't run in lockstep; a pass that fails is logged and
+the next one runs on schedule; stop() cancels the task on shutdown.
+"""
+import asyncio
+import logging
+import random
+from typing import Any, Awaitable, Callable, Optional
+
+class PeriodicJob:
+    def __init__(self, run: Callable[[], Awaitable[Any]], logger: logging.Logger, failure_message: str,
+                 max_jitter: float = 60):
+        self.run = run
+        self.logger = logger
+        self.failure_message = failure_message
+        self.max_jitter = max_jitter
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def _loop(self, interval: float) -> None:
+        await asyncio.sleep(random.uniform(0, min(interval, self.max_jitter)))
+        while True:
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(self.failure_message, extra={"error": str(e)})
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start(self, interval: float) -> None:
+        """Run every `interval` seconds; 0 or less leaves the job off (e.g. on all but one worker)"""
+        if interval <= 0 or self._task is not None:
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._loop(interval))
+
+    def wake(self) -> None:
+        """Run the next pass now instead of at the end of the interval"""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+            self._wake = None
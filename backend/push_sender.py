@@ -0,0 +1,57 @@
+import os
+import asyncio
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+
+from logging_config import get_logger
+from metrics import span
+from resources import resources
+
+load_dotenv()
+
+logger = get_logger("push")
+
+# Expo accepts at most 100 messages per request
+EXPO_PUSH_BATCH_SIZE = 100
+EXPO_PUSH_CONCURRENCY = int(os.getenv("EXPO_PUSH_CONCURRENCY", 4))
+EXPO_ACCESS_TOKEN = os.getenv("EXPO_ACCESS_TOKEN")
+EXPO_PUSH_PATH = "/--/api/v2/push/send"
+
+async def _send_batch(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    headers = {"Accept": "application/json"}
+    if EXPO_ACCESS_TOKEN:
+        headers["Authorization"] = f"Bearer {EXPO_ACCESS_TOKEN}"
+    try:
+        with span("expo", "push_send"):
+            response = await resources.push_http.post(EXPO_PUSH_PATH, json=batch, headers=headers)
+        response.raise_for_status()
+        tickets = response.json().get("data", [])
+    except Exception as e:
+        logger.error("Push batch failed", extra={"messages": len(batch), "error": str(e)})
+        return [{"status": "error", "message": str(e), "details": {"error": "BatchFailed"}}] * len(batch)
+    if len(tickets) != len(batch):
+        logger.warning("Push ticket count mismatch", extra={"messages": len(batch), "tickets": len(tickets)})
+        tickets = (tickets + [{"status": "error", "details": {"error": "MissingTicket"}}] * len(batch))[:len(batch)]
+    return tickets
+
+async def send_push_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Send Expo push messages in batches of 100; returns one ticket per message, in order"""
+    if not messages:
+        return []
+    semaphore = asyncio.Semaphore(EXPO_PUSH_CONCURRENCY)
+
+    async def limited(batch):
+        async with semaphore:
+            return await _send_batch(batch)
+
+    batches = [messages[i:i + EXPO_PUSH_BATCH_SIZE] for i in range(0, len(messages), EXPO_PUSH_BATCH_SIZE)]
+    results = await asyncio.gather(*(limited(b) for b in batches))
+    return [ticket for tickets in results for ticket in tickets]
+
+def unregistered_tokens(messages: List[Dict[str, Any]], tickets: List[Dict[str, Any]]) -> List[str]:
+    """Push tokens Expo says belong to uninstalled apps"""
+    return [
+        message["to"] for message, ticket in zip(messages, tickets)
+        if ticket.get("status") == "error" and ticket.get("details", {}).get("error") == "DeviceNotRegistered"
+    ]
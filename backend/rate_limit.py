@@ -0,0 +1,239 @@
+"""Rate limiting and admission control for expensive endpoints.
+
+Each endpoint class (auth, ai, status) has token buckets keyed by client IP and,
+for signed-in requests, by user id. It also has a per-worker concurrency
+semaphore. A request that is over its rate gets an immediate 429. A
+request that cannot get a concurrency slot within ADMISSION_WAIT_SECONDS
+gets a 503. Both responses carry Retry-After, so a burst of imports never
+queues up behind the semaphore and starves cheap endpoints.
+
+Buckets live in process memory unless RATE_LIMIT_REDIS_URL is set and the
+redis package is installed; then all workers share them.
+"""
+import os
+import math
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException, Request, status
+
+from logging_config import get_logger
+from metrics import Counter, registry
+
+load_dotenv()
+
+logger = get_logger("rate_limit")
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+# Only trust X-Forwarded-For behind a proxy that sets it
+TRUST_PROXY_HEADERS = os.getenv("TRUST_PROXY_HEADERS", "false").lower() == "true"
+# How long a request may wait for a concurrency slot before getting a 503
+ADMISSION_WAIT_SECONDS = float(os.getenv("ADMISSION_WAIT_SECONDS", 0.25))
+# Idle buckets kept in memory per worker
+MAX_TRACKED_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+
+rate_limit_rejections = registry.register(Counter(
+    "rate_limit_rejections_total", "Requests rejected by rate limiting or admission control", ("endpoint_class", "reason")))
+
+class LimitRule:
+    """Token bucket refilling `per_minute` tokens a minute, holding at most `burst`"""
+    __slots__ = ("per_minute", "burst")
+
+    def __init__(self, per_minute: float, burst: int):
+        self.per_minute = per_minute
+        self.burst = burst
+
+    @property
+    def rate(self) -> float:
+        return self.per_minute / 60.0
+
+def _rule(env_prefix: str, per_minute: float, burst: int) -> Optional[LimitRule]:
+    value = float(os.getenv(f"{env_prefix}_PER_MINUTE", per_minute))
+    return LimitRule(value, int(os.getenv(f"{env_prefix}_BURST", burst))) if value > 0 else None
+
+class EndpointClass:
+    __slots__ = ("name", "per_ip", "per_user", "max_concurrency")
+
+    def __init__(self, name: str, per_ip: Optional[LimitRule], per_user: Optional[LimitRule], max_concurrency: int):
+        self.name = name
+        self.per_ip = per_ip
+        self.per_user = per_user
+        self.max_concurrency = max_concurrency
+
+# Login and signup run bcrypt; analysis endpoints call the LLM and parse PDFs;
+# status endpoints are polled without a user session
+ENDPOINT_CLASSES = {
+    "auth": EndpointClass(
+        "auth",
+        per_ip=_rule("RATE_LIMIT_AUTH_IP", 20, 10),
+        per_user=None,
+        max_concurrency=int(os.getenv("AUTH_MAX_CONCURRENCY", 8)),
+    ),
+    "ai": EndpointClass(
+        "ai",
+        per_ip=_rule("RATE_LIMIT_AI_IP", 30, 10),
+        per_user=_rule("RATE_LIMIT_AI_USER", 6, 3),
+        max_concurrency=int(os.getenv("AI_MAX_CONCURRENCY", 4)),
+    ),
+    "status": EndpointClass(
+        "status",
+        per_ip=_rule("RATE_LIMIT_STATUS_IP", 60, 20),
+        per_user=None,
+        max_concurrency=int(os.getenv("STATUS_MAX_CONCURRENCY", 16)),
+    ),
+}
+
+# ========== BACKENDS ==========
+
+class MemoryBackend:
+    """Token buckets in this worker's memory, least recently used keys evicted first"""
+
+    def __init__(self, max_keys: int = MAX_TRACKED_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def hit(self, key: str, rule: LimitRule) -> float:
+        """Take a token; returns 0 if allowed, otherwise seconds until one is available"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (float(rule.burst), now))
+        tokens = min(float(rule.burst), tokens + (now - updated) * rule.rate)
+        if tokens >= 1:
+            tokens -= 1
+            retry_after = 0.0
+        else:
+            retry_after = (1 - tokens) / rule.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+    async def close(self) -> None:
+        self._buckets.clear()
+
+# KEYS[1] bucket key; ARGV rate per second, burst, now (seconds). Returns retry-after in ms.
+_REDIS_SCRIPT = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local retry = 0
+if tokens >= 1 then tokens = tokens - 1 else retry = math.ceil((1 - tokens) / rate * 1000) end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return retry
+"""
+
+class RedisBackend:
+    """Token buckets shared by all workers; fails open if Redis is unreachable"""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis_asyncio
+        self._client = redis_asyncio.from_url(url)
+        self._script = self._client.register_script(_REDIS_SCRIPT)
+
+    async def hit(self, key: str, rule: LimitRule) -> float:
+        try:
+            retry_ms = await self._script(keys=[f"ratelimit:{key}"], args=[rule.rate, rule.burst, time.time()])
+        except Exception as e:
+            logger.warning("Rate limit backend unavailable, allowing request", extra={"error": str(e)})
+            return 0.0
+        return int(retry_ms) / 1000.0
+
+    async def close(self) -> None:
+        await self._client.close()
+
+def create_backend() -> Any:
+    if RATE_LIMIT_REDIS_URL:
+        try:
+            return RedisBackend(RATE_LIMIT_REDIS_URL)
+        except ImportError:
+            logger.warning("RATE_LIMIT_REDIS_URL set but redis is not installed; using in-memory rate limits")
+    return MemoryBackend()
+
+# ========== ADMISSION ==========
+
+class AdmissionController:
+    def __init__(self, backend: Any, classes: Dict[str, EndpointClass]):
+        self.backend = backend
+        self.classes = classes
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _semaphore(self, name: str) -> asyncio.Semaphore:
+        # Created lazily so they bind to the running event loop
+        if name not in self._semaphores:
+            self._semaphores[name] = asyncio.Semaphore(self.classes[name].max_concurrency)
+        return self._semaphores[name]
+
+    def _reject(self, endpoint_class: str, reason: str, code: int, retry_after: float, detail: str) -> HTTPException:
+        rate_limit_rejections.inc((endpoint_class, reason))
+        return HTTPException(status_code=code, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+    async def check_rate(self, endpoint_class: str, client_ip: str, user_id: Optional[int]) -> None:
+        cls = self.classes[endpoint_class]
+        checks = []
+        if cls.per_ip is not None:
+            checks.append((f"{endpoint_class}:ip:{client_ip}", cls.per_ip))
+        if cls.per_user is not None and user_id is not None:
+            checks.append((f"{endpoint_class}:user:{user_id}", cls.per_user))
+        for key, rule in checks:
+            retry_after = await self.backend.hit(key, rule)
+            if retry_after > 0:
+                logger.info("Rate limit exceeded", extra={"endpoint_class": endpoint_class, "key": key.split(":")[1]})
+                raise self._reject(endpoint_class, "rate", status.HTTP_429_TOO_MANY_REQUESTS, retry_after,
+                                   "Too many requests, please try again later")
+
+    async def acquire(self, endpoint_class: str) -> asyncio.Semaphore:
+        semaphore = self._semaphore(endpoint_class)
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=ADMISSION_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            raise self._reject(endpoint_class, "concurrency", status.HTTP_503_SERVICE_UNAVAILABLE, 1,
+                               "Server is busy, please try again shortly")
+        return semaphore
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+admission = AdmissionController(create_backend(), ENDPOINT_CLASSES)
+
+def client_ip(request: Request) -> str:
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+def limited(endpoint_class: str, user_dependency: Optional[Callable] = None) -> Callable:
+    """Dependency enforcing an endpoint class's rate limits and holding a concurrency slot for the request.
+
+    Pass the endpoint's user dependency to also limit per user; FastAPI resolves it once per request.
+    """
+    async def admit(request: Request, user_id: Optional[int]) -> Optional[asyncio.Semaphore]:
+        if not RATE_LIMIT_ENABLED:
+            return None
+        await admission.check_rate(endpoint_class, client_ip(request), user_id)
+        return await admission.acquire(endpoint_class)
+
+    if user_dependency is None:
+        async def ip_guard(request: Request):
+            semaphore = await admit(request, None)
+            try:
+                yield
+            finally:
+                if semaphore is not None:
+                    semaphore.release()
+        return ip_guard
+
+    async def user_guard(request: Request, user: Any = Depends(user_dependency)):
+        semaphore = await admit(request, getattr(user, "id", None))
+        try:
+            yield
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+    return user_guard
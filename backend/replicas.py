@@ -0,0 +1,246 @@
+"""Read replica routing for the Supabase backend.
+
+SUPABASE_READ_REPLICA_URLS lists the API URLs of read replicas: Supabase
+read replica endpoints, or PostgREST in front of a streaming standby.
+Read-only operations in supabase_client.py run through `read()`, which
+picks a client as follows:
+
+- A replica is used only while its last health check succeeded with a
+  replication lag of at most REPLICA_MAX_LAG_SECONDS. Otherwise the read
+  goes to the primary. Healthy replicas take turns.
+- After a user's own write, that user's reads stay on the primary until
+  a health check shows a replica has replayed past the write, or at most
+  READ_YOUR_WRITES_SECONDS. A list right after a create therefore shows
+  the new row, also when the next request lands on another API worker:
+  a response to a request that wrote carries the write time in the
+  X-Last-Write header, and the app sends it back on its next requests
+  (ReadYourWritesMiddleware). Each process also remembers the write
+  times it saw itself, for clients that don't send the header.
+- A read that fails on a replica takes the replica out of rotation until
+  its next successful check, and is retried on the primary.
+
+Health checks call replication_lag_seconds() (migration 20251107090000)
+every REPLICA_HEALTH_INTERVAL_SECONDS. A replica that is too far behind
+is not used at all.
+
+Without replica URLs, or with STORAGE_BACKEND=sqlite, everything uses
+the primary. To try it locally, run two Postgres instances, one a
+standby of the other (`pg_basebackup -R`), put PostgREST in front of
+each, and point SUPABASE_URL and SUPABASE_READ_REPLICA_URLS at them.
+"""
+import os
+import time
+import asyncio
+import contextvars
+import itertools
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from logging_config import get_logger
+from metrics import Counter, Gauge, registry
+from periodic import PeriodicJob
+from resources import STORAGE_BACKEND, resources
+
+load_dotenv()
+
+logger = get_logger("replicas")
+
+READ_REPLICA_URLS = [u.strip() for u in os.getenv("SUPABASE_READ_REPLICA_URLS", "").split(",") if u.strip()]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 2))
+REPLICA_HEALTH_INTERVAL_SECONDS = float(os.getenv("REPLICA_HEALTH_INTERVAL_SECONDS", 5))
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", 10))
+# Users with a recent write that are remembered per process
+RECENT_WRITERS_MAX = 100000
+
+LAST_WRITE_HEADER = "x-last-write"
+
+# [last write the client reported, whether this request wrote], set per request by ReadYourWritesMiddleware
+request_writes_var: contextvars.ContextVar[Optional[List[Any]]] = contextvars.ContextVar("request_writes", default=None)
+
+db_reads = registry.register(Counter(
+    "db_reads_total", "Read-only database calls by where they ran", ("target",)))
+replica_lag = registry.register(Gauge(
+    "db_replica_lag_seconds", "Replication lag at the last health check, -1 if the check failed", ("replica",)))
+
+class Replica:
+    __slots__ = ("url", "client", "healthy", "lag", "replayed_at", "checked_at", "error")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.client: Any = None
+        # Unknown until the first check; reads go to the primary meanwhile
+        self.healthy = False
+        self.lag: Optional[float] = None
+        # Writes committed on the primary before this time are visible on the replica
+        self.replayed_at = 0.0
+        self.checked_at = 0.0
+        self.error: Optional[str] = None
+
+    def get_client(self) -> Any:
+        if self.client is None:
+            from supabase import create_client
+
+            self.client = create_client(self.url, os.getenv("SUPABASE_SERVICE_ROLE_KEY"))
+        return self.client
+
+    def status(self) -> Dict[str, Any]:
+        return {"url": self.url, "healthy": self.healthy, "lag_seconds": self.lag, "error": self.error}
+
+class ReplicaRouter:
+    def __init__(self, urls: List[str] = READ_REPLICA_URLS, max_lag: float = REPLICA_MAX_LAG_SECONDS,
+                 sticky_seconds: float = READ_YOUR_WRITES_SECONDS):
+        self.replicas = [Replica(url) for url in urls] if STORAGE_BACKEND == "supabase" else []
+        self.max_lag = max_lag
+        self.sticky_seconds = sticky_seconds
+        self._turn = itertools.count()
+        self._writes: "OrderedDict[int, float]" = OrderedDict()
+        # Checks start right away: until the first one, no replica is in rotation
+        self._job = PeriodicJob(self.check_all, logger, "Replica health check failed", max_jitter=0)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    # ---------- Read-your-writes ----------
+
+    def note_write(self, user_id: Optional[int]) -> None:
+        if not self.enabled or user_id is None:
+            return
+        now = time.time()
+        request_writes = request_writes_var.get()
+        if request_writes is not None:
+            request_writes[:] = [now, True]
+        self._writes[user_id] = now
+        self._writes.move_to_end(user_id)
+        while len(self._writes) > RECENT_WRITERS_MAX:
+            self._writes.popitem(last=False)
+
+    def _last_write(self, user_id: Optional[int], now: float) -> float:
+        if user_id is None:
+            return 0.0
+        written = self._writes.get(user_id, 0.0)
+        if written and now - written > self.sticky_seconds:
+            del self._writes[user_id]
+            written = 0.0
+        request_writes = request_writes_var.get()
+        # The client's clock isn't trusted: a time in the future counts as now
+        reported = min(request_writes[0], now) if request_writes is not None else 0.0
+        if now - reported > self.sticky_seconds:
+            reported = 0.0
+        return max(written, reported)
+
+    # ---------- Routing ----------
+
+    def pick(self, user_id: Optional[int] = None) -> Optional[Replica]:
+        """A replica that can serve this user's read, or None for the primary"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        written = self._last_write(user_id, now)
+        usable = [r for r in self.replicas if r.healthy and r.replayed_at >= written]
+        if not usable:
+            return None
+        return usable[next(self._turn) % len(usable)]
+
+    def mark_failed(self, replica: Replica, error: Exception) -> None:
+        replica.healthy = False
+        replica.error = str(error)[:200]
+        logger.warning("Replica read failed; using primary until the next check",
+                       extra={"replica": replica.url, "error": replica.error})
+
+    def read(self, query: Callable[[Any], Any], user_id: Optional[int] = None) -> Any:
+        """query(client) on a replica when one may serve it, otherwise (or if it fails) on the primary"""
+        replica = self.pick(user_id)
+        if replica is not None:
+            try:
+                result = query(replica.get_client())
+                db_reads.inc(("replica",))
+                return result
+            except Exception as e:
+                self.mark_failed(replica, e)
+                db_reads.inc(("fallback",))
+        else:
+            db_reads.inc(("primary",))
+        return query(resources.database)
+
+    # ---------- Health checks ----------
+
+    def _check(self, replica: Replica) -> None:
+        started = time.time()
+        try:
+            lag = replica.get_client().rpc("replication_lag_seconds", {}).execute().data
+        except Exception as e:
+            replica.healthy, replica.lag, replica.error = False, None, str(e)[:200]
+        else:
+            # NULL: the standby isn't streaming from the primary, so its lag is unknown
+            replica.lag = None if lag is None else float(lag)
+            replica.healthy = replica.lag is not None and replica.lag <= self.max_lag
+            replica.error = None if replica.healthy else "replication lag unknown or too high"
+            if replica.lag is not None:
+                replica.replayed_at = started - replica.lag
+        replica.checked_at = time.time()
+        replica_lag.set((replica.url,), -1 if replica.lag is None else replica.lag)
+
+    async def check_all(self) -> None:
+        for replica in self.replicas:
+            was_healthy = replica.healthy
+            await asyncio.to_thread(self._check, replica)
+            if replica.healthy != was_healthy:
+                log = logger.info if replica.healthy else logger.warning
+                log("Replica " + ("in rotation" if replica.healthy else "out of rotation"),
+                    extra={"replica": replica.url, "lag_seconds": replica.lag, "error": replica.error})
+
+    def start(self, interval: float = REPLICA_HEALTH_INTERVAL_SECONDS) -> None:
+        if self.enabled:
+            self._job.start(interval)
+
+    async def stop(self) -> None:
+        await self._job.stop()
+        for replica in self.replicas:
+            if replica.client is not None:
+                try:
+                    replica.client.postgrest.session.close()
+                except Exception as e:
+                    logger.warning("Error closing replica client", extra={"replica": replica.url, "error": str(e)})
+                replica.client = None
+            replica.healthy = False
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [replica.status() for replica in self.replicas]
+
+router = ReplicaRouter()
+
+class ReadYourWritesMiddleware:
+    """Reads the client's last write time from X-Last-Write and returns it after a request that wrote"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not router.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        reported = 0.0
+        for name, value in scope.get("headers", []):
+            if name == LAST_WRITE_HEADER.encode():
+                try:
+                    reported = float(value.decode("latin-1")[:32])
+                except ValueError:
+                    pass
+                break
+        request_writes = [reported, False]
+        token = request_writes_var.set(request_writes)
+
+        async def send_with_last_write(message):
+            if message["type"] == "http.response.start" and request_writes[1]:
+                message["headers"] = list(message.get("headers", [])) + [
+                    (LAST_WRITE_HEADER.encode(), f"{request_writes[0]:.3f}".encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_last_write)
+        finally:
+            request_writes_var.reset(token)
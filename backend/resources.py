@@ -0,0 +1,180 @@
+import os
+import asyncio
+import threading
+import time
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+from logging_config import get_logger
+
+load_dotenv()
+
+logger = get_logger("resources")
+
+TINK_API_URL = os.getenv("TINK_API_URL", "https://api.tink.com")
+EXPO_PUSH_URL = os.getenv("EXPO_PUSH_URL", "https://exp.host")
+COMPANY_API_URL = os.getenv("COMPANY_API_URL", "https://autocomplete.clearbit.com")
+LOGO_API_URL = os.getenv("LOGO_API_URL", "https://logo.clearbit.com")
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", 30))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+# "supabase", or "sqlite" for an embedded database (see sqlite_store.py)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase").lower()
+
+class Resources:
+    """Process-wide clients, created on first use and shared across requests.
+
+    Nothing heavy is imported or connected at import time; the lifespan hook
+    warms the clients in the background and closes them on shutdown.
+    """
+
+    def __init__(self):
+        self._database = None
+        self._openai = None
+        self._tink_http = None
+        self._push_http = None
+        self._company_http = None
+        self._logo_http = None
+        self._link_http = None
+        self.started_at = time.monotonic()
+        self.warm = False
+        self._warm_task: Optional[asyncio.Task] = None
+        # Warm-up creates clients in a worker thread while requests may race it
+        self._lock = threading.Lock()
+
+    def _get(self, attr: str, factory) -> Any:
+        client = getattr(self, attr)
+        if client is None:
+            with self._lock:
+                client = getattr(self, attr)
+                if client is None:
+                    client = factory()
+                    setattr(self, attr, client)
+        return client
+
+    # ---------- Clients ----------
+
+    @property
+    def database(self) -> Any:
+        """Supabase client, or the SQLite client with the same query interface"""
+        return self._get("_database", self._create_database)
+
+    @property
+    def openai(self) -> Any:
+        return self._get("_openai", self._create_openai)
+
+    @property
+    def tink_http(self) -> Any:
+        return self._get("_tink_http", lambda: self._http_client(TINK_API_URL))
+
+    @property
+    def push_http(self) -> Any:
+        return self._get("_push_http", lambda: self._http_client(EXPO_PUSH_URL))
+
+    @property
+    def company_http(self) -> Any:
+        return self._get("_company_http", lambda: self._http_client(COMPANY_API_URL))
+
+    @property
+    def logo_http(self) -> Any:
+        return self._get("_logo_http", lambda: self._http_client(LOGO_API_URL))
+
+    @property
+    def link_http(self) -> Any:
+        """Client for arbitrary merchant sites (cancel link checks), so no base URL"""
+        return self._get("_link_http", lambda: self._http_client(""))
+
+    @staticmethod
+    def _create_database() -> Any:
+        if STORAGE_BACKEND == "sqlite":
+            from sqlite_store import SQLiteClient
+
+            return SQLiteClient()
+        if STORAGE_BACKEND != "supabase":
+            raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}; expected supabase or sqlite.")
+
+        from supabase import create_client
+
+        url = os.getenv("SUPABASE_URL")
+        key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+        if not url or not key:
+            raise ValueError("SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY not found in environment variables.")
+        # Service role key bypasses RLS
+        return create_client(url, key)
+
+    @staticmethod
+    def _create_openai() -> Any:
+        import openai
+
+        return openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+    @staticmethod
+    def _http_client(base_url: str) -> Any:
+        import httpx
+
+        return httpx.AsyncClient(
+            base_url=base_url,
+            timeout=HTTP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS // 5 or 1),
+        )
+
+    # ---------- Lifecycle ----------
+
+    # Readiness requires the database; the other clients are optional features
+    REQUIRED_CLIENTS = ("database",)
+    OPTIONAL_CLIENTS = ("openai", "tink_http", "push_http", "company_http", "logo_http", "link_http")
+
+    async def warm_up(self) -> None:
+        """Create all clients off the event loop so the first requests don't pay for it"""
+        for name in self.REQUIRED_CLIENTS + self.OPTIONAL_CLIENTS:
+            try:
+                await asyncio.to_thread(getattr, self, name)
+            except Exception as e:
+                logger.warning("Client warm-up failed", extra={"client": name, "error": str(e)})
+                if name in self.REQUIRED_CLIENTS:
+                    return
+        self.warm = True
+
+    def start_warm_up(self) -> None:
+        self._warm_task = asyncio.create_task(self.warm_up())
+
+    async def close(self) -> None:
+        if self._warm_task and not self._warm_task.done():
+            self._warm_task.cancel()
+        for client in (self._tink_http, self._push_http, self._company_http, self._logo_http, self._link_http, self._openai):
+            if client is not None:
+                try:
+                    # httpx exposes aclose(), the OpenAI async client an awaitable close()
+                    closer = getattr(client, "aclose", None) or client.close
+                    await closer()
+                except Exception as e:
+                    logger.warning("Error closing client", extra={"error": str(e)})
+        if self._database is not None:
+            try:
+                if STORAGE_BACKEND == "sqlite":
+                    self._database.close()
+                else:
+                    self._database.postgrest.session.close()
+            except Exception as e:
+                logger.warning("Error closing database client", extra={"backend": STORAGE_BACKEND, "error": str(e)})
+        self._database = self._openai = self._tink_http = self._push_http = None
+        self._company_http = self._logo_http = self._link_http = None
+        self.warm = False
+
+    def status(self) -> dict:
+        return {
+            "ready": self.warm,
+            "uptime_seconds": round(time.monotonic() - self.started_at, 3),
+            "storage_backend": STORAGE_BACKEND,
+            "clients": {
+                "database": self._database is not None,
+                "openai": self._openai is not None,
+                "tink": self._tink_http is not None,
+                "push": self._push_http is not None,
+                "companies": self._company_http is not None,
+                "logos": self._logo_http is not None,
+                "cancel_links": self._link_http is not None,
+            },
+        }
+
+resources = Resources()
@@ -0,0 +1,150 @@
+import os
+import json
+import zlib
+from typing import Any, Iterable, List, Optional
+
+from dotenv import load_dotenv
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional: ~5-10x faster encoding for large lists
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip is offered without it
+    brotli = None
+
+load_dotenv()
+
+# Smaller bodies fit in a packet or two; compressing them costs more than it saves
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 5))
+
+# Already-compressed or incrementally consumed content types are passed through
+UNCOMPRESSED_TYPES = ("image/", "application/pdf", "application/zip", "text/event-stream")
+
+# ========== JSON ==========
+
+def dumps(content: Any) -> bytes:
+    """Compact UTF-8 JSON, using orjson when installed"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with dumps()"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+def project_rows(rows: Iterable[dict], fields: Iterable[str]) -> List[dict]:
+    """Rows already shaped by the database, trimmed to a response model's fields without re-validation"""
+    fields = tuple(fields)
+    return [{field: row.get(field) for field in fields} for row in rows]
+
+# ========== COMPRESSION ==========
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Preferred supported encoding from an Accept-Encoding header (q=0 means refused)"""
+    offered = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip()] = q
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    for encoding in candidates:
+        if offered.get(encoding, offered.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._impl = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._flush = self._impl.flush
+            self._finish = self._impl.finish
+            self._compress = self._impl.process
+        else:
+            self._impl = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self._flush = lambda: self._impl.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = self._impl.flush
+            self._compress = self._impl.compress
+
+    def chunk(self, data: bytes) -> bytes:
+        # Flush per chunk so streamed responses reach the client as they are produced
+        return self._compress(data) + self._flush()
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._compress(data) + self._finish()
+
+class CompressionMiddleware:
+    """gzip/brotli for responses above COMPRESSION_MIN_BYTES, including streamed ones"""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                passthrough = "content-encoding" in headers or content_type.startswith(UNCOMPRESSED_TYPES)
+                if passthrough:
+                    await send(message)
+                else:
+                    start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start_message is not None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                if not more_body and len(body) < self.minimum_size:
+                    await send(start_message)
+                    await send(message)
+                    passthrough = True
+                    return
+                compressor = _Compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    del headers["Content-Length"]
+                    body = compressor.chunk(body)
+                else:
+                    body = compressor.finish(body)
+                    headers["Content-Length"] = str(len(body))
+                await send(start_message)
+                start_message = None
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+                return
+
+            body = compressor.chunk(body) if more_body else compressor.finish(body)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
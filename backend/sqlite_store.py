@@ -0,0 +1,853 @@
+"""Embedded SQLite storage backend.
+
+supabase_client.py is written against the PostgREST query builder:
+`table(name).select(...).eq(...).order(...).execute()`, `insert`, `update`,
+`upsert`, `delete` and `rpc(name, params)`. `SQLiteClient` implements the
+part of that interface the backend uses on top of sqlite3, so every
+operation in supabase_client.py runs unchanged on either backend.
+STORAGE_BACKEND=sqlite selects it (see resources.py).
+
+- The schema is derived from supabase/migrations. Tables, indexes and
+  seed data are translated to SQLite, and applied versions are recorded
+  in schema_migrations. Functions, triggers, row level security and
+  policies are skipped: the RPCs the backend calls are implemented in
+  RPCS below, and updates set updated_at themselves.
+- Each process has one connection (see SharedConnection), in WAL mode
+  so readers in other processes never wait for the writer. Every
+  request is one transaction.
+- Values are always bound parameters. The SQL text of a query depends
+  only on its shape (`in_` binds one JSON array), so sqlite3's
+  per-connection statement cache reuses the prepared statements.
+
+    SQLITE_PATH=/tmp/subtrack.db python sqlite_store.py   # create or migrate the database
+"""
+import os
+import re
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+from logging_config import get_logger
+
+load_dotenv()
+
+logger = get_logger("sqlite_store")
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", "subtrack.db")
+SQLITE_BUSY_TIMEOUT_SECONDS = float(os.getenv("SQLITE_BUSY_TIMEOUT_SECONDS", 5))
+SQLITE_MIGRATIONS_DIR = os.getenv(
+    "SQLITE_MIGRATIONS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "supabase", "migrations"),
+)
+SQLITE_STATEMENT_CACHE_SIZE = 256
+
+# Same text format as datetime.isoformat() in UTC, so stored timestamps compare correctly as strings
+NOW_SQL = "(strftime('%Y-%m-%dT%H:%M:%f', 'now') || '+00:00')"
+UUID_SQL = (
+    "(lower(hex(randomblob(4)) || '-' || hex(randomblob(2)) || '-4' || substr(hex(randomblob(2)), 2) || '-' || "
+    "substr('89ab', 1 + abs(random()) % 4, 1) || substr(hex(randomblob(2)), 2) || '-' || hex(randomblob(6))))"
+)
+
+class StorageError(Exception):
+    pass
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+# ========== SCHEMA FROM MIGRATIONS ==========
+
+def split_statements(sql: str) -> List[str]:
+    """Statements of a migration without comments; quoted strings and $$ bodies are kept whole"""
+    statements, current = [], []
+    i, n = 0, len(sql)
+    while i < n:
+        if sql.startswith("--", i):
+            i = sql.find("\n", i)
+            i = n if i < 0 else i
+        elif sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+        elif sql[i] == "'":
+            end = i + 1
+            while end < n and not (sql[end] == "'" and not sql.startswith("''", end)):
+                end += 2 if sql.startswith("''", end) else 1
+            current.append(sql[i:end + 1])
+            i = end + 1
+        elif sql[i] == "$" and re.match(r"\$\w*\$", sql[i:]):
+            tag = re.match(r"\$\w*\$", sql[i:]).group(0)
+            end = sql.find(tag, i + len(tag))
+            end = n if end < 0 else end + len(tag)
+            current.append(sql[i:end])
+            i = end
+        elif sql[i] == ";":
+            statements.append("".join(current).strip())
+            current = []
+            i += 1
+        else:
+            current.append(sql[i])
+            i += 1
+    statements.append("".join(current).strip())
+    return [s for s in statements if s]
+
+# Statements with a SQLite equivalent; anything else (functions, triggers, RLS, policies, grants) is skipped
+TRANSLATED_STATEMENT = re.compile(
+    r"^(CREATE\s+TABLE|CREATE\s+(UNIQUE\s+)?INDEX|DROP\s+(TABLE|INDEX)|INSERT\s+INTO|UPDATE\s|DELETE\s+FROM"
+    r"|ALTER\s+TABLE\s+(IF\s+EXISTS\s+)?\S+\s+(ADD|DROP|RENAME)\s+COLUMN)",
+    re.I,
+)
+
+REWRITES = (
+    (re.compile(r"\bbigserial\s+PRIMARY\s+KEY\b", re.I), "INTEGER PRIMARY KEY AUTOINCREMENT"),
+    (re.compile(r"\b(big)?serial\b", re.I), "INTEGER"),
+    (re.compile(r"\b(\w+)\[\]", re.I), "JSONB"),
+    (re.compile(r"\bnow\(\)", re.I), NOW_SQL),
+    (re.compile(r"\bgen_random_uuid\(\)", re.I), UUID_SQL),
+    (re.compile(r"::\w+(\[\])?"), ""),
+    (re.compile(r"\bCONCURRENTLY\s+", re.I), ""),
+    (re.compile(r"\bUSING\s+\w+\s*(?=\()", re.I), ""),
+    (re.compile(r"\bINCLUDE\s*\([^)]*\)", re.I), ""),
+)
+
+def _drop_checks(statement: str, unsupported: Callable[[str], bool]) -> str:
+    """Remove CHECK (...) constraints whose expression SQLite can't evaluate"""
+    out, i = [], 0
+    for match in re.finditer(r"\bCHECK\s*\(", statement, re.I):
+        if match.start() < i:
+            continue
+        depth, end = 1, match.end()
+        while end < len(statement) and depth:
+            depth += {"(": 1, ")": -1}.get(statement[end], 0)
+            end += 1
+        if unsupported(statement[match.end():end - 1]):
+            out.append(statement[i:match.start()])
+            i = end
+    out.append(statement[i:])
+    return "".join(out)
+
+def translate_statement(statement: str) -> List[str]:
+    """SQLite statements for one Postgres migration statement (none if it has no SQLite equivalent)"""
+    if not TRANSLATED_STATEMENT.match(statement):
+        return []
+    for pattern, replacement in REWRITES:
+        statement = pattern.sub(lambda _: replacement, statement)
+    # Regular expression checks (e.g. the users.email format) are Postgres-only
+    statement = _drop_checks(statement, lambda expression: "~" in expression)
+    alter = re.match(r"^(ALTER\s+TABLE\s+(IF\s+EXISTS\s+)?\S+\s+)", statement, re.I)
+    if alter:
+        # One change per ALTER TABLE in SQLite; applied versions are tracked, so IF [NOT] EXISTS is dropped
+        actions = re.split(r",\s*(?=(ADD|DROP|RENAME)\s+COLUMN\b)", statement[alter.end():], flags=re.I)
+        prefix = re.sub(r"IF\s+EXISTS\s+", "", alter.group(1), flags=re.I)
+        return [prefix + re.sub(r"\bIF\s+(NOT\s+)?EXISTS\s+", "", action, flags=re.I)
+                for action in actions[::2]]
+    return [statement]
+
+def translate_migration(sql: str) -> List[str]:
+    return [translated for statement in split_statements(sql) for translated in translate_statement(statement)]
+
+def apply_migrations(conn: sqlite3.Connection, directory: str = SQLITE_MIGRATIONS_DIR) -> int:
+    """Apply migrations not yet recorded in schema_migrations; returns how many were applied"""
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version TEXT PRIMARY KEY, name TEXT, applied_at TEXT NOT NULL)")
+    applied = 0
+    for filename in sorted(f for f in os.listdir(directory) if f.endswith(".sql")):
+        version, _, name = filename[:-4].partition("_")
+        if conn.execute("SELECT 1 FROM schema_migrations WHERE version = ?", (version,)).fetchone():
+            continue
+        with open(os.path.join(directory, filename), encoding="utf-8") as f:
+            statements = translate_migration(f.read())
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have applied it while this one waited for the write lock
+            if conn.execute("SELECT 1 FROM schema_migrations WHERE version = ?", (version,)).fetchone():
+                conn.execute("ROLLBACK")
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute("INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                         (version, name, _now()))
+            conn.execute("COMMIT")
+        except Exception as e:
+            conn.execute("ROLLBACK")
+            raise StorageError(f"Migration {filename} failed: {e}") from e
+        applied += 1
+    return applied
+
+# ========== CONNECTIONS ==========
+
+def _unicode_lower(value: Any) -> Any:
+    return value.lower() if isinstance(value, str) else value
+
+class SharedConnection:
+    """The process's one sqlite3 connection, used by one caller at a time.
+
+    supabase_client.py runs every query synchronously inside its async
+    functions, on the event loop thread, so a pool of connections would
+    never run two queries at once. Other processes (more uvicorn workers,
+    the sync worker) open their own connection, and WAL lets their readers
+    run while one of them writes. The lock covers callers in worker
+    threads. A caller that can't get the connection within
+    SQLITE_BUSY_TIMEOUT_SECONDS gets a StorageError.
+    """
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, isolation_level=None,
+                               check_same_thread=False, cached_statements=SQLITE_STATEMENT_CACHE_SIZE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        # SQLite's lower() and LIKE only fold ASCII; ilike has to match æøå too
+        conn.create_function("unicode_lower", 1, _unicode_lower, deterministic=True)
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        if not self._lock.acquire(timeout=SQLITE_BUSY_TIMEOUT_SECONDS):
+            raise StorageError(f"SQLite connection still busy after {SQLITE_BUSY_TIMEOUT_SECONDS}s")
+        try:
+            if self._conn is None:
+                self._conn = self._connect()
+            conn = self._conn
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+        finally:
+            self._lock.release()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """The connection inside BEGIN IMMEDIATE, committed on success"""
+        with self.connection() as conn:
+            # Take the write lock up front; upgrading a read transaction later can't wait on busy_timeout
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+def _rows(cursor: sqlite3.Cursor) -> List[Dict[str, Any]]:
+    names = [d[0] for d in cursor.description or ()]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+def _decode_json(value: Any) -> Any:
+    return json.loads(value) if isinstance(value, str) else value
+
+def _decode_bool(value: Any) -> Any:
+    return None if value is None else bool(value)
+
+class Table:
+    """Column names, declared types and primary key of one table"""
+    __slots__ = ("name", "columns", "primary_key", "decoders")
+
+    def __init__(self, name: str, info: List[Tuple]):
+        self.name = name
+        self.columns = {column[1]: (column[2] or "").upper() for column in info}
+        self.primary_key = [column[1] for column in sorted(info, key=lambda c: c[5]) if column[5]]
+        self.decoders: Dict[str, Callable[[Any], Any]] = {}
+        for column, declared in self.columns.items():
+            if declared.startswith("BOOL"):
+                self.decoders[column] = _decode_bool
+            elif declared.startswith("JSON"):
+                self.decoders[column] = _decode_json
+
+    def column(self, name: str) -> str:
+        if name not in self.columns:
+            raise StorageError(f"column {self.name}.{name} does not exist")
+        return f'"{name}"'
+
+    def decode(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if self.decoders:
+            for row in rows:
+                for column, decode in self.decoders.items():
+                    if column in row:
+                        row[column] = decode(row[column])
+        return rows
+
+# ========== QUERY BUILDER ==========
+
+class Response:
+    """Same shape as postgrest-py's APIResponse"""
+    __slots__ = ("data", "count")
+
+    def __init__(self, data: Any, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+class Query:
+    """One PostgREST-style request against a table, run by execute()"""
+
+    def __init__(self, client: "SQLiteClient", table: Table, method: str, payload: Any = None,
+                 columns: str = "*", on_conflict: str = "", ignore_duplicates: bool = False):
+        self._client = client
+        self._table = table
+        self._method = method
+        self._payload = payload
+        self._columns = columns
+        self._on_conflict = on_conflict
+        self._ignore_duplicates = ignore_duplicates
+        self._where: List[str] = []
+        self._params: List[Any] = []
+        self._order: List[str] = []
+        self._limit: Optional[int] = None
+        self._offset = 0
+        self._maybe_single = False
+        self._negate = False
+
+    # ---------- Filters ----------
+
+    @property
+    def not_(self) -> "Query":
+        """Negate the next filter, like postgrest-py's `.not_.in_(...)`"""
+        self._negate = True
+        return self
+
+    def _condition(self, sql: str) -> None:
+        self._where.append(f"NOT ({sql})" if self._negate else sql)
+        self._negate = False
+
+    def _filter(self, column: str, operator: str, value: Any) -> "Query":
+        self._condition(f"{self._table.column(column)} {operator} ?")
+        self._params.append(_encode(value))
+        return self
+
+    def eq(self, column: str, value: Any) -> "Query":
+        return self._filter(column, "=", value)
+
+    def neq(self, column: str, value: Any) -> "Query":
+        return self._filter(column, "<>", value)
+
+    def gt(self, column: str, value: Any) -> "Query":
+        return self._filter(column, ">", value)
+
+    def gte(self, column: str, value: Any) -> "Query":
+        return self._filter(column, ">=", value)
+
+    def lt(self, column: str, value: Any) -> "Query":
+        return self._filter(column, "<", value)
+
+    def lte(self, column: str, value: Any) -> "Query":
+        return self._filter(column, "<=", value)
+
+    def like(self, column: str, pattern: str) -> "Query":
+        return self._filter(column, "LIKE", pattern)
+
+    def ilike(self, column: str, pattern: str) -> "Query":
+        self._condition(f"unicode_lower({self._table.column(column)}) LIKE unicode_lower(?)")
+        self._params.append(pattern)
+        return self
+
+    def is_(self, column: str, value: Any) -> "Query":
+        keyword = {"null": "NULL", "none": "NULL", "true": "TRUE", "false": "FALSE"}.get(str(value).lower())
+        if keyword is None:
+            raise StorageError(f"unsupported is_ value {value!r}")
+        self._condition(f"{self._table.column(column)} IS {keyword}")
+        return self
+
+    def in_(self, column: str, values: Sequence[Any]) -> "Query":
+        # One JSON array parameter, so the statement text doesn't change with the list length
+        self._condition(f"{self._table.column(column)} IN (SELECT value FROM json_each(?))")
+        self._params.append(json.dumps([_encode(v) for v in values], default=str))
+        return self
+
+    # ---------- Modifiers ----------
+
+    def order(self, column: str, desc: bool = False, nullsfirst: Optional[bool] = None) -> "Query":
+        # Postgres puts NULLs last ascending and first descending; SQLite does the opposite
+        nulls_first = desc if nullsfirst is None else nullsfirst
+        self._order.append(f"{self._table.column(column)} {'DESC' if desc else 'ASC'} NULLS {'FIRST' if nulls_first else 'LAST'}")
+        return self
+
+    def limit(self, size: int) -> "Query":
+        self._limit = int(size)
+        return self
+
+    def range(self, start: int, end: int) -> "Query":
+        self._offset, self._limit = int(start), int(end) - int(start) + 1
+        return self
+
+    def maybe_single(self) -> "Query":
+        self._maybe_single = True
+        return self
+
+    # ---------- SQL ----------
+
+    def _where_sql(self) -> str:
+        return " WHERE " + " AND ".join(self._where) if self._where else ""
+
+    def _touch_updated_at(self, row: Dict[str, Any]) -> str:
+        # What the update_updated_at_column() trigger does in Postgres
+        return ', "updated_at" = ' + NOW_SQL if "updated_at" in self._table.columns and "updated_at" not in row else ""
+
+    def _select(self, conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        if self._columns.strip() == "*":
+            columns = "*"
+        else:
+            columns = ", ".join(self._table.column(c.strip()) for c in self._columns.split(",") if c.strip())
+        sql = f'SELECT {columns} FROM "{self._table.name}"{self._where_sql()}'
+        if self._order:
+            sql += " ORDER BY " + ", ".join(self._order)
+        params = list(self._params)
+        limit = self._limit
+        if self._maybe_single and limit is None:
+            limit = 2
+        if limit is not None or self._offset:
+            sql += " LIMIT ? OFFSET ?"
+            params += [-1 if limit is None else limit, self._offset]
+        return _rows(conn.execute(sql, params))
+
+    def _insert_sql(self, row: Dict[str, Any]) -> str:
+        table = self._table.name
+        if not row:
+            return f'INSERT INTO "{table}" DEFAULT VALUES RETURNING *'
+        columns = [self._table.column(c) for c in row]
+        sql = f'INSERT INTO "{table}" ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+        if self._method == "upsert":
+            target = [c.strip() for c in self._on_conflict.split(",") if c.strip()] or self._table.primary_key
+            updates = [c for c in row if c not in target]
+            conflict = f' ON CONFLICT ({", ".join(self._table.column(c) for c in target)})'
+            if self._ignore_duplicates or not updates:
+                sql += conflict + " DO NOTHING"
+            else:
+                sql += conflict + " DO UPDATE SET " + ", ".join(f'"{c}" = excluded."{c}"' for c in updates)
+                sql += self._touch_updated_at(row)
+        return sql + " RETURNING *"
+
+    def _write(self, conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        if self._method in ("insert", "upsert"):
+            rows = self._payload if isinstance(self._payload, list) else [self._payload]
+            returned = []
+            for row in rows:
+                returned += _rows(conn.execute(self._insert_sql(row), [_encode(v) for v in row.values()]))
+            return returned
+        if self._method == "update":
+            assignments = ", ".join(f"{self._table.column(c)} = ?" for c in self._payload)
+            sql = (f'UPDATE "{self._table.name}" SET {assignments}{self._touch_updated_at(self._payload)}'
+                   f'{self._where_sql()} RETURNING *')
+            return _rows(conn.execute(sql, [_encode(v) for v in self._payload.values()] + self._params))
+        return _rows(conn.execute(f'DELETE FROM "{self._table.name}"{self._where_sql()} RETURNING *', self._params))
+
+    def execute(self) -> Optional[Response]:
+        db = self._client.db
+        try:
+            if self._method == "select":
+                with db.connection() as conn:
+                    rows = self._select(conn)
+            else:
+                with db.transaction() as conn:
+                    rows = self._write(conn)
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+        rows = self._table.decode(rows)
+        if self._maybe_single:
+            if len(rows) > 1:
+                raise StorageError("maybe_single query returned more than one row")
+            # Like postgrest-py: no response at all when nothing matched
+            return Response(rows[0]) if rows else None
+        return Response(rows)
+
+class TableQuery:
+    """client.table(name): picks the operation"""
+
+    def __init__(self, client: "SQLiteClient", table: Table):
+        self._client = client
+        self._table = table
+
+    def select(self, columns: str = "*", count: Optional[str] = None) -> Query:
+        return Query(self._client, self._table, "select", columns=columns)
+
+    def insert(self, json: Any, **_: Any) -> Query:
+        return Query(self._client, self._table, "insert", payload=json)
+
+    def upsert(self, json: Any, on_conflict: str = "", ignore_duplicates: bool = False, **_: Any) -> Query:
+        return Query(self._client, self._table, "upsert", payload=json, on_conflict=on_conflict,
+                     ignore_duplicates=ignore_duplicates)
+
+    def update(self, json: Dict[str, Any], **_: Any) -> Query:
+        return Query(self._client, self._table, "update", payload=json)
+
+    def delete(self, **_: Any) -> Query:
+        return Query(self._client, self._table, "delete")
+
+class RPCQuery:
+    def __init__(self, client: "SQLiteClient", name: str, params: Dict[str, Any]):
+        if name not in RPCS:
+            raise StorageError(f"function {name} does not exist")
+        self._client = client
+        self._function, self._writes = RPCS[name]
+        self._params = params or {}
+
+    def execute(self) -> Response:
+        db = self._client.db
+        try:
+            with (db.transaction() if self._writes else db.connection()) as conn:
+                return Response(self._function(conn, self._params))
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+class SQLiteClient:
+    """Drop-in for the Supabase client as far as supabase_client.py uses it"""
+
+    def __init__(self, path: str = SQLITE_PATH, migrations_dir: str = SQLITE_MIGRATIONS_DIR):
+        self.path = path
+        self.db = SharedConnection(path)
+        self._tables: Dict[str, Table] = {}
+        with self.db.connection() as conn:
+            applied = apply_migrations(conn, migrations_dir)
+        logger.info("SQLite database ready", extra={"path": path, "migrations_applied": applied})
+
+    def _table(self, name: str) -> Table:
+        table = self._tables.get(name)
+        if table is None:
+            with self.db.connection() as conn:
+                info = conn.execute("SELECT * FROM pragma_table_info(?)", (name,)).fetchall()
+            if not info:
+                raise StorageError(f"relation {name} does not exist")
+            table = self._tables[name] = Table(name, info)
+        return table
+
+    def table(self, name: str) -> TableQuery:
+        return TableQuery(self, self._table(name))
+
+    def rpc(self, name: str, params: Optional[Dict[str, Any]] = None) -> RPCQuery:
+        return RPCQuery(self, name, params or {})
+
+    def close(self) -> None:
+        self.db.close()
+
+# ========== RPC FUNCTIONS ==========
+# SQLite versions of the Postgres functions in supabase/migrations that supabase_client.py calls
+
+RPCS: Dict[str, Tuple[Callable[[sqlite3.Connection, Dict[str, Any]], Any], bool]] = {}
+
+def rpc(name: str, writes: bool = False):
+    def register(function):
+        RPCS[name] = (function, writes)
+        return function
+    return register
+
+def _as_of(args: Dict[str, Any]) -> str:
+    return str(args.get("p_as_of") or date.today().isoformat())[:10]
+
+def _timestamp(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+@rpc("get_tokens_expiring_soon")
+def rpc_get_tokens_expiring_soon(conn: sqlite3.Connection, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    now = datetime.now(timezone.utc)
+    horizon = now + timedelta(days=int(args.get("days_threshold", 15)))
+    rows = _rows(conn.execute(
+        "SELECT user_id, bank_name, expires_at FROM tink_tokens "
+        "WHERE is_active AND expires_at > ? AND expires_at <= ? ORDER BY expires_at",
+        (now.isoformat(), horizon.isoformat()),
+    ))
+    for row in rows:
+        row["days_until_expiry"] = (_timestamp(row["expires_at"]) - now).days
+    return rows
+
+DIGEST_SQL = """
+WITH page AS (
+  SELECT u.id
+  FROM users u
+  WHERE u.id > :after_user_id AND u.is_active AND COALESCE((
+    SELECT np.is_enabled FROM notification_preferences np
+    WHERE np.user_id = u.id AND np.subscription_id IS NULL AND np.notification_type = 'weekly_summary'
+    ORDER BY np.updated_at DESC, np.id DESC LIMIT 1), TRUE)
+  ORDER BY u.id
+  LIMIT :limit
+),
+sub_stats AS (
+  SELECT
+    s.owner_id,
+    count(*) AS active_count,
+    count(*) FILTER (WHERE s.created_at >= :week_ago) AS new_count
+  FROM subscriptions s
+  JOIN page p ON p.id = s.owner_id
+  WHERE s.is_active
+  GROUP BY s.owner_id
+),
+currency_sums AS (
+  SELECT
+    s.owner_id,
+    s.currency,
+    round(sum(s.amount * 1.0 / CASE s.frequency WHEN 'kvartal' THEN 3 WHEN 'halvår' THEN 6 WHEN 'år' THEN 12 ELSE 1 END), 2)
+      AS monthly
+  FROM subscriptions s
+  JOIN page p ON p.id = s.owner_id
+  WHERE s.is_active
+  GROUP BY s.owner_id, s.currency
+),
+currency_stats AS (
+  SELECT
+    owner_id,
+    json_group_object(currency, monthly) AS monthly_totals
+  FROM currency_sums
+  GROUP BY owner_id
+),
+event_stats AS (
+  SELECT e.user_id, count(*) AS price_increases
+  FROM notification_events e
+  JOIN page p ON p.id = e.user_id
+  WHERE e.event_type = 'price_increase' AND e.created_at >= :week_ago
+  GROUP BY e.user_id
+)
+SELECT
+  p.id AS user_id,
+  COALESCE(ss.active_count, 0) AS active_count,
+  COALESCE(cs.monthly_totals, '{}') AS monthly_totals,
+  COALESCE(ss.new_count, 0) AS new_count,
+  COALESCE(es.price_increases, 0) AS price_increases
+FROM page p
+LEFT JOIN sub_stats ss ON ss.owner_id = p.id
+LEFT JOIN currency_stats cs ON cs.owner_id = p.id
+LEFT JOIN event_stats es ON es.user_id = p.id
+ORDER BY p.id
+"""
+
+@rpc("get_weekly_digest_batch")
+def rpc_get_weekly_digest_batch(conn: sqlite3.Connection, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    as_of = date.fromisoformat(_as_of(args))
+    params = {
+        "after_user_id": int(args.get("p_after_user_id", 0)),
+        "limit": int(args.get("p_limit", 1000)),
+        "as_of": as_of.isoformat(),
+        "week_end": (as_of + timedelta(days=7)).isoformat(),
+        "week_ago": (as_of - timedelta(days=7)).isoformat(),
+    }
+    rows = _rows(conn.execute(DIGEST_SQL, params))
+    # The Postgres function aggregates these with jsonb_agg(... ORDER BY); SQLite 3.40 can't order inside an aggregate
+    renewals: Dict[int, List[Dict[str, Any]]] = {row["user_id"]: [] for row in rows}
+    for sub in _rows(conn.execute(
+        "SELECT owner_id, title, amount, currency, renewal_date, frequency FROM subscriptions "
+        "WHERE owner_id IN (SELECT value FROM json_each(?)) AND is_active AND renewal_date < ? "
+        "ORDER BY owner_id, renewal_date",
+        (json.dumps(list(renewals)), params["week_end"]),
+    )):
+        renewals[sub.pop("owner_id")].append(sub)
+    for row in rows:
+        row["renewals"] = renewals[row["user_id"]]
+        row["monthly_totals"] = json.loads(row["monthly_totals"])
+    return rows
+
+# One row per level, like the LATERAL ... LIMIT 1 joins of the Postgres functions
+PREFERENCE_JOINS = """
+  LEFT JOIN notification_preferences sp ON sp.id = (
+    SELECT p.id FROM notification_preferences p
+    WHERE p.subscription_id = s.id AND p.user_id = s.owner_id AND p.notification_type = :notification_type
+    ORDER BY p.updated_at DESC, p.id DESC LIMIT 1)
+  LEFT JOIN notification_preferences gp ON gp.id = (
+    SELECT p.id FROM notification_preferences p
+    WHERE p.user_id = s.owner_id AND p.subscription_id IS NULL AND p.notification_type = :notification_type
+    ORDER BY p.updated_at DESC, p.id DESC LIMIT 1)
+"""
+
+@rpc("resolve_notification_preferences")
+def rpc_resolve_notification_preferences(conn: sqlite3.Connection, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    rows = _rows(conn.execute(
+        "SELECT s.id AS subscription_id, s.owner_id AS user_id, "
+        "COALESCE(sp.is_enabled, gp.is_enabled, TRUE) AS is_enabled, "
+        "COALESCE(sp.days_before_renewal, gp.days_before_renewal, 1) AS days_before_renewal, "
+        "CASE WHEN sp.id IS NOT NULL THEN 'subscription' WHEN gp.id IS NOT NULL THEN 'global' ELSE 'default' END AS source "
+        "FROM subscriptions s" + PREFERENCE_JOINS +
+        "WHERE s.id IN (SELECT value FROM json_each(:subscription_ids)) ORDER BY s.id",
+        {"subscription_ids": json.dumps(args.get("p_subscription_ids") or []),
+         "notification_type": args["p_notification_type"]},
+    ))
+    for row in rows:
+        row["is_enabled"] = bool(row["is_enabled"])
+    return rows
+
+@rpc("get_due_renewal_reminders")
+def rpc_get_due_renewal_reminders(conn: sqlite3.Connection, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return _rows(conn.execute(
+        "SELECT s.id AS subscription_id, s.owner_id AS user_id, s.title, s.amount, s.currency, s.renewal_date, "
+        "COALESCE(sp.days_before_renewal, gp.days_before_renewal, 1) AS days_before_renewal "
+        "FROM subscriptions s JOIN users u ON u.id = s.owner_id AND u.is_active" + PREFERENCE_JOINS +
+        "WHERE s.is_active AND s.id > :after_id "
+        "AND s.renewal_date > :as_of AND s.renewal_date <= date(:as_of, '+30 days') "
+        "AND COALESCE(sp.is_enabled, gp.is_enabled, TRUE) "
+        "AND s.renewal_date = date(:as_of, '+' || COALESCE(sp.days_before_renewal, gp.days_before_renewal, 1) || ' days') "
+        "ORDER BY s.id LIMIT :limit",
+        {"notification_type": "renewal_reminder", "as_of": _as_of(args),
+         "after_id": int(args.get("p_after_subscription_id", 0)), "limit": int(args.get("p_limit", 1000))},
+    ))
+
+@rpc("claim_account_deletion", writes=True)
+def rpc_claim_account_deletion(conn: sqlite3.Connection, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # The write lock is held for the whole transaction, so no SKIP LOCKED is needed
+    now = datetime.now(timezone.utc)
+    return _rows(conn.execute(
+        "UPDATE account_deletions SET status = 'running', attempts = attempts + 1, lease_until = :lease_until, "
+        "started_at = COALESCE(started_at, :now), updated_at = :now "
+        "WHERE id = (SELECT id FROM account_deletions "
+        "WHERE status = 'pending' OR (status = 'running' AND lease_until < :now) ORDER BY requested_at LIMIT 1) "
+        "RETURNING *",
+        {"now": now.isoformat(),
+         "lease_until": (now + timedelta(seconds=int(args.get("p_lease_seconds", 300)))).isoformat()},
+    ))
+
+@rpc("claim_tink_webhook_events", writes=True)
+def rpc_claim_tink_webhook_events(conn: sqlite3.Connection, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    now = datetime.now(timezone.utc)
+    params = {
+        "now": now.isoformat(),
+        "quiet_before": (now - timedelta(seconds=int(args.get("p_quiet_seconds", 5)))).isoformat(),
+        "delay_before": (now - timedelta(seconds=int(args.get("p_max_delay_seconds", 60)))).isoformat(),
+        "lease_until": (now + timedelta(seconds=int(args.get("p_lease_seconds", 300)))).isoformat(),
+    }
+    # Only one writer at a time, so the user can't be claimed by someone else between these statements
+    user = conn.execute(
+        "SELECT user_id FROM tink_webhook_events WHERE status IN ('pending', 'processing') GROUP BY user_id "
+        "HAVING NOT max(status = 'processing' AND lease_until >= :now) "
+        "AND (max(received_at) < :quiet_before OR min(received_at) < :delay_before) "
+        "ORDER BY min(received_at) LIMIT 1",
+        params,
+    ).fetchone()
+    if user is None:
+        return []
+    return _rows(conn.execute(
+        "UPDATE tink_webhook_events SET status = 'processing', attempts = attempts + 1, lease_until = :lease_until "
+        "WHERE user_id = :user_id AND (status = 'pending' OR (status = 'processing' AND lease_until < :now)) "
+        "RETURNING *",
+        {**params, "user_id": user[0]},
+    ))
+
+@rpc("anonymize_analytics_events_batch", writes=True)
+def rpc_anonymize_analytics_events_batch(conn: sqlite3.Connection, args: Dict[str, Any]) -> int:
+    return conn.execute(
+        "UPDATE analytics_events SET user_id = NULL, subscription_id = NULL, session_id = NULL, event_data = NULL "
+        "WHERE id IN (SELECT id FROM analytics_events WHERE user_id = ? LIMIT ?)",
+        (args["p_user_id"], int(args.get("p_limit", 500))),
+    ).rowcount
+
+SUBSCRIPTION_COLUMNS = (
+    "id, owner_id, title, amount, currency, category, renewal_date, transaction_date, logo_url, "
+    "frequency, source, confidence_score, is_active, notes, created_at, updated_at"
+)
+
+@rpc("archive_inactive_subscriptions", writes=True)
+def rpc_archive_inactive_subscriptions(conn: sqlite3.Connection, args: Dict[str, Any]) -> int:
+    ids = [row[0] for row in conn.execute(
+        "SELECT id FROM subscriptions WHERE is_active = 0 AND updated_at < ? ORDER BY updated_at LIMIT ?",
+        (args["p_inactive_before"], int(args.get("p_limit", 500))),
+    )]
+    if not ids:
+        return 0
+    batch = json.dumps(ids)
+    conn.execute(
+        f"INSERT INTO subscriptions_archive ({SUBSCRIPTION_COLUMNS}) "
+        f"SELECT {SUBSCRIPTION_COLUMNS} FROM subscriptions WHERE id IN (SELECT value FROM json_each(?))",
+        (batch,),
+    )
+    return conn.execute("DELETE FROM subscriptions WHERE id IN (SELECT value FROM json_each(?))", (batch,)).rowcount
+
+@rpc("restore_archived_subscription", writes=True)
+def rpc_restore_archived_subscription(conn: sqlite3.Connection, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    params = (args["p_subscription_id"], args["p_owner_id"])
+    restored = _rows(conn.execute(
+        f"INSERT INTO subscriptions ({SUBSCRIPTION_COLUMNS}) "
+        "SELECT id, owner_id, title, amount, currency, category, renewal_date, transaction_date, logo_url, "
+        f"frequency, source, confidence_score, is_active OR ?, notes, created_at, {NOW_SQL} "
+        "FROM subscriptions_archive WHERE id = ? AND owner_id = ? RETURNING *",
+        (bool(args.get("p_activate", True)),) + params,
+    ))
+    conn.execute("DELETE FROM subscriptions_archive WHERE id = ? AND owner_id = ?", params)
+    for row in restored:
+        row["is_active"] = _decode_bool(row["is_active"])
+    return restored
+
+@rpc("claim_cancel_links_to_check", writes=True)
+def rpc_claim_cancel_links_to_check(conn: sqlite3.Connection, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return _rows(conn.execute(
+        f"UPDATE merchant_cancel_links SET checked_at = {NOW_SQL} "
+        "WHERE id IN (SELECT id FROM merchant_cancel_links "
+        "WHERE is_active AND cancel_type = 'url' AND (checked_at IS NULL OR checked_at < ?) "
+        "ORDER BY broken_reports DESC, verified_at ASC NULLS FIRST, id LIMIT ?) "
+        "RETURNING id, merchant_name, cancel_target, broken_reports, verified_at",
+        (args["p_checked_before"], int(args.get("p_limit", 100))),
+    ))
+
+@rpc("record_cancel_link_checks", writes=True)
+def rpc_record_cancel_link_checks(conn: sqlite3.Connection, args: Dict[str, Any]) -> int:
+    return conn.execute(
+        "WITH results AS (SELECT json_extract(value, '$.id') AS id, json_extract(value, '$.ok') AS ok, "
+        "json_extract(value, '$.error') AS error FROM json_each(?)) "
+        "UPDATE merchant_cancel_links SET "
+        "broken_reports = CASE WHEN r.ok THEN 0 WHEN NOT r.ok THEN broken_reports + 1 ELSE broken_reports END, "
+        "is_active = CASE WHEN r.ok THEN TRUE WHEN NOT r.ok AND broken_reports + 1 >= 3 THEN FALSE ELSE is_active END, "
+        f"verified_at = CASE WHEN r.ok THEN {NOW_SQL} ELSE verified_at END, "
+        f"check_error = r.error, updated_at = {NOW_SQL} "
+        "FROM results r WHERE merchant_cancel_links.id = r.id",
+        (json.dumps(args.get("p_results") or []),),
+    ).rowcount
+
+SERIES_COLUMNS = ("user_id", "merchant_key", "charge_count", "last_amount", "mean_amount", "recent_amounts",
+                  "first_booked_date", "last_booked_date", "subscription_id")
+
+@rpc("save_transaction_series", writes=True)
+def rpc_save_transaction_series(conn: sqlite3.Connection, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+    columns = ", ".join(f'"{c}"' for c in SERIES_COLUMNS)
+    updates = ", ".join(f'"{c}" = excluded."{c}"' for c in SERIES_COLUMNS[2:])
+    sql = (f"INSERT INTO transaction_series ({columns}, version) VALUES ({', '.join('?' * len(SERIES_COLUMNS))}, ?) "
+           f"ON CONFLICT (user_id, merchant_key) DO UPDATE SET {updates}, version = excluded.version, "
+           f"updated_at = {NOW_SQL} WHERE transaction_series.version = excluded.version - 1 RETURNING merchant_key")
+    saved = []
+    for row in args.get("p_rows") or []:
+        params = [_encode(row.get(c)) for c in SERIES_COLUMNS] + [int(row.get("version") or 0) + 1]
+        params[SERIES_COLUMNS.index("recent_amounts")] = _encode(row.get("recent_amounts") or [])
+        saved += _rows(conn.execute(sql, params))
+    return saved
+
+# The only tables delete_user_rows_batch accepts, and the column holding the user id
+USER_COLUMNS = {
+    "notification_events": "user_id", "transactions": "user_id", "transaction_series": "user_id",
+    "notification_preferences": "user_id", "push_tokens": "user_id", "tink_tokens": "user_id",
+    "tink_webhook_events": "user_id", "subscriptions_archive": "owner_id", "subscriptions": "owner_id",
+}
+
+@rpc("delete_user_rows_batch", writes=True)
+def rpc_delete_user_rows_batch(conn: sqlite3.Connection, args: Dict[str, Any]) -> int:
+    table = args["p_table"]
+    column = USER_COLUMNS.get(table)
+    if column is None:
+        raise StorageError(f"delete_user_rows_batch: unsupported table {table}")
+    return conn.execute(
+        f'DELETE FROM "{table}" WHERE rowid IN (SELECT rowid FROM "{table}" WHERE "{column}" = ? LIMIT ?)',
+        (args["p_user_id"], int(args.get("p_limit", 500))),
+    ).rowcount
+
+def main() -> None:
+    from logging_config import setup_logging, shutdown_logging
+
+    setup_logging()
+    try:
+        SQLiteClient().close()
+    finally:
+        shutdown_logging()
+
+if __name__ == "__main__":
+    main()
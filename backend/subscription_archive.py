@@ -0,0 +1,78 @@
+"""Archival of long-deleted subscriptions.
+
+Deleting a subscription only marks it inactive. A job in every API
+process moves subscriptions that have been inactive for
+SUBSCRIPTION_ARCHIVE_AFTER_DAYS from `subscriptions` to
+`subscriptions_archive`, so the live table and its indexes grow with
+active data only. Each batch of at most SUBSCRIPTION_ARCHIVE_BATCH_SIZE
+rows is one short statement, followed by a pause of
+SUBSCRIPTION_ARCHIVE_BATCH_PAUSE_SECONDS. Concurrent workers skip rows
+another worker holds.
+
+Archived subscriptions still appear in data exports and can be brought
+back with POST /api/subscriptions/{id}/restore.
+
+    python subscription_archive.py   # archive everything due once, e.g. from cron
+"""
+import os
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+
+from logging_config import get_logger, setup_logging, shutdown_logging
+from periodic import PeriodicJob
+from resources import resources
+from supabase_client import archive_inactive_subscriptions
+
+load_dotenv()
+
+logger = get_logger("subscription_archive")
+
+SUBSCRIPTION_ARCHIVE_AFTER_DAYS = int(os.getenv("SUBSCRIPTION_ARCHIVE_AFTER_DAYS", 90))
+SUBSCRIPTION_ARCHIVE_BATCH_SIZE = int(os.getenv("SUBSCRIPTION_ARCHIVE_BATCH_SIZE", 500))
+SUBSCRIPTION_ARCHIVE_BATCH_PAUSE_SECONDS = float(os.getenv("SUBSCRIPTION_ARCHIVE_BATCH_PAUSE_SECONDS", 0.05))
+SUBSCRIPTION_ARCHIVE_INTERVAL_SECONDS = float(os.getenv("SUBSCRIPTION_ARCHIVE_INTERVAL_SECONDS", 3600))
+
+class SubscriptionArchiver:
+    def __init__(self, after_days: int = SUBSCRIPTION_ARCHIVE_AFTER_DAYS, batch_size: int = SUBSCRIPTION_ARCHIVE_BATCH_SIZE,
+                 pause: float = SUBSCRIPTION_ARCHIVE_BATCH_PAUSE_SECONDS):
+        self.after_days = after_days
+        self.batch_size = batch_size
+        self.pause = pause
+        self._job = PeriodicJob(self.run_once, logger, "Subscription archive pass failed")
+
+    async def run_once(self) -> int:
+        """Archive in batches until nothing is due; returns how many subscriptions were moved"""
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=self.after_days)).isoformat()
+        archived = 0
+        while True:
+            moved = await archive_inactive_subscriptions(cutoff, self.batch_size)
+            archived += moved
+            if moved < self.batch_size:
+                break
+            await asyncio.sleep(self.pause)
+        if archived:
+            logger.info("Subscriptions archived", extra={"archived": archived, "inactive_before": cutoff})
+        return archived
+
+    # ---------- Background loop ----------
+
+    def start(self, interval: float = SUBSCRIPTION_ARCHIVE_INTERVAL_SECONDS) -> None:
+        self._job.start(interval)
+
+    async def stop(self) -> None:
+        await self._job.stop()
+
+archiver = SubscriptionArchiver()
+
+async def main() -> None:
+    setup_logging()
+    try:
+        await archiver.run_once()
+    finally:
+        await resources.close()
+        shutdown_logging()
+
+if __name__ == "__main__":
+    asyncio.run(main())
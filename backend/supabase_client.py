@@ -1,34 +1,52 @@
-import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
-from typing import Optional, List, Dict, Any
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any, Callable
 
-load_dotenv()
+from logging_config import get_logger
+from metrics import instrument
+from replicas import router
+from resources import resources
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+logger = get_logger("db")
 
-if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
-    raise ValueError("SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY not found in environment variables.")
+def get_client():
+    """Shared database client, created on first use by the resource container.
 
-# Initialize Supabase client with service role key (bypasses RLS)
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    Supabase by default; with STORAGE_BACKEND=sqlite an embedded SQLite
+    database that implements the same query builder (sqlite_store.py).
+    """
+    return resources.database
+
+def maybe_single(query) -> Optional[Dict[str, Any]]:
+    """Run a query expected to match at most one row and return that row or None.
+
+    postgrest-py returns None instead of an empty response when nothing matches.
+    """
+    response = query.maybe_single().execute()
+    return response.data if response else None
+
+def read(query: Callable[[Any], Any], user_id: Optional[int] = None) -> Any:
+    """Run a read-only query(client) on a read replica when one may serve it, else on the primary.
+
+    Pass the user whose data is read so their own recent writes stay visible (replicas.py).
+    """
+    return router.read(query, user_id)
 
 # ========== USER OPERATIONS ==========
 
+@instrument("supabase")
 async def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
     """Get user by email address"""
     try:
-        response = supabase.table("users").select("*").eq("email", email).maybeSingle().execute()
-        return response.data
+        return maybe_single(get_client().table("users").select("*").eq("email", email))
     except Exception as e:
-        print(f"[get_user_by_email] Error: {e}")
+        logger.error("Database call failed", extra={"operation": "get_user_by_email", "error": str(e)})
         raise
 
+@instrument("supabase")
 async def create_user(email: str, hashed_password: str) -> Dict[str, Any]:
     """Create a new user"""
     try:
-        response = supabase.table("users").insert({
+        response = get_client().table("users").insert({
             "email": email,
             "hashed_password": hashed_password
         }).execute()
@@ -37,126 +55,266 @@ async def create_user(email: str, hashed_password: str) -> Dict[str, Any]:
             return response.data[0]
         raise Exception("Failed to create user - no data returned")
     except Exception as e:
-        print(f"[create_user] Error: {e}")
+        logger.error("Database call failed", extra={"operation": "create_user", "error": str(e)})
         raise
 
+@instrument("supabase")
 async def update_user_last_login(user_id: int) -> bool:
     """Update user's last login timestamp"""
     try:
         from datetime import datetime
-        response = supabase.table("users").update({
+        response = get_client().table("users").update({
             "last_login": datetime.utcnow().isoformat()
         }).eq("id", user_id).execute()
         return True
     except Exception as e:
-        print(f"[update_user_last_login] Error: {e}")
+        logger.error("Database call failed", extra={"operation": "update_user_last_login", "error": str(e)})
         return False
 
+@instrument("supabase")
+async def deactivate_user(user_id: int) -> bool:
+    """Mark a user inactive so login and token refresh stop working"""
+    try:
+        get_client().table("users").update({"is_active": False}).eq("id", user_id).execute()
+        return True
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "deactivate_user", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def delete_user(user_id: int) -> bool:
+    """Delete the user row itself (dependent rows are expected to be gone already)"""
+    try:
+        get_client().table("users").delete().eq("id", user_id).execute()
+        return True
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "delete_user", "error": str(e)})
+        raise
+
 # ========== SUBSCRIPTION OPERATIONS ==========
 
+@instrument("supabase")
 async def create_subscription(data: Dict[str, Any]) -> Dict[str, Any]:
     """Create a new subscription"""
     try:
-        print(f"[create_subscription] Creating subscription with data: {data}")
-        response = supabase.table("subscriptions").insert(data).execute()
+        logger.debug("Creating subscription", extra={"owner_id": data.get("owner_id"), "title": data.get("title")})
+        response = get_client().table("subscriptions").insert(data).execute()
+        router.note_write(data.get("owner_id"))
 
         if response.data and len(response.data) > 0:
             return response.data[0]
         raise Exception("Failed to create subscription - no data returned")
     except Exception as e:
-        print(f"[create_subscription] Error: {e}")
+        logger.error("Database call failed", extra={"operation": "create_subscription", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def create_subscriptions(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Insert several subscriptions in one request"""
+    if not rows:
+        return []
+    try:
+        response = get_client().table("subscriptions").insert(rows).execute()
+        for owner_id in {row.get("owner_id") for row in rows}:
+            router.note_write(owner_id)
+        return response.data or []
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "create_subscriptions", "error": str(e)})
         raise
 
+@instrument("supabase")
 async def get_subscriptions_by_owner(owner_id: int) -> List[Dict[str, Any]]:
     """Get all active subscriptions for a user"""
     try:
-        response = supabase.table("subscriptions")\
-            .select("*")\
-            .eq("owner_id", owner_id)\
-            .eq("is_active", True)\
-            .order("created_at", desc=True)\
-            .execute()
+        response = read(lambda db: db.table("subscriptions")
+            .select("*")
+            .eq("owner_id", owner_id)
+            .eq("is_active", True)
+            .order("created_at", desc=True)
+            .execute(), owner_id)
+        return response.data or []
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "get_subscriptions_by_owner", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def get_subscriptions_renewing_before(owner_id: int, before: str) -> List[Dict[str, Any]]:
+    """Active subscriptions with renewal_date <= before (range scan on owner_id, renewal_date)"""
+    try:
+        response = read(lambda db: db.table("subscriptions")
+            .select("id,title,amount,currency,frequency,category,logo_url,renewal_date")
+            .eq("owner_id", owner_id)
+            .eq("is_active", True)
+            .lte("renewal_date", before)
+            .order("renewal_date")
+            .execute(), owner_id)
+        return response.data or []
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "get_subscriptions_renewing_before", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def get_subscriptions_page(owner_id: int, after_id: int = 0, limit: int = 500) -> List[Dict[str, Any]]:
+    """All of a user's subscriptions, including deleted ones, with id > after_id in id order"""
+    try:
+        response = read(lambda db: db.table("subscriptions")
+            .select("*")
+            .eq("owner_id", owner_id)
+            .gt("id", after_id)
+            .order("id")
+            .limit(limit)
+            .execute(), owner_id)
         return response.data or []
     except Exception as e:
-        print(f"[get_subscriptions_by_owner] Error: {e}")
+        logger.error("Database call failed", extra={"operation": "get_subscriptions_page", "error": str(e)})
         raise
 
+@instrument("supabase")
 async def get_subscription_by_id(subscription_id: int, owner_id: int) -> Optional[Dict[str, Any]]:
     """Get a specific subscription by ID (with owner verification)"""
     try:
-        response = supabase.table("subscriptions")\
-            .select("*")\
-            .eq("id", subscription_id)\
-            .eq("owner_id", owner_id)\
-            .maybeSingle()\
-            .execute()
-        return response.data
+        return maybe_single(get_client().table("subscriptions")
+            .select("*")
+            .eq("id", subscription_id)
+            .eq("owner_id", owner_id))
     except Exception as e:
-        print(f"[get_subscription_by_id] Error: {e}")
+        logger.error("Database call failed", extra={"operation": "get_subscription_by_id", "error": str(e)})
         raise
 
+@instrument("supabase")
 async def update_subscription(subscription_id: int, owner_id: int, data: Dict[str, Any]) -> Dict[str, Any]:
     """Update a subscription"""
     try:
-        response = supabase.table("subscriptions")\
+        response = get_client().table("subscriptions")\
             .update(data)\
             .eq("id", subscription_id)\
             .eq("owner_id", owner_id)\
             .execute()
+        router.note_write(owner_id)
 
         if response.data and len(response.data) > 0:
             return response.data[0]
         raise Exception("Failed to update subscription")
     except Exception as e:
-        print(f"[update_subscription] Error: {e}")
+        logger.error("Database call failed", extra={"operation": "update_subscription", "error": str(e)})
         raise
 
-async def delete_subscription(subscription_id: int) -> bool:
+@instrument("supabase")
+async def delete_subscription(subscription_id: int, owner_id: Optional[int] = None) -> bool:
     """Soft delete a subscription by setting is_active to False"""
     try:
-        print(f"[delete_subscription] Soft deleting subscription {subscription_id}")
-        response = supabase.table("subscriptions")\
+        response = get_client().table("subscriptions")\
             .update({"is_active": False})\
             .eq("id", subscription_id)\
             .execute()
-        print(f"[delete_subscription] Successfully soft deleted subscription {subscription_id}")
+        router.note_write(owner_id)
+        logger.debug("Soft deleted subscription", extra={"subscription_id": subscription_id})
         return True
     except Exception as e:
-        print(f"[delete_subscription] Error: {e}")
+        logger.error("Database call failed", extra={"operation": "delete_subscription", "error": str(e)})
+        raise
+
+# ========== SUBSCRIPTION ARCHIVE ==========
+
+@instrument("supabase")
+async def get_archived_subscriptions_page(owner_id: int, after_id: int = 0, limit: int = 500) -> List[Dict[str, Any]]:
+    """A user's archived subscriptions with id > after_id in id order"""
+    try:
+        response = read(lambda db: db.table("subscriptions_archive")
+            .select("*")
+            .eq("owner_id", owner_id)
+            .gt("id", after_id)
+            .order("id")
+            .limit(limit)
+            .execute(), owner_id)
+        return response.data or []
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "get_archived_subscriptions_page", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def archive_inactive_subscriptions(inactive_before: str, limit: int) -> int:
+    """Move up to `limit` subscriptions inactive since before the cutoff to the archive; returns how many moved"""
+    try:
+        response = get_client().rpc("archive_inactive_subscriptions", {
+            "p_inactive_before": inactive_before,
+            "p_limit": limit,
+        }).execute()
+        return int(response.data or 0)
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "archive_inactive_subscriptions", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def restore_archived_subscription(subscription_id: int, owner_id: int, activate: bool = True) -> Optional[Dict[str, Any]]:
+    """Move an archived subscription back, active again unless activate is False; None if not archived"""
+    try:
+        response = get_client().rpc("restore_archived_subscription", {
+            "p_subscription_id": subscription_id,
+            "p_owner_id": owner_id,
+            "p_activate": activate,
+        }).execute()
+        router.note_write(owner_id)
+        return response.data[0] if response.data else None
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "restore_archived_subscription", "error": str(e)})
         raise
 
 # ========== MERCHANT CANCEL LINKS ==========
 
+@instrument("supabase")
 async def get_merchant_cancel_link(merchant_name: str) -> Optional[Dict[str, Any]]:
     """Get cancellation link for a merchant"""
     try:
-        response = supabase.table("merchant_cancel_links")\
-            .select("*")\
-            .eq("merchant_name", merchant_name)\
-            .eq("is_active", True)\
-            .maybeSingle()\
-            .execute()
-        return response.data
+        return read(lambda db: maybe_single(db.table("merchant_cancel_links")
+            .select("*")
+            .eq("merchant_name", merchant_name)
+            .eq("is_active", True)))
     except Exception as e:
-        print(f"[get_merchant_cancel_link] Error: {e}")
+        logger.error("Database call failed", extra={"operation": "get_merchant_cancel_link", "error": str(e)})
         return None
 
+@instrument("supabase")
 async def search_merchant_cancel_links(query: str) -> List[Dict[str, Any]]:
     """Search for merchant cancel links by name"""
     try:
-        response = supabase.table("merchant_cancel_links")\
-            .select("*")\
-            .ilike("merchant_name", f"%{query}%")\
-            .eq("is_active", True)\
-            .limit(10)\
-            .execute()
+        response = read(lambda db: db.table("merchant_cancel_links")
+            .select("*")
+            .ilike("merchant_name", f"%{query}%")
+            .eq("is_active", True)
+            .limit(10)
+            .execute())
         return response.data or []
     except Exception as e:
-        print(f"[search_merchant_cancel_links] Error: {e}")
+        logger.error("Database call failed", extra={"operation": "search_merchant_cancel_links", "error": str(e)})
         return []
 
+@instrument("supabase")
+async def claim_cancel_links_to_check(checked_before: str, limit: int = 100) -> List[Dict[str, Any]]:
+    """Claim active url links not checked since the cutoff, most reported and least recently verified first"""
+    try:
+        response = get_client().rpc("claim_cancel_links_to_check", {
+            "p_checked_before": checked_before,
+            "p_limit": limit,
+        }).execute()
+        return response.data or []
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "claim_cancel_links_to_check", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def record_cancel_link_checks(results: List[Dict[str, Any]]) -> int:
+    """Write back {id, ok, error} check results in one call; returns how many links were updated"""
+    try:
+        response = get_client().rpc("record_cancel_link_checks", {"p_results": results}).execute()
+        return int(response.data or 0)
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "record_cancel_link_checks", "error": str(e)})
+        raise
+
 # ========== ANALYTICS OPERATIONS ==========
 
+@instrument("supabase")
 async def log_analytics_event(
     user_id: int,
     event_type: str,
@@ -187,26 +345,28 @@ async def log_analytics_event(
         if app_version:
             data["app_version"] = app_version
 
-        supabase.table("analytics_events").insert(data).execute()
+        get_client().table("analytics_events").insert(data).execute()
         return True
     except Exception as e:
-        print(f"[log_analytics_event] Error: {e}")
+        logger.error("Database call failed", extra={"operation": "log_analytics_event", "error": str(e)})
         return False
 
 # ========== NOTIFICATION PREFERENCES ==========
 
+@instrument("supabase")
 async def get_user_notification_preferences(user_id: int) -> List[Dict[str, Any]]:
     """Get all notification preferences for a user"""
     try:
-        response = supabase.table("notification_preferences")\
-            .select("*")\
-            .eq("user_id", user_id)\
-            .execute()
+        response = read(lambda db: db.table("notification_preferences")
+            .select("*")
+            .eq("user_id", user_id)
+            .execute(), user_id)
         return response.data or []
     except Exception as e:
-        print(f"[get_user_notification_preferences] Error: {e}")
+        logger.error("Database call failed", extra={"operation": "get_user_notification_preferences", "error": str(e)})
         return []
 
+@instrument("supabase")
 async def update_notification_preference(
     user_id: int,
     notification_type: str,
@@ -216,7 +376,7 @@ async def update_notification_preference(
     """Update or create a notification preference"""
     try:
         # Check if preference exists
-        query = supabase.table("notification_preferences")\
+        query = get_client().table("notification_preferences")\
             .select("*")\
             .eq("user_id", user_id)\
             .eq("notification_type", notification_type)
@@ -226,7 +386,7 @@ async def update_notification_preference(
         else:
             query = query.is_("subscription_id", "null")
 
-        existing = query.maybeSingle().execute()
+        existing = maybe_single(query)
 
         data = {
             "user_id": user_id,
@@ -237,23 +397,54 @@ async def update_notification_preference(
         if subscription_id:
             data["subscription_id"] = subscription_id
 
-        if existing.data:
+        if existing:
             # Update existing
-            supabase.table("notification_preferences")\
+            get_client().table("notification_preferences")\
                 .update({"is_enabled": is_enabled})\
-                .eq("id", existing.data["id"])\
+                .eq("id", existing["id"])\
                 .execute()
         else:
             # Create new
-            supabase.table("notification_preferences").insert(data).execute()
+            get_client().table("notification_preferences").insert(data).execute()
+        router.note_write(user_id)
 
         return True
     except Exception as e:
-        print(f"[update_notification_preference] Error: {e}")
+        logger.error("Database call failed", extra={"operation": "update_notification_preference", "error": str(e)})
         return False
 
+@instrument("supabase")
+async def resolve_notification_preferences(subscription_ids: List[int], notification_type: str) -> Dict[int, Dict[str, Any]]:
+    """Effective preference per subscription (override -> global -> default) in one query"""
+    if not subscription_ids:
+        return {}
+    try:
+        response = read(lambda db: db.rpc("resolve_notification_preferences", {
+            "p_subscription_ids": subscription_ids,
+            "p_notification_type": notification_type,
+        }).execute())
+        return {row["subscription_id"]: row for row in response.data or []}
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "resolve_notification_preferences", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def get_due_renewal_reminders(as_of: str, after_subscription_id: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+    """Subscriptions whose renewal reminder is due on as_of (keyset on subscription id)"""
+    try:
+        response = read(lambda db: db.rpc("get_due_renewal_reminders", {
+            "p_as_of": as_of,
+            "p_after_subscription_id": after_subscription_id,
+            "p_limit": limit,
+        }).execute())
+        return response.data or []
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "get_due_renewal_reminders", "error": str(e)})
+        raise
+
 # ========== PUSH TOKENS ==========
 
+@instrument("supabase")
 async def register_push_token(
     user_id: int,
     expo_push_token: str,
@@ -266,11 +457,9 @@ async def register_push_token(
     """Register or update a push notification token"""
     try:
         # Check if token already exists
-        existing = supabase.table("push_tokens")\
-            .select("*")\
-            .eq("expo_push_token", expo_push_token)\
-            .maybeSingle()\
-            .execute()
+        existing = maybe_single(get_client().table("push_tokens")
+            .select("*")
+            .eq("expo_push_token", expo_push_token))
 
         data = {
             "user_id": user_id,
@@ -288,33 +477,456 @@ async def register_push_token(
         if app_version:
             data["app_version"] = app_version
 
-        if existing.data:
+        if existing:
             # Update existing token
-            supabase.table("push_tokens")\
+            get_client().table("push_tokens")\
                 .update(data)\
-                .eq("id", existing.data["id"])\
+                .eq("id", existing["id"])\
                 .execute()
         else:
             # Insert new token
-            supabase.table("push_tokens").insert(data).execute()
+            get_client().table("push_tokens").insert(data).execute()
+        router.note_write(user_id)
 
         return True
     except Exception as e:
-        print(f"[register_push_token] Error: {e}")
+        logger.error("Database call failed", extra={"operation": "register_push_token", "error": str(e)})
         return False
 
+@instrument("supabase")
 async def get_user_push_tokens(user_id: int) -> List[str]:
     """Get all active push tokens for a user"""
     try:
-        response = supabase.table("push_tokens")\
-            .select("expo_push_token")\
+        response = read(lambda db: db.table("push_tokens")
+            .select("expo_push_token")
+            .eq("user_id", user_id)
+            .eq("is_active", True)
+            .execute(), user_id)
+
+        if response.data:
+            return [token["expo_push_token"] for token in response.data]
+        return []
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "get_user_push_tokens", "error": str(e)})
+        return []
+
+@instrument("supabase")
+async def get_push_tokens_for_users(user_ids: List[int]) -> List[Dict[str, Any]]:
+    """Active push tokens for a batch of users in one query"""
+    if not user_ids:
+        return []
+    try:
+        response = read(lambda db: db.table("push_tokens")
+            .select("id,user_id,expo_push_token")
+            .in_("user_id", user_ids)
+            .eq("is_active", True)
+            .execute())
+        return response.data or []
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "get_push_tokens_for_users", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def deactivate_push_tokens(expo_push_tokens: List[str]) -> bool:
+    """Mark tokens the push service reported as unregistered"""
+    if not expo_push_tokens:
+        return True
+    try:
+        get_client().table("push_tokens")\
+            .update({"is_active": False})\
+            .in_("expo_push_token", expo_push_tokens)\
+            .execute()
+        return True
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "deactivate_push_tokens", "error": str(e)})
+        return False
+
+# ========== TINK TOKENS ==========
+
+@instrument("supabase")
+async def upsert_tink_token(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Insert or replace the (encrypted) token for a user's bank connection"""
+    try:
+        response = get_client().table("tink_tokens")\
+            .upsert(data, on_conflict="user_id,bank_name")\
+            .execute()
+
+        if response.data and len(response.data) > 0:
+            return response.data[0]
+        raise Exception("Failed to store Tink token - no data returned")
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "upsert_tink_token", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def get_tink_tokens(user_id: int) -> List[Dict[str, Any]]:
+    """Get a user's active bank connections"""
+    try:
+        response = get_client().table("tink_tokens")\
+            .select("*")\
             .eq("user_id", user_id)\
             .eq("is_active", True)\
             .execute()
+        return response.data or []
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "get_tink_tokens", "error": str(e)})
+        raise
 
-        if response.data:
-            return [token["expo_push_token"] for token in response.data]
+@instrument("supabase")
+async def get_tink_tokens_for_users(user_ids: List[int]) -> List[Dict[str, Any]]:
+    """Get active bank connections for a batch of users in one query"""
+    if not user_ids:
         return []
+    try:
+        response = get_client().table("tink_tokens")\
+            .select("*")\
+            .in_("user_id", user_ids)\
+            .eq("is_active", True)\
+            .execute()
+        return response.data or []
     except Exception as e:
-        print(f"[get_user_push_tokens] Error: {e}")
+        logger.error("Database call failed", extra={"operation": "get_tink_tokens_for_users", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def get_user_id_for_tink_user(tink_user_id: str) -> Optional[int]:
+    """Our user id for a Tink user id stored with a bank connection, None if no connection has it"""
+    try:
+        response = get_client().table("tink_tokens")\
+            .select("user_id")\
+            .eq("tink_user_id", tink_user_id)\
+            .order("updated_at", desc=True)\
+            .limit(1)\
+            .execute()
+        rows = response.data or []
+        return rows[0]["user_id"] if rows else None
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "get_user_id_for_tink_user", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def update_tink_token(token_id: int, data: Dict[str, Any]) -> bool:
+    """Update fields of a stored Tink token"""
+    try:
+        get_client().table("tink_tokens")\
+            .update(data)\
+            .eq("id", token_id)\
+            .execute()
+        return True
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "update_tink_token", "error": str(e)})
+        return False
+
+@instrument("supabase")
+async def get_tokens_expiring_soon(days_threshold: int = 15) -> List[Dict[str, Any]]:
+    """Active tokens expiring within the threshold, soonest first"""
+    try:
+        response = get_client().rpc("get_tokens_expiring_soon", {"days_threshold": days_threshold}).execute()
+        return response.data or []
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "get_tokens_expiring_soon", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def get_tink_tokens_due_for_sync(synced_before: datetime, limit: int = 100,
+                                       exclude_user_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+    """Active connections never synced or last synced before the cutoff, oldest first"""
+    try:
+        query = get_client().table("tink_tokens")\
+            .select("*")\
+            .eq("is_active", True)
+        if exclude_user_ids:
+            query = query.not_.in_("user_id", exclude_user_ids)
+        response = query\
+            .order("last_sync_at", desc=False, nullsfirst=True)\
+            .limit(limit)\
+            .execute()
+        # Ordered by last_sync_at, so everything after the first recent row is recent too
+        due = []
+        for row in response.data or []:
+            if row.get("last_sync_at") and datetime.fromisoformat(row["last_sync_at"].replace("Z", "+00:00")) >= synced_before:
+                break
+            due.append(row)
+        return due
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "get_tink_tokens_due_for_sync", "error": str(e)})
+        raise
+
+# ========== TINK WEBHOOK EVENTS ==========
+
+@instrument("supabase")
+async def enqueue_tink_webhook_event(data: Dict[str, Any]) -> bool:
+    """Store a received webhook event; False if an event with the same event_id was stored before"""
+    try:
+        response = get_client().table("tink_webhook_events")\
+            .upsert(data, on_conflict="event_id", ignore_duplicates=True)\
+            .execute()
+        return bool(response.data)
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "enqueue_tink_webhook_event", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def claim_tink_webhook_events(quiet_seconds: int, max_delay_seconds: int, lease_seconds: int) -> List[Dict[str, Any]]:
+    """All open events of the next user whose burst of events is over, leased to this worker"""
+    try:
+        response = get_client().rpc("claim_tink_webhook_events", {
+            "p_quiet_seconds": quiet_seconds,
+            "p_max_delay_seconds": max_delay_seconds,
+            "p_lease_seconds": lease_seconds,
+        }).execute()
+        return response.data or []
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "claim_tink_webhook_events", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def update_tink_webhook_events(event_ids: List[int], data: Dict[str, Any]) -> bool:
+    if not event_ids:
+        return True
+    try:
+        get_client().table("tink_webhook_events").update(data).in_("id", event_ids).execute()
+        return True
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "update_tink_webhook_events", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def delete_processed_tink_webhook_events(received_before: str) -> bool:
+    """Forget processed events old enough that Tink won't redeliver them"""
+    try:
+        get_client().table("tink_webhook_events")\
+            .delete()\
+            .eq("status", "processed")\
+            .lt("received_at", received_before)\
+            .execute()
+        return True
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "delete_processed_tink_webhook_events", "error": str(e)})
+        return False
+
+# ========== TRANSACTION STORE ==========
+
+@instrument("supabase")
+async def insert_new_transactions(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Insert transactions, skipping ones already stored; returns only the newly inserted rows"""
+    if not rows:
         return []
+    try:
+        response = get_client().table("transactions")\
+            .upsert(rows, on_conflict="user_id,external_id", ignore_duplicates=True)\
+            .execute()
+        for user_id in {row.get("user_id") for row in rows}:
+            router.note_write(user_id)
+        return response.data or []
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "insert_new_transactions", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def get_transactions_page(user_id: int, after_id: int = 0, limit: int = 500) -> List[Dict[str, Any]]:
+    """A user's stored transactions with id > after_id in id order"""
+    try:
+        response = read(lambda db: db.table("transactions")
+            .select("id,external_id,account_id,merchant_key,description,amount,currency,booked_date,subscription_id,created_at")
+            .eq("user_id", user_id)
+            .gt("id", after_id)
+            .order("id")
+            .limit(limit)
+            .execute(), user_id)
+        return response.data or []
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "get_transactions_page", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def get_transaction_series(user_id: int, merchant_keys: List[str]) -> List[Dict[str, Any]]:
+    """Charge history summaries for the given merchants of one user"""
+    if not merchant_keys:
+        return []
+    try:
+        response = get_client().table("transaction_series")\
+            .select("*")\
+            .eq("user_id", user_id)\
+            .in_("merchant_key", merchant_keys)\
+            .execute()
+        return response.data or []
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "get_transaction_series", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def save_transaction_series(rows: List[Dict[str, Any]]) -> List[str]:
+    """Write back charge series in one call, each only if its version is still the one read.
+
+    Returns the merchant keys written; the others were changed concurrently.
+    """
+    if not rows:
+        return []
+    try:
+        response = get_client().rpc("save_transaction_series", {"p_rows": rows}).execute()
+        return [row["merchant_key"] for row in response.data or []]
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "save_transaction_series", "error": str(e)})
+        raise
+
+# ========== NOTIFICATION EVENTS ==========
+
+@instrument("supabase")
+async def create_notification_events(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Queue notification events; events whose dedupe_key already exists are skipped"""
+    if not rows:
+        return []
+    try:
+        response = get_client().table("notification_events")\
+            .upsert(rows, on_conflict="dedupe_key", ignore_duplicates=True)\
+            .execute()
+        return response.data or []
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "create_notification_events", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def get_notification_events_by_keys(dedupe_keys: List[str], status: str = "pending") -> List[Dict[str, Any]]:
+    """Events with the given dedupe keys and status, e.g. to resume an interrupted send"""
+    if not dedupe_keys:
+        return []
+    try:
+        response = get_client().table("notification_events")\
+            .select("*")\
+            .in_("dedupe_key", dedupe_keys)\
+            .eq("status", status)\
+            .execute()
+        return response.data or []
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "get_notification_events_by_keys", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def mark_notification_events(event_ids: List[int], status: str) -> bool:
+    """Set the delivery status of a batch of events"""
+    if not event_ids:
+        return True
+    try:
+        get_client().table("notification_events")\
+            .update({"status": status, "processed_at": datetime.now(timezone.utc).isoformat()})\
+            .in_("id", event_ids)\
+            .execute()
+        return True
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "mark_notification_events", "error": str(e)})
+        raise
+
+# ========== DIGESTS ==========
+
+@instrument("supabase")
+async def get_weekly_digest_batch(after_user_id: int, limit: int, as_of: str) -> List[Dict[str, Any]]:
+    """Digest figures for the next page of opted-in users (keyset on user id)"""
+    try:
+        response = read(lambda db: db.rpc("get_weekly_digest_batch", {
+            "p_after_user_id": after_user_id,
+            "p_limit": limit,
+            "p_as_of": as_of,
+        }).execute())
+        return response.data or []
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "get_weekly_digest_batch", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def get_or_create_digest_run(digest_type: str, period_start: str) -> Dict[str, Any]:
+    """Checkpoint row for a digest period, created on first use"""
+    try:
+        existing = maybe_single(get_client().table("digest_runs")
+            .select("*")
+            .eq("digest_type", digest_type)
+            .eq("period_start", period_start))
+        if existing:
+            return existing
+        response = get_client().table("digest_runs").insert({
+            "digest_type": digest_type,
+            "period_start": period_start,
+        }).execute()
+        return response.data[0]
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "get_or_create_digest_run", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def update_digest_run(run_id: int, data: Dict[str, Any]) -> bool:
+    """Advance a digest checkpoint"""
+    try:
+        get_client().table("digest_runs").update(data).eq("id", run_id).execute()
+        return True
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "update_digest_run", "error": str(e)})
+        raise
+
+# ========== ACCOUNT DELETION ==========
+
+@instrument("supabase")
+async def request_account_deletion(user_id: int) -> Dict[str, Any]:
+    """The user's pending or running deletion job, created if there is none"""
+    try:
+        existing = maybe_single(get_client().table("account_deletions")
+            .select("*")
+            .eq("user_id", user_id)
+            .in_("status", ["pending", "running"]))
+        if existing:
+            return existing
+        response = get_client().table("account_deletions").insert({"user_id": user_id}).execute()
+        return response.data[0]
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "request_account_deletion", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def get_account_deletion(deletion_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        return maybe_single(get_client().table("account_deletions").select("*").eq("id", deletion_id))
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "get_account_deletion", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def claim_account_deletion(lease_seconds: int) -> Optional[Dict[str, Any]]:
+    """Next pending (or abandoned) deletion job, leased to this worker"""
+    try:
+        response = get_client().rpc("claim_account_deletion", {"p_lease_seconds": lease_seconds}).execute()
+        return response.data[0] if response.data else None
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "claim_account_deletion", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def update_account_deletion(deletion_id: str, data: Dict[str, Any]) -> bool:
+    try:
+        get_client().table("account_deletions").update(data).eq("id", deletion_id).execute()
+        return True
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "update_account_deletion", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def anonymize_analytics_events_batch(user_id: int, limit: int) -> int:
+    """Detach up to `limit` analytics events from a user; returns how many were changed"""
+    try:
+        response = get_client().rpc("anonymize_analytics_events_batch", {"p_user_id": user_id, "p_limit": limit}).execute()
+        return int(response.data or 0)
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "anonymize_analytics_events_batch", "error": str(e)})
+        raise
+
+@instrument("supabase")
+async def delete_user_rows_batch(table: str, user_id: int, limit: int) -> int:
+    """Delete up to `limit` of a user's rows from a dependent table; returns how many were deleted"""
+    try:
+        response = get_client().rpc("delete_user_rows_batch", {
+            "p_table": table,
+            "p_user_id": user_id,
+            "p_limit": limit,
+        }).execute()
+        return int(response.data or 0)
+    except Exception as e:
+        logger.error("Database call failed", extra={"operation": "delete_user_rows_batch", "table": table, "error": str(e)})
+        raise
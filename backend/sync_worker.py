@@ -0,0 +1,369 @@
+"""Background bank sync worker.
+
+    python sync_worker.py            # loop forever
+    python sync_worker.py --once     # one batch, then exit
+
+Picks the bank connections whose `last_sync_at` is oldest, fetches their
+recent Tink transactions, runs subscription detection, stores the
+results and feeds new charges to the price-change detector. Tink calls are scheduled round-robin across users (one page at a
+time) under a global and a per-user rate limit, so a user with many
+accounts cannot starve the rest of the batch.
+"""
+import os
+import argparse
+import asyncio
+import time
+from collections import deque
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from dotenv import load_dotenv
+
+from charge_detector import ingest_transactions
+from detection import detect_subscriptions
+from logging_config import get_logger, setup_logging, shutdown_logging
+from metrics import span
+from resources import resources
+from supabase_client import (
+    create_subscriptions, get_subscriptions_by_owner, get_tink_tokens_due_for_sync, update_subscription, update_tink_token
+)
+from tink_vault import vault
+
+load_dotenv()
+
+logger = get_logger("sync_worker")
+
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", 200))
+SYNC_INTERVAL_SECONDS = float(os.getenv("SYNC_INTERVAL_SECONDS", 60))
+# Connections synced more recently than this are skipped
+SYNC_MIN_AGE_HOURS = float(os.getenv("SYNC_MIN_AGE_HOURS", 12))
+SYNC_LOOKBACK_DAYS = int(os.getenv("SYNC_LOOKBACK_DAYS", 180))
+SYNC_MAX_PAGES_PER_ACCOUNT = int(os.getenv("SYNC_MAX_PAGES_PER_ACCOUNT", 5))
+# Tink calls in flight across all users, and requests/second overall and per user
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", 16))
+SYNC_GLOBAL_RATE = float(os.getenv("SYNC_GLOBAL_RATE", 20))
+SYNC_USER_RATE = float(os.getenv("SYNC_USER_RATE", 2))
+SYNC_USER_CONCURRENCY = int(os.getenv("SYNC_USER_CONCURRENCY", 2))
+SYNC_DETECTION_CONCURRENCY = int(os.getenv("SYNC_DETECTION_CONCURRENCY", 4))
+# Detected subscriptions below this confidence are left for the user to import by hand
+SYNC_MIN_CONFIDENCE = int(os.getenv("SYNC_MIN_CONFIDENCE", 85))
+SYNC_FAILURE_BACKOFF_SECONDS = float(os.getenv("SYNC_FAILURE_BACKOFF_SECONDS", 900))
+
+# ========== RATE LIMITING ==========
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available; 0 if one is available now"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+# ========== FAIR SCHEDULER ==========
+
+Job = Callable[[], Awaitable[None]]
+
+class _UserQueue:
+    __slots__ = ("jobs", "in_flight", "bucket")
+
+    def __init__(self, rate: float):
+        self.jobs: Deque[Job] = deque()
+        self.in_flight = 0
+        self.bucket = TokenBucket(rate)
+
+class FairScheduler:
+    """Runs jobs round-robin across users, one job per user per turn.
+
+    A job may add follow-up jobs (next page, next account) for its user; those
+    go to the back of that user's queue, so users with many accounts get the
+    same share of calls per turn as users with one.
+    """
+
+    def __init__(self, concurrency: int = SYNC_CONCURRENCY, global_rate: float = SYNC_GLOBAL_RATE,
+                 user_rate: float = SYNC_USER_RATE, user_concurrency: int = SYNC_USER_CONCURRENCY):
+        self.concurrency = concurrency
+        self.global_bucket = TokenBucket(global_rate)
+        self.user_rate = user_rate
+        self.user_concurrency = user_concurrency
+        self.users: Dict[int, _UserQueue] = {}
+        self.ring: Deque[int] = deque()
+        self.in_flight = 0
+        self._changed = asyncio.Condition()
+
+    def add(self, user_id: int, job: Job) -> None:
+        queue = self.users.get(user_id)
+        if queue is None:
+            queue = self.users[user_id] = _UserQueue(self.user_rate)
+            self.ring.append(user_id)
+        queue.jobs.append(job)
+
+    def _pick(self) -> tuple:
+        """Next (user_id, job) in ring order, or (None, seconds to wait)"""
+        wait = self.global_bucket.wait_time()
+        if wait:
+            return None, wait
+        shortest = None
+        for _ in range(len(self.ring)):
+            user_id = self.ring[0]
+            self.ring.rotate(-1)
+            queue = self.users[user_id]
+            if not queue.jobs or queue.in_flight >= self.user_concurrency:
+                continue
+            user_wait = queue.bucket.wait_time()
+            if user_wait:
+                shortest = user_wait if shortest is None else min(shortest, user_wait)
+                continue
+            queue.bucket.take()
+            self.global_bucket.take()
+            return user_id, queue.jobs.popleft()
+        return None, shortest
+
+    def _idle(self) -> bool:
+        return self.in_flight == 0 and not any(q.jobs for q in self.users.values())
+
+    async def _worker(self) -> None:
+        while True:
+            async with self._changed:
+                while True:
+                    if self._idle():
+                        self._changed.notify_all()
+                        return
+                    user_id, picked = self._pick()
+                    if user_id is not None:
+                        job = picked
+                        break
+                    try:
+                        # Woken early when a job finishes; otherwise when a rate limit frees up
+                        await asyncio.wait_for(self._changed.wait(), timeout=picked)
+                    except asyncio.TimeoutError:
+                        pass
+                self.in_flight += 1
+                self.users[user_id].in_flight += 1
+
+            try:
+                await job()
+            except Exception as e:
+                logger.error("Sync job failed", extra={"user_id": user_id, "error": str(e)})
+            finally:
+                async with self._changed:
+                    self.in_flight -= 1
+                    self.users[user_id].in_flight -= 1
+                    self._changed.notify_all()
+
+    async def run(self) -> None:
+        await asyncio.gather(*(self._worker() for _ in range(self.concurrency)))
+
+# ========== PER-USER SYNC ==========
+
+class UserSync:
+    """Transactions collected for one user during a batch"""
+
+    def __init__(self, user_id: int, rows: List[Dict[str, Any]]):
+        self.user_id = user_id
+        self.rows = rows
+        self.transactions: List[Dict[str, Any]] = []
+        self.pending = 0
+        self.failed = False
+
+class SyncWorker:
+    def __init__(self, batch_size: int = SYNC_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.detection_limit = asyncio.Semaphore(SYNC_DETECTION_CONCURRENCY)
+        # user_id -> monotonic time before which the user is skipped
+        self.backoff: Dict[int, float] = {}
+        self._finishing: Set[asyncio.Task] = set()
+
+    async def _tink_get(self, path: str, access_token: str, params: Optional[dict] = None) -> dict:
+        with span("tink", "sync_" + path.rsplit("/", 1)[-1]):
+            response = await resources.tink_http.get(path, headers={"Authorization": f"Bearer {access_token}"}, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def _spawn(self, scheduler: FairScheduler, sync: UserSync, job: Job) -> None:
+        sync.pending += 1
+
+        async def tracked():
+            try:
+                await job()
+            except Exception:
+                sync.failed = True
+                raise
+            finally:
+                sync.pending -= 1
+                if sync.pending == 0:
+                    # Last Tink call for this user finished; detection runs outside the rate limits
+                    self._finishing.add(asyncio.get_running_loop().create_task(self._finish_user(sync)))
+        scheduler.add(sync.user_id, tracked)
+
+    def _accounts_job(self, scheduler: FairScheduler, sync: UserSync, access_token: str) -> Job:
+        async def job():
+            data = await self._tink_get("/data/v2/accounts", access_token)
+            for account in data.get("accounts", []):
+                if account.get("id"):
+                    self._spawn(scheduler, sync, self._transactions_job(scheduler, sync, access_token, account["id"], None, 1))
+        return job
+
+    def _transactions_job(self, scheduler: FairScheduler, sync: UserSync, access_token: str,
+                          account_id: str, page_token: Optional[str], page: int) -> Job:
+        async def job():
+            params = {
+                "accountId": account_id,
+                "pageSize": 100,
+                "bookedDateGte": (date.today() - timedelta(days=SYNC_LOOKBACK_DAYS)).isoformat(),
+            }
+            if page_token:
+                params["pageToken"] = page_token
+            data = await self._tink_get("/data/v2/transactions", access_token, params)
+            sync.transactions.extend(data.get("transactions", []))
+            next_token = data.get("nextPageToken")
+            if next_token and page < SYNC_MAX_PAGES_PER_ACCOUNT:
+                self._spawn(scheduler, sync, self._transactions_job(scheduler, sync, access_token, account_id, next_token, page + 1))
+        return job
+
+    async def _finish_user(self, sync: UserSync) -> None:
+        if sync.failed:
+            self.backoff[sync.user_id] = time.monotonic() + SYNC_FAILURE_BACKOFF_SECONDS
+            self.stats["failed_users"] += 1
+            return
+        try:
+            async with self.detection_limit:
+                detected = await detect_subscriptions(sync.transactions)
+            created, updated = await persist_detected(sync.user_id, detected)
+            # After persisting, so subscriptions imported just now don't count as unknown charges
+            charges = await ingest_transactions(sync.user_id, sync.transactions)
+            self.stats["events"] += charges["events"]
+            synced_at = datetime.now(timezone.utc).isoformat()
+            for row in sync.rows:
+                await update_tink_token(row["id"], {"last_sync_at": synced_at})
+            self.stats["synced_users"] += 1
+            self.stats["synced_connections"] += len(sync.rows)
+            self.stats["subscriptions_created"] += created
+            self.stats["subscriptions_updated"] += updated
+            logger.info("User synced", extra={"user_id": sync.user_id, "transactions": len(sync.transactions), "subscriptions_created": created, "subscriptions_updated": updated})
+        except Exception as e:
+            self.backoff[sync.user_id] = time.monotonic() + SYNC_FAILURE_BACKOFF_SECONDS
+            self.stats["failed_users"] += 1
+            logger.error("User sync failed", extra={"user_id": sync.user_id, "error": str(e)})
+
+    async def run_once(self) -> Dict[str, int]:
+        """Sync one batch of the least recently synced connections"""
+        self.stats = {"connections": 0, "users": 0, "synced_connections": 0, "synced_users": 0, "failed_users": 0,
+                      "subscriptions_created": 0, "subscriptions_updated": 0, "events": 0}
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=SYNC_MIN_AGE_HOURS)
+        now = time.monotonic()
+        self.backoff = {user_id: until for user_id, until in self.backoff.items() if until > now}
+        # Excluded in the query, so users in backoff don't fill the batch and starve everyone else
+        rows = await get_tink_tokens_due_for_sync(cutoff, self.batch_size, list(self.backoff))
+        if not rows:
+            return self.stats
+
+        tokens = await vault.tokens_for_rows(rows)
+        by_user: Dict[int, List[Dict[str, Any]]] = {}
+        for row in rows:
+            if row["id"] in tokens:
+                by_user.setdefault(row["user_id"], []).append(row)
+            else:
+                # Token couldn't be loaded or refreshed; its last_sync_at stays old, so without a
+                # backoff the row would head every batch
+                self.backoff[row["user_id"]] = now + SYNC_FAILURE_BACKOFF_SECONDS
+        self.stats["connections"], self.stats["users"] = len(rows), len(by_user)
+
+        scheduler = FairScheduler()
+        for user_id, user_rows in by_user.items():
+            sync = UserSync(user_id, user_rows)
+            for row in user_rows:
+                self._spawn(scheduler, sync, self._accounts_job(scheduler, sync, tokens[row["id"]]))
+
+        started = time.perf_counter()
+        await scheduler.run()
+        # Detection tasks started by the last Tink call of each user
+        if self._finishing:
+            await asyncio.gather(*self._finishing)
+            self._finishing.clear()
+        logger.info("Sync batch finished", extra={**self.stats, "duration_s": round(time.perf_counter() - started, 2)})
+        return self.stats
+
+    async def run_forever(self, interval: float = SYNC_INTERVAL_SECONDS) -> None:
+        while True:
+            try:
+                stats = await self.run_once()
+            except Exception as e:
+                logger.error("Sync batch failed", extra={"error": str(e)})
+                stats = {}
+            # Go straight on while full batches sync; otherwise (idle, or failing rows) poll
+            if stats.get("synced_connections", 0) < self.batch_size:
+                await asyncio.sleep(interval)
+
+# ========== PERSISTENCE ==========
+
+async def persist_detected(user_id: int, detected: List[Dict[str, Any]]) -> tuple:
+    """Insert new confident detections and move renewal dates of known ones forward"""
+    existing = {sub["title"].lower(): sub for sub in await get_subscriptions_by_owner(user_id)}
+    new_rows, updated = [], 0
+    for sub in detected:
+        if sub["confidence"] < SYNC_MIN_CONFIDENCE:
+            continue
+        current = existing.get(sub["name"].lower())
+        if current is None:
+            new_rows.append({
+                "owner_id": user_id,
+                "title": sub["name"],
+                "amount": sub["amount"],
+                "category": sub["category"],
+                "frequency": sub["frequency"],
+                "renewal_date": sub["renewal_date"],
+                "transaction_date": sub["transaction_date"],
+                "source": "tink",
+                "confidence_score": sub["confidence"],
+            })
+        elif current.get("source") == "tink" and (current.get("transaction_date") or "") < sub["transaction_date"]:
+            await update_subscription(current["id"], user_id, {
+                "renewal_date": sub["renewal_date"],
+                "transaction_date": sub["transaction_date"],
+            })
+            updated += 1
+    await create_subscriptions(new_rows)
+    return len(new_rows), updated
+
+# ========== ENTRY POINT ==========
+
+async def main_async(args) -> None:
+    worker = SyncWorker(args.batch_size)
+    try:
+        if args.once:
+            print(await worker.run_once())
+        else:
+            await worker.run_forever(args.interval)
+    finally:
+        await vault.stop()
+        await resources.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="Sync a single batch and exit")
+    parser.add_argument("--batch-size", type=int, default=SYNC_BATCH_SIZE)
+    parser.add_argument("--interval", type=float, default=SYNC_INTERVAL_SECONDS, help="Seconds between batches when idle")
+    args = parser.parse_args()
+
+    setup_logging()
+    try:
+        asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown_logging()
+
+if __name__ == "__main__":
+    main()
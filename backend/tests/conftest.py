@@ -0,0 +1,49 @@
+"""Test setup: the backend runs on a fresh SQLite file, and Tink and OpenAI are the stand-ins.
+
+    cd backend && python -m pytest -q
+
+Modules read their configuration when imported, so the environment is set
+here, before any test module imports them. The stand-ins
+(benchmarks/standins.py) start once per session on a free port.
+"""
+import os
+import sys
+import base64
+import tempfile
+import time
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks.harness import bench_env, free_port, spawn, stop, wait_for  # noqa: E402
+
+STANDINS_PORT = free_port()
+STANDINS_URL = f"http://127.0.0.1:{STANDINS_PORT}"
+_tmp = tempfile.mkdtemp(prefix="subtrack-tests-")
+
+os.environ.update({
+    "STORAGE_BACKEND": "sqlite",
+    "SQLITE_PATH": os.path.join(_tmp, "subtrack.db"),
+    "PDF_CACHE_DIR": os.path.join(_tmp, "pdf-cache"),
+    "SUPABASE_URL": STANDINS_URL,
+    "TINK_API_URL": STANDINS_URL,
+    "OPENAI_BASE_URL": STANDINS_URL + "/v1",
+    "OPENAI_API_KEY": "test",
+    "EXPO_PUSH_URL": STANDINS_URL,
+    "SECRET_JWT_KEY": "test-secret",
+    "TINK_TOKEN_ENCRYPTION_KEY": base64.b64encode(b"k" * 32).decode(),
+    "TINK_WEBHOOK_SECRET": "test-webhook-secret",
+    "LOG_LEVEL": "WARNING",
+})
+
+@pytest.fixture(scope="session")
+def standins():
+    proc = spawn(["-m", "benchmarks.standins", "--port", str(STANDINS_PORT),
+                  "--tink-latency-ms", "1", "--openai-latency-ms", "1"], bench_env())
+    try:
+        wait_for(STANDINS_URL + "/_standins/stats", time.perf_counter() + 15)
+        yield STANDINS_URL
+    finally:
+        stop(proc)
@@ -0,0 +1,230 @@
+import os
+import asyncio
+import json
+import sqlite3
+from datetime import date, datetime, timezone
+
+import httpx
+import pytest
+
+from cost_model import FxTable, add_months, charges_between, next_renewal, normalize_costs
+from detection import cluster_keys, descriptor_key, same_merchant
+from pdf_cache import LineItemCache, statement_lines
+from sqlite_store import SQLITE_MIGRATIONS_DIR, apply_migrations, translate_migration, translate_statement
+from sync_worker import FairScheduler, SyncWorker, TokenBucket
+from tink_webhooks import WebhookError, WebhookSignatureError, parse_event, sign, verify_signature
+
+# ========== CLUSTERING ==========
+
+def test_cluster_keys_keeps_mobilepay_payees_apart():
+    keys = [descriptor_key(d) for d in (
+        "MobilePay John Hansen", "MobilePay Jane Hansen", "MobilePay Jens Hansen", "MobilePay Jens Hansen 4471",
+    )]
+    clusters = cluster_keys(keys)
+    assert len(set(clusters.values())) == 3
+    assert clusters["mobilepay jens hansen"] != clusters["mobilepay john hansen"]
+
+def test_cluster_keys_keeps_products_of_one_merchant_apart():
+    clusters = cluster_keys(["google youtube premium", "google youtube music", "google youtube"])
+    assert clusters["google youtube premium"] != clusters["google youtube music"]
+
+def test_cluster_keys_merges_suffixes_and_truncated_descriptors():
+    clusters = cluster_keys(["netflix", "netflix dk", "disney plus subscri", "disney plus subscription"])
+    assert clusters == {"netflix": "netflix", "netflix dk": "netflix",
+                        "disney plus subscri": "disney plus subscri", "disney plus subscription": "disney plus subscri"}
+
+def test_same_merchant_needs_the_first_word_in_full():
+    assert same_merchant("spotify", "spotify ab")
+    assert not same_merchant("spot", "spotify")
+    assert not same_merchant("mobilepay john", "mobilepay jane")
+
+# ========== SYNC SCHEDULING ==========
+
+def test_token_bucket_waits_for_the_next_token():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.wait_time() == 0
+    bucket.take()
+    bucket.take()
+    assert 0 < bucket.wait_time() <= 0.1
+
+def test_fair_scheduler_takes_turns_between_users():
+    order = []
+
+    def job(user_id, follow_ups=0):
+        async def run():
+            order.append(user_id)
+            if follow_ups:
+                scheduler.add(user_id, job(user_id, follow_ups - 1))
+        return run
+
+    scheduler = FairScheduler(concurrency=1, global_rate=1000, user_rate=1000, user_concurrency=1)
+    scheduler.add(1, job(1, follow_ups=3))
+    scheduler.add(1, job(1))
+    scheduler.add(2, job(2))
+    scheduler.add(2, job(2))
+    asyncio.run(scheduler.run())
+    assert order[:4] == [1, 2, 1, 2]
+    assert order.count(1) == 5 and order.count(2) == 2
+
+# ========== TINK WEBHOOKS ==========
+
+SECRET = "test-webhook-secret"
+
+def test_verify_signature_accepts_only_the_signed_body():
+    body = b'{"event": "refresh:finished"}'
+    verify_signature(body, sign(body, SECRET), SECRET)
+    with pytest.raises(WebhookSignatureError):
+        verify_signature(body + b" ", sign(body, SECRET), SECRET)
+    with pytest.raises(WebhookSignatureError):
+        verify_signature(body, None, SECRET)
+    with pytest.raises(WebhookSignatureError):
+        verify_signature(body, sign(body, SECRET, timestamp=0), SECRET)
+
+def test_parse_event_reads_transaction_events():
+    body = json.dumps({
+        "event": "account-transactions:modified",
+        "context": {"userId": "tink-user-7", "externalUserId": "42"},
+        "content": {"account": {"id": "acc-1"}, "transactions": {"earliestModifiedBookedDate": "2026-01-05T00:00:00Z"}},
+    }).encode()
+    event = parse_event(body)
+    assert event["user_id"] == 42 and event["tink_user_id"] == "tink-user-7"
+    assert event["account_id"] == "acc-1" and event["booked_from"] == "2026-01-05"
+    # No id in the payload: redeliveries of the same body get the same event id
+    assert parse_event(body)["event_id"] == event["event_id"]
+
+def test_parse_event_ignores_other_events_and_rejects_bad_payloads():
+    assert parse_event(b'{"event": "credentials:updated", "context": {"userId": "u"}}') is None
+    with pytest.raises(WebhookError):
+        parse_event(b"not json")
+    with pytest.raises(WebhookError):
+        parse_event(b'{"event": "account-transactions:modified", "context": {"userId": "u"}}')
+
+# ========== PDF STATEMENT LINES ==========
+
+STATEMENT = "\n".join([
+    "Kontoudtog januar",
+    "05.01.2026 NETFLIX.COM -129.00",
+    "09.01.2026 NETTO -312.50",
+    "05.02.2026 NETFLIX.COM -129.00",
+])
+
+def test_statement_lines_keeps_dated_lines_with_their_offsets():
+    lines = statement_lines(STATEMENT)
+    assert [line["merchant"] for line in lines] == ["netflix", "netto", "netflix"]
+    assert lines[0]["date"] == datetime(2026, 1, 5)
+    assert all(STATEMENT[:line["end"]].endswith(line["text"]) for line in lines)
+
+def test_line_item_cache_plans_only_new_merchants():
+    cache = LineItemCache()
+    lines = statement_lines(STATEMENT)
+    to_classify, reused = cache.plan(1, lines)
+    assert to_classify == lines and reused == []
+    cache.remember(1, lines, [{"name": "Netflix", "original_description": "NETFLIX.COM", "frequency": "måned"}])
+
+    later = statement_lines(STATEMENT + "\n11.02.2026 YOUSEE -299.00")
+    to_classify, reused = cache.plan(1, later)
+    # Netto was seen and not listed, so it is neither sent again nor reported
+    assert [line["merchant"] for line in to_classify] == ["yousee"]
+    assert [r["name"] for r in reused] == ["Netflix"]
+    assert reused[0]["next_renewal_date"] >= date.today().isoformat()
+    # Results are per user
+    assert cache.plan(2, later)[0] == later
+
+# ========== COST MODEL ==========
+
+def test_add_months_clamps_to_the_end_of_the_month():
+    assert add_months(date(2026, 1, 31), 1) == date(2026, 2, 28)
+    assert add_months(date(2026, 1, 31), -2) == date(2025, 11, 30)
+
+def test_next_renewal_moves_past_dates_onto_the_schedule():
+    assert next_renewal(date(2026, 1, 15), "måned") == date(2026, 2, 15)
+    assert next_renewal(date(2024, 3, 10), "kvartal", date(2026, 10, 19)) == date(2026, 12, 10)
+    assert next_renewal(date(2025, 1, 31), "måned", date(2026, 2, 1)) == date(2026, 2, 28)
+
+def test_charges_between_follows_the_anchor_both_ways():
+    assert charges_between(date(2026, 6, 1), "kvartal", date(2026, 1, 1), date(2026, 12, 31)) == [
+        date(2026, 3, 1), date(2026, 6, 1), date(2026, 9, 1), date(2026, 12, 1)]
+    assert charges_between(date(2026, 6, 1), "år", date(2026, 7, 1), date(2027, 5, 31)) == []
+
+def test_normalize_costs_converts_currency_and_frequency():
+    costs = normalize_costs([
+        {"id": 1, "amount": 10, "currency": "EUR", "frequency": "måned"},
+        {"id": 2, "amount": 1200, "currency": "DKK", "frequency": "år"},
+        {"id": 3, "amount": 5, "currency": "XYZ"},
+    ], FxTable(path=None))
+    assert [(c["amount_dkk"], c["monthly"], c["yearly"]) for c in costs] == [
+        (74.6, 74.6, 895.2), (1200.0, 100.0, 1200.0), (5.0, 5.0, 60.0)]
+
+# ========== SQLITE MIGRATIONS ==========
+
+def test_translate_statement_rewrites_postgres_types_and_skips_functions():
+    [create] = translate_statement(
+        "CREATE TABLE IF NOT EXISTS t (id bigserial PRIMARY KEY, tags text[] DEFAULT '{}'::text[], "
+        "email text CHECK (email ~* '^.+@.+$'), created_at timestamptz DEFAULT now())")
+    assert "INTEGER PRIMARY KEY AUTOINCREMENT" in create and "JSONB" in create
+    assert "::" not in create and "CHECK" not in create and "now()" not in create
+    assert translate_statement("ALTER TABLE t ADD COLUMN IF NOT EXISTS a int, ADD COLUMN IF NOT EXISTS b int") == [
+        "ALTER TABLE t ADD COLUMN a int", "ALTER TABLE t ADD COLUMN b int"]
+    assert translate_migration(
+        "CREATE FUNCTION f() RETURNS int AS $$ SELECT 1; $$ LANGUAGE sql;\n"
+        "ALTER TABLE t ENABLE ROW LEVEL SECURITY;\n"
+        "CREATE INDEX i ON t USING btree (a) INCLUDE (b);") == ["CREATE INDEX i ON t (a) "]
+
+def test_every_migration_applies_to_sqlite_once():
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    applied = apply_migrations(conn)
+    assert applied == len([f for f in os.listdir(SQLITE_MIGRATIONS_DIR) if f.endswith(".sql")])
+    assert apply_migrations(conn) == 0
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(transaction_series)")}
+    assert "version" in columns
+
+# ========== SYNC WORKER ==========
+
+def test_sync_worker_backs_off_unusable_tokens_without_starving_others(standins):
+    import supabase_client as db
+    from resources import resources
+    from tink_vault import vault
+
+    async def scenario():
+        users = [await db.create_user(f"sync{i}@example.dk", "x") for i in range(4)]
+        async with httpx.AsyncClient(base_url=standins) as tink:
+            for i, user in enumerate(users):
+                token = (await tink.post("/api/v1/oauth/token", data={"grant_type": "authorization_code",
+                                                                       "code": str(i)})).json()
+                await vault.store(user["id"], token, "bank")
+        rows = {row["user_id"]: row for row in await db.get_tink_tokens_due_for_sync(datetime.now(timezone.utc), 10)}
+        broken, working = [u["id"] for u in users[:2]], [u["id"] for u in users[2:]]
+        # The broken connections are the oldest, so they head every batch unless backed off
+        for user_id in broken:
+            await db.update_tink_token(rows[user_id]["id"], {"access_token": "not-decryptable",
+                                                             "last_sync_at": "2020-01-01T00:00:00+00:00"})
+        for user_id in working:
+            await db.update_tink_token(rows[user_id]["id"], {"last_sync_at": "2021-01-01T00:00:00+00:00"})
+        vault.clear()
+
+        worker = SyncWorker(batch_size=2)
+        first = await worker.run_once()
+        assert (first["connections"], first["synced_connections"]) == (2, 0)
+        assert sorted(worker.backoff) == broken
+        second = await worker.run_once()
+        assert second["synced_connections"] == 2
+        assert (await worker.run_once())["connections"] == 0
+
+        # Only the broken connections are due now. A batch full of them must not be retried in a tight loop
+        worker = SyncWorker(batch_size=2)
+        batches = []
+        run_once = worker.run_once
+
+        async def counted():
+            batches.append(await run_once())
+            # Lets this test's sleep end even if run_forever never sleeps
+            await asyncio.sleep(0)
+            return batches[-1]
+        worker.run_once = counted
+        loop = asyncio.ensure_future(worker.run_forever(interval=60))
+        await asyncio.sleep(0.5)
+        loop.cancel()
+        await resources.close()
+        assert len(batches) == 1 and batches[0]["synced_connections"] == 0
+
+    asyncio.run(scenario())
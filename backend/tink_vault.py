@@ -0,0 +1,362 @@
+import os
+import asyncio
+import base64
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from companies import TTLCache
+from idempotency import SingleFlight
+from logging_config import get_logger
+from metrics import span
+from periodic import PeriodicJob
+from resources import resources
+from supabase_client import (
+    get_tink_tokens, get_tink_tokens_for_users, get_tokens_expiring_soon, update_tink_token, upsert_tink_token
+)
+
+load_dotenv()
+
+logger = get_logger("tink_vault")
+
+# 32 random bytes, base64 encoded: python -c "import os,base64;print(base64.b64encode(os.urandom(32)).decode())"
+TINK_TOKEN_ENCRYPTION_KEY = os.getenv("TINK_TOKEN_ENCRYPTION_KEY")
+TINK_CLIENT_ID = os.getenv("TINK_CLIENT_ID")
+TINK_CLIENT_SECRET = os.getenv("TINK_CLIENT_SECRET")
+# Refresh tokens this long before they expire, both in the job and on demand
+TINK_REFRESH_AHEAD_SECONDS = int(os.getenv("TINK_REFRESH_AHEAD_SECONDS", 900))
+# 0 disables the background job (e.g. on all but one worker)
+TINK_REFRESH_INTERVAL_SECONDS = int(os.getenv("TINK_REFRESH_INTERVAL_SECONDS", 300))
+TINK_REFRESH_BATCH_SIZE = int(os.getenv("TINK_REFRESH_BATCH_SIZE", 50))
+TINK_REFRESH_CONCURRENCY = int(os.getenv("TINK_REFRESH_CONCURRENCY", 8))
+# Users whose decrypted tokens are kept in memory, and for how long before they are read again
+TINK_VAULT_CACHE_SIZE = int(os.getenv("TINK_VAULT_CACHE_SIZE", 10000))
+TINK_VAULT_CACHE_TTL_SECONDS = int(os.getenv("TINK_VAULT_CACHE_TTL_SECONDS", 900))
+
+DEFAULT_BANK = "tink"
+CIPHER_VERSION = "v1"
+
+class TokenCipher:
+    """AES-256-GCM for tokens at rest; each value is bound to its user and bank"""
+
+    NONCE_BYTES = 12
+
+    def __init__(self, key: bytes):
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        if len(key) != 32:
+            raise ValueError("TINK_TOKEN_ENCRYPTION_KEY must decode to 32 bytes")
+        self._aead = AESGCM(key)
+
+    @classmethod
+    def from_env(cls, value: Optional[str] = TINK_TOKEN_ENCRYPTION_KEY) -> Optional["TokenCipher"]:
+        if not value:
+            return None
+        return cls(base64.b64decode(value))
+
+    @staticmethod
+    def _aad(user_id: int, bank_name: str, field: str) -> bytes:
+        # Ciphertext copied to another row or column fails to decrypt
+        return f"{user_id}:{bank_name}:{field}".encode()
+
+    def encrypt(self, plaintext: str, user_id: int, bank_name: str, field: str) -> str:
+        nonce = os.urandom(self.NONCE_BYTES)
+        sealed = self._aead.encrypt(nonce, plaintext.encode(), self._aad(user_id, bank_name, field))
+        return f"{CIPHER_VERSION}.{base64.urlsafe_b64encode(nonce + sealed).decode()}"
+
+    def decrypt(self, value: str, user_id: int, bank_name: str, field: str) -> str:
+        version, _, payload = value.partition(".")
+        if version != CIPHER_VERSION:
+            raise ValueError(f"Unsupported token cipher version: {version}")
+        raw = base64.urlsafe_b64decode(payload)
+        nonce, sealed = raw[:self.NONCE_BYTES], raw[self.NONCE_BYTES:]
+        return self._aead.decrypt(nonce, sealed, self._aad(user_id, bank_name, field)).decode()
+
+class TinkAuthError(Exception):
+    """Tink rejected a refresh token; the user has to link the bank again"""
+
+class VaultEntry:
+    __slots__ = ("row_id", "user_id", "bank_name", "access_token", "refresh_token", "expires_at", "tink_user_id")
+
+    def __init__(self, row_id: int, user_id: int, bank_name: str, access_token: str,
+                 refresh_token: Optional[str], expires_at: float, tink_user_id: Optional[str] = None):
+        self.row_id = row_id
+        self.user_id = user_id
+        self.bank_name = bank_name
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.expires_at = expires_at  # epoch seconds
+        self.tink_user_id = tink_user_id
+
+    def fresh(self, now: Optional[float] = None) -> bool:
+        return self.expires_at - (now or time.time()) > TINK_REFRESH_AHEAD_SECONDS
+
+def _parse_timestamp(value: str) -> float:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+class TinkTokenVault:
+    """Encrypted Tink tokens in `tink_tokens`, decrypted copies cached per process.
+
+    The cache holds at most TINK_VAULT_CACHE_SIZE users, each for
+    TINK_VAULT_CACHE_TTL_SECONDS, so plaintext tokens don't pile up in memory.
+
+    Access tokens are refreshed on demand when they are about to expire and
+    ahead of time by a background job, so imports and syncs can run without
+    sending the user through Tink Link again.
+    """
+
+    def __init__(self, cipher: Optional[TokenCipher] = None):
+        self.cipher = cipher
+        # user_id -> {bank_name: VaultEntry}
+        self._entries = TTLCache(TINK_VAULT_CACHE_SIZE, TINK_VAULT_CACHE_TTL_SECONDS)
+        # Concurrent refreshes of one connection share a single call to Tink
+        self._refreshes = SingleFlight()
+        self._job = PeriodicJob(self.refresh_expiring, logger, "Tink token refresh pass failed", max_jitter=30)
+
+    @property
+    def enabled(self) -> bool:
+        return self.cipher is not None
+
+    # ---------- Rows ----------
+
+    def _row_data(self, user_id: int, bank_name: str, token_data: Dict[str, Any]) -> Dict[str, Any]:
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=int(token_data.get("expires_in", 7200)))
+        data = {
+            "user_id": user_id,
+            "bank_name": bank_name,
+            "access_token": self.cipher.encrypt(token_data["access_token"], user_id, bank_name, "access_token"),
+            "token_type": token_data.get("token_type", "Bearer"),
+            "expires_at": expires_at.isoformat(),
+            "is_active": True,
+        }
+        if token_data.get("refresh_token"):
+            data["refresh_token"] = self.cipher.encrypt(token_data["refresh_token"], user_id, bank_name, "refresh_token")
+        if token_data.get("scope"):
+            data["scope"] = token_data["scope"]
+        return data
+
+    def _entry_from_row(self, row: Dict[str, Any]) -> VaultEntry:
+        user_id, bank_name = row["user_id"], row.get("bank_name") or DEFAULT_BANK
+        refresh = row.get("refresh_token")
+        return VaultEntry(
+            row_id=row["id"],
+            user_id=user_id,
+            bank_name=bank_name,
+            access_token=self.cipher.decrypt(row["access_token"], user_id, bank_name, "access_token"),
+            refresh_token=self.cipher.decrypt(refresh, user_id, bank_name, "refresh_token") if refresh else None,
+            expires_at=_parse_timestamp(row["expires_at"]),
+            tink_user_id=row.get("tink_user_id"),
+        )
+
+    def _cached(self, user_id: int, bank_name: str) -> Optional[VaultEntry]:
+        return (self._entries.get(user_id) or {}).get(bank_name)
+
+    def _remember(self, entry: VaultEntry) -> VaultEntry:
+        # A user who isn't cached is loaded in full on next use; caching one bank alone would hide the rest
+        entries = self._entries.get(entry.user_id)
+        if entries is not None:
+            entries[entry.bank_name] = entry
+        return entry
+
+    async def _tink_user_id(self, token_data: Dict[str, Any]) -> Optional[str]:
+        """Tink's id for the user behind a token, which webhooks are addressed by; None if Tink won't say"""
+        if token_data.get("id_hint"):
+            return str(token_data["id_hint"])
+        try:
+            with span("tink", "user"):
+                response = await resources.tink_http.get(
+                    "/api/v1/user", headers={"Authorization": f"Bearer {token_data['access_token']}"})
+            response.raise_for_status()
+            return str(response.json()["id"])
+        except Exception as e:
+            # Needs the user:read scope; without it webhooks can't be matched to this connection
+            logger.warning("Could not look up Tink user id", extra={"error": str(e)})
+            return None
+
+    async def _load_user(self, user_id: int) -> Dict[str, VaultEntry]:
+        entries = {}
+        for row in await get_tink_tokens(user_id):
+            try:
+                entry = self._entry_from_row(row)
+            except Exception as e:
+                # Wrong key or tampered row; treat as not connected rather than failing the request
+                logger.error("Could not decrypt Tink token", extra={"user_id": user_id, "token_id": row.get("id"), "error": str(e)})
+                continue
+            entries[entry.bank_name] = entry
+        self._entries.put(user_id, entries)
+        return entries
+
+    # ---------- Public API ----------
+
+    async def store(self, user_id: int, token_data: Dict[str, Any], bank_name: Optional[str] = None) -> None:
+        """Encrypt and upsert a token response from the OAuth code exchange"""
+        bank_name = bank_name or DEFAULT_BANK
+        tink_user_id = await self._tink_user_id(token_data)
+        data = self._row_data(user_id, bank_name, token_data)
+        if tink_user_id:
+            data["tink_user_id"] = tink_user_id
+        row = await upsert_tink_token(data)
+        self._remember(VaultEntry(
+            row_id=row["id"], user_id=user_id, bank_name=bank_name,
+            access_token=token_data["access_token"], refresh_token=token_data.get("refresh_token"),
+            expires_at=time.time() + int(token_data.get("expires_in", 7200)), tink_user_id=tink_user_id,
+        ))
+        logger.info("Stored Tink token", extra={"user_id": user_id, "bank_name": bank_name})
+
+    async def access_tokens(self, user_id: int) -> Dict[str, str]:
+        """Valid access token per connected bank, refreshing any that are about to expire"""
+        entries = self._entries.get(user_id)
+        if entries is None:
+            entries = await self._load_user(user_id)
+
+        tokens = {}
+        for bank_name, entry in list(entries.items()):
+            if not entry.fresh():
+                try:
+                    entry = await self._ensure_fresh(entry)
+                except TinkAuthError:
+                    continue
+                except Exception as e:
+                    logger.warning("Tink token refresh failed", extra={"user_id": user_id, "bank_name": bank_name, "error": str(e)})
+                    if entry.expires_at <= time.time():
+                        continue
+            tokens[bank_name] = entry.access_token
+        return tokens
+
+    async def tokens_for_rows(self, rows: List[Dict[str, Any]]) -> Dict[int, str]:
+        """Access token per row id for rows the caller already fetched (e.g. a sync batch)"""
+        tokens = {}
+        for row in rows:
+            try:
+                entry = self._entry_from_row(row)
+                if not entry.fresh():
+                    entry = await self._ensure_fresh(entry)
+            except TinkAuthError:
+                continue
+            except Exception as e:
+                logger.warning("Could not load Tink token", extra={"user_id": row.get("user_id"), "token_id": row.get("id"), "error": str(e)})
+                continue
+            tokens[row["id"]] = entry.access_token
+        return tokens
+
+    async def connections(self, user_id: int) -> List[Dict[str, Any]]:
+        entries = self._entries.get(user_id)
+        if entries is None:
+            entries = await self._load_user(user_id)
+        return [
+            {"bank_name": e.bank_name, "expires_at": datetime.fromtimestamp(e.expires_at, timezone.utc).isoformat()}
+            for e in entries.values()
+        ]
+
+    async def mark_synced(self, user_id: int, bank_name: str) -> None:
+        entry = self._cached(user_id, bank_name)
+        if entry is not None:
+            await update_tink_token(entry.row_id, {"last_sync_at": datetime.now(timezone.utc).isoformat()})
+
+    def invalidate_user(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    # ---------- Refresh ----------
+
+    async def _ensure_fresh(self, entry: VaultEntry) -> VaultEntry:
+        async def refresh() -> VaultEntry:
+            current = self._cached(entry.user_id, entry.bank_name) or entry
+            if current.fresh():
+                # Refreshed by a request that finished just before this one started
+                return current
+            # Another worker may already have rotated the token
+            reloaded = (await self._load_user(entry.user_id)).get(entry.bank_name)
+            if reloaded is not None and reloaded.fresh():
+                return reloaded
+            return await self._refresh(reloaded or current)
+
+        refreshed, _ = await self._refreshes.do(f"{entry.user_id}:{entry.bank_name}", refresh)
+        return refreshed
+
+    async def _refresh(self, entry: VaultEntry) -> VaultEntry:
+        if not entry.refresh_token:
+            raise TinkAuthError("No refresh token stored")
+        data = {
+            "client_id": TINK_CLIENT_ID,
+            "client_secret": TINK_CLIENT_SECRET,
+            "grant_type": "refresh_token",
+            "refresh_token": entry.refresh_token,
+        }
+        with span("tink", "oauth_refresh"):
+            response = await resources.tink_http.post("/api/v1/oauth/token", data=data)
+        if response.status_code in (400, 401):
+            # Revoked or expired consent; stop retrying until the user links again
+            await update_tink_token(entry.row_id, {"is_active": False})
+            (self._entries.get(entry.user_id) or {}).pop(entry.bank_name, None)
+            logger.warning("Tink refresh token rejected", extra={"user_id": entry.user_id, "bank_name": entry.bank_name, "status": response.status_code})
+            raise TinkAuthError(response.text)
+        response.raise_for_status()
+        token_data = response.json()
+        token_data.setdefault("refresh_token", entry.refresh_token)
+
+        fields = self._row_data(entry.user_id, entry.bank_name, token_data)
+        # Connections stored before Tink user ids were kept get theirs here
+        tink_user_id = entry.tink_user_id or await self._tink_user_id(token_data)
+        if tink_user_id and tink_user_id != entry.tink_user_id:
+            fields["tink_user_id"] = tink_user_id
+        await update_tink_token(entry.row_id, fields)
+        refreshed = VaultEntry(
+            row_id=entry.row_id, user_id=entry.user_id, bank_name=entry.bank_name,
+            access_token=token_data["access_token"], refresh_token=token_data["refresh_token"],
+            expires_at=time.time() + int(token_data.get("expires_in", 7200)), tink_user_id=tink_user_id,
+        )
+        logger.info("Refreshed Tink token", extra={"user_id": entry.user_id, "bank_name": entry.bank_name})
+        return self._remember(refreshed)
+
+    async def refresh_expiring(self) -> Dict[str, int]:
+        """One pass of the background job: refresh every token expiring within the look-ahead window"""
+        days = max(1, math.ceil(TINK_REFRESH_AHEAD_SECONDS / 86400))
+        horizon = time.time() + TINK_REFRESH_AHEAD_SECONDS
+        due = {(r["user_id"], r.get("bank_name") or DEFAULT_BANK)
+               for r in await get_tokens_expiring_soon(days)
+               if _parse_timestamp(r["expires_at"]) <= horizon}
+        stats = {"due": len(due), "refreshed": 0, "rejected": 0, "failed": 0}
+        if not due:
+            return stats
+
+        semaphore = asyncio.Semaphore(TINK_REFRESH_CONCURRENCY)
+
+        async def refresh_one(row: Dict[str, Any]) -> None:
+            async with semaphore:
+                try:
+                    await self._ensure_fresh(self._entry_from_row(row))
+                    stats["refreshed"] += 1
+                except TinkAuthError:
+                    stats["rejected"] += 1
+                except Exception as e:
+                    stats["failed"] += 1
+                    logger.warning("Tink token refresh failed", extra={"user_id": row["user_id"], "error": str(e)})
+
+        user_ids = sorted({user_id for user_id, _ in due})
+        for i in range(0, len(user_ids), TINK_REFRESH_BATCH_SIZE):
+            # One query for the encrypted rows of a whole batch of users
+            rows = await get_tink_tokens_for_users(user_ids[i:i + TINK_REFRESH_BATCH_SIZE])
+            await asyncio.gather(*(
+                refresh_one(row) for row in rows
+                if (row["user_id"], row.get("bank_name") or DEFAULT_BANK) in due
+            ))
+        logger.info("Tink token refresh pass finished", extra=stats)
+        return stats
+
+    def start_refresh_job(self, interval: float = TINK_REFRESH_INTERVAL_SECONDS) -> None:
+        if self.enabled:
+            self._job.start(interval)
+
+    async def stop(self) -> None:
+        await self._job.stop()
+
+vault = TinkTokenVault(TokenCipher.from_env())
@@ -0,0 +1,319 @@
+"""Tink webhooks: push-based transaction updates.
+
+Tink calls POST /api/tink/webhooks when an account's transactions change
+or a refresh finishes. The endpoint only checks the signature and stores
+the event before answering, so Tink never waits on bank calls. Events
+are unique on their id, so redeliveries are dropped.
+
+A worker in every API process claims all open events of a user once no
+new event has arrived for that user for TINK_WEBHOOK_QUIET_SECONDS, or
+the oldest has waited TINK_WEBHOOK_MAX_DELAY_SECONDS. A burst of events
+therefore becomes one fetch per affected account, starting at the
+earliest booked date the events report as changed. A refresh event on
+its own fetches the last TINK_WEBHOOK_REFRESH_DAYS of every account;
+next to transaction events it adds nothing and is skipped. New
+transactions go through the charge detector as in a sync. Full
+subscription detection stays with sync_worker.py, which can run much
+less often once webhooks are on (SYNC_MIN_AGE_HOURS).
+
+Tink names the user by its own user id (context.userId). The vault
+stores it with each bank connection when the Tink Link code is exchanged
+or the token refreshed, from the token response's id_hint or from
+GET /api/v1/user (which needs the user:read scope in the Tink Link URL),
+and events are resolved through it. An externalUserId that is one of our
+user ids is used when no connection matches. Events of unknown users are
+acknowledged and dropped.
+
+Setup: in Tink Console, add a webhook for <API URL>/api/tink/webhooks
+with the events above and put its secret in TINK_WEBHOOK_SECRET.
+Signatures follow Tink's scheme:
+X-Tink-Signature: t=<unix time>,v1=<hex HMAC-SHA256 of "<t>.<body>">
+
+    python tink_webhooks.py   # process open events once, e.g. from cron
+
+benchmarks/replay_webhooks.py signs and sends recorded or generated
+events to a local API.
+"""
+import os
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from dotenv import load_dotenv
+
+from charge_detector import ingest_transactions
+from logging_config import get_logger, setup_logging, shutdown_logging
+from metrics import Counter, registry, span
+from periodic import PeriodicJob
+from resources import resources
+from supabase_client import (
+    claim_tink_webhook_events, delete_processed_tink_webhook_events, enqueue_tink_webhook_event,
+    get_user_id_for_tink_user, update_tink_webhook_events
+)
+from sync_worker import SYNC_LOOKBACK_DAYS, SYNC_MAX_PAGES_PER_ACCOUNT
+from tink_vault import vault
+
+load_dotenv()
+
+logger = get_logger("tink_webhooks")
+
+TINK_WEBHOOK_SECRET = os.getenv("TINK_WEBHOOK_SECRET")
+# Signed timestamps older or newer than this are rejected as replays
+TINK_WEBHOOK_TOLERANCE_SECONDS = int(os.getenv("TINK_WEBHOOK_TOLERANCE_SECONDS", 300))
+TINK_WEBHOOK_QUIET_SECONDS = int(os.getenv("TINK_WEBHOOK_QUIET_SECONDS", 5))
+TINK_WEBHOOK_MAX_DELAY_SECONDS = int(os.getenv("TINK_WEBHOOK_MAX_DELAY_SECONDS", 60))
+TINK_WEBHOOK_POLL_SECONDS = float(os.getenv("TINK_WEBHOOK_POLL_SECONDS", 2))
+TINK_WEBHOOK_LEASE_SECONDS = int(os.getenv("TINK_WEBHOOK_LEASE_SECONDS", 300))
+TINK_WEBHOOK_CONCURRENCY = int(os.getenv("TINK_WEBHOOK_CONCURRENCY", 4))
+TINK_WEBHOOK_REFRESH_DAYS = int(os.getenv("TINK_WEBHOOK_REFRESH_DAYS", 7))
+TINK_WEBHOOK_RETENTION_DAYS = int(os.getenv("TINK_WEBHOOK_RETENTION_DAYS", 7))
+TINK_WEBHOOK_MAX_ATTEMPTS = 5
+PRUNE_INTERVAL_SECONDS = 3600
+
+TRANSACTION_EVENTS = ("account-transactions:modified", "account-booked-transactions:modified")
+REFRESH_EVENTS = ("refresh:finished",)
+
+webhook_events = registry.register(Counter(
+    "tink_webhook_events_total", "Tink webhook deliveries by event type and outcome", ("event", "outcome")))
+
+class WebhookError(Exception):
+    """The delivery is malformed; Tink should not retry it"""
+
+class WebhookSignatureError(WebhookError):
+    """Missing, wrong or expired signature"""
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+# ========== SIGNATURES ==========
+
+def sign(body: bytes, secret: str, timestamp: Optional[int] = None) -> str:
+    """X-Tink-Signature header value for a body"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+def verify_signature(body: bytes, header: Optional[str], secret: Optional[str] = TINK_WEBHOOK_SECRET,
+                     now: Optional[float] = None) -> None:
+    if not secret:
+        raise WebhookSignatureError("Webhook secret not configured")
+    parts = dict(p.split("=", 1) for p in (header or "").split(",") if "=" in p)
+    try:
+        timestamp = int(parts["t"])
+    except (KeyError, ValueError):
+        raise WebhookSignatureError("Missing signature")
+    if abs((time.time() if now is None else now) - timestamp) > TINK_WEBHOOK_TOLERANCE_SECONDS:
+        raise WebhookSignatureError("Signature expired")
+    expected = sign(body, secret, timestamp).split("v1=", 1)[1]
+    if not hmac.compare_digest(expected, parts.get("v1", "")):
+        raise WebhookSignatureError("Invalid signature")
+
+# ========== EVENTS ==========
+
+def parse_event(body: bytes) -> Optional[Dict[str, Any]]:
+    """tink_webhook_events row for a delivery, None for event types we don't handle.
+
+    `user_id` is the externalUserId if that is one of our ids, else None; `tink_user_id`
+    is Tink's id, which receive() resolves through the stored connections.
+    """
+    try:
+        payload = json.loads(body)
+        event_type = payload["event"]
+    except (ValueError, KeyError, TypeError):
+        raise WebhookError("Invalid webhook payload")
+    if event_type not in TRANSACTION_EVENTS + REFRESH_EVENTS:
+        return None
+
+    context = payload.get("context") or {}
+    tink_user_id = context.get("userId")
+    try:
+        user_id = int(context.get("externalUserId"))
+    except (TypeError, ValueError):
+        user_id = None
+    if not tink_user_id and user_id is None:
+        raise WebhookError("Webhook has no user")
+    content = payload.get("content") or {}
+    row = {
+        # Tink redelivers the same body, so its hash identifies an event that carries no id
+        "event_id": str(payload.get("id") or hashlib.sha256(body).hexdigest()),
+        "event_type": event_type,
+        "tink_user_id": str(tink_user_id) if tink_user_id else None,
+        "user_id": user_id,
+        "account_id": None,
+        "booked_from": None,
+    }
+    if event_type in TRANSACTION_EVENTS:
+        account_id = (content.get("account") or {}).get("id")
+        if not account_id:
+            raise WebhookError("Transaction webhook has no account id")
+        row["account_id"] = account_id
+        earliest = (content.get("transactions") or {}).get("earliestModifiedBookedDate")
+        if earliest:
+            row["booked_from"] = str(earliest)[:10]
+    return row
+
+async def resolve_user(tink_user_id: Optional[str], external_user_id: Optional[int]) -> Optional[int]:
+    """Our user id: the one stored with the Tink user's bank connection, else the externalUserId"""
+    if tink_user_id:
+        user_id = await get_user_id_for_tink_user(tink_user_id)
+        if user_id is not None:
+            return user_id
+    return external_user_id
+
+async def receive(body: bytes, signature: Optional[str]) -> str:
+    """Verify and store one delivery; returns stored, duplicate, ignored or unknown_user"""
+    try:
+        verify_signature(body, signature)
+        event = parse_event(body)
+    except WebhookError:
+        webhook_events.inc(("unknown", "rejected"))
+        raise
+    if event is None:
+        outcome = "ignored"
+    else:
+        tink_user_id = event.pop("tink_user_id")
+        event["user_id"] = await resolve_user(tink_user_id, event["user_id"])
+        if event["user_id"] is None:
+            # Nothing to fetch with; Tink retrying wouldn't change that
+            logger.warning("Tink webhook for unknown user", extra={"tink_user_id": tink_user_id})
+            outcome = "unknown_user"
+        else:
+            outcome = "stored" if await enqueue_tink_webhook_event(event) else "duplicate"
+    webhook_events.inc((event["event_type"] if event else "other", outcome))
+    return outcome
+
+# ========== PROCESSING ==========
+
+class TinkWebhookProcessor:
+    def __init__(self, concurrency: int = TINK_WEBHOOK_CONCURRENCY):
+        self.concurrency = concurrency
+        self._job = PeriodicJob(self._run_pass, logger, "Tink webhook pass failed")
+        self._pruned_at = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(TINK_WEBHOOK_SECRET)
+
+    async def _tink_get(self, path: str, access_token: str, params: Optional[dict] = None) -> dict:
+        with span("tink", "webhook_" + path.rsplit("/", 1)[-1]):
+            response = await resources.tink_http.get(path, headers={"Authorization": f"Bearer {access_token}"}, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def _fetch_account(self, access_token: str, account_id: str, booked_from: str) -> List[Dict[str, Any]]:
+        transactions, page_token = [], None
+        for _ in range(SYNC_MAX_PAGES_PER_ACCOUNT):
+            params = {"accountId": account_id, "pageSize": 100, "bookedDateGte": booked_from}
+            if page_token:
+                params["pageToken"] = page_token
+            data = await self._tink_get("/data/v2/transactions", access_token, params)
+            transactions.extend(data.get("transactions", []))
+            page_token = data.get("nextPageToken")
+            if not page_token:
+                break
+        return transactions
+
+    async def _fetch(self, user_id: int, account_ids: Optional[Set[str]], booked_from: str) -> List[Dict[str, Any]]:
+        """Transactions booked on or after booked_from for the given accounts, or all accounts if None"""
+        tokens = await vault.access_tokens(user_id)
+        if not tokens:
+            raise WebhookError("No bank connection")
+        transactions = []
+        for access_token in tokens.values():
+            wanted = account_ids
+            if account_ids is None or len(tokens) > 1:
+                # Which connection an account belongs to is only known from its account list
+                listed = {a["id"] for a in (await self._tink_get("/data/v2/accounts", access_token)).get("accounts", []) if a.get("id")}
+                wanted = listed if account_ids is None else listed & account_ids
+            for account_id in sorted(wanted):
+                transactions.extend(await self._fetch_account(access_token, account_id, booked_from))
+        return transactions
+
+    async def process(self, events: List[Dict[str, Any]]) -> None:
+        """Fetch and ingest what one user's claimed events report as changed"""
+        user_id = events[0]["user_id"]
+        ids = [e["id"] for e in events]
+        changed = [e for e in events if e["event_type"] in TRANSACTION_EVENTS]
+        oldest = (date.today() - timedelta(days=SYNC_LOOKBACK_DAYS)).isoformat()
+        if changed:
+            account_ids = {e["account_id"] for e in changed}
+            booked_from = min((e["booked_from"] or oldest) for e in changed)
+        else:
+            account_ids = None
+            booked_from = (date.today() - timedelta(days=TINK_WEBHOOK_REFRESH_DAYS)).isoformat()
+        booked_from = max(booked_from, oldest)
+
+        try:
+            transactions = await self._fetch(user_id, account_ids, booked_from)
+            stats = await ingest_transactions(user_id, transactions)
+        except asyncio.CancelledError:
+            # Shutting down; the lease runs out and the events are claimed again
+            raise
+        except WebhookError as e:
+            logger.warning("Tink webhook events dropped", extra={"user_id": user_id, "events": len(ids), "error": str(e)})
+            await update_tink_webhook_events(ids, {"status": "failed", "error": str(e), "lease_until": None, "processed_at": _now()})
+            return
+        except Exception as e:
+            failed = max(event["attempts"] for event in events) >= TINK_WEBHOOK_MAX_ATTEMPTS
+            logger.error("Tink webhook processing failed", extra={"user_id": user_id, "events": len(ids), "error": str(e)})
+            # Left processing with its lease unless out of attempts; claimed again once the lease expires
+            await update_tink_webhook_events(ids, {"error": str(e)[:500], **(
+                {"status": "failed", "lease_until": None, "processed_at": _now()} if failed else {})})
+            return
+        await update_tink_webhook_events(ids, {"status": "processed", "error": None, "lease_until": None, "processed_at": _now()})
+        logger.info("Tink webhook events processed", extra={
+            "user_id": user_id, "events": len(ids), "accounts": "all" if account_ids is None else len(account_ids),
+            "booked_from": booked_from, "transactions": len(transactions), "new_transactions": stats["new_transactions"],
+            "charge_events": stats["events"]})
+
+    async def _drain(self) -> int:
+        processed = 0
+        while True:
+            events = await claim_tink_webhook_events(TINK_WEBHOOK_QUIET_SECONDS, TINK_WEBHOOK_MAX_DELAY_SECONDS,
+                                                     TINK_WEBHOOK_LEASE_SECONDS)
+            if not events:
+                return processed
+            await self.process(events)
+            processed += len(events)
+
+    async def run_once(self) -> int:
+        """Process users with settled events until none is left; returns how many events were claimed"""
+        return sum(await asyncio.gather(*(self._drain() for _ in range(self.concurrency))))
+
+    async def prune(self) -> None:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=TINK_WEBHOOK_RETENTION_DAYS)
+        await delete_processed_tink_webhook_events(cutoff.isoformat())
+        self._pruned_at = time.monotonic()
+
+    # ---------- Background loop ----------
+
+    async def _run_pass(self) -> None:
+        await self.run_once()
+        if time.monotonic() - self._pruned_at > PRUNE_INTERVAL_SECONDS:
+            await self.prune()
+
+    def start(self, interval: float = TINK_WEBHOOK_POLL_SECONDS) -> None:
+        if self.enabled:
+            self._job.start(interval)
+
+    async def stop(self) -> None:
+        await self._job.stop()
+
+webhooks = TinkWebhookProcessor()
+
+async def main() -> None:
+    setup_logging()
+    try:
+        processed = await webhooks.run_once()
+        logger.info("Tink webhook events processed", extra={"events": processed})
+    finally:
+        await vault.stop()
+        await resources.close()
+        shutdown_logging()
+
+if __name__ == "__main__":
+    asyncio.run(main())
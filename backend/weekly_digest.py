@@ -0,0 +1,186 @@
+"""Weekly summary digest job.
+
+    python weekly_digest.py                      # digest for the current week
+    python weekly_digest.py --as-of 2025-11-03   # a specific week
+
+Users are processed in keyset pages by id. get_weekly_digest_batch() computes
+each page's figures in one set-based query, with totals per currency; the
+job converts them to DKK with the cost model's FX rates, projects renewal
+dates that have passed onto their schedule (like /api/subscriptions/upcoming),
+renders the push payloads and hands them to the Expo sender in batches of 100. After every
+page the cursor is written to digest_runs, so a crashed or killed run
+resumes at the next page when started again. Events are deduplicated on
+(user, week), so a page that is redone never notifies anyone twice.
+"""
+import os
+import argparse
+import asyncio
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from cost_model import fx_rates, next_renewal, parse_date
+from logging_config import get_logger, setup_logging, shutdown_logging
+from push_sender import send_push_messages, unregistered_tokens
+from resources import resources
+from supabase_client import (
+    create_notification_events, deactivate_push_tokens, get_notification_events_by_keys, get_or_create_digest_run,
+    get_push_tokens_for_users, get_weekly_digest_batch, mark_notification_events, update_digest_run
+)
+
+load_dotenv()
+
+logger = get_logger("weekly_digest")
+
+DIGEST_TYPE = "weekly_summary"
+DIGEST_PAGE_SIZE = int(os.getenv("DIGEST_PAGE_SIZE", 1000))
+
+def week_start(day: date) -> date:
+    """Monday of the week containing day"""
+    return day - timedelta(days=day.weekday())
+
+def _kr(amount: float) -> str:
+    return f"{float(amount):,.0f} kr.".replace(",", ".")
+
+def _dkk(totals: Dict[str, Any]) -> float:
+    """Sum of per-currency totals in DKK"""
+    return round(sum(fx_rates.to_base(float(amount), code) for code, amount in totals.items()), 2)
+
+def upcoming_renewals(renewals: List[Dict[str, Any]], as_of: date) -> List[Dict[str, Any]]:
+    """Renewals in the 7 days from as_of, with renewal dates that have passed moved to their next charge"""
+    week_end = as_of + timedelta(days=7)
+    upcoming = []
+    for sub in renewals:
+        renewal = parse_date(sub["renewal_date"])
+        if renewal is None:
+            continue
+        if renewal < as_of:
+            renewal = next_renewal(renewal, sub.get("frequency"), as_of)
+        if renewal < week_end:
+            upcoming.append({"title": sub["title"], "amount": sub["amount"], "currency": sub["currency"],
+                             "renewal_date": renewal.isoformat()})
+    return sorted(upcoming, key=lambda sub: sub["renewal_date"])
+
+def render_digest(row: Dict[str, Any], as_of: date) -> Dict[str, Any]:
+    """Push title, body and data for one user's digest row"""
+    monthly_total = _dkk(row["monthly_totals"])
+    upcoming = upcoming_renewals(row["renewals"], as_of)
+    parts = [f"{row['active_count']} aktive abonnementer for {_kr(monthly_total)}/md."]
+    if upcoming:
+        upcoming_total = round(sum(fx_rates.to_base(float(sub["amount"]), sub["currency"]) for sub in upcoming), 2)
+        parts.append(f"{len(upcoming)} fornyes i denne uge ({_kr(upcoming_total)})")
+    if row["price_increases"]:
+        parts.append(f"{row['price_increases']} prisstigning{'er' if row['price_increases'] > 1 else ''}")
+    if row["new_count"]:
+        parts.append(f"{row['new_count']} nye")
+    return {
+        "title": "Din ugentlige oversigt",
+        "body": " · ".join(parts),
+        "data": {
+            "type": DIGEST_TYPE,
+            "monthly_total": monthly_total,
+            "upcoming": upcoming[:5],
+            "price_increases": row["price_increases"],
+            "new_count": row["new_count"],
+        },
+    }
+
+class DigestJob:
+    def __init__(self, as_of: date, page_size: int = DIGEST_PAGE_SIZE):
+        self.as_of = as_of
+        self.period = week_start(as_of).isoformat()
+        self.page_size = page_size
+
+    def _fetch(self, after_user_id: int) -> asyncio.Task:
+        return asyncio.create_task(get_weekly_digest_batch(after_user_id, self.page_size, self.as_of.isoformat()))
+
+    async def _deliver(self, rows: List[Dict[str, Any]]) -> int:
+        """Queue and send one page of digests; returns messages accepted by the sender"""
+        recipients = [r for r in rows if r["active_count"] > 0]
+        if not recipients:
+            return 0
+        events = [{
+            "user_id": r["user_id"],
+            "event_type": DIGEST_TYPE,
+            "dedupe_key": f"{DIGEST_TYPE}:{r['user_id']}:{self.period}",
+            "payload": render_digest(r, self.as_of),
+        } for r in recipients]
+        created = await create_notification_events(events)
+        created_keys = {e["dedupe_key"] for e in created}
+        leftover = [e["dedupe_key"] for e in events if e["dedupe_key"] not in created_keys]
+        # Queued by an earlier, interrupted attempt at this page but never sent
+        pending = created + await get_notification_events_by_keys(leftover)
+        if not pending:
+            return 0
+
+        by_user = {e["user_id"]: e for e in pending}
+        tokens = await get_push_tokens_for_users(list(by_user))
+        messages = []
+        for token in tokens:
+            payload = by_user[token["user_id"]]["payload"]
+            messages.append({"to": token["expo_push_token"], "sound": "default", **payload})
+        tickets = await send_push_messages(messages)
+
+        delivered_users = {token["user_id"] for token, ticket in zip(tokens, tickets) if ticket.get("status") == "ok"}
+        await deactivate_push_tokens(unregistered_tokens(messages, tickets))
+        await mark_notification_events([e["id"] for e in pending if e["user_id"] in delivered_users], "sent")
+        await mark_notification_events([e["id"] for e in pending if e["user_id"] not in delivered_users], "skipped")
+        return sum(1 for t in tickets if t.get("status") == "ok")
+
+    async def run(self, restart: bool = False) -> Dict[str, Any]:
+        run = await get_or_create_digest_run(DIGEST_TYPE, self.period)
+        if run["status"] == "completed" and not restart:
+            logger.info("Digest already completed", extra={"period": self.period})
+            return run
+        cursor = 0 if restart else run["last_user_id"]
+        users = 0 if restart else run["users_processed"]
+        sent = 0 if restart else run["notifications_sent"]
+        if restart:
+            await update_digest_run(run["id"], {"status": "running", "last_user_id": 0, "users_processed": 0, "notifications_sent": 0})
+        logger.info("Digest run started", extra={"period": self.period, "cursor": cursor})
+
+        started = time.perf_counter()
+        next_page = self._fetch(cursor)
+        while True:
+            rows = await next_page
+            if not rows:
+                break
+            # Compute the next page while this one is being sent
+            next_page: Optional[asyncio.Task] = self._fetch(rows[-1]["user_id"]) if len(rows) == self.page_size else None
+            sent += await self._deliver(rows)
+            users += sum(1 for r in rows if r["active_count"] > 0)
+            cursor = rows[-1]["user_id"]
+            await update_digest_run(run["id"], {"last_user_id": cursor, "users_processed": users, "notifications_sent": sent})
+            logger.info("Digest page done", extra={"cursor": cursor, "users_processed": users, "notifications_sent": sent})
+            if next_page is None:
+                break
+
+        await update_digest_run(run["id"], {"status": "completed", "finished_at": datetime.now(timezone.utc).isoformat()})
+        result = {"period": self.period, "users_processed": users, "notifications_sent": sent,
+                  "duration_s": round(time.perf_counter() - started, 2)}
+        logger.info("Digest run finished", extra=result)
+        return result
+
+async def main_async(args) -> None:
+    try:
+        await DigestJob(args.as_of, args.page_size).run(restart=args.restart)
+    finally:
+        await resources.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--as-of", type=date.fromisoformat, default=date.today(), help="Date the digest is computed for")
+    parser.add_argument("--page-size", type=int, default=DIGEST_PAGE_SIZE)
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the first user")
+    args = parser.parse_args()
+
+    setup_logging()
+    try:
+        asyncio.run(main_async(args))
+    finally:
+        shutdown_logging()
+
+if __name__ == "__main__":
+    main()
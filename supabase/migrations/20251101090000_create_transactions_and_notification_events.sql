@@ -0,0 +1,130 @@
+/*
+  # Create transaction store, charge series and notification events
+
+  ## Summary
+  Keeps a compact copy of imported bank transactions per user so price changes and new recurring
+  charges can be detected incrementally, and adds an outbox of notification events for the
+  `price_increase` and `transaction_detected` notification types.
+
+  ## New Tables
+
+  ### `transactions`
+  - `id` (bigserial, primary key) - Unique transaction record identifier
+  - `user_id` (bigint, foreign key, not null) - References users.id
+  - `external_id` (text, not null) - Tink transaction id (dedupe key per user)
+  - `account_id` (text) - Tink account id
+  - `merchant_key` (text, not null) - Normalized merchant name used to group charges
+  - `description` (text) - Original bank description
+  - `amount` (numeric(12,2), not null) - Signed amount (negative = money out)
+  - `currency` (text) - Currency code (default: DKK)
+  - `booked_date` (date, not null) - Booking date
+  - `subscription_id` (bigint, foreign key) - Matched subscription, if any
+  - `created_at` (timestamptz) - When the transaction was stored
+
+  ### `transaction_series`
+  One row per (user, merchant) summarizing the charge history, so a new charge is compared
+  against the series without re-reading old transactions.
+  - `user_id`, `merchant_key` (primary key)
+  - `charge_count` (integer) - Number of charges seen
+  - `last_amount` (numeric(12,2)) - Most recent charge amount (positive)
+  - `mean_amount` (numeric(12,2)) - Running mean of charge amounts
+  - `recent_amounts` (jsonb) - Last few amounts, newest last
+  - `first_booked_date`, `last_booked_date` (date) - Span of the series
+  - `subscription_id` (bigint, foreign key) - Matched subscription, if any
+  - `updated_at` (timestamptz) - Last update timestamp
+
+  ### `notification_events`
+  Outbox consumed by the notification dispatcher.
+  - `id` (bigserial, primary key)
+  - `user_id` (bigint, foreign key, not null) - References users.id
+  - `subscription_id` (bigint, foreign key) - Related subscription, if any
+  - `event_type` (text, not null) - One of the notification_preferences types
+  - `payload` (jsonb) - Rendered event data (amounts, merchant, dates)
+  - `dedupe_key` (text, unique, not null) - Prevents duplicate events on re-sync
+  - `status` (text) - pending, sent, skipped or failed
+  - `attempts` (integer) - Delivery attempts
+  - `created_at`, `processed_at` (timestamptz)
+
+  ## Security
+  - Enable RLS on all three tables; backend uses the service role key
+  - Cascade delete with the user account (GDPR)
+
+  ## Indexes
+  - Unique `transactions(user_id, external_id)` so re-imports are idempotent
+  - `transactions(user_id, merchant_key, booked_date DESC)` for per-merchant history
+  - Partial `notification_events(created_at) WHERE status = 'pending'` for the dispatcher
+
+  ## Important Notes
+  1. Only the fields needed for detection are stored, not the raw Tink payload
+  2. Re-importing the same transactions inserts nothing and emits no events
+*/
+
+-- Create transactions table
+CREATE TABLE IF NOT EXISTS transactions (
+  id bigserial PRIMARY KEY,
+  user_id bigint NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  external_id text NOT NULL,
+  account_id text,
+  merchant_key text NOT NULL,
+  description text,
+  amount numeric(12,2) NOT NULL,
+  currency text DEFAULT 'DKK' NOT NULL,
+  booked_date date NOT NULL,
+  subscription_id bigint REFERENCES subscriptions(id) ON DELETE SET NULL,
+  created_at timestamptz DEFAULT now() NOT NULL,
+  CONSTRAINT unique_user_transaction UNIQUE(user_id, external_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_transactions_user_merchant_date ON transactions(user_id, merchant_key, booked_date DESC);
+
+ALTER TABLE transactions ENABLE ROW LEVEL SECURITY;
+
+-- Create transaction_series table
+CREATE TABLE IF NOT EXISTS transaction_series (
+  user_id bigint NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  merchant_key text NOT NULL,
+  charge_count integer DEFAULT 0 NOT NULL,
+  last_amount numeric(12,2),
+  mean_amount numeric(12,2),
+  recent_amounts jsonb DEFAULT '[]'::jsonb NOT NULL,
+  first_booked_date date,
+  last_booked_date date,
+  subscription_id bigint REFERENCES subscriptions(id) ON DELETE SET NULL,
+  updated_at timestamptz DEFAULT now() NOT NULL,
+  PRIMARY KEY (user_id, merchant_key)
+);
+
+ALTER TABLE transaction_series ENABLE ROW LEVEL SECURITY;
+
+CREATE TRIGGER update_transaction_series_updated_at
+  BEFORE UPDATE ON transaction_series
+  FOR EACH ROW
+  EXECUTE FUNCTION update_updated_at_column();
+
+-- Create notification_events outbox
+CREATE TABLE IF NOT EXISTS notification_events (
+  id bigserial PRIMARY KEY,
+  user_id bigint NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  subscription_id bigint REFERENCES subscriptions(id) ON DELETE SET NULL,
+  event_type text NOT NULL CHECK (
+    event_type IN (
+      'new_subscription',
+      'renewal_reminder',
+      'price_increase',
+      'token_expiring',
+      'transaction_detected',
+      'weekly_summary'
+    )
+  ),
+  payload jsonb DEFAULT '{}'::jsonb NOT NULL,
+  dedupe_key text NOT NULL UNIQUE,
+  status text DEFAULT 'pending' NOT NULL CHECK (status IN ('pending', 'sent', 'skipped', 'failed')),
+  attempts integer DEFAULT 0 NOT NULL,
+  created_at timestamptz DEFAULT now() NOT NULL,
+  processed_at timestamptz
+);
+
+CREATE INDEX IF NOT EXISTS idx_notification_events_user_id ON notification_events(user_id);
+CREATE INDEX IF NOT EXISTS idx_notification_events_pending ON notification_events(created_at) WHERE status = 'pending';
+
+ALTER TABLE notification_events ENABLE ROW LEVEL SECURITY;
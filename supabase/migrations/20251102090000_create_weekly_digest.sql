@@ -0,0 +1,159 @@
+/*
+  # Weekly summary digest
+
+  ## Summary
+  Set-based aggregation for the `weekly_summary` notification type. One call computes the digest
+  figures for a page of opted-in users, so the digest job never loads subscriptions per user.
+  A small checkpoint table lets an interrupted run resume where it stopped.
+
+  ## New Tables
+
+  ### `digest_runs`
+  - `id` (bigserial, primary key)
+  - `digest_type` (text, not null) - Digest kind (currently only weekly_summary)
+  - `period_start` (date, not null) - First day of the digest period
+  - `last_user_id` (bigint) - Keyset cursor: every user with id <= this has been processed
+  - `users_processed` (integer) - Users with a digest computed so far
+  - `notifications_sent` (integer) - Push messages accepted by the sender
+  - `status` (text) - running or completed
+  - `started_at`, `updated_at`, `finished_at` (timestamptz)
+
+  ## New Functions
+
+  ### `get_weekly_digest_batch(p_after_user_id, p_limit, p_as_of)`
+  Returns one row per opted-in active user with id > p_after_user_id (at most p_limit users,
+  ordered by id) with:
+  - `active_count`, `monthly_totals` (amounts normalized to a month by frequency)
+  - `upcoming_count`, `upcoming_totals`, `upcoming` (renewals in the 7 days from p_as_of)
+  - `new_count` (subscriptions added in the 7 days before p_as_of)
+  - `price_increases` (price_increase events in the 7 days before p_as_of)
+  Users without active subscriptions are returned with active_count = 0 so the caller can
+  advance its cursor past them.
+
+  ## Important Notes
+  1. Opt-in follows get_user_notification_preference(): a missing global preference means enabled;
+     with duplicate global rows the most recently updated one counts
+  2. Pagination is keyset on users.id, so each page is an index range scan
+  3. monthly_totals and upcoming_totals are jsonb objects of currency -> sum. Amounts in different
+     currencies are never added here; the digest job converts them to DKK with the cost model's FX
+     rates before rendering
+*/
+
+CREATE TABLE IF NOT EXISTS digest_runs (
+  id bigserial PRIMARY KEY,
+  digest_type text NOT NULL DEFAULT 'weekly_summary',
+  period_start date NOT NULL,
+  last_user_id bigint DEFAULT 0 NOT NULL,
+  users_processed integer DEFAULT 0 NOT NULL,
+  notifications_sent integer DEFAULT 0 NOT NULL,
+  status text DEFAULT 'running' NOT NULL CHECK (status IN ('running', 'completed')),
+  started_at timestamptz DEFAULT now() NOT NULL,
+  updated_at timestamptz DEFAULT now() NOT NULL,
+  finished_at timestamptz,
+  CONSTRAINT unique_digest_period UNIQUE(digest_type, period_start)
+);
+
+ALTER TABLE digest_runs ENABLE ROW LEVEL SECURITY;
+
+CREATE TRIGGER update_digest_runs_updated_at
+  BEFORE UPDATE ON digest_runs
+  FOR EACH ROW
+  EXECUTE FUNCTION update_updated_at_column();
+
+CREATE OR REPLACE FUNCTION get_weekly_digest_batch(
+  p_after_user_id bigint DEFAULT 0,
+  p_limit integer DEFAULT 1000,
+  p_as_of date DEFAULT CURRENT_DATE
+)
+RETURNS TABLE (
+  user_id bigint,
+  active_count integer,
+  monthly_totals jsonb,
+  upcoming_count integer,
+  upcoming_totals jsonb,
+  upcoming jsonb,
+  new_count integer,
+  price_increases integer
+) AS $$
+  WITH page AS (
+    SELECT u.id
+    FROM users u
+    WHERE u.id > p_after_user_id
+      AND u.is_active = true
+      AND COALESCE((
+        SELECT np.is_enabled
+        FROM notification_preferences np
+        WHERE np.user_id = u.id
+          AND np.subscription_id IS NULL
+          AND np.notification_type = 'weekly_summary'
+        ORDER BY np.updated_at DESC, np.id DESC
+        LIMIT 1
+      ), true)
+    ORDER BY u.id
+    LIMIT p_limit
+  ),
+  sub_stats AS (
+    SELECT
+      s.owner_id,
+      count(*)::integer AS active_count,
+      count(*) FILTER (WHERE s.renewal_date >= p_as_of AND s.renewal_date < p_as_of + 7)::integer AS upcoming_count,
+      COALESCE(
+        jsonb_agg(
+          jsonb_build_object('title', s.title, 'amount', s.amount, 'currency', s.currency, 'renewal_date', s.renewal_date)
+          ORDER BY s.renewal_date
+        ) FILTER (WHERE s.renewal_date >= p_as_of AND s.renewal_date < p_as_of + 7),
+        '[]'::jsonb
+      ) AS upcoming,
+      count(*) FILTER (WHERE s.created_at >= p_as_of - 7)::integer AS new_count
+    FROM subscriptions s
+    JOIN page p ON p.id = s.owner_id
+    WHERE s.is_active = true
+    GROUP BY s.owner_id
+  ),
+  currency_sums AS (
+    SELECT
+      s.owner_id,
+      s.currency,
+      round(sum(s.amount / CASE s.frequency
+        WHEN 'kvartal' THEN 3
+        WHEN 'halvår' THEN 6
+        WHEN 'år' THEN 12
+        ELSE 1
+      END), 2) AS monthly,
+      sum(s.amount) FILTER (WHERE s.renewal_date >= p_as_of AND s.renewal_date < p_as_of + 7) AS upcoming
+    FROM subscriptions s
+    JOIN page p ON p.id = s.owner_id
+    WHERE s.is_active = true
+    GROUP BY s.owner_id, s.currency
+  ),
+  currency_stats AS (
+    SELECT
+      owner_id,
+      jsonb_object_agg(currency, monthly) AS monthly_totals,
+      COALESCE(jsonb_object_agg(currency, upcoming) FILTER (WHERE upcoming IS NOT NULL), '{}'::jsonb) AS upcoming_totals
+    FROM currency_sums
+    GROUP BY owner_id
+  ),
+  event_stats AS (
+    SELECT e.user_id, count(*)::integer AS price_increases
+    FROM notification_events e
+    JOIN page p ON p.id = e.user_id
+    WHERE e.event_type = 'price_increase'
+      AND e.created_at >= p_as_of - 7
+    GROUP BY e.user_id
+  )
+  SELECT
+    p.id,
+    COALESCE(ss.active_count, 0),
+    COALESCE(cs.monthly_totals, '{}'::jsonb),
+    COALESCE(ss.upcoming_count, 0),
+    COALESCE(cs.upcoming_totals, '{}'::jsonb),
+    COALESCE(ss.upcoming, '[]'::jsonb),
+    COALESCE(ss.new_count, 0),
+    COALESCE(es.price_increases, 0)
+  FROM page p
+  LEFT JOIN sub_stats ss ON ss.owner_id = p.id
+  LEFT JOIN currency_stats cs ON cs.owner_id = p.id
+  LEFT JOIN event_stats es ON es.user_id = p.id
+  ORDER BY p.id;
+$$ LANGUAGE sql STABLE SECURITY DEFINER;
@@ -0,0 +1,139 @@
+/*
+  # Batch notification preference resolution
+
+  ## Summary
+  get_user_notification_preference() resolves one (user, subscription, type) triple per call with up to
+  two lookups, so a reminder job calling it per subscription issues N x 2 queries. These functions
+  resolve the effective preference for a whole batch of subscriptions in a single join.
+
+  ## New Functions
+
+  ### `resolve_notification_preferences(p_subscription_ids, p_notification_type)`
+  Returns one row per existing subscription in p_subscription_ids with:
+  - `subscription_id`, `user_id`
+  - `is_enabled` (boolean) - Effective setting: subscription override -> global -> true
+  - `days_before_renewal` (integer) - Same precedence, default 1
+  - `source` (text) - Which level decided: subscription, global or default
+
+  ### `get_due_renewal_reminders(p_as_of, p_after_subscription_id, p_limit)`
+  Active subscriptions whose renewal_date is exactly the user's effective days_before_renewal after
+  p_as_of and whose effective renewal_reminder preference is enabled. Keyset paged on subscription id.
+
+  ## Indexes
+  - Partial `notification_preferences(subscription_id, notification_type) WHERE subscription_id IS NOT NULL`
+  - Partial `notification_preferences(user_id, notification_type) WHERE subscription_id IS NULL`
+  The unique constraint cannot serve either lookup on its own: it leads with user_id and NULL
+  subscription ids never compare equal.
+
+  ## Important Notes
+  1. Precedence matches get_user_notification_preference(), which stays for single lookups; an
+     override only counts if it belongs to the subscription's owner
+  2. The unique constraint doesn't stop duplicate global rows (NULL subscription ids never compare
+     equal), so each level takes its most recently updated row and every subscription appears once
+  3. Inactive users get no reminders
+*/
+
+CREATE INDEX IF NOT EXISTS idx_notif_prefs_subscription_type
+  ON notification_preferences(subscription_id, notification_type)
+  WHERE subscription_id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_notif_prefs_global_type
+  ON notification_preferences(user_id, notification_type)
+  WHERE subscription_id IS NULL;
+
+CREATE OR REPLACE FUNCTION resolve_notification_preferences(
+  p_subscription_ids bigint[],
+  p_notification_type text
+)
+RETURNS TABLE (
+  subscription_id bigint,
+  user_id bigint,
+  is_enabled boolean,
+  days_before_renewal integer,
+  source text
+) AS $$
+  SELECT
+    s.id,
+    s.owner_id,
+    COALESCE(sp.is_enabled, gp.is_enabled, true),
+    COALESCE(sp.days_before_renewal, gp.days_before_renewal, 1),
+    CASE
+      WHEN sp.id IS NOT NULL THEN 'subscription'
+      WHEN gp.id IS NOT NULL THEN 'global'
+      ELSE 'default'
+    END
+  FROM subscriptions s
+  LEFT JOIN LATERAL (
+    SELECT p.id, p.is_enabled, p.days_before_renewal
+    FROM notification_preferences p
+    WHERE p.subscription_id = s.id
+      AND p.user_id = s.owner_id
+      AND p.notification_type = p_notification_type
+    ORDER BY p.updated_at DESC, p.id DESC
+    LIMIT 1
+  ) sp ON true
+  LEFT JOIN LATERAL (
+    SELECT p.id, p.is_enabled, p.days_before_renewal
+    FROM notification_preferences p
+    WHERE p.user_id = s.owner_id
+      AND p.subscription_id IS NULL
+      AND p.notification_type = p_notification_type
+    ORDER BY p.updated_at DESC, p.id DESC
+    LIMIT 1
+  ) gp ON true
+  WHERE s.id = ANY(p_subscription_ids)
+  ORDER BY s.id;
+$$ LANGUAGE sql STABLE SECURITY DEFINER;
+
+CREATE OR REPLACE FUNCTION get_due_renewal_reminders(
+  p_as_of date DEFAULT CURRENT_DATE,
+  p_after_subscription_id bigint DEFAULT 0,
+  p_limit integer DEFAULT 1000
+)
+RETURNS TABLE (
+  subscription_id bigint,
+  user_id bigint,
+  title text,
+  amount numeric,
+  currency text,
+  renewal_date date,
+  days_before_renewal integer
+) AS $$
+  SELECT
+    s.id,
+    s.owner_id,
+    s.title,
+    s.amount,
+    s.currency,
+    s.renewal_date,
+    COALESCE(sp.days_before_renewal, gp.days_before_renewal, 1)
+  FROM subscriptions s
+  JOIN users u ON u.id = s.owner_id AND u.is_active = true
+  LEFT JOIN LATERAL (
+    SELECT p.id, p.is_enabled, p.days_before_renewal
+    FROM notification_preferences p
+    WHERE p.subscription_id = s.id
+      AND p.user_id = s.owner_id
+      AND p.notification_type = 'renewal_reminder'
+    ORDER BY p.updated_at DESC, p.id DESC
+    LIMIT 1
+  ) sp ON true
+  LEFT JOIN LATERAL (
+    SELECT p.id, p.is_enabled, p.days_before_renewal
+    FROM notification_preferences p
+    WHERE p.user_id = s.owner_id
+      AND p.subscription_id IS NULL
+      AND p.notification_type = 'renewal_reminder'
+    ORDER BY p.updated_at DESC, p.id DESC
+    LIMIT 1
+  ) gp ON true
+  WHERE s.is_active = true
+    AND s.id > p_after_subscription_id
+    -- 30 is the largest days_before_renewal the preferences table allows
+    AND s.renewal_date > p_as_of
+    AND s.renewal_date <= p_as_of + 30
+    AND COALESCE(sp.is_enabled, gp.is_enabled, true)
+    AND s.renewal_date = p_as_of + COALESCE(sp.days_before_renewal, gp.days_before_renewal, 1)
+  ORDER BY s.id
+  LIMIT p_limit;
+$$ LANGUAGE sql STABLE SECURITY DEFINER;
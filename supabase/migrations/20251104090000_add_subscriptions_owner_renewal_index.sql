@@ -0,0 +1,19 @@
+/*
+  # Owner-scoped renewal index
+
+  ## Summary
+  Backs GET /api/subscriptions/upcoming, which reads a user's active subscriptions renewing before a
+  date. The single-column renewal_date index covers every user's rows, so the owner filter would be
+  applied after the scan. This partial composite index turns the query into a narrow range scan over
+  a single user's active rows.
+
+  ## Indexes
+  - `idx_subscriptions_owner_renewal_active` on `subscriptions(owner_id, renewal_date) WHERE is_active = true`
+
+  ## Important Notes
+  1. Soft-deleted subscriptions (is_active = false) are left out of the index entirely
+*/
+
+CREATE INDEX IF NOT EXISTS idx_subscriptions_owner_renewal_active
+  ON subscriptions(owner_id, renewal_date)
+  WHERE is_active = true;
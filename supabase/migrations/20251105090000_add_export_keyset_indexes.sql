@@ -0,0 +1,20 @@
+/*
+  # Keyset indexes for data export
+
+  ## Summary
+  GET /api/export reads a user's subscriptions and stored transactions in pages of
+  `WHERE owner = $1 AND id > $last ORDER BY id LIMIT n`. With these composite indexes every page
+  is a short range scan starting at the previous page's last id, so page cost does not grow with
+  how far into the export it is (unlike OFFSET pagination).
+
+  ## Indexes
+  - `idx_subscriptions_owner_id_id` on `subscriptions(owner_id, id)`
+  - `idx_transactions_user_id_id` on `transactions(user_id, id)`
+
+  ## Important Notes
+  1. The subscriptions index covers soft-deleted rows too; exports include them
+*/
+
+CREATE INDEX IF NOT EXISTS idx_subscriptions_owner_id_id ON subscriptions(owner_id, id);
+
+CREATE INDEX IF NOT EXISTS idx_transactions_user_id_id ON transactions(user_id, id);
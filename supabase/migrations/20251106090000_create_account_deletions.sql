@@ -0,0 +1,150 @@
+/*
+  # Account deletion jobs
+
+  ## Summary
+  Account deletion (GDPR) runs as a background job instead of a single `DELETE FROM users`.
+  Relying on the cascades for a heavy user deletes or updates every dependent row in one statement:
+  its subscriptions, transactions and events, and `analytics_events` through ON DELETE SET NULL.
+  That holds row locks on all of them until the statement commits. The job instead anonymizes and
+  deletes in small batches, each its own short transaction, and only removes the `users` row once
+  nothing references it any more.
+
+  ## New Tables
+
+  ### `account_deletions`
+  - `id` (uuid, primary key) - Opaque id; the progress endpoint is looked up by it after the user is gone
+  - `user_id` (bigint, not null) - The user being deleted (no foreign key: the user row is deleted last)
+  - `status` (text) - pending, running, completed or failed
+  - `phase` (text) - Current step: revoke, anonymize, delete or finalize
+  - `rows_anonymized` (integer) - analytics_events rows detached from the user so far
+  - `rows_deleted` (integer) - Dependent rows deleted so far
+  - `attempts` (integer) - Times a worker has claimed the job
+  - `lease_until` (timestamptz) - A running job whose lease has passed is picked up by another worker
+  - `error` (text) - Last failure, if any
+  - `requested_at`, `started_at`, `updated_at`, `finished_at` (timestamptz)
+
+  ## New Functions
+
+  ### `claim_account_deletion(p_lease_seconds)`
+  Claims the oldest pending job, or a running job with an expired lease, using FOR UPDATE SKIP LOCKED
+  so several workers never claim the same job. Returns the claimed row, or nothing.
+
+  ### `anonymize_analytics_events_batch(p_user_id, p_limit)`
+  Clears user_id, subscription_id, session_id and event_data on up to p_limit of the user's events
+  and returns how many were changed. Event type, merchant, platform and time are kept for aggregates.
+
+  ### `delete_user_rows_batch(p_table, p_user_id, p_limit)`
+  Deletes up to p_limit of the user's rows from one of the dependent tables and returns how many were
+  deleted. Only the tables listed in the function are accepted.
+
+  ## Security
+  - Enable RLS on account_deletions; backend uses the service role key
+
+  ## Indexes
+  - Unique partial `account_deletions(user_id) WHERE status IN ('pending', 'running')`: one active job per user
+  - Partial `account_deletions(requested_at) WHERE status IN ('pending', 'running')` for claiming
+
+  ## Important Notes
+  1. Batches use SKIP LOCKED, so a row another transaction holds is taken by a later batch rather than waited on
+  2. Completed jobs keep only the user id and counters, no personal data
+*/
+
+CREATE TABLE IF NOT EXISTS account_deletions (
+  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  user_id bigint NOT NULL,
+  status text DEFAULT 'pending' NOT NULL CHECK (status IN ('pending', 'running', 'completed', 'failed')),
+  phase text DEFAULT 'revoke' NOT NULL CHECK (phase IN ('revoke', 'anonymize', 'delete', 'finalize')),
+  rows_anonymized integer DEFAULT 0 NOT NULL,
+  rows_deleted integer DEFAULT 0 NOT NULL,
+  attempts integer DEFAULT 0 NOT NULL,
+  lease_until timestamptz,
+  error text,
+  requested_at timestamptz DEFAULT now() NOT NULL,
+  started_at timestamptz,
+  updated_at timestamptz DEFAULT now() NOT NULL,
+  finished_at timestamptz
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_account_deletions_active_user
+  ON account_deletions(user_id)
+  WHERE status IN ('pending', 'running');
+
+CREATE INDEX IF NOT EXISTS idx_account_deletions_queue
+  ON account_deletions(requested_at)
+  WHERE status IN ('pending', 'running');
+
+ALTER TABLE account_deletions ENABLE ROW LEVEL SECURITY;
+
+CREATE TRIGGER update_account_deletions_updated_at
+  BEFORE UPDATE ON account_deletions
+  FOR EACH ROW
+  EXECUTE FUNCTION update_updated_at_column();
+
+CREATE OR REPLACE FUNCTION claim_account_deletion(p_lease_seconds integer DEFAULT 300)
+RETURNS SETOF account_deletions AS $$
+  UPDATE account_deletions d
+  SET status = 'running',
+      attempts = d.attempts + 1,
+      lease_until = now() + make_interval(secs => p_lease_seconds),
+      started_at = COALESCE(d.started_at, now())
+  WHERE d.id = (
+    SELECT id
+    FROM account_deletions
+    WHERE status = 'pending'
+       OR (status = 'running' AND lease_until < now())
+    ORDER BY requested_at
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+  )
+  RETURNING d.*;
+$$ LANGUAGE sql VOLATILE SECURITY DEFINER;
+
+CREATE OR REPLACE FUNCTION anonymize_analytics_events_batch(p_user_id bigint, p_limit integer DEFAULT 500)
+RETURNS integer AS $$
+  WITH batch AS (
+    SELECT id
+    FROM analytics_events
+    WHERE user_id = p_user_id
+    LIMIT p_limit
+    FOR UPDATE SKIP LOCKED
+  ), updated AS (
+    UPDATE analytics_events e
+    SET user_id = NULL,
+        subscription_id = NULL,
+        session_id = NULL,
+        event_data = NULL
+    FROM batch
+    WHERE e.id = batch.id
+    RETURNING 1
+  )
+  SELECT count(*)::integer FROM updated;
+$$ LANGUAGE sql VOLATILE SECURITY DEFINER;
+
+CREATE OR REPLACE FUNCTION delete_user_rows_batch(p_table text, p_user_id bigint, p_limit integer DEFAULT 500)
+RETURNS integer AS $$
+DECLARE
+  v_column text;
+  v_deleted integer;
+BEGIN
+  v_column := CASE p_table
+    WHEN 'notification_events' THEN 'user_id'
+    WHEN 'transactions' THEN 'user_id'
+    WHEN 'transaction_series' THEN 'user_id'
+    WHEN 'notification_preferences' THEN 'user_id'
+    WHEN 'push_tokens' THEN 'user_id'
+    WHEN 'tink_tokens' THEN 'user_id'
+    WHEN 'subscriptions' THEN 'owner_id'
+  END;
+  IF v_column IS NULL THEN
+    RAISE EXCEPTION 'delete_user_rows_batch: unsupported table %', p_table;
+  END IF;
+
+  -- ctid works for every table, including transaction_series which has no id column
+  EXECUTE format(
+    'DELETE FROM %1$I WHERE ctid = ANY(ARRAY(SELECT ctid FROM %1$I WHERE %2$I = $1 LIMIT $2 FOR UPDATE SKIP LOCKED))',
+    p_table, v_column
+  ) USING p_user_id, p_limit;
+  GET DIAGNOSTICS v_deleted = ROW_COUNT;
+  RETURN v_deleted;
+END;
+$$ LANGUAGE plpgsql VOLATILE SECURITY DEFINER;
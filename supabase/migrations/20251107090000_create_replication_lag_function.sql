@@ -0,0 +1,30 @@
+/*
+  # Replication lag for read replica routing
+
+  ## Summary
+  The backend sends read-only queries to read replicas when SUPABASE_READ_REPLICA_URLS is set
+  (backend/replicas.py). Its health check calls this function on every replica to decide whether
+  the replica is streaming and close enough to the primary to serve reads.
+
+  ## New Functions
+
+  ### `replication_lag_seconds()`
+  - 0 on a primary, or on a standby that has replayed everything it has received
+  - Otherwise the seconds since the last replayed transaction was committed on the primary
+  - NULL when the standby is not streaming from the primary; the backend treats that as unhealthy
+
+  ## Important Notes
+  1. Apply this migration on the primary; physical standbys get the function through replication
+  2. An idle primary writes nothing, so a caught-up standby would otherwise appear to fall behind
+     over time; comparing the received and replayed WAL positions reports it as current instead
+*/
+
+CREATE OR REPLACE FUNCTION replication_lag_seconds()
+RETURNS double precision AS $$
+  SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE GREATEST(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)::double precision
+  END;
+$$ LANGUAGE sql STABLE SECURITY DEFINER;
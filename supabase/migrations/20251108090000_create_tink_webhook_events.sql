@@ -0,0 +1,140 @@
+/*
+  # Tink webhook events
+
+  ## Summary
+  Tink pushes transaction and refresh events to POST /api/tink/webhooks instead of the backend
+  polling for changes. The endpoint verifies the signature, stores the event and answers right
+  away; a worker later fetches only the affected accounts from the earliest changed date. Storing
+  events by their id makes redelivered events no-ops, and claiming a user's events together
+  turns a burst of events into one fetch.
+
+  ## New Tables
+
+  ### `tink_webhook_events`
+  - `id` (bigserial, primary key)
+  - `event_id` (text, unique) - Tink's event id, or a hash of the body when it has none
+  - `event_type` (text) - e.g. account-transactions:modified, refresh:finished
+  - `user_id` (bigint, not null) - From the event's externalUserId (no foreign key; removed by account deletion)
+  - `account_id` (text) - Affected account; NULL means all of the user's accounts
+  - `booked_from` (date) - Earliest booked date the event says changed, if given
+  - `status` (text) - pending, processing, processed or failed
+  - `attempts` (integer) - Times a worker has claimed the event
+  - `lease_until` (timestamptz) - A processing event whose lease has passed is claimed again
+  - `error` (text) - Last failure, if any
+  - `received_at`, `processed_at` (timestamptz)
+
+  ## New Functions
+
+  ### `claim_tink_webhook_events(p_quiet_seconds, p_max_delay_seconds, p_lease_seconds)`
+  Claims all open events of one user, once no event has arrived for that user for p_quiet_seconds
+  or the oldest has waited p_max_delay_seconds. Users another worker is processing are skipped.
+  Returns the claimed rows, or nothing.
+
+  ### `delete_user_rows_batch` (replaced)
+  Also accepts `tink_webhook_events`, so account deletion removes them.
+
+  ## Security
+  - Enable RLS on tink_webhook_events; backend uses the service role key
+
+  ## Indexes
+  - Unique `event_id` for deduplication
+  - Partial `(user_id, received_at) WHERE status IN ('pending', 'processing')` for claiming
+  - `(user_id)` for account deletion
+
+  ## Important Notes
+  1. Processed events are kept for TINK_WEBHOOK_RETENTION_DAYS so late redeliveries are still recognized
+  2. The claim takes a transaction-level advisory lock per user, so two workers never claim the same user
+*/
+
+CREATE TABLE IF NOT EXISTS tink_webhook_events (
+  id bigserial PRIMARY KEY,
+  event_id text NOT NULL,
+  event_type text NOT NULL,
+  user_id bigint NOT NULL,
+  account_id text,
+  booked_from date,
+  status text DEFAULT 'pending' NOT NULL CHECK (status IN ('pending', 'processing', 'processed', 'failed')),
+  attempts integer DEFAULT 0 NOT NULL,
+  lease_until timestamptz,
+  error text,
+  received_at timestamptz DEFAULT now() NOT NULL,
+  processed_at timestamptz
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_tink_webhook_events_event_id
+  ON tink_webhook_events(event_id);
+
+CREATE INDEX IF NOT EXISTS idx_tink_webhook_events_open
+  ON tink_webhook_events(user_id, received_at)
+  WHERE status IN ('pending', 'processing');
+
+CREATE INDEX IF NOT EXISTS idx_tink_webhook_events_user_id
+  ON tink_webhook_events(user_id);
+
+ALTER TABLE tink_webhook_events ENABLE ROW LEVEL SECURITY;
+
+CREATE OR REPLACE FUNCTION claim_tink_webhook_events(
+  p_quiet_seconds integer DEFAULT 5,
+  p_max_delay_seconds integer DEFAULT 60,
+  p_lease_seconds integer DEFAULT 300
+)
+RETURNS SETOF tink_webhook_events AS $$
+DECLARE
+  v_user_id bigint;
+BEGIN
+  FOR v_user_id IN
+    SELECT user_id
+    FROM tink_webhook_events
+    WHERE status IN ('pending', 'processing')
+    GROUP BY user_id
+    HAVING NOT bool_or(status = 'processing' AND lease_until >= now())
+       AND (max(received_at) < now() - make_interval(secs => p_quiet_seconds)
+            OR min(received_at) < now() - make_interval(secs => p_max_delay_seconds))
+    ORDER BY min(received_at)
+    LIMIT 10
+  LOOP
+    IF pg_try_advisory_xact_lock(hashtextextended('tink_webhook_events:' || v_user_id, 0)) THEN
+      -- Rechecked against the committed row if another worker claimed it meanwhile
+      RETURN QUERY
+        UPDATE tink_webhook_events
+        SET status = 'processing',
+            attempts = attempts + 1,
+            lease_until = now() + make_interval(secs => p_lease_seconds)
+        WHERE user_id = v_user_id
+          AND (status = 'pending' OR (status = 'processing' AND lease_until < now()))
+        RETURNING *;
+      RETURN;
+    END IF;
+  END LOOP;
+END;
+$$ LANGUAGE plpgsql VOLATILE SECURITY DEFINER;
+
+CREATE OR REPLACE FUNCTION delete_user_rows_batch(p_table text, p_user_id bigint, p_limit integer DEFAULT 500)
+RETURNS integer AS $$
+DECLARE
+  v_column text;
+  v_deleted integer;
+BEGIN
+  v_column := CASE p_table
+    WHEN 'notification_events' THEN 'user_id'
+    WHEN 'transactions' THEN 'user_id'
+    WHEN 'transaction_series' THEN 'user_id'
+    WHEN 'notification_preferences' THEN 'user_id'
+    WHEN 'push_tokens' THEN 'user_id'
+    WHEN 'tink_tokens' THEN 'user_id'
+    WHEN 'tink_webhook_events' THEN 'user_id'
+    WHEN 'subscriptions' THEN 'owner_id'
+  END;
+  IF v_column IS NULL THEN
+    RAISE EXCEPTION 'delete_user_rows_batch: unsupported table %', p_table;
+  END IF;
+
+  -- ctid works for every table, including transaction_series which has no id column
+  EXECUTE format(
+    'DELETE FROM %1$I WHERE ctid = ANY(ARRAY(SELECT ctid FROM %1$I WHERE %2$I = $1 LIMIT $2 FOR UPDATE SKIP LOCKED))',
+    p_table, v_column
+  ) USING p_user_id, p_limit;
+  GET DIAGNOSTICS v_deleted = ROW_COUNT;
+  RETURN v_deleted;
+END;
+$$ LANGUAGE plpgsql VOLATILE SECURITY DEFINER;
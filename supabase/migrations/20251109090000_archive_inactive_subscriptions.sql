@@ -0,0 +1,182 @@
+/*
+  # Partial indexes on active subscriptions and an archive for deleted ones
+
+  ## Summary
+  Deleting a subscription only sets is_active = false, so deleted rows stayed in `subscriptions`
+  and in every index on it. Every owner-scoped read filters on is_active = true. The hot indexes
+  become partial indexes over active rows only. A background job (backend/subscription_archive.py)
+  moves subscriptions that have been inactive for SUBSCRIPTION_ARCHIVE_AFTER_DAYS into
+  `subscriptions_archive` in small batches. `subscriptions` and its indexes then grow with live
+  data only.
+
+  ## Indexes
+  - Replaced `idx_subscriptions_owner_active (owner_id, is_active)` with
+    `idx_subscriptions_owner_created_active (owner_id, created_at DESC) WHERE is_active = true`,
+    which also matches the ORDER BY of the subscription list
+  - Replaced `idx_subscriptions_renewal_date` with `idx_subscriptions_renewal_date_active ... WHERE is_active = true`
+    (renewal reminders)
+  - Replaced `idx_subscriptions_category` with `idx_subscriptions_category_active ... WHERE is_active = true`
+  - Dropped `idx_subscriptions_owner_id`; `idx_subscriptions_owner_id_id (owner_id, id)` covers the same
+    lookups, including the users foreign key
+  - New `idx_subscriptions_inactive_updated (updated_at) WHERE is_active = false` lets the archive job
+    find its candidates without scanning active rows
+  - `subscriptions_archive(owner_id, id)` for export and account deletion
+
+  ## New Tables
+
+  ### `subscriptions_archive`
+  Same columns as `subscriptions`, plus `archived_at` (timestamptz). Rows keep their original id.
+
+  ## New Functions
+
+  ### `archive_inactive_subscriptions(p_inactive_before, p_limit)`
+  Moves up to p_limit subscriptions that are inactive and were last updated before p_inactive_before
+  into the archive, in one statement, and returns how many were moved. Rows locked by another
+  transaction are skipped (SKIP LOCKED).
+
+  ### `restore_archived_subscription(p_subscription_id, p_owner_id, p_activate)`
+  Moves one archived subscription of the owner back into `subscriptions` under its original id,
+  active again unless p_activate is false. Returns the restored row, or nothing.
+
+  ### `delete_user_rows_batch` (replaced)
+  Also accepts `subscriptions_archive`, so account deletion removes archived rows.
+
+  ## Security
+  - Enable RLS on subscriptions_archive; backend uses the service role key
+
+  ## Important Notes
+  1. Archiving deletes the subscriptions row, so foreign keys act as on any delete: links from
+     transactions, transaction_series, notification_events and analytics_events are set to NULL,
+     and per-subscription notification preferences are removed. A restored subscription starts
+     without them; new charges are linked to it again by the charge detector
+  2. Restore sets updated_at to now, so an inactive restored row isn't archived again right away
+  3. The indexes are built without CONCURRENTLY, like every migration here; run this outside peak hours
+*/
+
+DROP INDEX IF EXISTS idx_subscriptions_owner_active;
+DROP INDEX IF EXISTS idx_subscriptions_renewal_date;
+DROP INDEX IF EXISTS idx_subscriptions_category;
+DROP INDEX IF EXISTS idx_subscriptions_owner_id;
+
+CREATE INDEX IF NOT EXISTS idx_subscriptions_owner_created_active
+  ON subscriptions(owner_id, created_at DESC)
+  WHERE is_active = true;
+
+CREATE INDEX IF NOT EXISTS idx_subscriptions_renewal_date_active
+  ON subscriptions(renewal_date)
+  WHERE is_active = true;
+
+CREATE INDEX IF NOT EXISTS idx_subscriptions_category_active
+  ON subscriptions(category)
+  WHERE is_active = true;
+
+CREATE INDEX IF NOT EXISTS idx_subscriptions_inactive_updated
+  ON subscriptions(updated_at)
+  WHERE is_active = false;
+
+CREATE TABLE IF NOT EXISTS subscriptions_archive (
+  id bigint PRIMARY KEY,
+  owner_id bigint NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  title text NOT NULL,
+  amount numeric(10,2) NOT NULL,
+  currency text DEFAULT 'DKK' NOT NULL,
+  category text,
+  renewal_date date NOT NULL,
+  transaction_date date,
+  logo_url text,
+  frequency text,
+  source text,
+  confidence_score integer,
+  is_active boolean NOT NULL,
+  notes text,
+  created_at timestamptz NOT NULL,
+  updated_at timestamptz NOT NULL,
+  archived_at timestamptz DEFAULT now() NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_subscriptions_archive_owner_id_id ON subscriptions_archive(owner_id, id);
+
+ALTER TABLE subscriptions_archive ENABLE ROW LEVEL SECURITY;
+
+CREATE OR REPLACE FUNCTION archive_inactive_subscriptions(p_inactive_before timestamptz, p_limit integer DEFAULT 500)
+RETURNS integer AS $$
+  WITH batch AS (
+    SELECT id
+    FROM subscriptions
+    WHERE is_active = false
+      AND updated_at < p_inactive_before
+    ORDER BY updated_at
+    LIMIT p_limit
+    FOR UPDATE SKIP LOCKED
+  ), moved AS (
+    DELETE FROM subscriptions s
+    USING batch
+    WHERE s.id = batch.id
+    RETURNING s.*
+  ), archived AS (
+    INSERT INTO subscriptions_archive (
+      id, owner_id, title, amount, currency, category, renewal_date, transaction_date, logo_url,
+      frequency, source, confidence_score, is_active, notes, created_at, updated_at
+    )
+    SELECT
+      id, owner_id, title, amount, currency, category, renewal_date, transaction_date, logo_url,
+      frequency, source, confidence_score, is_active, notes, created_at, updated_at
+    FROM moved
+    RETURNING 1
+  )
+  SELECT count(*)::integer FROM archived;
+$$ LANGUAGE sql VOLATILE SECURITY DEFINER;
+
+CREATE OR REPLACE FUNCTION restore_archived_subscription(
+  p_subscription_id bigint,
+  p_owner_id bigint,
+  p_activate boolean DEFAULT true
+)
+RETURNS SETOF subscriptions AS $$
+  WITH moved AS (
+    DELETE FROM subscriptions_archive
+    WHERE id = p_subscription_id
+      AND owner_id = p_owner_id
+    RETURNING *
+  )
+  INSERT INTO subscriptions (
+    id, owner_id, title, amount, currency, category, renewal_date, transaction_date, logo_url,
+    frequency, source, confidence_score, is_active, notes, created_at, updated_at
+  )
+  SELECT
+    id, owner_id, title, amount, currency, category, renewal_date, transaction_date, logo_url,
+    frequency, source, confidence_score, is_active OR p_activate, notes, created_at, now()
+  FROM moved
+  RETURNING *;
+$$ LANGUAGE sql VOLATILE SECURITY DEFINER;
+
+CREATE OR REPLACE FUNCTION delete_user_rows_batch(p_table text, p_user_id bigint, p_limit integer DEFAULT 500)
+RETURNS integer AS $$
+DECLARE
+  v_column text;
+  v_deleted integer;
+BEGIN
+  v_column := CASE p_table
+    WHEN 'notification_events' THEN 'user_id'
+    WHEN 'transactions' THEN 'user_id'
+    WHEN 'transaction_series' THEN 'user_id'
+    WHEN 'notification_preferences' THEN 'user_id'
+    WHEN 'push_tokens' THEN 'user_id'
+    WHEN 'tink_tokens' THEN 'user_id'
+    WHEN 'tink_webhook_events' THEN 'user_id'
+    WHEN 'subscriptions_archive' THEN 'owner_id'
+    WHEN 'subscriptions' THEN 'owner_id'
+  END;
+  IF v_column IS NULL THEN
+    RAISE EXCEPTION 'delete_user_rows_batch: unsupported table %', p_table;
+  END IF;
+
+  -- ctid works for every table, including transaction_series which has no id column
+  EXECUTE format(
+    'DELETE FROM %1$I WHERE ctid = ANY(ARRAY(SELECT ctid FROM %1$I WHERE %2$I = $1 LIMIT $2 FOR UPDATE SKIP LOCKED))',
+    p_table, v_column
+  ) USING p_user_id, p_limit;
+  GET DIAGNOSTICS v_deleted = ROW_COUNT;
+  RETURN v_deleted;
+END;
+$$ LANGUAGE plpgsql VOLATILE SECURITY DEFINER;
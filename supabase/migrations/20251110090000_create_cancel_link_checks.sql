@@ -0,0 +1,93 @@
+/*
+  # Automated health checks for merchant cancel links
+
+  ## Summary
+  verify_cancel_link() and report_broken_cancel_link() existed, but nothing called them, so
+  verified_at was never set and only user reports could take a dead link out of the app. A
+  background checker (backend/cancel_links.py) now fetches every active `url` link on a schedule.
+  These functions let it claim a batch of due links and write all results back in one call.
+
+  ## Modified Tables
+
+  ### `merchant_cancel_links`
+  - `checked_at` (timestamptz) - Last time the checker claimed the link, whatever the outcome
+  - `check_error` (text) - Why the last check failed; NULL after a successful one
+
+  ## New Functions
+
+  ### `claim_cancel_links_to_check(p_checked_before, p_limit)`
+  Returns up to p_limit active `url` links that have not been checked since p_checked_before, and
+  sets their checked_at to now. Links with the most broken_reports come first, then the ones
+  verified longest ago (never verified first). Rows locked by another worker are skipped.
+
+  ### `record_cancel_link_checks(p_results)`
+  p_results is a JSON array of {id, ok, error}. Applies each result with the same rules as the
+  single-link functions:
+  - ok = true: like verify_cancel_link (reports reset, active, verified_at = now)
+  - ok = false: like report_broken_cancel_link (one more report, deactivated at 3)
+  - ok = null (inconclusive, e.g. timeouts or 5xx): only check_error is stored
+  Returns the number of links updated.
+
+  ## Indexes
+  - Partial `merchant_cancel_links(checked_at) WHERE is_active AND cancel_type = 'url'` for the claim
+
+  ## Important Notes
+  1. A failed check counts like a user report, so a link that fails three checks in a row with no
+     successful check in between is deactivated
+  2. Deactivated links are not checked again; fixing one still means updating it by hand
+*/
+
+ALTER TABLE merchant_cancel_links
+  ADD COLUMN IF NOT EXISTS checked_at timestamptz,
+  ADD COLUMN IF NOT EXISTS check_error text;
+
+CREATE INDEX IF NOT EXISTS idx_merchant_links_check_due
+  ON merchant_cancel_links(checked_at)
+  WHERE is_active = true AND cancel_type = 'url';
+
+CREATE OR REPLACE FUNCTION claim_cancel_links_to_check(p_checked_before timestamptz, p_limit integer DEFAULT 100)
+RETURNS TABLE (
+  id bigint,
+  merchant_name text,
+  cancel_target text,
+  broken_reports integer,
+  verified_at timestamptz
+) AS $$
+  UPDATE merchant_cancel_links m
+  SET checked_at = now()
+  FROM (
+    SELECT l.id
+    FROM merchant_cancel_links l
+    WHERE l.is_active = true
+      AND l.cancel_type = 'url'
+      AND (l.checked_at IS NULL OR l.checked_at < p_checked_before)
+    ORDER BY l.broken_reports DESC, l.verified_at ASC NULLS FIRST, l.id
+    LIMIT p_limit
+    FOR UPDATE SKIP LOCKED
+  ) due
+  WHERE m.id = due.id
+  RETURNING m.id, m.merchant_name, m.cancel_target, m.broken_reports, m.verified_at;
+$$ LANGUAGE sql VOLATILE SECURITY DEFINER;
+
+CREATE OR REPLACE FUNCTION record_cancel_link_checks(p_results jsonb)
+RETURNS integer AS $$
+  WITH results AS (
+    SELECT * FROM jsonb_to_recordset(p_results) AS r(id bigint, ok boolean, error text)
+  ), updated AS (
+    UPDATE merchant_cancel_links m
+    SET
+      broken_reports = CASE WHEN r.ok THEN 0 WHEN NOT r.ok THEN m.broken_reports + 1 ELSE m.broken_reports END,
+      is_active = CASE
+        WHEN r.ok THEN true
+        WHEN NOT r.ok AND m.broken_reports + 1 >= 3 THEN false
+        ELSE m.is_active
+      END,
+      verified_at = CASE WHEN r.ok THEN now() ELSE m.verified_at END,
+      check_error = r.error,
+      updated_at = now()
+    FROM results r
+    WHERE m.id = r.id
+    RETURNING 1
+  )
+  SELECT count(*)::integer FROM updated;
+$$ LANGUAGE sql VOLATILE SECURITY DEFINER;
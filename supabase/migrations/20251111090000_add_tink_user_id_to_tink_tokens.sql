@@ -0,0 +1,30 @@
+/*
+  # Tink user id on bank connections
+
+  ## Summary
+  Tink webhooks name the user by Tink's own user id (context.userId). The externalUserId next to
+  it is only set for Tink users created with one, and the Tink Link flow used by the app
+  (a one-time code exchanged in POST /api/tink/token) never creates them. The backend now stores
+  the Tink user id of every connection when the code is exchanged or a token refreshed, and
+  resolves webhook events through it.
+
+  ## Modified Tables
+
+  ### `tink_tokens`
+  - `tink_user_id` (text) - Tink's id of the user behind the connection; NULL until known
+
+  ## Indexes
+  - Partial `tink_tokens(tink_user_id) WHERE tink_user_id IS NOT NULL` for resolving webhook events
+
+  ## Important Notes
+  1. Connections stored before this migration get their tink_user_id on their next token refresh
+  2. The id comes from the token response's id_hint, or GET /api/v1/user when Tink leaves it out
+     (that call needs the user:read scope in the Tink Link URL)
+*/
+
+ALTER TABLE tink_tokens
+  ADD COLUMN IF NOT EXISTS tink_user_id text;
+
+CREATE INDEX IF NOT EXISTS idx_tink_tokens_tink_user_id
+  ON tink_tokens(tink_user_id)
+  WHERE tink_user_id IS NOT NULL;
@@ -0,0 +1,59 @@
+/*
+  # Versioned writes for transaction series
+
+  ## Summary
+  The charge detector (backend/charge_detector.py) reads a user's series, folds new charges into
+  them and writes them back. The analyze endpoint, the sync worker and the webhook processor can
+  ingest for the same user at the same time. With a plain upsert, the last writer overwrote the
+  count, mean and last date another one had just saved. Series now carry a version. They are only
+  written back if nobody else wrote them since they were read. Otherwise the caller re-reads them
+  and applies its charges again.
+
+  ## Modified Tables
+
+  ### `transaction_series`
+  - `version` (integer, default 0) - Incremented on every write
+
+  ## New Functions
+
+  ### `save_transaction_series(p_rows)`
+  p_rows is a JSON array of series rows, each with the `version` it was read at (0 for a new
+  series). Inserts new series and updates existing ones whose stored version still matches, and
+  stores version + 1. Returns the merchant_key of every row written. Rows missing from the result
+  were changed concurrently and must be re-read.
+
+  ## Important Notes
+  1. The new charges themselves belong to a single caller, because insert_new_transactions skips
+     transactions that are already stored. A retry never counts a charge twice.
+*/
+
+ALTER TABLE transaction_series
+  ADD COLUMN IF NOT EXISTS version integer DEFAULT 0 NOT NULL;
+
+CREATE OR REPLACE FUNCTION save_transaction_series(p_rows jsonb)
+RETURNS TABLE (merchant_key text) AS $$
+  INSERT INTO transaction_series AS s (
+    user_id, merchant_key, charge_count, last_amount, mean_amount, recent_amounts,
+    first_booked_date, last_booked_date, subscription_id, version
+  )
+  SELECT
+    r.user_id, r.merchant_key, r.charge_count, r.last_amount, r.mean_amount,
+    COALESCE(r.recent_amounts, '[]'::jsonb), r.first_booked_date, r.last_booked_date,
+    r.subscription_id, r.version + 1
+  FROM jsonb_to_recordset(p_rows) AS r(
+    user_id bigint, merchant_key text, charge_count integer, last_amount numeric, mean_amount numeric,
+    recent_amounts jsonb, first_booked_date date, last_booked_date date, subscription_id bigint,
+    version integer
+  )
+  ON CONFLICT (user_id, merchant_key) DO UPDATE SET
+    charge_count = EXCLUDED.charge_count,
+    last_amount = EXCLUDED.last_amount,
+    mean_amount = EXCLUDED.mean_amount,
+    recent_amounts = EXCLUDED.recent_amounts,
+    first_booked_date = EXCLUDED.first_booked_date,
+    last_booked_date = EXCLUDED.last_booked_date,
+    subscription_id = EXCLUDED.subscription_id,
+    version = EXCLUDED.version
+  WHERE s.version = EXCLUDED.version - 1
+  RETURNING s.merchant_key;
+$$ LANGUAGE sql VOLATILE SECURITY DEFINER;
@@ -0,0 +1,116 @@
+/*
+  # Project past renewal dates in the weekly digest
+
+  ## Summary
+  get_weekly_digest_batch() counted a renewal as upcoming only if the stored renewal_date fell in
+  the digest week. A recurring subscription whose renewal_date has passed and was never moved
+  forward was left out, while /api/subscriptions/upcoming projects it onto its schedule with the
+  cost model. The function now returns every active subscription with a renewal_date before the
+  end of the week, with its frequency. The digest job (backend/weekly_digest.py) projects past
+  dates with cost_model.next_renewal and computes the week's renewals and their total itself.
+
+  ## Modified Functions
+
+  ### `get_weekly_digest_batch(p_after_user_id, p_limit, p_as_of)`
+  - `upcoming_count`, `upcoming_totals` and `upcoming` are replaced by `renewals`: title, amount,
+    currency, renewal_date and frequency of active subscriptions with renewal_date < p_as_of + 7,
+    ordered by renewal_date
+  - The other columns are unchanged
+
+  ## Important Notes
+  1. The return type changes, so the function is dropped and created again
+*/
+
+DROP FUNCTION IF EXISTS get_weekly_digest_batch(bigint, integer, date);
+
+CREATE FUNCTION get_weekly_digest_batch(
+  p_after_user_id bigint DEFAULT 0,
+  p_limit integer DEFAULT 1000,
+  p_as_of date DEFAULT CURRENT_DATE
+)
+RETURNS TABLE (
+  user_id bigint,
+  active_count integer,
+  monthly_totals jsonb,
+  renewals jsonb,
+  new_count integer,
+  price_increases integer
+) AS $$
+  WITH page AS (
+    SELECT u.id
+    FROM users u
+    WHERE u.id > p_after_user_id
+      AND u.is_active = true
+      AND COALESCE((
+        SELECT np.is_enabled
+        FROM notification_preferences np
+        WHERE np.user_id = u.id
+          AND np.subscription_id IS NULL
+          AND np.notification_type = 'weekly_summary'
+        ORDER BY np.updated_at DESC, np.id DESC
+        LIMIT 1
+      ), true)
+    ORDER BY u.id
+    LIMIT p_limit
+  ),
+  sub_stats AS (
+    SELECT
+      s.owner_id,
+      count(*)::integer AS active_count,
+      COALESCE(
+        jsonb_agg(
+          jsonb_build_object('title', s.title, 'amount', s.amount, 'currency', s.currency,
+                             'renewal_date', s.renewal_date, 'frequency', s.frequency)
+          ORDER BY s.renewal_date
+        ) FILTER (WHERE s.renewal_date < p_as_of + 7),
+        '[]'::jsonb
+      ) AS renewals,
+      count(*) FILTER (WHERE s.created_at >= p_as_of - 7)::integer AS new_count
+    FROM subscriptions s
+    JOIN page p ON p.id = s.owner_id
+    WHERE s.is_active = true
+    GROUP BY s.owner_id
+  ),
+  currency_sums AS (
+    SELECT
+      s.owner_id,
+      s.currency,
+      round(sum(s.amount / CASE s.frequency
+        WHEN 'kvartal' THEN 3
+        WHEN 'halvår' THEN 6
+        WHEN 'år' THEN 12
+        ELSE 1
+      END), 2) AS monthly
+    FROM subscriptions s
+    JOIN page p ON p.id = s.owner_id
+    WHERE s.is_active = true
+    GROUP BY s.owner_id, s.currency
+  ),
+  currency_stats AS (
+    SELECT
+      owner_id,
+      jsonb_object_agg(currency, monthly) AS monthly_totals
+    FROM currency_sums
+    GROUP BY owner_id
+  ),
+  event_stats AS (
+    SELECT e.user_id, count(*)::integer AS price_increases
+    FROM notification_events e
+    JOIN page p ON p.id = e.user_id
+    WHERE e.event_type = 'price_increase'
+      AND e.created_at >= p_as_of - 7
+    GROUP BY e.user_id
+  )
+  SELECT
+    p.id,
+    COALESCE(ss.active_count, 0),
+    COALESCE(cs.monthly_totals, '{}'::jsonb),
+    COALESCE(ss.renewals, '[]'::jsonb),
+    COALESCE(ss.new_count, 0),
+    COALESCE(es.price_increases, 0)
+  FROM page p
+  LEFT JOIN sub_stats ss ON ss.owner_id = p.id
+  LEFT JOIN currency_stats cs ON cs.owner_id = p.id
+  LEFT JOIN event_stats es ON es.user_id = p.id
+  ORDER BY p.id;
+$$ LANGUAGE sql STABLE SECURITY DEFINER;